@@ -0,0 +1,93 @@
+import zlib
+from typing import Dict, Any, List
+
+# 4ビットのカウンター（0〜15）として扱う上限
+MAX_COUNT = 15
+# カウンターを半分にするための変換表（bytearray.translateで全カウンターを一度に半分にする）
+_HALVE = bytes(i >> 1 for i in range(256))
+
+
+class FrequencySketch:
+    """
+    ショートコードごとの問い合わせ頻度を近似的に数えるCount-Min Sketch（TinyLFUの頻度推定）。
+
+    - depth 行 × width 列のカウンターを持ち、キーごとに各行の1つを加算する。推定値は各行の最小値
+    - 加算は最小値のカウンターだけに行い（conservative update）、過大評価を抑える
+    - sample_size 回加算するごとに全カウンターを半分にし、古い人気が残り続けないようにする（エージング）
+
+    ロックは持たないため、複数スレッドから使う場合は呼び出し側で排他すること。
+    """
+
+    def __init__(self, capacity: int, depth: int = 4, sample_factor: int = 10):
+        """
+        Args:
+            capacity: 対象のキャッシュの最大エントリ数（列数はこの4倍、エージングの間隔もこれに合わせる）
+            depth: 行数（ハッシュ関数の数）
+            sample_factor: 何エントリ分の加算ごとにカウンターを半分にするか（capacity × sample_factor 回）
+        """
+        width = 16
+        while width < capacity * 4:
+            width <<= 1
+        self.width = width
+        self.depth = max(1, depth)
+        self.sample_size = max(1, capacity) * max(1, sample_factor)
+        self._mask = width - 1
+        self._rows: List[bytearray] = [bytearray(width) for _ in range(self.depth)]
+        self._additions = 0
+        self.resets = 0
+
+    def _indexes(self, key: str) -> List[int]:
+        # プロセスごとに変わる hash() ではなく crc32 を使い、推定値を再現できるようにする
+        h = zlib.crc32(key.encode("utf-8"))
+        # 1つのハッシュ値から行ごとに異なる位置を作る（double hashing）
+        step = (h >> 16) | 1
+        return [(h + i * step) & self._mask for i in range(self.depth)]
+
+    def increment(self, key: str) -> None:
+        """キーの問い合わせを1回記録する"""
+        indexes = self._indexes(key)
+        counts = [row[i] for row, i in zip(self._rows, indexes)]
+        current = min(counts)
+        if current < MAX_COUNT:
+            for row, i, count in zip(self._rows, indexes, counts):
+                if count == current:
+                    row[i] = current + 1
+        self._additions += 1
+        if self._additions >= self.sample_size:
+            self._age()
+
+    def estimate(self, key: str) -> int:
+        """キーの問い合わせ頻度の推定値を返す"""
+        return min(row[i] for row, i in zip(self._rows, self._indexes(key)))
+
+    def _age(self) -> None:
+        self._rows = [row.translate(_HALVE) for row in self._rows]
+        self._additions //= 2
+        self.resets += 1
+
+    def admit(self, candidate: str, victim: str) -> bool:
+        """
+        新しいエントリ（candidate）を、破棄されるエントリ（victim）と入れ替えるべきかを返す。
+        候補の推定頻度が破棄対象より高い場合だけTrueを返す。
+        """
+        return self.estimate(candidate) > self.estimate(victim)
+
+    def clear(self) -> None:
+        """全カウンターを消去する"""
+        self._rows = [bytearray(self.width) for _ in range(self.depth)]
+        self._additions = 0
+        self.resets = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        統計情報を返す。
+
+        Returns:
+            width / depth / sample_size / resets（エージングの回数）を含む辞書
+        """
+        return {
+            "width": self.width,
+            "depth": self.depth,
+            "sample_size": self.sample_size,
+            "resets": self.resets,
+        }
@@ -0,0 +1,428 @@
+import asyncio
+import copy
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, Callable, Set, Tuple
+from urllib.parse import urlsplit, parse_qs
+
+from core.config import (
+    RESULT_CACHE_ENABLED, RESULT_CACHE_MAX_ENTRIES, RESULT_CACHE_TTL,
+    RESULT_CACHE_BACKEND, RESULT_CACHE_PATH, RESULT_CACHE_MAX_BYTES, RESULT_CACHE_STALE_TTL,
+    RESULT_CACHE_EXPIRY_MARGIN, RESULT_CACHE_REFRESH_AHEAD, RESULT_CACHE_REFRESH_MIN_HITS,
+    RESULT_CACHE_ADMISSION
+)
+from core.admission import FrequencySketch
+from core.persistent_cache import SQLiteCacheBackend
+
+
+def cdn_expiry(url: Optional[str]) -> Optional[float]:
+    """
+    Instagram CDNの署名付きURLの有効期限（UNIX時間）を返す。
+
+    署名付きURLはクエリの oe= に有効期限を16進数で持つ（例: ...&oe=65F1A2B3）。
+
+    Returns:
+        有効期限、oe= がない・解釈できない場合はNone
+    """
+    if not isinstance(url, str) or "oe=" not in url:
+        return None
+    try:
+        values = parse_qs(urlsplit(url).query).get("oe")
+        return float(int(values[0], 16)) if values else None
+    except (ValueError, IndexError):
+        return None
+
+
+def result_expiry(value: Dict[str, Any]) -> Optional[float]:
+    """結果に含まれるメディアURL・サムネイルURLのうち、最も早い有効期限（UNIX時間）を返す"""
+    urls = [value.get("media_url"), value.get("preview_url")]
+    for media in value.get("media_list") or ():
+        if isinstance(media, dict):
+            urls.extend((media.get("url"), media.get("thumbnail")))
+    expiries = [e for e in map(cdn_expiry, urls) if e is not None]
+    return min(expiries) if expiries else None
+
+
+class ResultCache:
+    """
+    process_instagram_urlの結果をショートコード単位で保持するインメモリキャッシュ。
+    TTLによる期限切れとLRUによる容量制限を組み合わせている。
+    LINE(スレッド)とDiscord(asyncio)の両方から呼ばれるため、操作はロックで保護する。
+
+    backendを指定した場合は、メモリにない結果をbackend（プロセス間で共有する永続キャッシュ）から読み込み、
+    保存した結果はbackendにも書き込む。
+
+    期限切れのエントリは stale_ttl の間だけ残し、上流APIの障害時に get_stale() で古い結果として返せるようにする。
+
+    メディアURLはCDNの署名付きURLで有効期限があるため、エントリのTTLは「最も早い有効期限 - expiry_margin」
+    を上限とする（期限切れのリンクを返さないため）。また、よく使われるエントリは期限の refresh_ahead 秒前から
+    claim_refresh() で再取得の対象として返し、ユーザーの問い合わせがAPIを待たずに済むようにする。
+
+    admission=Trueの場合は、容量がいっぱいのときに新しいエントリを無条件には入れず、問い合わせ頻度の推定値
+    （FrequencySketch）がLRUで破棄されるエントリより高い場合だけ入れ替える（TinyLFU）。
+    グループチャットで一度だけ貼られたリンクに、何度も共有される投稿が押し出されるのを防ぐ。
+
+    asyncioから呼ぶ場合は aget() / aget_stale() / aset() を使う。backendの読み込み（SQLiteのロック待ちを含む）は
+    スレッドで行い、書き込みはメモリに保存した後に専用のスレッドで行う（write-behind）ため、イベントループを止めない。
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 512,
+        ttl: float = 600.0,
+        enabled: bool = True,
+        clock: Callable[[], float] = time.monotonic,
+        backend: Optional[SQLiteCacheBackend] = None,
+        stale_ttl: float = 0.0,
+        expiry_margin: float = 300.0,
+        refresh_ahead: float = 0.0,
+        refresh_min_hits: int = 3,
+        wall_clock: Callable[[], float] = time.time,
+        admission: bool = False,
+    ):
+        """
+        Args:
+            max_entries: 保持する最大エントリ数（超えた場合は最も古く使われたものを破棄）
+            ttl: エントリの有効期間（秒）
+            enabled: Falseの場合、キャッシュは常にミスとなり何も保存しない
+            clock: 現在時刻を返す関数（テスト用に差し替え可能）
+            backend: 永続キャッシュのバックエンド（Noneの場合はメモリのみ）
+            stale_ttl: 期限切れ後もエントリを残しておく時間（秒）。0の場合は期限切れと同時に破棄する
+            expiry_margin: CDNのURLの有効期限より何秒前にエントリを期限切れにするか
+            refresh_ahead: 期限の何秒前から再取得の対象にするか（0の場合は再取得しない）
+            refresh_min_hits: 再取得の対象にするのに必要なヒット数
+            wall_clock: CDNの有効期限（UNIX時間）と比較する現在時刻を返す関数
+            admission: Trueの場合、容量がいっぱいのときは頻度の推定値で新しいエントリを入れるか決める
+        """
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self.enabled = enabled
+        self._clock = clock
+        self.backend = backend
+        self.stale_ttl = max(0.0, stale_ttl)
+        self.expiry_margin = expiry_margin
+        self.refresh_ahead = max(0.0, refresh_ahead)
+        self.refresh_min_hits = max(1, refresh_min_hits)
+        self._wall_clock = wall_clock
+        self._lock = threading.Lock()
+        # key -> (expires_at, value)。末尾ほど最近使われたエントリ
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        # key -> 保存後のヒット数（再取得の対象を選ぶため）と、再取得中のキー
+        self._popularity: Dict[str, int] = {}
+        self._refreshing: Set[str] = set()
+        self._sketch = FrequencySketch(self.max_entries) if admission else None
+        # asyncio版のset()でbackendに書き込むスレッド（1本にして書き込みの順序を保つ）
+        self._writer = (
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix="result-cache-writer") if backend is not None else None
+        )
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.stale_hits = 0
+        self.expiry_capped = 0   # CDNの有効期限でTTLを短くした回数
+        self.expired_links = 0   # 有効期限が近すぎて保存しなかった回数
+        self.refreshes = 0       # 期限前の再取得の対象として返した回数
+        self.rejections = 0      # 頻度が低いため保存しなかった回数
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        キャッシュから結果を取得する。
+
+        Args:
+            key: 投稿のショートコード
+
+        Returns:
+            キャッシュされた結果のコピー。存在しない・期限切れの場合はNone
+        """
+        if not self.enabled:
+            return None
+        value = self._get_memory(key)
+        if value is not None:
+            return value
+        # 他のプロセスが保存した結果や、再起動前に保存した結果を探す
+        found = self.backend.get(key) if self.backend is not None else None
+        return self._load_found(key, found)
+
+    async def aget(self, key: str) -> Optional[Dict[str, Any]]:
+        """getのasyncio版（backendの読み込みはスレッドで行う）"""
+        if not self.enabled:
+            return None
+        value = self._get_memory(key)
+        if value is not None:
+            return value
+        found = await asyncio.to_thread(self.backend.get, key) if self.backend is not None else None
+        return self._load_found(key, found)
+
+    def _get_memory(self, key: str) -> Optional[Dict[str, Any]]:
+        """メモリから有効期限内の結果のコピーを取得する（見つかった場合はヒットとして数える）"""
+        with self._lock:
+            if self._sketch is not None:
+                self._sketch.increment(key)
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                now = self._clock()
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    self._popularity[key] = self._popularity.get(key, 0) + 1
+                    # 呼び出し側での変更がキャッシュに波及しないようコピーを返す
+                    return copy.deepcopy(value)
+                if expires_at + self.stale_ttl <= now:
+                    self._remove(key)
+                    self.expirations += 1
+        return None
+
+    def _load_found(self, key: str, found: Optional[Tuple[Dict[str, Any], float]]) -> Optional[Dict[str, Any]]:
+        """backendから読み込んだ結果をメモリに保存してコピーを返す（Noneの場合はミスとして数える）"""
+        if found is None:
+            with self._lock:
+                self.misses += 1
+            return None
+        value, remaining = found
+        with self._lock:
+            self.hits += 1
+            self._store(key, value, min(self.ttl, remaining))
+        return copy.deepcopy(value)
+
+    def get_stale(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        期限切れ（stale_ttl以内）のものを含めて結果を取得する。上流APIが使えない場合のフォールバック用。
+
+        Args:
+            key: 投稿のショートコード
+
+        Returns:
+            キャッシュされた結果のコピー。存在しない場合はNone
+        """
+        if not self.enabled:
+            return None
+        value = self._get_stale_memory(key)
+        if value is not None or self.backend is None:
+            return value
+        return self._count_stale(self.backend.get(key, allow_stale=True))
+
+    async def aget_stale(self, key: str) -> Optional[Dict[str, Any]]:
+        """get_staleのasyncio版（backendの読み込みはスレッドで行う）"""
+        if not self.enabled:
+            return None
+        value = self._get_stale_memory(key)
+        if value is not None or self.backend is None:
+            return value
+        return self._count_stale(await asyncio.to_thread(self.backend.get, key, True))
+
+    def _get_stale_memory(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] + self.stale_ttl > self._clock():
+                self.stale_hits += 1
+                return copy.deepcopy(entry[1])
+        return None
+
+    def _count_stale(self, found: Optional[Tuple[Dict[str, Any], float]]) -> Optional[Dict[str, Any]]:
+        if found is None:
+            return None
+        with self._lock:
+            self.stale_hits += 1
+        return found[0]
+
+    def claim_refresh(self, key: str) -> bool:
+        """
+        エントリを期限前に再取得すべきかを返す。
+        ヒット数が refresh_min_hits 以上で、期限まで refresh_ahead 秒を切っている場合にTrueを返す。
+        同じエントリに対しては、set() で更新されるまで1回だけTrueを返す。
+
+        Args:
+            key: 投稿のショートコード
+        """
+        if not self.enabled or self.refresh_ahead <= 0:
+            return False
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or key in self._refreshing:
+                return False
+            remaining = entry[0] - self._clock()
+            if not 0 < remaining <= self.refresh_ahead or self._popularity.get(key, 0) < self.refresh_min_hits:
+                return False
+            self._refreshing.add(key)
+            self.refreshes += 1
+            return True
+
+    def ttl_for(self, value: Dict[str, Any]) -> float:
+        """
+        結果を保存する期間（秒）を返す。
+        CDNのURLの有効期限がTTLより早い場合は「有効期限 - expiry_margin」までとする。
+        """
+        expiry = result_expiry(value)
+        if expiry is None:
+            return self.ttl
+        return min(self.ttl, expiry - self._wall_clock() - self.expiry_margin)
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        """
+        結果をキャッシュに保存する。容量を超えた場合はLRUで破棄する。
+        メディアURLの有効期限が近すぎる場合は保存しない。
+
+        Args:
+            key: 投稿のショートコード
+            value: process_instagram_urlの戻り値
+        """
+        stored = self._set_memory(key, value)
+        if stored is not None and self.backend is not None:
+            self.backend.set(key, *stored)
+
+    def aset(self, key: str, value: Dict[str, Any]) -> None:
+        """
+        setのasyncio版。メモリに保存し、backendへの書き込みは専用のスレッドに任せて待たない（write-behind）。
+        """
+        stored = self._set_memory(key, value)
+        if stored is not None and self._writer is not None:
+            self._writer.submit(self.backend.set, key, *stored)
+
+    def flush(self) -> None:
+        """aset()で積んだbackendへの書き込みが終わるまで待つ（テスト・停止処理用）"""
+        if self._writer is not None:
+            self._writer.submit(lambda: None).result()
+
+    def _set_memory(self, key: str, value: Dict[str, Any]) -> Optional[Tuple[Dict[str, Any], float]]:
+        """
+        メモリに保存する。
+
+        Returns:
+            backendに書き込む (結果, TTL)。保存しなかった場合はNone
+        """
+        if not self.enabled:
+            return None
+
+        stored = copy.deepcopy(value)
+        ttl = self.ttl_for(stored)
+        with self._lock:
+            self._refreshing.discard(key)
+            if ttl <= 0:
+                self.expired_links += 1
+                return None
+            if ttl < self.ttl:
+                self.expiry_capped += 1
+            # 再取得した人気のエントリは、次の期限前にも再取得されるようヒット数を半分だけ引き継ぐ
+            popularity = self._popularity.get(key, 0) // 2
+            if self._store(key, stored, ttl):
+                self._popularity[key] = popularity
+        return stored, ttl
+
+    def _store(self, key: str, value: Dict[str, Any], ttl: float) -> bool:
+        """
+        メモリにエントリを保存する（ロックを取得した状態で呼ぶ）。
+
+        Returns:
+            保存した場合はTrue、頻度が低く保存しなかった場合はFalse
+        """
+        if not self._admit(key):
+            self.rejections += 1
+            return False
+        self._entries[key] = (self._clock() + ttl, value)
+        self._entries.move_to_end(key)
+        self._popularity[key] = 0
+        while len(self._entries) > self.max_entries:
+            evicted, _ = self._entries.popitem(last=False)
+            self._popularity.pop(evicted, None)
+            self._refreshing.discard(evicted)
+            self.evictions += 1
+        return True
+
+    def _admit(self, key: str) -> bool:
+        """新しいエントリを入れてよいかを返す（ロックを取得した状態で呼ぶ）"""
+        if self._sketch is None or key in self._entries or len(self._entries) < self.max_entries:
+            return True
+        victim, (expires_at, _) = next(iter(self._entries.items()))
+        # 破棄されるエントリが期限切れなら、頻度に関係なく入れ替える
+        if expires_at <= self._clock():
+            return True
+        return self._sketch.admit(key, victim)
+
+    def _remove(self, key: str) -> None:
+        """メモリからエントリを削除する（ロックを取得した状態で呼ぶ）"""
+        del self._entries[key]
+        self._popularity.pop(key, None)
+        self._refreshing.discard(key)
+
+    def clear(self) -> None:
+        """全エントリと統計情報を消去する（backendを含む）"""
+        if self.backend is not None:
+            self.flush()
+            self.backend.clear()
+        with self._lock:
+            self._entries.clear()
+            self._popularity.clear()
+            self._refreshing.clear()
+            if self._sketch is not None:
+                self._sketch.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+            self.expirations = 0
+            self.stale_hits = 0
+            self.expiry_capped = 0
+            self.expired_links = 0
+            self.refreshes = 0
+            self.rejections = 0
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        キャッシュの統計情報を返す。
+
+        Returns:
+            hits / misses / stale_hits / evictions / expirations / expiry_capped / expired_links /
+            refreshes / rejections / size / enabled を含む辞書。
+            backendを使用している場合は "backend" に、admissionを使用している場合は "admission" に
+            それぞれの統計情報を含む
+        """
+        with self._lock:
+            stats: Dict[str, Any] = {
+                "enabled": self.enabled,
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale_hits": self.stale_hits,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "expiry_capped": self.expiry_capped,
+                "expired_links": self.expired_links,
+                "refreshes": self.refreshes,
+                "rejections": self.rejections,
+            }
+            if self._sketch is not None:
+                stats["admission"] = self._sketch.stats()
+        if self.backend is not None:
+            stats["backend"] = self.backend.stats()
+        return stats
+
+
+def _create_backend() -> Optional[SQLiteCacheBackend]:
+    """RESULT_CACHE_BACKENDの設定に応じて永続キャッシュのバックエンドを作成する"""
+    if RESULT_CACHE_BACKEND == "sqlite":
+        return SQLiteCacheBackend(
+            RESULT_CACHE_PATH, max_bytes=RESULT_CACHE_MAX_BYTES, stale_ttl=RESULT_CACHE_STALE_TTL
+        )
+    return None
+
+
+# 両Botで共有するモジュールレベルのキャッシュ
+result_cache = ResultCache(
+    max_entries=RESULT_CACHE_MAX_ENTRIES,
+    ttl=RESULT_CACHE_TTL,
+    enabled=RESULT_CACHE_ENABLED,
+    backend=_create_backend(),
+    stale_ttl=RESULT_CACHE_STALE_TTL,
+    expiry_margin=RESULT_CACHE_EXPIRY_MARGIN,
+    refresh_ahead=RESULT_CACHE_REFRESH_AHEAD,
+    refresh_min_hits=RESULT_CACHE_REFRESH_MIN_HITS,
+    admission=RESULT_CACHE_ADMISSION,
+)
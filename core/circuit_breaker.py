@@ -0,0 +1,238 @@
+import logging
+import threading
+import time
+from collections import deque
+from typing import Optional, Dict, Any, Callable, Deque, List, Tuple
+
+from core.config import (
+    CIRCUIT_BREAKER_ENABLED, CIRCUIT_BREAKER_WINDOW, CIRCUIT_BREAKER_MIN_CALLS, CIRCUIT_BREAKER_FAILURE_RATE,
+    CIRCUIT_BREAKER_SLOW_CALL_SECONDS, CIRCUIT_BREAKER_SLOW_CALL_RATE, CIRCUIT_BREAKER_OPEN_SECONDS
+)
+
+# ログ設定
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """サーキットが開いているため、上流APIを呼び出さずに失敗させた"""
+
+
+class Permit:
+    """
+    allow() が返す呼び出しの許可。呼び出しの結果と一緒に record_* / release() に渡す。
+    半開状態では試しの呼び出しごとに別のインスタンスを返し、その呼び出しの結果だけで状態を変える。
+    """
+
+    __slots__ = ()
+
+
+# 閉じている（または無効な）間に返す許可。半開状態の状態変化には使われない
+_ALLOWED = Permit()
+
+
+class CircuitBreaker:
+    """
+    上流API（RapidAPI）用のサーキットブレーカー。
+
+    - 直近 window 件の呼び出しのうち、失敗率が failure_rate 以上、
+      または slow_call_seconds を超えた呼び出しの割合が slow_call_rate 以上になったら開く
+    - 開いている間（open_seconds）は呼び出しを即座に失敗させ、タイムアウトを待たずに済ませる
+    - 経過後は半開状態になり、1件だけ試しに呼び出す。成功すれば閉じ、失敗すれば再び開く
+
+    状態の変化は add_listener() で登録した関数に通知する（古い結果の再取得に使う）。
+    """
+
+    def __init__(
+        self,
+        window: int = 20,
+        min_calls: int = 5,
+        failure_rate: float = 0.5,
+        slow_call_seconds: float = 10.0,
+        slow_call_rate: float = 0.8,
+        open_seconds: float = 30.0,
+        enabled: bool = True,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        Args:
+            window: 判定に使う直近の呼び出し数
+            min_calls: 判定を始めるのに必要な呼び出し数
+            failure_rate: 開く失敗率（0〜1）
+            slow_call_seconds: 遅い呼び出しとみなす処理時間（秒）
+            slow_call_rate: 開く遅い呼び出しの割合（0〜1）
+            open_seconds: 開いてから試しに呼び出すまでの時間（秒）
+            enabled: Falseの場合は常に呼び出しを許可する（記録のみ行う）
+            clock: 現在時刻を返す関数
+        """
+        self.window = max(1, window)
+        self.min_calls = max(1, min(min_calls, self.window))
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        self.enabled = enabled
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._listeners: List[Callable[[str, str], None]] = []
+
+        self.state = CLOSED
+        # (成功したか, 遅かったか)。末尾ほど新しい
+        self._outcomes: Deque[Tuple[bool, bool]] = deque(maxlen=self.window)
+        self._opened_at = 0.0
+        # 半開状態で試しの呼び出しに渡した許可（試している間だけ設定する）
+        self._probe: Optional[Permit] = None
+        # 統計
+        self.rejected = 0
+        self.opened = 0
+
+    def allow(self) -> Optional[Permit]:
+        """
+        呼び出してよいかを判定する。半開状態では1件だけ許可する
+        （その結果を許可と一緒に record_* で記録するか、呼び出さなかった場合は release() を呼ぶこと）。
+
+        Returns:
+            呼び出してよい場合は許可、開いている（または試しの呼び出し中の）場合はNone
+        """
+        if not self.enabled:
+            return _ALLOWED
+        transition = None
+        with self._lock:
+            if self.state == OPEN and self._clock() - self._opened_at >= self.open_seconds:
+                transition = self._set_state(HALF_OPEN)
+            if self.state == CLOSED:
+                permit: Optional[Permit] = _ALLOWED
+            elif self.state == HALF_OPEN and self._probe is None:
+                permit = self._probe = Permit()
+            else:
+                self.rejected += 1
+                permit = None
+        self._notify(transition)
+        return permit
+
+    def is_open(self) -> bool:
+        """開いていて、まだ試しに呼び出す時刻になっていない場合にTrueを返す（呼び出し枠は消費しない）"""
+        if not self.enabled:
+            return False
+        with self._lock:
+            return self.state == OPEN and self._clock() - self._opened_at < self.open_seconds
+
+    def record_success(self, latency: float = 0.0, permit: Optional[Permit] = None) -> None:
+        """
+        成功した呼び出しを記録する。
+
+        Args:
+            latency: 呼び出しにかかった時間（秒）。slow_call_seconds を超えた場合は遅い呼び出しとして数える
+            permit: allow() が返した許可。半開状態では試しの呼び出しの許可の場合だけ状態を変える
+        """
+        self._record(True, latency > self.slow_call_seconds, permit)
+
+    def record_failure(self, permit: Optional[Permit] = None) -> None:
+        """
+        失敗した呼び出し（接続エラー・タイムアウト・5xx）を記録する。
+
+        Args:
+            permit: allow() が返した許可。半開状態では試しの呼び出しの許可の場合だけ状態を変える
+        """
+        self._record(False, False, permit)
+
+    def release(self, permit: Optional[Permit]) -> None:
+        """
+        結果を記録せずに呼び出しを終える（レート制限などで上流を呼び出さなかった場合）。
+
+        Args:
+            permit: allow() が返した許可。試しの呼び出しの許可の場合は、次の呼び出しが試せるようになる
+        """
+        with self._lock:
+            if permit is not None and permit is self._probe:
+                self._probe = None
+
+    def _record(self, ok: bool, slow: bool, permit: Optional[Permit]) -> None:
+        transition = None
+        with self._lock:
+            if self.state == HALF_OPEN:
+                # 試しの呼び出しより前に許可された呼び出しの結果では、状態を変えない
+                if permit is None or permit is not self._probe:
+                    return
+                self._probe = None
+                # 試しの呼び出しが遅い場合は、まだ回復していないとみなす
+                if ok and not slow:
+                    self._outcomes.clear()
+                    transition = self._set_state(CLOSED)
+                else:
+                    transition = self._open()
+            elif self.state == CLOSED:
+                self._outcomes.append((ok, slow))
+                if self._should_open():
+                    transition = self._open()
+        self._notify(transition)
+
+    def _should_open(self) -> bool:
+        calls = len(self._outcomes)
+        if calls < self.min_calls:
+            return False
+        failures = sum(1 for ok, _ in self._outcomes if not ok)
+        slow = sum(1 for _, is_slow in self._outcomes if is_slow)
+        return failures / calls >= self.failure_rate or slow / calls >= self.slow_call_rate
+
+    def _open(self) -> Tuple[str, str]:
+        self._opened_at = self._clock()
+        self.opened += 1
+        return self._set_state(OPEN)
+
+    def _set_state(self, state: str) -> Tuple[str, str]:
+        """状態を変更する（ロックを取得した状態で呼ぶ）。通知はロックを外してから行う"""
+        old, self.state = self.state, state
+        return old, state
+
+    def add_listener(self, listener: Callable[[str, str], None]) -> None:
+        """状態が変化したときに (変化前, 変化後) の状態で呼び出す関数を登録する"""
+        self._listeners.append(listener)
+
+    def _notify(self, transition: Optional[Tuple[str, str]]) -> None:
+        if transition is None or transition[0] == transition[1]:
+            return
+        logger.warning(f"Upstream circuit {transition[0]} -> {transition[1]}")
+        for listener in list(self._listeners):
+            try:
+                listener(*transition)
+            except Exception as e:
+                logger.error(f"Circuit breaker listener failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        サーキットの状態と統計情報を返す。
+
+        Returns:
+            state / calls / failure_rate / slow_call_rate（直近の呼び出し）/ open_for / opened / rejected を含む辞書
+        """
+        with self._lock:
+            calls = len(self._outcomes)
+            failures = sum(1 for ok, _ in self._outcomes if not ok)
+            slow = sum(1 for _, is_slow in self._outcomes if is_slow)
+            open_for = self.open_seconds - (self._clock() - self._opened_at) if self.state == OPEN else 0.0
+            return {
+                "enabled": self.enabled,
+                "state": self.state,
+                "calls": calls,
+                "failure_rate": round(failures / calls, 3) if calls else 0.0,
+                "slow_call_rate": round(slow / calls, 3) if calls else 0.0,
+                "open_for": max(0.0, open_for),
+                "opened": self.opened,
+                "rejected": self.rejected,
+            }
+
+
+# 両Botで共有するRapidAPI用のサーキットブレーカー
+circuit_breaker = CircuitBreaker(
+    window=CIRCUIT_BREAKER_WINDOW,
+    min_calls=CIRCUIT_BREAKER_MIN_CALLS,
+    failure_rate=CIRCUIT_BREAKER_FAILURE_RATE,
+    slow_call_seconds=CIRCUIT_BREAKER_SLOW_CALL_SECONDS,
+    slow_call_rate=CIRCUIT_BREAKER_SLOW_CALL_RATE,
+    open_seconds=CIRCUIT_BREAKER_OPEN_SECONDS,
+    enabled=CIRCUIT_BREAKER_ENABLED,
+)
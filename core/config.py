@@ -1,11 +1,35 @@
-
 import os
 from dotenv import load_dotenv
-from typing import Optional
+from typing import Optional, Dict, Any
 
 # .envファイルを読み込む
 load_dotenv()
 
+
+def _get_bool(name: str, default: bool) -> bool:
+    """真偽値の環境変数を読み込む（"1", "true", "yes", "on" を真とみなす）"""
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def _get_int(name: str, default: int) -> int:
+    """整数の環境変数を読み込む。不正な値の場合はデフォルト値を使う"""
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def _get_float(name: str, default: float) -> float:
+    """浮動小数点数の環境変数を読み込む。不正な値の場合はデフォルト値を使う"""
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
 # --- 環境変数の読み込み ---
 
 # LINE Configuration
@@ -14,6 +38,8 @@ LINE_CHANNEL_SECRET: Optional[str] = os.environ.get('LINE_CHANNEL_SECRET')
 
 # Discord Configuration
 DISCORD_BOT_TOKEN: Optional[str] = os.environ.get('DISCORD_BOT_TOKEN')
+# カルーセルの画像を1メッセージに複数のEmbedとしてまとめ、動画のURLを1つの本文にまとめて送る
+DISCORD_BATCH_EMBEDS: bool = _get_bool('DISCORD_BATCH_EMBEDS', True)
 
 # API Key Configuration
 RAPID_API_KEY: Optional[str] = os.environ.get('RAPID_API_KEY')
@@ -21,3 +47,142 @@ RAPID_API_HOST: str = os.environ.get(
     'RAPID_API_HOST',
     'instagram-downloader-download-instagram-videos-stories.p.rapidapi.com'
 )
+
+# Result Cache Configuration (ショートコード単位の結果キャッシュ)
+RESULT_CACHE_ENABLED: bool = _get_bool('RESULT_CACHE_ENABLED', True)
+RESULT_CACHE_MAX_ENTRIES: int = _get_int('RESULT_CACHE_MAX_ENTRIES', 512)
+RESULT_CACHE_TTL: float = _get_float('RESULT_CACHE_TTL', 600.0)
+# 永続キャッシュ（プロセス間で共有し、再起動後も保持する）: "sqlite" | "memory"（メモリのみ）
+RESULT_CACHE_BACKEND: str = os.environ.get('RESULT_CACHE_BACKEND', 'sqlite').strip().lower()
+RESULT_CACHE_PATH: str = os.environ.get('RESULT_CACHE_PATH', 'data/result_cache.sqlite3')
+RESULT_CACHE_MAX_BYTES: int = _get_int('RESULT_CACHE_MAX_BYTES', 64 * 1024 * 1024)
+# 期限切れ後も結果を残しておく時間（秒）。上流APIの障害時はこの範囲の古い結果を返す
+RESULT_CACHE_STALE_TTL: float = _get_float('RESULT_CACHE_STALE_TTL', 86400.0)
+# メディアURL（CDNの署名付きURL）の有効期限の何秒前にエントリを期限切れにするか
+RESULT_CACHE_EXPIRY_MARGIN: float = _get_float('RESULT_CACHE_EXPIRY_MARGIN', 300.0)
+# よく使われるエントリを期限の何秒前から裏で再取得するか（0で無効）と、対象にするのに必要なヒット数
+RESULT_CACHE_REFRESH_AHEAD: float = _get_float('RESULT_CACHE_REFRESH_AHEAD', 120.0)
+RESULT_CACHE_REFRESH_MIN_HITS: int = _get_int('RESULT_CACHE_REFRESH_MIN_HITS', 3)
+# 容量がいっぱいのとき、問い合わせ頻度の推定値が破棄対象より高い結果だけを保存する（TinyLFU）
+RESULT_CACHE_ADMISSION: bool = _get_bool('RESULT_CACHE_ADMISSION', True)
+
+# Negative Cache Configuration (取得に失敗した投稿を短時間記録し、再送されたリンクを即座に失敗させる)
+NEGATIVE_CACHE_ENABLED: bool = _get_bool('NEGATIVE_CACHE_ENABLED', True)
+NEGATIVE_CACHE_MAX_ENTRIES: int = _get_int('NEGATIVE_CACHE_MAX_ENTRIES', 1024)
+# 削除・非公開の投稿、メディアがない・扱えない投稿、プロバイダー側の一時的な問題それぞれの有効期間（秒）
+NEGATIVE_CACHE_TTL: float = _get_float('NEGATIVE_CACHE_TTL', 600.0)
+NEGATIVE_CACHE_EMPTY_TTL: float = _get_float('NEGATIVE_CACHE_EMPTY_TTL', 120.0)
+NEGATIVE_CACHE_TRANSIENT_TTL: float = _get_float('NEGATIVE_CACHE_TRANSIENT_TTL', 15.0)
+
+# HTTP Client Configuration (RapidAPI呼び出し用のコネクションプール)
+HTTP_POOL_SIZE: int = _get_int('HTTP_POOL_SIZE', 10)
+HTTP_CONNECT_TIMEOUT: float = _get_float('HTTP_CONNECT_TIMEOUT', 3.05)
+HTTP_READ_TIMEOUT: float = _get_float('HTTP_READ_TIMEOUT', 15.0)
+HTTP_MAX_RETRIES: int = _get_int('HTTP_MAX_RETRIES', 2)
+HTTP_BACKOFF_BASE: float = _get_float('HTTP_BACKOFF_BASE', 0.3)
+HTTP_BACKOFF_MAX: float = _get_float('HTTP_BACKOFF_MAX', 3.0)
+
+# Batch Configuration (1メッセージ内の複数リンクの並行処理)
+BATCH_MAX_LINKS: int = _get_int('BATCH_MAX_LINKS', 5)
+BATCH_MAX_CONCURRENCY: int = max(1, _get_int('BATCH_MAX_CONCURRENCY', 4))
+
+# Streaming Configuration (レスポンスボディを読み込む単位)
+STREAM_CHUNK_SIZE: int = _get_int('STREAM_CHUNK_SIZE', 8192)
+
+# Job Queue Configuration (LINE Webhookのイベントをバックグラウンドで処理する永続キュー)
+JOB_QUEUE_ENABLED: bool = _get_bool('JOB_QUEUE_ENABLED', True)
+JOB_QUEUE_PATH: str = os.environ.get('JOB_QUEUE_PATH', 'data/line_jobs.sqlite3')
+JOB_QUEUE_WORKERS: int = max(1, _get_int('JOB_QUEUE_WORKERS', 2))
+JOB_QUEUE_MAX_ATTEMPTS: int = max(1, _get_int('JOB_QUEUE_MAX_ATTEMPTS', 3))
+JOB_QUEUE_RETRY_BASE: float = _get_float('JOB_QUEUE_RETRY_BASE', 1.0)
+JOB_QUEUE_RETRY_MAX: float = _get_float('JOB_QUEUE_RETRY_MAX', 30.0)
+JOB_QUEUE_LEASE: float = _get_float('JOB_QUEUE_LEASE', 60.0)
+JOB_QUEUE_POLL_INTERVAL: float = _get_float('JOB_QUEUE_POLL_INTERVAL', 0.5)
+
+# LINE Push Configuration (返信に入りきらないメディアをpushメッセージで送るキュー)
+LINE_PUSH_ENABLED: bool = _get_bool('LINE_PUSH_ENABLED', True)
+LINE_PUSH_PER_SECOND: float = _get_float('LINE_PUSH_PER_SECOND', 10.0)
+LINE_PUSH_MAX_RETRIES: int = max(0, _get_int('LINE_PUSH_MAX_RETRIES', 2))
+
+# 1つのWebhookに含まれる複数のイベントを並行して処理する数の上限（プロセス全体）
+LINE_EVENT_CONCURRENCY: int = max(1, _get_int('LINE_EVENT_CONCURRENCY', 5))
+
+# Idempotency Configuration (LINEが再送したWebhookイベントを処理前に取り除く)
+IDEMPOTENCY_ENABLED: bool = _get_bool('IDEMPOTENCY_ENABLED', True)
+# 処理済みのイベントを記録しておく時間（秒）と、メモリに保持する最大数
+IDEMPOTENCY_TTL: float = _get_float('IDEMPOTENCY_TTL', 3600.0)
+IDEMPOTENCY_MAX_ENTRIES: int = _get_int('IDEMPOTENCY_MAX_ENTRIES', 10000)
+# sqlite: プロセス間で共有する（Gunicornの複数ワーカー・再起動後も有効） / memory: プロセス内のみ
+IDEMPOTENCY_BACKEND: str = os.environ.get('IDEMPOTENCY_BACKEND', 'sqlite').strip().lower()
+IDEMPOTENCY_PATH: str = os.environ.get('IDEMPOTENCY_PATH', 'data/idempotency.sqlite3')
+
+# Media Proxy Configuration (CDNのメディアを自前のエンドポイントから配信し、ディスクにキャッシュする)
+MEDIA_PROXY_ENABLED: bool = _get_bool('MEDIA_PROXY_ENABLED', False)
+# 公開URL（例: https://example.onrender.com）。LINEはHTTPSのURLしか受け付けない
+MEDIA_PROXY_BASE_URL: str = os.environ.get('MEDIA_PROXY_BASE_URL', '').rstrip('/')
+# プロキシURLの署名鍵（未設定の場合はLINE_CHANNEL_SECRETから導出する）
+MEDIA_PROXY_SECRET: str = os.environ.get('MEDIA_PROXY_SECRET', '')
+MEDIA_CACHE_DIR: str = os.environ.get('MEDIA_CACHE_DIR', 'data/media')
+# キャッシュ全体の上限と、1ファイルの上限（バイト。超えるメディアは元のURLへリダイレクトする）
+MEDIA_CACHE_MAX_BYTES: int = _get_int('MEDIA_CACHE_MAX_BYTES', 512 * 1024 * 1024)
+MEDIA_CACHE_MAX_OBJECT_BYTES: int = _get_int('MEDIA_CACHE_MAX_OBJECT_BYTES', 50 * 1024 * 1024)
+
+# Preview Configuration (LINEのプレビュー画像を縮小して自前のエンドポイントから配信する。MEDIA_PROXY_BASE_URLが必要)
+LINE_PREVIEW_ENABLED: bool = _get_bool('LINE_PREVIEW_ENABLED', True)
+# プレビュー画像の長辺（px）とファイルサイズの上限（バイト、LINEの上限は1MB）
+LINE_PREVIEW_MAX_DIMENSION: int = max(16, _get_int('LINE_PREVIEW_MAX_DIMENSION', 240))
+LINE_PREVIEW_MAX_BYTES: int = _get_int('LINE_PREVIEW_MAX_BYTES', 1024 * 1024)
+# プレビュー画像を生成するスレッド数（縮小はCPUを使うため少なめにする）
+LINE_PREVIEW_WORKERS: int = max(1, _get_int('LINE_PREVIEW_WORKERS', 2))
+
+# Rate Limit Configuration (RapidAPI呼び出しのトークンバケット)
+RATE_LIMIT_ENABLED: bool = _get_bool('RATE_LIMIT_ENABLED', True)
+RATE_LIMIT_PER_SECOND: float = _get_float('RATE_LIMIT_PER_SECOND', 5.0)
+RATE_LIMIT_BURST: float = _get_float('RATE_LIMIT_BURST', 5.0)
+RATE_LIMIT_PER_DAY: int = _get_int('RATE_LIMIT_PER_DAY', 0)  # 0: 無制限
+RATE_LIMIT_MAX_WAIT: float = _get_float('RATE_LIMIT_MAX_WAIT', 5.0)
+RATE_LIMIT_MAX_429_RETRIES: int = max(0, _get_int('RATE_LIMIT_MAX_429_RETRIES', 1))
+
+
+def provider_rate_limit(name: str) -> Dict[str, Any]:
+    """
+    プロバイダーごとのレートリミッターの設定を返す（RateLimiterの引数）。
+    RATE_LIMIT_<NAME>_PER_SECOND / _BURST / _PER_DAY（NAMEはプロバイダー名の大文字）があればその値を、
+    なければ共通の RATE_LIMIT_PER_SECOND / RATE_LIMIT_BURST / RATE_LIMIT_PER_DAY を使う。
+
+    Args:
+        name: プロバイダー名（downloader / looter / scraper）
+    """
+    prefix = f"RATE_LIMIT_{name.upper()}_"
+    return {
+        "per_second": _get_float(prefix + "PER_SECOND", RATE_LIMIT_PER_SECOND),
+        "burst": _get_float(prefix + "BURST", RATE_LIMIT_BURST),
+        "per_day": _get_int(prefix + "PER_DAY", RATE_LIMIT_PER_DAY),
+        "max_wait": RATE_LIMIT_MAX_WAIT,
+        "enabled": RATE_LIMIT_ENABLED,
+    }
+
+# Fair Scheduling Configuration (依頼元ごとに公平にRapidAPIの問い合わせを割り当てる)
+FAIR_MAX_CONCURRENCY: int = max(1, _get_int('FAIR_MAX_CONCURRENCY', 8))
+FAIR_PER_KEY_CONCURRENCY: int = max(1, _get_int('FAIR_PER_KEY_CONCURRENCY', 2))
+FAIR_PER_KEY_QUEUE: int = max(0, _get_int('FAIR_PER_KEY_QUEUE', 10))
+FAIR_MAX_WAIT: float = _get_float('FAIR_MAX_WAIT', 30.0)
+# クラスごとの重み（例: "line_group=2,discord_guild=1"。未指定のクラスは1）
+FAIR_CLASS_WEIGHTS: str = os.environ.get('FAIR_CLASS_WEIGHTS', '')
+
+# Circuit Breaker Configuration (RapidAPIの障害時に待たずに失敗させる)
+CIRCUIT_BREAKER_ENABLED: bool = _get_bool('CIRCUIT_BREAKER_ENABLED', True)
+CIRCUIT_BREAKER_WINDOW: int = max(1, _get_int('CIRCUIT_BREAKER_WINDOW', 20))
+CIRCUIT_BREAKER_MIN_CALLS: int = max(1, _get_int('CIRCUIT_BREAKER_MIN_CALLS', 5))
+CIRCUIT_BREAKER_FAILURE_RATE: float = _get_float('CIRCUIT_BREAKER_FAILURE_RATE', 0.5)
+CIRCUIT_BREAKER_SLOW_CALL_SECONDS: float = _get_float('CIRCUIT_BREAKER_SLOW_CALL_SECONDS', 10.0)
+CIRCUIT_BREAKER_SLOW_CALL_RATE: float = _get_float('CIRCUIT_BREAKER_SLOW_CALL_RATE', 0.8)
+CIRCUIT_BREAKER_OPEN_SECONDS: float = _get_float('CIRCUIT_BREAKER_OPEN_SECONDS', 30.0)
+
+# Upstream Provider Configuration (メディア取得に使うAPIと、遅い場合の追加問い合わせ)
+# 使用するプロバイダー（カンマ区切り）: downloader / looter / scraper
+UPSTREAM_PROVIDERS: str = os.environ.get('UPSTREAM_PROVIDERS', 'downloader')
+HEDGE_ENABLED: bool = _get_bool('HEDGE_ENABLED', True)
+# 統計がない場合に、次のプロバイダーへ問い合わせるまで待つ時間（秒）と、その下限
+HEDGE_DEFAULT_DELAY: float = _get_float('HEDGE_DEFAULT_DELAY', 3.0)
+HEDGE_MIN_DELAY: float = _get_float('HEDGE_MIN_DELAY', 0.5)
@@ -0,0 +1,42 @@
+import os
+import sqlite3
+import threading
+
+
+class SQLiteConnections:
+    """
+    SQLite(WALモード)のファイルへのスレッドごとの接続を管理する。
+    sqlite3の接続はスレッド間で共有できないため、スレッドごとに1本の接続を作って使い回す。
+    WALモードでは読み込みと書き込みが互いをブロックしないため、
+    複数のスレッド・プロセス（Gunicornワーカー等）から同じファイルを安全に共有できる。
+    """
+
+    def __init__(self, path: str, schema: str = "", timeout: float = 10.0):
+        """
+        Args:
+            path: SQLiteファイルのパス（ディレクトリがなければ作成する）
+            schema: 最初の接続時に実行するSQL（CREATE TABLE IF NOT EXISTS ... 等）
+            timeout: 他の接続が書き込み中の場合に待つ最大時間（秒）
+        """
+        self.path = path
+        self.schema = schema
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def get(self) -> sqlite3.Connection:
+        """
+        現在のスレッドの接続を返す。ファイルとテーブルは最初の接続時に作成する。
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # isolation_level=None: トランザクションは必要な箇所で明示的に BEGIN IMMEDIATE で開始する
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            if self.schema:
+                conn.executescript(self.schema)
+            self._local.conn = conn
+        return conn
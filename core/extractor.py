@@ -0,0 +1,473 @@
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Union, List, Set, Tuple, Hashable
+
+from core.parser import is_instagram_post_url
+
+# ログ設定
+logger = logging.getLogger(__name__)
+
+# メディアURLが直接入っている可能性のあるキー（優先順）
+DIRECT_URL_KEYS = ('video_url', 'download_url', 'media', 'thumbnail', 'cover', 'thumb', 'url')
+
+# メディアがネストされている可能性のあるキー（探索順）
+NESTED_KEYS = ('body', 'data', 'results', 'items', 'carousel_media', 'edges')
+
+# 探索の上限（深くネストされた・巨大なJSONで処理が暴走しないようにする）
+MAX_DEPTH = 32
+MAX_NODES = 10000
+
+# 探索で意味を持つキーの集合（これ以外のキーは構造シグネチャ・抽出プランでは無視する）
+_RELEVANT_KEYS = frozenset(DIRECT_URL_KEYS + NESTED_KEYS + ('medias',))
+
+# 保持する抽出プランの数
+PLAN_CACHE_SIZE = 64
+
+# ノードの種類
+_DICT, _LIST, _SCALAR = 'd', 'l', 's'
+
+# プラン中でリストの任意の要素を表すキー
+_ANY_INDEX = '*'
+
+
+def _collect_direct_urls(
+    obj: Dict[str, Any],
+    urls: List[str],
+    seen: Set[str],
+    keys: Tuple[str, ...] = DIRECT_URL_KEYS,
+) -> None:
+    """辞書の直下にあるメディアURLを、出現順・重複なしで収集する"""
+    for key in keys:
+        value = obj.get(key)
+        if not isinstance(value, str) or not value.startswith('http'):
+            continue
+        # InstagramのHTMLページURLは除外
+        if value in seen or is_instagram_post_url(value):
+            continue
+        seen.add(value)
+        urls.append(value)
+
+
+def _is_flat_media(item: Any) -> bool:
+    """子要素を探索する必要のない、URLだけを持つメディア辞書かどうか"""
+    if not isinstance(item, dict) or isinstance(item.get('medias'), list):
+        return False
+    return not any(key in item for key in NESTED_KEYS)
+
+
+class _PlanNode:
+    """
+    抽出プランの1ノード。学習時にこの位置で見た構造（ノードの種類と関係するキー）を表す。
+    リストの要素は全て '*' の子ノードにまとめる。
+    """
+    __slots__ = ("kinds", "keys", "medias_list", "collect", "nested", "children")
+
+    def __init__(self) -> None:
+        self.kinds: Set[str] = set()
+        self.keys: Set[str] = set()
+        self.medias_list = False               # 'medias' がリストだったことがあるか
+        self.collect: Tuple[str, ...] = ()     # 読むべき直接URLキー（DIRECT_URL_KEYSの順）
+        self.nested: Tuple[str, ...] = ()      # たどるべきネストキー（NESTED_KEYSの逆順 = スタック投入順）
+        self.children: Dict[str, "_PlanNode"] = {}
+
+    def child(self, key: str) -> "_PlanNode":
+        node = self.children.get(key)
+        if node is None:
+            node = self.children[key] = _PlanNode()
+        return node
+
+    @property
+    def flat(self) -> bool:
+        """この位置のノードが常に、子要素をたどる必要のない（URLだけを持つ）メディア辞書だったか"""
+        return self.kinds == {_DICT} and not self.medias_list and not self.nested
+
+    def learn_dict(self, relevant: "frozenset[str]", medias_list: bool) -> None:
+        self.kinds.add(_DICT)
+        if not relevant <= self.keys:
+            self.keys |= relevant
+            self.collect = tuple(k for k in DIRECT_URL_KEYS if k in self.keys)
+            self.nested = tuple(k for k in reversed(NESTED_KEYS) if k in self.keys)
+        self.medias_list = self.medias_list or medias_list
+
+
+class _PlanMismatch(Exception):
+    """抽出プランと異なる構造に出会ったことを表す（汎用探索に切り替える）"""
+
+
+class _PlanCache:
+    """構造シグネチャ -> 抽出プラン のLRUキャッシュ"""
+
+    def __init__(self, max_entries: int) -> None:
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._plans: "OrderedDict[Hashable, _PlanNode]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.fallbacks = 0  # プランと構造が合わず汎用探索に戻った回数
+
+    def get(self, signature: Hashable) -> Optional[_PlanNode]:
+        with self._lock:
+            plan = self._plans.get(signature)
+            if plan is None:
+                self.misses += 1
+                return None
+            self._plans.move_to_end(signature)
+            self.hits += 1
+            return plan
+
+    def put(self, signature: Hashable, plan: _PlanNode) -> None:
+        with self._lock:
+            self._plans[signature] = plan
+            self._plans.move_to_end(signature)
+            while len(self._plans) > self.max_entries:
+                self._plans.popitem(last=False)
+
+    def record_fallback(self) -> None:
+        with self._lock:
+            self.fallbacks += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._plans.clear()
+            self.hits = 0
+            self.misses = 0
+            self.fallbacks = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._plans),
+                "hits": self.hits,
+                "misses": self.misses,
+                "fallbacks": self.fallbacks,
+            }
+
+
+_plan_cache = _PlanCache(PLAN_CACHE_SIZE)
+
+
+def get_plan_cache_stats() -> Dict[str, int]:
+    """抽出プランキャッシュの統計情報（size / hits / misses / fallbacks）を返す"""
+    return _plan_cache.stats()
+
+
+def clear_plan_cache() -> None:
+    """学習済みの抽出プランを全て破棄する"""
+    _plan_cache.clear()
+
+
+def _shape_signature(obj: Any) -> Hashable:
+    """
+    レスポンスの構造シグネチャ。最上位の関係するキーの集合だけを使うため一定のコストで計算できる。
+    より深い階層の違いは、プランを再生する際の構造チェックで検出する。
+    """
+    if isinstance(obj, dict):
+        return (_DICT, frozenset(obj.keys() & _RELEVANT_KEYS))
+    if isinstance(obj, list):
+        return (_LIST,)
+    return (_SCALAR,)
+
+
+def _walk(
+    obj: Union[Dict[str, Any], List[Any]],
+    urls: List[str],
+    plan: Optional[_PlanNode] = None,
+) -> List[str]:
+    """
+    明示的なスタックによる汎用探索。
+    planを指定した場合は、訪れたノードの構造をプランに学習させる。
+    """
+    seen = set(urls)
+    stack: List[Tuple[Any, int, Optional[_PlanNode]]] = [(obj, 0, plan)]
+    visited = 0
+
+    while stack:
+        node, depth, step = stack.pop()
+        visited += 1
+        if visited > MAX_NODES:
+            logger.warning(f"Media search stopped after {MAX_NODES} nodes")
+            break
+
+        if isinstance(node, dict):
+            medias = node.get('medias')
+            if step is not None:
+                step.learn_dict(node.keys() & _RELEVANT_KEYS, isinstance(medias, list))
+            if not isinstance(medias, list):
+                # パターンB: 直接的なメディアURL
+                _collect_direct_urls(node, urls, seen)
+                # パターンC: ネストされている場合（各キーを順番に深さ優先で処理する）
+                if depth < MAX_DEPTH:
+                    stack.extend(
+                        (node[key], depth + 1, step.child(key) if step is not None else None)
+                        for key in reversed(NESTED_KEYS) if key in node
+                    )
+                continue
+            # パターンA: 'medias' リストがある場合（複数メディアの可能性大）
+            children = medias
+            if step is not None:
+                step = step.child('medias')
+        elif isinstance(node, list):
+            children = node
+        else:
+            if step is not None:
+                step.kinds.add(_SCALAR)
+            continue
+
+        item_step = None
+        if step is not None:
+            step.kinds.add(_LIST)
+            item_step = step.child(_ANY_INDEX)
+
+        # 高速パス: medias / carousel_media 等の要素が全てフラットなメディア辞書なら、スタックを使わずに収集する
+        if item_step is None and all(_is_flat_media(item) for item in children):
+            for item in children:
+                _collect_direct_urls(item, urls, seen)
+            visited += len(children)
+            continue
+
+        if depth < MAX_DEPTH:
+            stack.extend((child, depth + 1, item_step) for child in reversed(children))
+
+    return urls
+
+
+def _replay(obj: Any, plan: _PlanNode) -> List[str]:
+    """
+    抽出プランに沿って探索する。各辞書で関係するキーを集合演算で一度に確認し、
+    プランに記録されたキーだけを直接読む。たどる順序は汎用探索と同じ（深さ優先・前順）。
+
+    Raises:
+        _PlanMismatch: プランにない構造（キー・ノードの種類）に出会った場合
+    """
+    urls: List[str] = []
+    seen: Set[str] = set()
+    stack: List[Tuple[Any, int, _PlanNode]] = [(obj, 0, plan)]
+    visited = 0
+
+    while stack:
+        node, depth, step = stack.pop()
+        visited += 1
+        if visited > MAX_NODES:
+            raise _PlanMismatch()
+
+        if isinstance(node, dict):
+            if _DICT not in step.kinds or not node.keys() & _RELEVANT_KEYS <= step.keys:
+                raise _PlanMismatch()
+            medias = node.get('medias')
+            if isinstance(medias, list):
+                if not step.medias_list:
+                    raise _PlanMismatch()
+                node, step = medias, step.children['medias']
+            else:
+                if step.collect:
+                    _collect_direct_urls(node, urls, seen, keys=step.collect)
+                if depth < MAX_DEPTH:
+                    for key in step.nested:
+                        if key not in node:
+                            continue
+                        # 'medias' がリストだったためにたどらなかったキーは、プランに子ノードがない
+                        child = step.children.get(key)
+                        if child is None:
+                            raise _PlanMismatch()
+                        stack.append((node[key], depth + 1, child))
+                continue
+
+        if isinstance(node, list):
+            if _LIST not in step.kinds:
+                raise _PlanMismatch()
+            if not node:
+                continue
+            item_step = step.children.get(_ANY_INDEX)
+            if item_step is None:
+                raise _PlanMismatch()
+            if depth >= MAX_DEPTH:
+                continue
+            # 高速パス: medias / carousel_media 等の要素が全てフラットなメディア辞書だった位置では、
+            # スタックを使わずに要素のURLを順に収集する（次にスタックから取り出すのもこれらの要素のため順序は変わらない）
+            if item_step.flat:
+                visited += len(node)
+                if visited > MAX_NODES:
+                    raise _PlanMismatch()
+                for item in node:
+                    if not isinstance(item, dict) or not item.keys() & _RELEVANT_KEYS <= item_step.keys:
+                        raise _PlanMismatch()
+                    if isinstance(item.get('medias'), list):
+                        raise _PlanMismatch()
+                    _collect_direct_urls(item, urls, seen, keys=item_step.collect)
+                continue
+            stack.extend((item, depth + 1, item_step) for item in reversed(node))
+        elif _SCALAR not in step.kinds:
+            raise _PlanMismatch()
+
+    return urls
+
+
+def find_all_urls(obj: Union[Dict[str, Any], List[Any]], collected_urls: Optional[List[str]] = None) -> List[str]:
+    """
+    レスポンスJSONから全てのメディアURLを探索する。
+    再帰の代わりに明示的なスタックを使い、深さと訪問ノード数に上限を設ける。
+    収集順は深さ優先・前順（従来の再帰実装と同じ）で、重複はセットで除外する。
+
+    プロバイダーのレスポンスは少数の構造パターンに限られるため、構造シグネチャごとに
+    「どの位置でどのキーを読めばよいか」を抽出プランとして学習し、同じ構造のレスポンスは
+    プランに沿って直接読む。プランにない構造に出会った場合は汎用探索に戻り、プランに追加学習する。
+
+    Args:
+        obj: 探索対象の辞書またはリスト
+        collected_urls: 収集済みのURLリスト（指定した場合はこのリストに追記し、プランは使わない）
+
+    Returns:
+        見つかった全てのURL文字列のリスト
+    """
+    if collected_urls is not None:
+        return _walk(obj, collected_urls)
+
+    signature = _shape_signature(obj)
+    plan = _plan_cache.get(signature)
+    if plan is not None:
+        try:
+            return _replay(obj, plan)
+        except _PlanMismatch:
+            _plan_cache.record_fallback()
+        # 再生中の他スレッドに学習途中の状態を見せないよう、複製に追加学習してから置き換える
+        learned = _copy_plan(plan)
+    else:
+        learned = _PlanNode()
+
+    urls = _walk(obj, [], learned)
+    _plan_cache.put(signature, learned)
+    return urls
+
+
+def _copy_plan(plan: _PlanNode) -> _PlanNode:
+    """プランの木を複製する（再生中の他スレッドに学習途中の状態を見せないため）"""
+    root = _PlanNode()
+    stack = [(plan, root)]
+    while stack:
+        source, target = stack.pop()
+        target.kinds = set(source.kinds)
+        target.keys = set(source.keys)
+        target.medias_list = source.medias_list
+        target.collect = source.collect
+        target.nested = source.nested
+        for key, child in source.children.items():
+            target.children[key] = _PlanNode()
+            stack.append((child, target.children[key]))
+    return root
+
+
+def find_url(obj: Union[Dict[str, Any], List[Any]]) -> Optional[str]:
+    """
+    レスポンスJSONから最初のメディアURLを探索する。
+
+    Args:
+        obj: 探索対象の辞書またはリスト
+
+    Returns:
+        見つかったURL文字列、またはNone
+    """
+    urls = find_all_urls(obj)
+    return urls[0] if urls else None
+
+
+def _mentions_video(obj: Any) -> bool:
+    """
+    キーまたは文字列値のどこかに "video" を含むかを判定する。
+    str(obj).lower() で辞書全体を文字列化する代わりに、要素を順に調べて見つかった時点で打ち切る。
+    """
+    stack = [obj]
+    visited = 0
+    while stack and visited < MAX_NODES:
+        node = stack.pop()
+        visited += 1
+        if isinstance(node, str):
+            if 'video' in node.lower():
+                return True
+        elif isinstance(node, dict):
+            for key, value in node.items():
+                if isinstance(key, str) and 'video' in key.lower():
+                    return True
+                stack.append(value)
+        elif isinstance(node, (list, tuple)):
+            stack.extend(node)
+    return False
+
+
+def media_info_from_item(media: Any) -> Optional[Dict[str, Any]]:
+    """
+    'medias' リストの1要素からメディア情報を作る。
+
+    Args:
+        media: 'medias' リストの要素
+
+    Returns:
+        {"url", "type", "thumbnail"} の辞書。メディアURLが見つからない場合はNone
+    """
+    if not isinstance(media, dict):
+        return None
+
+    media_info: Dict[str, Any] = {
+        "url": None,
+        "type": "image",
+        "thumbnail": None
+    }
+
+    # 動画チェック
+    if 'video_url' in media:
+        media_info["url"] = media['video_url']
+        media_info["type"] = "video"
+        # サムネイルも取得
+        if 'thumbnail' in media:
+            media_info["thumbnail"] = media['thumbnail']
+        elif 'thumb' in media:
+            media_info["thumbnail"] = media['thumb']
+    elif 'download_url' in media:
+        media_info["url"] = media['download_url']
+    elif isinstance(media.get('url'), str) and not is_instagram_post_url(media['url']):
+        media_info["url"] = media['url']
+
+    if not media_info["url"] or not isinstance(media_info["url"], str):
+        return None
+
+    # タイプ判定の追加ロジック
+    if media_info["type"] != "video" and (".mp4" in media_info["url"] or _mentions_video(media)):
+        media_info["type"] = "video"
+
+    return media_info
+
+
+def extract_media_info(data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    APIレスポンスから詳細なメディア情報を抽出する。
+
+    Args:
+        data: APIレスポンスのJSON
+
+    Returns:
+        メディア情報のリスト。各要素は以下の構造：
+        {
+            "url": str,           # メディアURL
+            "type": "image" | "video",  # メディアタイプ
+            "thumbnail": str | None     # サムネイルURL（動画の場合）
+        }
+    """
+    media_list = []
+
+    # mediasリストがある場合（最も一般的なパターン）
+    if isinstance(data, dict) and isinstance(data.get('medias'), list):
+        for media in data['medias']:
+            media_info = media_info_from_item(media)
+            if media_info is not None:
+                media_list.append(media_info)
+
+    # mediasがない場合は従来の方法でURLを探す
+    if not media_list:
+        for url in find_all_urls(data):
+            media_list.append({
+                "url": url,
+                "type": "video" if ".mp4" in url else "image",
+                "thumbnail": None
+            })
+
+    return media_list
@@ -0,0 +1,471 @@
+import asyncio
+import json
+import logging
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import timedelta
+from types import SimpleNamespace
+from typing import Optional, Any, Callable, Awaitable, Mapping, AsyncIterator
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from core.config import (
+    HTTP_POOL_SIZE, HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT,
+    HTTP_MAX_RETRIES, HTTP_BACKOFF_BASE, HTTP_BACKOFF_MAX
+)
+
+# ログ設定
+logger = logging.getLogger(__name__)
+
+# リトライ対象とするHTTPステータス（上流の一時的な障害）
+RETRY_STATUSES = frozenset({500, 502, 503, 504})
+
+# 接続確立（TCP+TLSハンドシェイク）にかかった時間をスレッドごとに記録する
+_connect_timing = threading.local()
+
+
+def _record_connect(seconds: float) -> None:
+    _connect_timing.seconds = getattr(_connect_timing, "seconds", 0.0) + seconds
+    _connect_timing.count = getattr(_connect_timing, "count", 0) + 1
+
+
+def _reset_connect() -> None:
+    _connect_timing.seconds = 0.0
+    _connect_timing.count = 0
+
+
+def _backoff_delay(base: float, maximum: float, attempt: int) -> float:
+    """attempt回目（0始まり）のリトライ前に待つ時間を返す（Full Jitter方式）"""
+    cap = min(maximum, base * (2 ** attempt))
+    return random.uniform(0, cap)
+
+
+class _TimedHTTPConnection(HTTPConnection):
+    """connect()の所要時間を記録するHTTP接続"""
+
+    def connect(self) -> None:
+        started = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            _record_connect(time.perf_counter() - started)
+
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    """connect()（TCP接続+TLSハンドシェイク）の所要時間を記録するHTTPS接続"""
+
+    def connect(self) -> None:
+        started = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            _record_connect(time.perf_counter() - started)
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class _TimedHTTPAdapter(HTTPAdapter):
+    """接続時間を計測するコネクションプールを使うHTTPAdapter"""
+
+    def init_poolmanager(self, *args: Any, **kwargs: Any) -> None:
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TimedHTTPConnectionPool,
+            "https": _TimedHTTPSConnectionPool,
+        }
+
+
+@dataclass
+class RequestTiming:
+    """1リクエストあたりの時間内訳（ミリ秒）"""
+    attempts: int
+    handshake_ms: float       # 新規接続の確立（TCP+TLS）にかかった時間
+    wait_ms: float            # リクエスト送信からレスポンスヘッダー受信まで（ハンドシェイクを除く）
+    transfer_ms: float        # レスポンスボディの受信にかかった時間
+    total_ms: float           # リトライを含む全体の所要時間
+    reused_connection: bool   # 最後の試行がプール済みの接続を再利用したか
+
+
+class HttpClient:
+    """
+    Keep-Aliveのコネクションプールを共有するHTTPクライアント。
+    タイムアウトと、5xx/接続エラー時のジッター付き指数バックオフによるリトライを備える。
+    """
+
+    def __init__(
+        self,
+        pool_size: int = 10,
+        connect_timeout: float = 3.05,
+        read_timeout: float = 15.0,
+        max_retries: int = 2,
+        backoff_base: float = 0.3,
+        backoff_max: float = 3.0,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        """
+        Args:
+            pool_size: ホストごとに保持する接続数
+            connect_timeout: 接続確立のタイムアウト（秒）
+            read_timeout: レスポンス受信のタイムアウト（秒）
+            max_retries: 初回に加えて行う最大リトライ回数
+            backoff_base: バックオフの基準時間（秒）
+            backoff_max: バックオフの上限（秒）
+            sleep: 待機関数（テスト用に差し替え可能）
+        """
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max(0, max_retries)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._sleep = sleep
+
+        self.session = requests.Session()
+        adapter = _TimedHTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            max_retries=0,  # リトライはこのクラスで制御する
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def backoff_delay(self, attempt: int) -> float:
+        """
+        attempt回目（0始まり）のリトライ前に待つ時間を返す（Full Jitter方式）。
+        """
+        return _backoff_delay(self.backoff_base, self.backoff_max, attempt)
+
+    def get(self, url: str, **kwargs: Any) -> requests.Response:
+        """
+        GETリクエストを送信する。5xxと接続エラー・タイムアウトはリトライする。
+        戻り値のレスポンスには `timing` 属性として RequestTiming が付与される。
+
+        Args:
+            url: リクエスト先URL
+            **kwargs: requests.Session.get にそのまま渡す引数
+
+        Returns:
+            最後の試行のレスポンス（5xxのままリトライを使い切った場合もそのまま返す）
+
+        Raises:
+            requests.RequestException: リトライを使い切っても接続できなかった場合
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        started = time.perf_counter()
+        attempt = 0
+
+        while True:
+            _reset_connect()
+            attempt_started = time.perf_counter()
+            try:
+                response = self.session.get(url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self.backoff_delay(attempt)
+                logger.warning(f"Request to {url} failed ({e}), retrying in {delay:.2f}s")
+                self._sleep(delay)
+                attempt += 1
+                continue
+
+            if response.status_code in RETRY_STATUSES and attempt < self.max_retries:
+                delay = self.backoff_delay(attempt)
+                logger.warning(
+                    f"Request to {url} returned {response.status_code}, retrying in {delay:.2f}s"
+                )
+                response.close()
+                self._sleep(delay)
+                attempt += 1
+                continue
+
+            finished = time.perf_counter()
+            response.timing = self._build_timing(response, attempt + 1, started, attempt_started, finished)
+            return response
+
+    @staticmethod
+    def _build_timing(
+        response: requests.Response,
+        attempts: int,
+        started: float,
+        attempt_started: float,
+        finished: float,
+    ) -> RequestTiming:
+        handshake = getattr(_connect_timing, "seconds", 0.0)
+        new_connections = getattr(_connect_timing, "count", 0)
+        attempt_total = finished - attempt_started
+
+        # response.elapsed は送信からヘッダー受信（パース完了）までの時間
+        elapsed = getattr(response, "elapsed", None)
+        headers_at = elapsed.total_seconds() if isinstance(elapsed, timedelta) else attempt_total
+        headers_at = min(headers_at, attempt_total)
+
+        return RequestTiming(
+            attempts=attempts,
+            handshake_ms=handshake * 1000,
+            wait_ms=max(0.0, headers_at - handshake) * 1000,
+            transfer_ms=max(0.0, attempt_total - headers_at) * 1000,
+            total_ms=(finished - started) * 1000,
+            reused_connection=new_connections == 0,
+        )
+
+    def close(self) -> None:
+        """プール内の接続をすべて閉じる"""
+        self.session.close()
+
+
+@dataclass
+class AsyncResponse:
+    """AsyncHttpClientが返す、ボディ読み込み済みのレスポンス"""
+    status_code: int
+    headers: Mapping[str, str]   # 大文字小文字を区別しないヘッダー
+    content: bytes
+    url: str
+    timing: Optional[RequestTiming] = field(default=None)
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self) -> Any:
+        return json.loads(self.content)
+
+    def raise_for_status(self) -> None:
+        """
+        4xx/5xxの場合に requests.HTTPError を送出する。
+        同期版と同じ例外型にすることで、呼び出し側のエラー処理を共通化できる。
+        """
+        if self.status_code >= 400:
+            raise requests.HTTPError(
+                f"{self.status_code} Error for url: {self.url}", response=self  # type: ignore[arg-type]
+            )
+
+
+async def _on_request_start(session: Any, ctx: SimpleNamespace, params: Any) -> None:
+    ctx.trace_request_ctx.started = time.perf_counter()
+
+
+async def _on_connection_create_start(session: Any, ctx: SimpleNamespace, params: Any) -> None:
+    ctx.trace_request_ctx.connect_started = time.perf_counter()
+
+
+async def _on_connection_create_end(session: Any, ctx: SimpleNamespace, params: Any) -> None:
+    request_ctx = ctx.trace_request_ctx
+    request_ctx.handshake += time.perf_counter() - request_ctx.connect_started
+    request_ctx.reused = False
+
+
+async def _on_request_end(session: Any, ctx: SimpleNamespace, params: Any) -> None:
+    ctx.trace_request_ctx.headers_at = time.perf_counter()
+
+
+def _timing_trace_config() -> aiohttp.TraceConfig:
+    """接続確立・ヘッダー受信の時刻を記録するTraceConfigを作成する"""
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(_on_request_start)
+    trace_config.on_connection_create_start.append(_on_connection_create_start)
+    trace_config.on_connection_create_end.append(_on_connection_create_end)
+    trace_config.on_request_end.append(_on_request_end)
+    return trace_config
+
+
+class AsyncHttpClient:
+    """
+    HttpClientのasyncio版。aiohttpのコネクションプールを使い、
+    同じタイムアウト・リトライ方針でリクエストを送信する。
+    同時実行中のリクエストはスレッドではなくコルーチンとして扱われる。
+    """
+
+    def __init__(
+        self,
+        pool_size: int = 10,
+        connect_timeout: float = 3.05,
+        read_timeout: float = 15.0,
+        max_retries: int = 2,
+        backoff_base: float = 0.3,
+        backoff_max: float = 3.0,
+        sleep: Callable[[float], Awaitable[None]] = asyncio.sleep,
+    ):
+        """
+        Args:
+            pool_size: 全ホスト合計の最大同時接続数
+            connect_timeout: 接続確立のタイムアウト（秒）
+            read_timeout: ソケット読み込みのタイムアウト（秒）
+            max_retries: 初回に加えて行う最大リトライ回数
+            backoff_base: バックオフの基準時間（秒）
+            backoff_max: バックオフの上限（秒）
+            sleep: 待機コルーチン関数（テスト用に差し替え可能）
+        """
+        self.pool_size = pool_size
+        self.timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        self.max_retries = max(0, max_retries)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._sleep = sleep
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """実行中のイベントループに紐づくセッションを返す（未作成なら作成する）"""
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._loop is not loop:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+                timeout=self.timeout,
+                trace_configs=[_timing_trace_config()],
+            )
+            self._loop = loop
+        return self._session
+
+    async def get(self, url: str, **kwargs: Any) -> AsyncResponse:
+        """
+        GETリクエストを送信し、ボディまで読み込んだレスポンスを返す。
+        5xxと接続エラー・タイムアウトはリトライする。
+
+        Args:
+            url: リクエスト先URL
+            **kwargs: aiohttp.ClientSession.get にそのまま渡す引数（headers, params等）
+
+        Returns:
+            最後の試行のレスポンス（timing属性付き）
+
+        Raises:
+            aiohttp.ClientError / asyncio.TimeoutError: リトライを使い切っても接続できなかった場合
+        """
+        session = self._get_session()
+        started = time.perf_counter()
+        attempt = 0
+
+        while True:
+            trace = SimpleNamespace(started=time.perf_counter(), handshake=0.0, reused=True, headers_at=None)
+            try:
+                async with session.get(url, trace_request_ctx=trace, **kwargs) as resp:
+                    content = await resp.read()
+                    status = resp.status
+                    headers = resp.headers.copy()
+                    final_url = str(resp.url)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = _backoff_delay(self.backoff_base, self.backoff_max, attempt)
+                logger.warning(f"Request to {url} failed ({e!r}), retrying in {delay:.2f}s")
+                await self._sleep(delay)
+                attempt += 1
+                continue
+
+            if status in RETRY_STATUSES and attempt < self.max_retries:
+                delay = _backoff_delay(self.backoff_base, self.backoff_max, attempt)
+                logger.warning(f"Request to {url} returned {status}, retrying in {delay:.2f}s")
+                await self._sleep(delay)
+                attempt += 1
+                continue
+
+            finished = time.perf_counter()
+            headers_at = trace.headers_at or finished
+            timing = RequestTiming(
+                attempts=attempt + 1,
+                handshake_ms=trace.handshake * 1000,
+                wait_ms=max(0.0, headers_at - trace.started - trace.handshake) * 1000,
+                transfer_ms=max(0.0, finished - headers_at) * 1000,
+                total_ms=(finished - started) * 1000,
+                reused_connection=trace.reused,
+            )
+            return AsyncResponse(
+                status_code=status, headers=headers, content=content, url=final_url, timing=timing
+            )
+
+    async def iter_chunks(
+        self,
+        url: str,
+        chunk_size: int = 8192,
+        on_response: Optional[Callable[[int, Mapping[str, str]], Any]] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[bytes]:
+        """
+        GETリクエストを送信し、レスポンスボディをチャンクごとに返す非同期ジェネレーター。
+        リトライはレスポンスヘッダーを受信するまで（5xxと接続エラー・タイムアウト）に限る。
+
+        Args:
+            url: リクエスト先URL
+            chunk_size: 1回に返す最大バイト数
+            on_response: 最終的なレスポンスのステータスコードとヘッダーを受け取る関数（ボディの読み込み前に呼ばれる）
+            **kwargs: aiohttp.ClientSession.get にそのまま渡す引数
+
+        Yields:
+            ボディのバイト列
+
+        Raises:
+            requests.HTTPError: 4xx/5xxの場合
+        """
+        session = self._get_session()
+        attempt = 0
+
+        while True:
+            try:
+                trace = SimpleNamespace(started=time.perf_counter(), handshake=0.0, reused=True, headers_at=None)
+                resp = await session.get(url, trace_request_ctx=trace, **kwargs)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = _backoff_delay(self.backoff_base, self.backoff_max, attempt)
+                logger.warning(f"Request to {url} failed ({e!r}), retrying in {delay:.2f}s")
+                await self._sleep(delay)
+                attempt += 1
+                continue
+
+            if resp.status in RETRY_STATUSES and attempt < self.max_retries:
+                resp.release()
+                delay = _backoff_delay(self.backoff_base, self.backoff_max, attempt)
+                logger.warning(f"Request to {url} returned {resp.status}, retrying in {delay:.2f}s")
+                await self._sleep(delay)
+                attempt += 1
+                continue
+            break
+
+        try:
+            if on_response is not None:
+                on_response(resp.status, resp.headers.copy())
+            AsyncResponse(
+                status_code=resp.status, headers=resp.headers.copy(), content=b"", url=str(resp.url)
+            ).raise_for_status()
+            async for chunk in resp.content.iter_chunked(chunk_size):
+                yield chunk
+        finally:
+            resp.release()
+
+    async def close(self) -> None:
+        """プール内の接続をすべて閉じる"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        self._loop = None
+
+
+# 両Botで共有するモジュールレベルのクライアント
+http_client = HttpClient(
+    pool_size=HTTP_POOL_SIZE,
+    connect_timeout=HTTP_CONNECT_TIMEOUT,
+    read_timeout=HTTP_READ_TIMEOUT,
+    max_retries=HTTP_MAX_RETRIES,
+    backoff_base=HTTP_BACKOFF_BASE,
+    backoff_max=HTTP_BACKOFF_MAX,
+)
+
+# Discord Bot等のasyncioコードから使うクライアント
+async_http_client = AsyncHttpClient(
+    pool_size=HTTP_POOL_SIZE,
+    connect_timeout=HTTP_CONNECT_TIMEOUT,
+    read_timeout=HTTP_READ_TIMEOUT,
+    max_retries=HTTP_MAX_RETRIES,
+    backoff_base=HTTP_BACKOFF_BASE,
+    backoff_max=HTTP_BACKOFF_MAX,
+)
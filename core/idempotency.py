@@ -0,0 +1,261 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Callable
+
+from core.config import (
+    IDEMPOTENCY_ENABLED, IDEMPOTENCY_TTL, IDEMPOTENCY_MAX_ENTRIES, IDEMPOTENCY_BACKEND, IDEMPOTENCY_PATH
+)
+from core.db import SQLiteConnections
+
+# ログ設定
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS seen (
+    key        BLOB PRIMARY KEY,  -- digest() の8バイト
+    expires_at REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS seen_expires ON seen (expires_at);
+"""
+
+# 何回の記録ごとに期限切れの行を掃除するか
+_SWEEP_INTERVAL = 100
+
+
+def digest(key: str) -> bytes:
+    """キー（webhookEventId等）を8バイトのダイジェストに変換する（保存サイズを一定に抑えるため）"""
+    return hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest()
+
+
+class SQLiteIdempotencyBackend:
+    """
+    IdempotencyStoreのプロセス間共有用バックエンド（SQLite WALモード）。
+    Gunicornの複数ワーカーや再起動をまたいで、処理済みのキーを期限付きで記録する。
+    """
+
+    def __init__(self, path: str, clock: Callable[[], float] = time.time):
+        """
+        Args:
+            path: SQLiteファイルのパス
+            clock: 現在時刻（UNIX時間）を返す関数。プロセス間で比較するため壁時計を使う
+        """
+        self.path = path
+        self._clock = clock
+        self._connections = SQLiteConnections(path, _SCHEMA)
+        self._lock = threading.Lock()
+        self._adds = 0
+        self.errors = 0
+
+    def add(self, key: bytes, ttl: float) -> Optional[bool]:
+        """
+        キーを記録する。
+
+        Args:
+            key: digest() で変換したキー
+            ttl: 記録しておく時間（秒）
+
+        Returns:
+            新しく記録した場合はTrue、記録済み（期限内）の場合はFalse、エラーの場合はNone
+        """
+        now = self._clock()
+        with self._lock:
+            self._adds += 1
+            sweep = self._adds % _SWEEP_INTERVAL == 0
+        try:
+            conn = self._connections.get()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if sweep:
+                    conn.execute("DELETE FROM seen WHERE expires_at <= ?", (now,))
+                # 期限切れの行は上書きし、期限内の行があれば何もしない（更新件数で判定する）
+                cursor = conn.execute(
+                    "INSERT INTO seen (key, expires_at) VALUES (?, ?) "
+                    "ON CONFLICT (key) DO UPDATE SET expires_at = excluded.expires_at WHERE seen.expires_at <= ?",
+                    (key, now + ttl, now),
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        except Exception as e:
+            # 重複の判定ができなくても処理は続ける（二重に処理する可能性はあるが、取りこぼしはしない）
+            logger.warning(f"Idempotency store add failed: {e!r}")
+            with self._lock:
+                self.errors += 1
+            return None
+        return cursor.rowcount > 0
+
+    def remove(self, key: bytes) -> None:
+        """
+        キーの記録を取り消す。
+
+        Args:
+            key: digest() で変換したキー
+        """
+        try:
+            self._connections.get().execute("DELETE FROM seen WHERE key = ?", (key,))
+        except Exception as e:
+            logger.warning(f"Idempotency store remove failed: {e!r}")
+            with self._lock:
+                self.errors += 1
+
+    def clear(self) -> None:
+        """全ての記録を消去する"""
+        try:
+            self._connections.get().execute("DELETE FROM seen")
+        except Exception as e:
+            logger.warning(f"Idempotency store clear failed: {e!r}")
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        統計情報を返す。
+
+        Returns:
+            entries（全プロセス合計、期限切れで未掃除の行を含む）/ errors（このプロセス）を含む辞書
+        """
+        try:
+            entries = self._connections.get().execute("SELECT COUNT(*) FROM seen").fetchone()[0]
+        except Exception:
+            entries = None
+        with self._lock:
+            return {"entries": entries, "errors": self.errors}
+
+
+class IdempotencyStore:
+    """
+    処理済みのLINE Webhookイベント（webhookEventId・メッセージID）を期限付きで記録し、
+    再送されたイベントを処理前に取り除くためのインデックス。
+
+    - キーは8バイトのダイジェストにしてメモリに保持し、max_entries を超えた場合は古いものから破棄する
+    - backendを指定した場合は、プロセス間で共有する記録も確認する（メモリは確認済みのキーのキャッシュ）
+    """
+
+    def __init__(
+        self,
+        ttl: float = 3600.0,
+        max_entries: int = 10000,
+        backend: Optional[SQLiteIdempotencyBackend] = None,
+        enabled: bool = True,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        Args:
+            ttl: キーを記録しておく時間（秒）。LINEが再送する期間より長くする
+            max_entries: メモリに保持する最大キー数
+            backend: プロセス間で共有するバックエンド（Noneの場合はメモリのみ）
+            enabled: Falseの場合は常に新しいキーとして扱う
+            clock: 現在時刻を返す関数
+        """
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self.backend = backend
+        self.enabled = enabled
+        self._clock = clock
+        self._lock = threading.Lock()
+        # digest -> expires_at。末尾ほど新しい
+        self._entries: "OrderedDict[bytes, float]" = OrderedDict()
+        self.checked = 0
+        self.duplicates = 0
+
+    def is_duplicate(self, key: str) -> bool:
+        """
+        キーが処理済みかを確認し、未処理なら処理済みとして記録する。
+
+        Args:
+            key: webhookEventId またはメッセージID
+
+        Returns:
+            期限内に同じキーを記録済みの場合はTrue
+        """
+        if not self.enabled or not key:
+            return False
+        hashed = digest(key)
+        now = self._clock()
+        with self._lock:
+            self.checked += 1
+            expires_at = self._entries.get(hashed)
+            if expires_at is not None and expires_at > now:
+                self.duplicates += 1
+                return True
+            self._remember(hashed, now)
+
+        if self.backend is not None and self.backend.add(hashed, self.ttl) is False:
+            # 他のプロセスが処理済み
+            with self._lock:
+                self.duplicates += 1
+            return True
+        return False
+
+    def _remember(self, hashed: bytes, now: float) -> None:
+        """メモリにキーを記録する（ロックを取得した状態で呼ぶ）"""
+        self._entries[hashed] = now + self.ttl
+        self._entries.move_to_end(hashed)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def forget(self, key: str) -> None:
+        """
+        is_duplicate で記録したキーを取り消す（処理を引き受けられなかったイベントを、再送時に処理できるようにする）。
+
+        Args:
+            key: webhookEventId またはメッセージID
+        """
+        if not self.enabled or not key:
+            return
+        hashed = digest(key)
+        with self._lock:
+            self._entries.pop(hashed, None)
+        if self.backend is not None:
+            self.backend.remove(hashed)
+
+    def clear(self) -> None:
+        """全ての記録と統計情報を消去する（backendを含む）"""
+        if self.backend is not None:
+            self.backend.clear()
+        with self._lock:
+            self._entries.clear()
+            self.checked = 0
+            self.duplicates = 0
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        統計情報を返す。
+
+        Returns:
+            checked / duplicates / duplicate_rate / size と、
+            backendを使用している場合は "backend" にその統計情報を含む辞書
+        """
+        with self._lock:
+            stats: Dict[str, Any] = {
+                "enabled": self.enabled,
+                "size": len(self._entries),
+                "checked": self.checked,
+                "duplicates": self.duplicates,
+                "duplicate_rate": round(self.duplicates / self.checked, 4) if self.checked else 0.0,
+            }
+        if self.backend is not None:
+            stats["backend"] = self.backend.stats()
+        return stats
+
+
+def _create_backend() -> Optional[SQLiteIdempotencyBackend]:
+    """IDEMPOTENCY_BACKENDの設定に応じてプロセス間共有のバックエンドを作成する"""
+    if IDEMPOTENCY_BACKEND == "sqlite":
+        return SQLiteIdempotencyBackend(IDEMPOTENCY_PATH)
+    return None
+
+
+# LINE Bot（Flask版・単一プロセス版）で共有する処理済みイベントの記録
+idempotency_store = IdempotencyStore(
+    ttl=IDEMPOTENCY_TTL,
+    max_entries=IDEMPOTENCY_MAX_ENTRIES,
+    backend=_create_backend(),
+    enabled=IDEMPOTENCY_ENABLED,
+)
@@ -0,0 +1,552 @@
+import asyncio
+import logging
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Optional, Dict, Any, Callable, Awaitable, List, NamedTuple
+
+from core.config import (
+    JOB_QUEUE_PATH, JOB_QUEUE_MAX_ATTEMPTS, JOB_QUEUE_RETRY_BASE, JOB_QUEUE_RETRY_MAX, JOB_QUEUE_LEASE
+)
+from core.db import SQLiteConnections
+
+# ログ設定
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id           INTEGER PRIMARY KEY AUTOINCREMENT,
+    payload      TEXT    NOT NULL,
+    status       TEXT    NOT NULL DEFAULT 'pending',  -- 'pending' | 'dead'
+    attempts     INTEGER NOT NULL DEFAULT 0,
+    created_at   REAL    NOT NULL,
+    available_at REAL    NOT NULL,  -- この時刻以降に取り出せる（リトライ待ち・処理中はリース期限）
+    lease        TEXT,              -- 処理中のワーカーが持つリースの識別子（取り出すたびに変わる）
+    last_error   TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (status, available_at);
+"""
+
+
+class Job(NamedTuple):
+    """キューから取り出したジョブ"""
+    id: int
+    payload: str
+    attempts: int     # 今回を含む実行回数
+    created_at: float
+    lease: str        # このワーカーのリースの識別子
+
+
+class LeaseLost(Exception):
+    """リースが切れ、ジョブが他のワーカーに取り出された（またはリトライに回された）"""
+
+
+class RetryJob(Exception):
+    """
+    handlerが送出すると、ジョブのpayloadを置き換えてリトライする
+    （一部だけ失敗した処理を、失敗した分だけ再実行する場合に使う）。
+    """
+
+    def __init__(self, payload: str, reason: str):
+        """
+        Args:
+            payload: リトライ時に使うpayload
+            reason: 失敗の内容
+        """
+        super().__init__(reason)
+        self.payload = payload
+
+
+class JobQueue:
+    """
+    SQLite(WALモード)を使った永続的なジョブキュー。
+    Webhookで受け取ったイベントをここに積み、ワーカーが非同期に処理する。
+    複数のGunicornワーカー(プロセス)から同じファイルを共有しても安全に動作する。
+
+    取り出したジョブは一定時間（リース）他のワーカーから見えなくなり、
+    完了(complete)すれば削除、失敗(fail)すればバックオフ後に再実行、
+    最大試行回数に達したものはデッドレターとして残す。
+    ワーカーがクラッシュした場合もリース切れで再実行される。
+    処理が長引く場合はワーカーが extend_lease でリースを延長する。complete / fail / extend_lease は
+    リースを持つワーカーからの呼び出しだけを受け付け、リース切れ後に他のワーカーが取り出したジョブを
+    古いワーカーが完了・失敗させることはない。
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_attempts: int = 3,
+        retry_base: float = 1.0,
+        retry_max: float = 30.0,
+        lease: float = 60.0,
+        clock: Callable[[], float] = time.time,
+    ):
+        """
+        Args:
+            path: SQLiteファイルのパス（":memory:" は不可。プロセス間で共有するためファイルを使う）
+            max_attempts: 1ジョブあたりの最大試行回数（超えるとデッドレター）
+            retry_base: リトライ待ち時間の基準値（秒、指数バックオフ）
+            retry_max: リトライ待ち時間の上限（秒）
+            lease: 取り出したジョブを他のワーカーから隠す時間（秒）
+            clock: 現在時刻（UNIX時間）を返す関数。プロセス間で比較するため壁時計を使う
+        """
+        self.path = path
+        self.max_attempts = max(1, max_attempts)
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.lease = lease
+        self._clock = clock
+        self._connections = SQLiteConnections(path, _SCHEMA)
+        self._stats_lock = threading.Lock()
+        # このプロセス内での処理件数
+        self.completed = 0
+        self.retried = 0
+        self.dead_lettered = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        return self._connections.get()
+
+    def enqueue(self, payload: str, delay: float = 0.0) -> int:
+        """
+        ジョブを追加する。
+
+        Args:
+            payload: ジョブの内容（JSON文字列など）
+            delay: 実行可能になるまでの待ち時間（秒）
+
+        Returns:
+            ジョブID
+        """
+        now = self._clock()
+        cursor = self._connect().execute(
+            "INSERT INTO jobs (payload, created_at, available_at) VALUES (?, ?, ?)",
+            (payload, now, now + delay),
+        )
+        return cursor.lastrowid
+
+    def claim(self) -> Optional[Job]:
+        """
+        実行可能な最も古いジョブを1件取り出し、リース期間中は他のワーカーから隠す。
+
+        Returns:
+            Job、実行可能なジョブがない場合はNone
+        """
+        conn = self._connect()
+        now = self._clock()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT id, payload, attempts, created_at FROM jobs "
+                "WHERE status = 'pending' AND available_at <= ? ORDER BY available_at, id LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            lease = uuid.uuid4().hex
+            conn.execute(
+                "UPDATE jobs SET attempts = attempts + 1, available_at = ?, lease = ? WHERE id = ?",
+                (now + self.lease, lease, row[0]),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return Job(row[0], row[1], row[2] + 1, row[3], lease)
+
+    def extend_lease(self, job: Job) -> None:
+        """
+        処理中のジョブのリースを現在時刻から lease 秒後まで延長する（ワーカーが処理中に定期的に呼ぶ）。
+
+        Raises:
+            LeaseLost: リースが切れて他のワーカーに取り出されていた場合
+        """
+        cursor = self._connect().execute(
+            "UPDATE jobs SET available_at = ? WHERE id = ? AND lease = ? AND status = 'pending'",
+            (self._clock() + self.lease, job.id, job.lease),
+        )
+        if cursor.rowcount == 0:
+            raise LeaseLost(f"Job {job.id} is no longer leased by this worker")
+
+    def complete(self, job: Job) -> None:
+        """
+        ジョブの完了を記録し、キューから削除する。
+
+        Raises:
+            LeaseLost: リースが切れて他のワーカーに取り出されていた場合（ジョブは削除しない）
+        """
+        cursor = self._connect().execute("DELETE FROM jobs WHERE id = ? AND lease = ?", (job.id, job.lease))
+        if cursor.rowcount == 0:
+            raise LeaseLost(f"Job {job.id} is no longer leased by this worker")
+        with self._stats_lock:
+            self.completed += 1
+
+    def fail(self, job: Job, error: str, payload: Optional[str] = None) -> bool:
+        """
+        ジョブの失敗を記録する。試行回数が残っていればバックオフ後に再実行し、
+        残っていなければデッドレターとして保存する。
+
+        Args:
+            job: 失敗したジョブ
+            error: エラー内容
+            payload: 再実行（デッドレターの再投入）で使うpayload。Noneの場合は元のpayloadのまま
+
+        Returns:
+            再実行される場合はTrue、デッドレターになった場合はFalse
+
+        Raises:
+            LeaseLost: リースが切れて他のワーカーに取り出されていた場合（ジョブは変更しない）
+        """
+        conn = self._connect()
+        payload = job.payload if payload is None else payload
+        if job.attempts >= self.max_attempts:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'dead', lease = NULL, payload = ?, last_error = ? "
+                "WHERE id = ? AND lease = ?",
+                (payload, error, job.id, job.lease),
+            )
+            if cursor.rowcount == 0:
+                raise LeaseLost(f"Job {job.id} is no longer leased by this worker")
+            with self._stats_lock:
+                self.dead_lettered += 1
+            return False
+
+        delay = self.retry_delay(job.attempts)
+        cursor = conn.execute(
+            "UPDATE jobs SET available_at = ?, lease = NULL, payload = ?, last_error = ? WHERE id = ? AND lease = ?",
+            (self._clock() + delay, payload, error, job.id, job.lease),
+        )
+        if cursor.rowcount == 0:
+            raise LeaseLost(f"Job {job.id} is no longer leased by this worker")
+        with self._stats_lock:
+            self.retried += 1
+        return True
+
+    def retry_delay(self, attempts: int) -> float:
+        """n回目の失敗後の待ち時間（指数バックオフ＋ジッター）を返す"""
+        ceiling = min(self.retry_max, self.retry_base * (2 ** max(0, attempts - 1)))
+        return random.uniform(ceiling / 2, ceiling)
+
+    def dead_letters(self, limit: int = 100) -> List[Dict[str, Any]]:
+        """
+        デッドレターになったジョブを古い順に返す。
+
+        Returns:
+            id / payload / attempts / created_at / last_error を含む辞書のリスト
+        """
+        rows = self._connect().execute(
+            "SELECT id, payload, attempts, created_at, last_error FROM jobs "
+            "WHERE status = 'dead' ORDER BY id LIMIT ?",
+            (limit,),
+        ).fetchall()
+        return [
+            {"id": r[0], "payload": r[1], "attempts": r[2], "created_at": r[3], "last_error": r[4]}
+            for r in rows
+        ]
+
+    def requeue_dead(self) -> int:
+        """デッドレターを試行回数をリセットして再投入する。再投入した件数を返す"""
+        cursor = self._connect().execute(
+            "UPDATE jobs SET status = 'pending', attempts = 0, available_at = ? WHERE status = 'dead'",
+            (self._clock(),),
+        )
+        return cursor.rowcount
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        キューの統計情報を返す。
+
+        Returns:
+            depth（未完了のジョブ数）/ ready（今すぐ実行可能な数）/ dead（デッドレター数）/
+            oldest_age（最も古い未完了ジョブの経過秒数）/ completed / retried / dead_lettered
+            （このプロセスでの処理件数）を含む辞書
+        """
+        now = self._clock()
+        depth, ready, oldest = self._connect().execute(
+            "SELECT COUNT(*), COALESCE(SUM(available_at <= ?), 0), MIN(created_at) "
+            "FROM jobs WHERE status = 'pending'",
+            (now,),
+        ).fetchone()
+        dead = self._connect().execute("SELECT COUNT(*) FROM jobs WHERE status = 'dead'").fetchone()[0]
+        with self._stats_lock:
+            return {
+                "depth": depth,
+                "ready": ready,
+                "dead": dead,
+                "oldest_age": max(0.0, now - oldest) if oldest is not None else 0.0,
+                "completed": self.completed,
+                "retried": self.retried,
+                "dead_lettered": self.dead_lettered,
+            }
+
+
+class JobWorkerPool:
+    """
+    JobQueueからジョブを取り出して処理するワーカースレッドのプール。
+    handlerが例外を送出したジョブはリトライ（またはデッドレター）に回す（RetryJobの場合はpayloadを置き換える）。
+    handlerの実行中はリースの1/3ごとにリースを延長し、処理が長引いても他のワーカーに取り出されないようにする。
+    """
+
+    def __init__(
+        self,
+        queue: JobQueue,
+        handler: Callable[[str], None],
+        workers: int = 2,
+        poll_interval: float = 0.5,
+    ):
+        """
+        Args:
+            queue: 処理対象のキュー
+            handler: ジョブのpayloadを受け取って処理する関数
+            workers: ワーカースレッド数
+            poll_interval: キューが空のときの待機間隔（秒）。
+                他プロセスが積んだジョブやリトライ待ちのジョブはこの間隔で拾う
+        """
+        self.queue = queue
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.poll_interval = poll_interval
+        self._wakeup = threading.Condition()
+        self._stopping = False
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        """ワーカースレッドを起動する（起動済みの場合は何もしない）"""
+        with self._lock:
+            if self._threads:
+                return
+            self._stopping = False
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"job-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout: Optional[float] = 5.0) -> None:
+        """処理中のジョブの完了を待ってワーカースレッドを停止する"""
+        with self._lock:
+            threads, self._threads = self._threads, []
+        with self._wakeup:
+            self._stopping = True
+            self._wakeup.notify_all()
+        for thread in threads:
+            thread.join(timeout)
+
+    @property
+    def running(self) -> bool:
+        return bool(self._threads)
+
+    def notify(self) -> None:
+        """新しいジョブが積まれたことを通知し、待機中のワーカーを起こす"""
+        with self._wakeup:
+            self._wakeup.notify()
+
+    def run_pending(self) -> int:
+        """
+        実行可能なジョブを呼び出し元のスレッドで全て処理する（テスト・手動実行用）。
+
+        Returns:
+            処理したジョブ数
+        """
+        count = 0
+        while self._process_one():
+            count += 1
+        return count
+
+    def _run(self) -> None:
+        while not self._stopping:
+            try:
+                if self._process_one():
+                    continue
+            except Exception as e:
+                # キュー自体のエラー（DBロック等）でワーカーが止まらないようにする
+                logger.error(f"Job queue error: {e}")
+            with self._wakeup:
+                if not self._stopping:
+                    self._wakeup.wait(self.poll_interval)
+
+    def _process_one(self) -> bool:
+        job = self.queue.claim()
+        if job is None:
+            return False
+
+        started = time.perf_counter()
+        stop = threading.Event()
+        heartbeat = threading.Thread(
+            target=_heartbeat, args=(self.queue, job, stop), name=f"job-heartbeat-{job.id}", daemon=True
+        )
+        heartbeat.start()
+        try:
+            self.handler(job.payload)
+        except Exception as e:
+            _record_failure(self.queue, job, e)
+            return True
+        finally:
+            stop.set()
+            heartbeat.join()
+
+        _complete(self.queue, job, started)
+        return True
+
+
+class AsyncJobWorker:
+    """
+    JobWorkerPoolのasyncio版。Discord Botと同じイベントループ上でジョブを処理する（run_app.py用）。
+    SQLiteの操作は短時間で終わるが、イベントループを止めないようスレッドで実行する。
+    handlerの実行中はJobWorkerPoolと同様にリースを延長する。
+    """
+
+    def __init__(
+        self,
+        queue: JobQueue,
+        handler: Callable[[str], Awaitable[None]],
+        concurrency: int = 2,
+        poll_interval: float = 0.5,
+    ):
+        """
+        Args:
+            queue: 処理対象のキュー
+            handler: ジョブのpayloadを受け取って処理するコルーチン関数
+            concurrency: 同時に処理するジョブ数
+            poll_interval: キューが空のときの待機間隔（秒）
+        """
+        self.queue = queue
+        self.handler = handler
+        self.concurrency = max(1, concurrency)
+        self.poll_interval = poll_interval
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: List["asyncio.Task[None]"] = []
+
+    def start(self) -> None:
+        """実行中のイベントループ上でワーカータスクを起動する（起動済みの場合は何もしない）"""
+        if self._tasks:
+            return
+        self._wakeup = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        self._tasks = [
+            loop.create_task(self._run(), name=f"job-worker-{i}") for i in range(self.concurrency)
+        ]
+
+    async def stop(self) -> None:
+        """ワーカータスクを停止する。処理中だったジョブはリース切れ後に再実行される"""
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def notify(self) -> None:
+        """新しいジョブが積まれたことを通知し、待機中のワーカーを起こす"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def run_pending(self) -> int:
+        """実行可能なジョブを全て処理する（テスト・手動実行用）。処理したジョブ数を返す"""
+        count = 0
+        while await self._process_one():
+            count += 1
+        return count
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                if await self._process_one():
+                    continue
+            except Exception as e:
+                logger.error(f"Job queue error: {e}")
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _process_one(self) -> bool:
+        job = await asyncio.to_thread(self.queue.claim)
+        if job is None:
+            return False
+
+        started = time.perf_counter()
+        heartbeat = asyncio.get_running_loop().create_task(_heartbeat_async(self.queue, job))
+        try:
+            await self.handler(job.payload)
+        except Exception as e:
+            await asyncio.to_thread(_record_failure, self.queue, job, e)
+            return True
+        finally:
+            heartbeat.cancel()
+
+        await asyncio.to_thread(_complete, self.queue, job, started)
+        return True
+
+
+def _heartbeat(queue: JobQueue, job: Job, stop: threading.Event) -> None:
+    """stopが設定されるまで、リースの1/3ごとにジョブのリースを延長する"""
+    while not stop.wait(queue.lease / 3):
+        if not _extend_lease(queue, job):
+            return
+
+
+async def _heartbeat_async(queue: JobQueue, job: Job) -> None:
+    """_heartbeatのasyncio版（キャンセルされるまでリースを延長する）"""
+    while True:
+        await asyncio.sleep(queue.lease / 3)
+        if not await asyncio.to_thread(_extend_lease, queue, job):
+            return
+
+
+def _extend_lease(queue: JobQueue, job: Job) -> bool:
+    """リースを延長する。リースを失った場合はFalseを返す（DBのエラーは次の延長で再試行する）"""
+    try:
+        queue.extend_lease(job)
+    except LeaseLost:
+        logger.warning(f"Job {job.id} lost its lease while running; another worker may run it again")
+        return False
+    except Exception as e:
+        logger.error(f"Failed to extend lease of job {job.id}: {e}")
+    return True
+
+
+def _complete(queue: JobQueue, job: Job, started: float) -> None:
+    """完了したジョブをキューから削除してログに残す"""
+    try:
+        queue.complete(job)
+    except LeaseLost:
+        logger.warning(f"Job {job.id} finished after its lease was lost; leaving it to the current owner")
+        return
+    _log_completion(job, started)
+
+
+def _record_failure(queue: JobQueue, job: Job, error: Exception) -> None:
+    """失敗したジョブをリトライまたはデッドレターに回してログに残す"""
+    payload = error.payload if isinstance(error, RetryJob) else None
+    try:
+        will_retry = queue.fail(job, repr(error), payload)
+    except LeaseLost:
+        logger.warning(f"Job {job.id} failed after its lease was lost; leaving it to the current owner: {error!r}")
+        return
+    if will_retry:
+        logger.warning(f"Job {job.id} failed (attempt {job.attempts}), will retry: {error!r}")
+    else:
+        logger.error(f"Job {job.id} moved to dead letters after {job.attempts} attempts: {error!r}")
+
+
+def _log_completion(job: Job, started: float) -> None:
+    logger.info(
+        f"Job {job.id} done in {(time.perf_counter() - started) * 1000:.0f}ms "
+        f"(queued {max(0.0, time.time() - job.created_at) * 1000:.0f}ms ago)"
+    )
+
+
+# LINE Webhook用のキュー（Webhookとワーカーで共有する）
+job_queue = JobQueue(
+    JOB_QUEUE_PATH,
+    max_attempts=JOB_QUEUE_MAX_ATTEMPTS,
+    retry_base=JOB_QUEUE_RETRY_BASE,
+    retry_max=JOB_QUEUE_RETRY_MAX,
+    lease=JOB_QUEUE_LEASE,
+)
@@ -1,209 +1,876 @@
+import asyncio
+import codecs
 import logging
-import requests
-import json
-from typing import Optional, Dict, Any, Union, List
+import threading
+import time
+from collections import OrderedDict
+from contextlib import aclosing
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from typing import Optional, Dict, Any, List, Tuple, Iterator, AsyncIterator, NamedTuple
 
-from core.config import RAPID_API_KEY, RAPID_API_HOST
+from core.config import (
+    RAPID_API_KEY, BATCH_MAX_LINKS, BATCH_MAX_CONCURRENCY, STREAM_CHUNK_SIZE,
+    RATE_LIMIT_MAX_429_RETRIES, FAIR_MAX_CONCURRENCY, HEDGE_ENABLED
+)
+from core.cache import result_cache
+from core.http_client import http_client, async_http_client, RequestTiming
+from core.singleflight import singleflight, async_singleflight
+from core.rate_limiter import RateLimitExceeded
+from core.circuit_breaker import CLOSED, CircuitOpenError, Permit, circuit_breaker
+from core.scheduler import Requester, SchedulerRejected, fair_scheduler
+from core.providers import Provider, provider_pool
+from core.negative_cache import EMPTY, PROVIDER_ERROR, classify_failure, worst_failure, negative_cache
+from core.parser import InstagramPost, extract_post, extract_posts
+from core.extractor import (
+    find_all_urls as _find_all_urls,
+    find_url as _find_url,
+    extract_media_info as _extract_media_info,
+)
+from core.streaming import MediaStreamParser, iter_media_items
 
 # ログ設定
 logger = logging.getLogger(__name__)
 
-def _find_all_urls(obj: Union[Dict[str, Any], List[Any]], collected_urls: Optional[List[str]] = None) -> List[str]:
+# サーキットが閉じたときに再取得する投稿の上限（古い結果を返した投稿を記録しておく）
+MAX_PENDING_REFRESH = 256
+
+def process_instagram_url(text: str, requester: Optional[Requester] = None) -> Optional[Dict[str, Any]]:
     """
-    レスポンスJSONから全てのメディアURLを再帰的に探索するヘルパー関数。
-    カルーセル投稿の複数画像・動画に対応。
+    テキスト内のInstagram URLを検出し、RapidAPIを使用してメディア情報を取得する。
+    複数メディア（カルーセル投稿）に対応。
     
     Args:
-        obj: 探索対象の辞書またはリスト
-        collected_urls: 収集済みのURLリスト（再帰処理用）
+        text (str): ユーザーからの入力テキスト
+        requester: 依頼元（RapidAPIの問い合わせを依頼元ごとに公平に割り当てるために使う）
         
     Returns:
-        見つかった全てのURL文字列のリスト
+        Optional[Dict[str, Any]]: 取得成功時は以下の辞書を返す。失敗時またはURLが含まれない場合はNone。
+            {
+                "type": "single" | "carousel",  # 投稿タイプ
+                "media_count": int,              # メディア数
+                "media_list": [                  # メディアのリスト
+                    {
+                        "url": str,
+                        "type": "image" | "video",
+                        "thumbnail": str | None
+                    },
+                    ...
+                ],
+                # 後方互換性のため以下も保持
+                "media_url": str,       # 最初のメディアURL
+                "preview_url": str      # 最初のプレビューURL
+            }
     """
-    if collected_urls is None:
-        collected_urls = []
+    # InstagramのURLを検出（APIにはメッセージ全体ではなく正規化した投稿URLのみを送る）
+    post = extract_post(text)
+    if post is None:
+        return None
+
+    return _process_post(post, requester)
+
+async def process_instagram_url_async(
+    text: str, requester: Optional[Requester] = None
+) -> Optional[Dict[str, Any]]:
+    """
+    process_instagram_urlのasyncio版。
+    aiohttpのコネクションプールを使うため、スレッドを消費せずに多数の問い合わせを同時に待機できる。
     
-    if isinstance(obj, dict):
-        # パターンA: 'medias' リストがある場合（複数メディアの可能性大）
-        if 'medias' in obj and isinstance(obj['medias'], list):
-            for media_item in obj['medias']:
-                _find_all_urls(media_item, collected_urls)
-            return collected_urls
+    Args:
+        text (str): ユーザーからの入力テキスト
+        requester: 依頼元
         
-        # パターンB: 直接的なメディアURL
-        for key in ['video_url', 'download_url', 'media', 'thumbnail', 'cover', 'thumb', 'url']:
-            if key in obj and isinstance(obj[key], str) and obj[key].startswith('http'):
-                # InstagramのHTMLページURLは除外
-                if "instagram.com/p/" in obj[key] or "instagram.com/reel/" in obj[key]:
-                    continue
-                # 重複を避ける
-                if obj[key] not in collected_urls:
-                    collected_urls.append(obj[key])
+    Returns:
+        Optional[Dict[str, Any]]: process_instagram_urlと同じ形式の辞書。失敗時またはURLが含まれない場合はNone。
+    """
+    # InstagramのURLを検出（APIにはメッセージ全体ではなく正規化した投稿URLのみを送る）
+    post = extract_post(text)
+    if post is None:
+        return None
+
+    return await _process_post_async(post, requester)
+
+def process_instagram_urls(text: str, requester: Optional[Requester] = None) -> List[Optional[Dict[str, Any]]]:
+    """
+    テキスト内の全てのInstagram投稿を並行して取得する。
+    同時実行数は BATCH_MAX_CONCURRENCY、処理する投稿数は BATCH_MAX_LINKS で制限する。
+    
+    Args:
+        text (str): ユーザーからの入力テキスト
+        requester: 依頼元（同じ依頼元の問い合わせは FAIR_PER_KEY_CONCURRENCY 件ずつ実行される）
         
-        # パターンC: ネストされている場合
-        for key in ['body', 'data', 'results', 'items', 'carousel_media', 'edges']:
-            if key in obj:
-                _find_all_urls(obj[key], collected_urls)
-                
-    elif isinstance(obj, list):
-        for item in obj:
-            _find_all_urls(item, collected_urls)
-            
-    return collected_urls
-
-def _find_url(obj: Union[Dict[str, Any], List[Any]]) -> Optional[str]:
-    """
-    レスポンスJSONから最初のメディアURLを探索するヘルパー関数。
-    後方互換性のために残す。
+    Returns:
+        List[Optional[Dict[str, Any]]]: 投稿の出現順に並んだ結果のリスト。
+            取得に失敗した投稿の位置はNoneになる（他の投稿の結果には影響しない）。
+            URLが含まれない場合は空リスト。
+    """
+    posts = extract_posts(text)[:BATCH_MAX_LINKS]
+    if len(posts) <= 1:
+        return [_process_post_safely(post, requester) for post in posts]
+
+    with ThreadPoolExecutor(max_workers=min(BATCH_MAX_CONCURRENCY, len(posts))) as executor:
+        return list(executor.map(lambda post: _process_post_safely(post, requester), posts))
+
+async def process_instagram_urls_async(
+    text: str, requester: Optional[Requester] = None
+) -> List[Optional[Dict[str, Any]]]:
+    """
+    process_instagram_urlsのasyncio版。
     
     Args:
-        obj: 探索対象の辞書またはリスト
+        text (str): ユーザーからの入力テキスト
+        requester: 依頼元
         
     Returns:
-        見つかったURL文字列、またはNone
+        List[Optional[Dict[str, Any]]]: process_instagram_urlsと同じ形式のリスト
     """
-    urls = _find_all_urls(obj)
-    return urls[0] if urls else None
+    posts = extract_posts(text)[:BATCH_MAX_LINKS]
+    semaphore = asyncio.Semaphore(BATCH_MAX_CONCURRENCY)
+
+    async def run(post: InstagramPost) -> Optional[Dict[str, Any]]:
+        async with semaphore:
+            try:
+                return await _process_post_async(post, requester)
+            except Exception as e:
+                logger.error(f"Error processing {post.url}: {e}")
+                return None
 
-def _extract_media_info(data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return list(await asyncio.gather(*(run(post) for post in posts)))
+
+def combine_results(results: List[Optional[Dict[str, Any]]]) -> Optional[Dict[str, Any]]:
     """
-    APIレスポンスから詳細なメディア情報を抽出する。
+    複数投稿の取得結果を、process_instagram_urlと同じ形式の1つの結果にまとめる。
+    Bot側は単一投稿と同じ方法で描画できる。
     
     Args:
-        data: APIレスポンスのJSON
+        results: process_instagram_urls(_async)の戻り値
         
     Returns:
-        メディア情報のリスト。各要素は以下の構造：
-        {
-            "url": str,           # メディアURL
-            "type": "image" | "video",  # メディアタイプ
-            "thumbnail": str | None     # サムネイルURL（動画の場合）
-        }
-    """
-    media_list = []
-    
-    # mediasリストがある場合（最も一般的なパターン）
-    if 'medias' in data and isinstance(data['medias'], list):
-        for media in data['medias']:
-            media_info = {
-                "url": None,
-                "type": "image",
-                "thumbnail": None
-            }
-            
-            # メディアURLの取得
-            if isinstance(media, dict):
-                # 動画チェック
-                if 'video_url' in media:
-                    media_info["url"] = media['video_url']
-                    media_info["type"] = "video"
-                    # サムネイルも取得
-                    if 'thumbnail' in media:
-                        media_info["thumbnail"] = media['thumbnail']
-                    elif 'thumb' in media:
-                        media_info["thumbnail"] = media['thumb']
-                elif 'download_url' in media:
-                    media_info["url"] = media['download_url']
-                elif 'url' in media and not ("instagram.com/p/" in media['url'] or "instagram.com/reel/" in media['url']):
-                    media_info["url"] = media['url']
-                
-                # タイプ判定の追加ロジック
-                if media_info["url"]:
-                    if ".mp4" in media_info["url"] or "video" in str(media).lower():
-                        media_info["type"] = "video"
-                    
-                    media_list.append(media_info)
-    
-    # mediasがない場合は従来の方法でURLを探す
-    if not media_list:
-        urls = _find_all_urls(data)
-        for url in urls:
-            media_info = {
-                "url": url,
-                "type": "video" if ".mp4" in url else "image",
-                "thumbnail": None
-            }
-            media_list.append(media_info)
+        まとめた結果の辞書（"post_count" と "failed_count" を追加）。成功した投稿がなければNone
+    """
+    succeeded = [r for r in results if r]
+    if not succeeded:
+        return None
+    if len(succeeded) == 1 and len(results) == 1:
+        return succeeded[0]
+
+    media_list = [media for r in succeeded for media in r["media_list"]]
+    combined = _make_result(media_list)
+    combined["post_count"] = len(succeeded)
+    combined["failed_count"] = len(results) - len(succeeded)
+    return combined
+
+def iter_media(text: str) -> Iterator[Dict[str, Any]]:
+    """
+    テキスト内の最初のInstagram投稿のメディア情報を、パースできた順に1件ずつ返すジェネレーター。
+    RapidAPIのレスポンスをストリーミングで読み込むため、カルーセル全体のデコードを待たずに
+    最初のメディアを送信し始められる。読み終えた結果は通常のAPIと同じキャッシュに保存される。
     
-    return media_list
+    Args:
+        text (str): ユーザーからの入力テキスト
+        
+    Yields:
+        {"url": str, "type": "image" | "video", "thumbnail": str | None} の辞書。
+        URLが含まれない場合や取得に失敗した場合は何も返さない（失敗はログに記録する）。
+    """
+    post = extract_post(text)
+    if post is None:
+        return
+
+    cached = result_cache.get(post.shortcode)
+    if cached is not None:
+        logger.info(f"Cache hit for shortcode: {post.shortcode}")
+        _maybe_refresh_ahead(post)
+        yield from cached["media_list"]
+        return
+
+    failure = _recent_failure(post)
+    if failure is not None:
+        stale = _serve_stale_after_failure(post, failure)
+        if stale is not None:
+            yield from stale["media_list"]
+        return
+
+    if not RAPID_API_KEY:
+        logger.error("RAPID_API_KEY is not set.")
+        return
 
-def process_instagram_url(text: str) -> Optional[Dict[str, Any]]:
+    provider = provider_pool.streaming_provider()
+    if provider is None:
+        # 逐次パースできるプロバイダーがない場合は、通常の取得結果を順に返す
+        result = _process_post(post)
+        if result is not None:
+            yield from result["media_list"]
+        return
+
+    media_list: List[Dict[str, Any]] = []
+    status_code: Optional[int] = None
+    try:
+        permit = circuit_breaker.allow()
+        if permit is None:
+            raise CircuitOpenError("RapidAPI circuit is open")
+        logger.info(f"Streaming media from {provider.name} for URL: {post.url}")
+        started = time.monotonic()
+        try:
+            response = _rapidapi_get(provider, post.url, stream=True)
+        except RateLimitExceeded:
+            circuit_breaker.release(permit)
+            raise
+        except Exception:
+            circuit_breaker.record_failure(permit)
+            raise
+        status_code = response.status_code
+        _record_upstream(status_code, started, permit)
+        try:
+            _log_timing(getattr(response, "timing", None))
+            response.raise_for_status()
+            for media in iter_media_items(response.iter_content(chunk_size=STREAM_CHUNK_SIZE)):
+                media_list.append(media)
+                yield media
+        finally:
+            response.close()
+    except Exception as e:
+        logger.error(f"Error in iter_media: {e}")
+        if not media_list:
+            failure = None
+            if not isinstance(e, (CircuitOpenError, RateLimitExceeded)):
+                failure = classify_failure(status_code)
+                _record_failure(post, failure)
+            stale = _serve_stale_after_failure(post, failure)
+            if stale is not None:
+                yield from stale["media_list"]
+        return
+
+    if media_list:
+        result_cache.set(post.shortcode, _make_result(media_list))
+    else:
+        _record_failure(post, EMPTY)
+
+async def aiter_media(text: str) -> AsyncIterator[Dict[str, Any]]:
     """
-    テキスト内のInstagram URLを検出し、RapidAPIを使用してメディア情報を取得する。
-    複数メディア（カルーセル投稿）に対応。
+    iter_mediaのasyncio版。
     
     Args:
         text (str): ユーザーからの入力テキスト
         
-    Returns:
-        Optional[Dict[str, Any]]: 取得成功時は以下の辞書を返す。失敗時またはURLが含まれない場合はNone。
-            {
-                "type": "single" | "carousel",  # 投稿タイプ
-                "media_count": int,              # メディア数
-                "media_list": [                  # メディアのリスト
-                    {
-                        "url": str,
-                        "type": "image" | "video",
-                        "thumbnail": str | None
-                    },
-                    ...
-                ],
-                # 後方互換性のため以下も保持
-                "media_url": str,       # 最初のメディアURL
-                "preview_url": str      # 最初のプレビューURL
-            }
+    Yields:
+        iter_mediaと同じ形式のメディア情報
     """
-    # InstagramのURLが含まれているかチェック
-    if "instagram.com/p/" not in text and "instagram.com/reel/" not in text:
-        return None
+    post = extract_post(text)
+    if post is None:
+        return
+
+    cached = await result_cache.aget(post.shortcode)
+    if cached is not None:
+        logger.info(f"Cache hit for shortcode: {post.shortcode}")
+        _maybe_refresh_ahead(post)
+        for media in cached["media_list"]:
+            yield media
+        return
+
+    failure = _recent_failure(post)
+    if failure is not None:
+        stale = await _serve_stale_after_failure_async(post, failure)
+        if stale is not None:
+            for media in stale["media_list"]:
+                yield media
+        return
 
     if not RAPID_API_KEY:
         logger.error("RAPID_API_KEY is not set.")
+        return
+
+    provider = provider_pool.streaming_provider()
+    if provider is None:
+        result = await _process_post_async(post)
+        if result is not None:
+            for media in result["media_list"]:
+                yield media
+        return
+
+    media_list: List[Dict[str, Any]] = []
+    status_code: Optional[int] = None
+    try:
+        url, querystring, headers = provider.build_request(post.url)
+        logger.info(f"Streaming media from {provider.name} for URL: {post.url}")
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        parser = MediaStreamParser()
+        if circuit_breaker.is_open():
+            raise CircuitOpenError("RapidAPI circuit is open")
+        await provider.limiter.acquire_async()
+        permit = circuit_breaker.allow()
+        if permit is None:
+            raise CircuitOpenError("RapidAPI circuit is open")
+        started = time.monotonic()
+        responded = False
+
+        def on_response(response_status: int, response_headers: Any) -> None:
+            nonlocal responded, status_code
+            responded = True
+            status_code = response_status
+            _record_upstream(response_status, started, permit)
+            provider.limiter.observe(response_status, response_headers)
+
+        chunks = async_http_client.iter_chunks(
+            url, chunk_size=STREAM_CHUNK_SIZE, headers=headers, params=querystring,
+            on_response=on_response,
+        )
+        try:
+            async with aclosing(chunks):
+                async for chunk in chunks:
+                    for media in parser.feed(decoder.decode(chunk)):
+                        media_list.append(media)
+                        yield media
+                    if parser.finished:
+                        break
+        except Exception:
+            if not responded:
+                circuit_breaker.record_failure(permit)
+                responded = True
+            raise
+        finally:
+            # 応答前にキャンセルされた場合は結果を記録せずに呼び出し枠を返す
+            # （半開状態の試しの呼び出しが終わらないままにならないようにする）
+            if not responded:
+                circuit_breaker.release(permit)
+        for media in parser.feed(decoder.decode(b"", final=True)) + parser.close():
+            media_list.append(media)
+            yield media
+    except Exception as e:
+        logger.error(f"Error in aiter_media: {e}")
+        if not media_list:
+            failure = None
+            if not isinstance(e, (CircuitOpenError, RateLimitExceeded)):
+                failure = classify_failure(status_code)
+                _record_failure(post, failure)
+            stale = await _serve_stale_after_failure_async(post, failure)
+            if stale is not None:
+                for media in stale["media_list"]:
+                    yield media
+        return
+
+    if media_list:
+        result_cache.aset(post.shortcode, _make_result(media_list))
+    else:
+        _record_failure(post, EMPTY)
+
+def _process_post(post: InstagramPost, requester: Optional[Requester] = None) -> Optional[Dict[str, Any]]:
+    """1件の投稿をキャッシュ・リクエスト集約を経由して取得する"""
+    # 同じ投稿が直近に処理されていればキャッシュから返す（API呼び出しを節約）
+    cached = result_cache.get(post.shortcode)
+    if cached is not None:
+        logger.info(f"Cache hit for shortcode: {post.shortcode}")
+        _maybe_refresh_ahead(post)
+        return cached
+
+    # 同じ投稿への同時リクエストは1回のAPI呼び出しにまとめる
+    return singleflight.do(post.shortcode, lambda: _fetch_and_cache(post, requester))
+
+def _process_post_safely(post: InstagramPost, requester: Optional[Requester] = None) -> Optional[Dict[str, Any]]:
+    """_process_postの例外をNoneに変換する（バッチ処理で他の投稿に影響させないため）"""
+    try:
+        return _process_post(post, requester)
+    except Exception as e:
+        logger.error(f"Error processing {post.url}: {e}")
         return None
 
+async def _process_post_async(
+    post: InstagramPost, requester: Optional[Requester] = None
+) -> Optional[Dict[str, Any]]:
+    """_process_postのasyncio版"""
+    cached = await result_cache.aget(post.shortcode)
+    if cached is not None:
+        logger.info(f"Cache hit for shortcode: {post.shortcode}")
+        _maybe_refresh_ahead(post)
+        return cached
+
+    return await async_singleflight.do(post.shortcode, lambda: _fetch_and_cache_async(post, requester))
+
+def _fetch_and_cache(post: InstagramPost, requester: Optional[Requester] = None) -> Optional[Dict[str, Any]]:
+    """
+    依頼元ごとの公平なスケジューリングを経てAPIから結果を取得し、成功した場合はキャッシュに保存する。
+    サーキットが開いている場合や取得に失敗した場合は、期限切れのキャッシュがあればそれを返す。
+    """
+    # 直近に失敗した投稿は、APIを呼ばずに即座に失敗させる
+    failure = _recent_failure(post)
+    if failure is not None:
+        return _serve_stale_after_failure(post, failure)
+    # サーキットが開いている間は実行枠も待たずに古い結果を返す
+    if circuit_breaker.is_open():
+        return _serve_stale(post)
     try:
-        # --- RapidAPI呼び出しロジック ---
-        url = f"https://{RAPID_API_HOST}/download"
-        querystring = {"url": text}
-        headers = {
-            "X-RapidAPI-Key": RAPID_API_KEY,
-            "X-RapidAPI-Host": RAPID_API_HOST
-        }
-
-        logger.info(f"Fetching media from RapidAPI for URL: {text}")
-        response = requests.get(url, headers=headers, params=querystring)
-        response.raise_for_status()
-        
-        data = response.json()
-        logger.info(f"RapidAPI Response: {json.dumps(data, ensure_ascii=False)[:500]}...")  # 最初の500文字のみログ
+        with fair_scheduler.slot(requester):
+            result, failure = _fetch_media_result(post.url)
+    except SchedulerRejected as e:
+        logger.warning(f"Lookup for {post.url} rejected: {e}")
+        return _serve_stale(post)
+    if result is None:
+        _record_failure(post, failure)
+        return _serve_stale_after_failure(post, failure)
+    result_cache.set(post.shortcode, result)
+    return result
+
+async def _fetch_and_cache_async(
+    post: InstagramPost, requester: Optional[Requester] = None
+) -> Optional[Dict[str, Any]]:
+    """_fetch_and_cacheのasyncio版"""
+    failure = _recent_failure(post)
+    if failure is not None:
+        return await _serve_stale_after_failure_async(post, failure)
+    if circuit_breaker.is_open():
+        return await _serve_stale_async(post)
+    try:
+        async with fair_scheduler.aslot(requester):
+            result, failure = await _fetch_media_result_async(post.url)
+    except SchedulerRejected as e:
+        logger.warning(f"Lookup for {post.url} rejected: {e}")
+        return await _serve_stale_async(post)
+    if result is None:
+        _record_failure(post, failure)
+        return await _serve_stale_after_failure_async(post, failure)
+    result_cache.aset(post.shortcode, result)
+    return result
+
+def _recent_failure(post: InstagramPost) -> Optional[str]:
+    """直近に記録された失敗の種類を返す（記録がなければNone）"""
+    failure = negative_cache.get(post.shortcode)
+    if failure is not None:
+        logger.info(f"Negative cache hit for shortcode: {post.shortcode} ({failure})")
+    return failure
+
+def _record_failure(post: InstagramPost, failure: Optional[str]) -> None:
+    """取得に失敗した投稿を失敗の種類ごとのTTLで記録する（レート制限等で問い合わせなかった場合は記録しない）"""
+    if failure is not None:
+        negative_cache.set(post.shortcode, failure)
+
+def _serve_stale_after_failure(post: InstagramPost, failure: Optional[str]) -> Optional[Dict[str, Any]]:
+    """
+    失敗した投稿に古い結果を返すかを決める。
+    プロバイダー側の一時的な問題なら古い結果を返し、削除・非公開など投稿自体の問題なら返さない。
+    """
+    if failure in (None, PROVIDER_ERROR):
+        return _serve_stale(post)
+    return None
+
+async def _serve_stale_after_failure_async(post: InstagramPost, failure: Optional[str]) -> Optional[Dict[str, Any]]:
+    """_serve_stale_after_failureのasyncio版"""
+    if failure in (None, PROVIDER_ERROR):
+        return await _serve_stale_async(post)
+    return None
+
+# 古い結果を返した投稿（ショートコード -> 投稿）。サーキットが閉じたときにバックグラウンドで再取得する
+_pending_refresh: "OrderedDict[str, InstagramPost]" = OrderedDict()
+_pending_refresh_lock = threading.Lock()
+# キャッシュの再取得（期限前の再取得と、障害から回復した後の再取得）を行うスレッド
+_refresh_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cache-refresh")
+# バックグラウンドでの再取得の依頼元（ユーザーの問い合わせとは別のキーとして公平に割り当てる）
+_BACKGROUND = Requester("background", "")
 
-        # --- メディア情報の抽出 ---
-        media_list = _extract_media_info(data)
+def _maybe_refresh_ahead(post: InstagramPost) -> None:
+    """よく使われるエントリの期限が近い場合、ユーザーを待たせないよう裏で再取得する"""
+    if result_cache.claim_refresh(post.shortcode):
+        logger.info(f"Refreshing popular entry ahead of expiry: {post.shortcode}")
+        _refresh_executor.submit(_refresh_ahead, post)
+
+def _refresh_ahead(post: InstagramPost) -> None:
+    try:
+        singleflight.do(post.shortcode, lambda: _fetch_and_cache(post, _BACKGROUND))
+    except Exception as e:
+        logger.error(f"Error refreshing {post.url}: {e}")
+
+def _serve_stale(post: InstagramPost) -> Optional[Dict[str, Any]]:
+    """
+    期限切れを含むキャッシュから結果を返す（stale-while-revalidate）。
+    上流APIが回復していない場合は、回復後に再取得するよう記録する。
+    """
+    stale = result_cache.get_stale(post.shortcode)
+    if stale is None:
+        return None
+    return _mark_stale(post, stale)
+
+def _mark_stale(post: InstagramPost, stale: Dict[str, Any]) -> Dict[str, Any]:
+    """古い結果を返したことを記録し、上流APIが回復していなければ回復後の再取得を予約する"""
+    logger.warning(f"Serving stale result for shortcode: {post.shortcode} (circuit {circuit_breaker.state})")
+    if circuit_breaker.state != CLOSED:
+        with _pending_refresh_lock:
+            _pending_refresh[post.shortcode] = post
+            _pending_refresh.move_to_end(post.shortcode)
+            while len(_pending_refresh) > MAX_PENDING_REFRESH:
+                _pending_refresh.popitem(last=False)
+    return stale
+
+async def _serve_stale_async(post: InstagramPost) -> Optional[Dict[str, Any]]:
+    """_serve_staleのasyncio版（永続キャッシュの読み込みでイベントループを止めない）"""
+    stale = await result_cache.aget_stale(post.shortcode)
+    if stale is None:
+        return None
+    return _mark_stale(post, stale)
+
+def _refresh_stale(post: InstagramPost) -> None:
+    """古い結果を返した投稿をAPIから再取得してキャッシュを更新する"""
+    if result_cache.get(post.shortcode) is not None:
+        return
+    _refresh_ahead(post)
+
+def _on_circuit_change(old_state: str, new_state: str) -> None:
+    """サーキットが閉じた（上流APIが回復した）ら、古い結果を返した投稿を再取得する"""
+    if new_state != CLOSED:
+        return
+    with _pending_refresh_lock:
+        posts = list(_pending_refresh.values())
+        _pending_refresh.clear()
+    if posts:
+        logger.info(f"Refreshing {len(posts)} stale results after upstream recovery")
+    for post in posts:
+        _refresh_executor.submit(_refresh_stale, post)
+
+circuit_breaker.add_listener(_on_circuit_change)
+
+def _record_upstream(status_code: int, started: float, permit: Optional[Permit]) -> None:
+    """RapidAPIの応答をサーキットブレーカーに記録する（5xxは障害、それ以外は応答時間を記録）"""
+    if status_code >= 500:
+        circuit_breaker.record_failure(permit)
+    else:
+        circuit_breaker.record_success(time.monotonic() - started, permit)
+
+def _record_lookup(upstream_ok: Optional[bool], started: float, permit: Optional[Permit]) -> None:
+    """
+    1件の問い合わせ（ヘッジを含む）の結果をサーキットブレーカーに記録する。
+    いずれかのプロバイダーが応答すれば成功、全て接続エラー・5xxなら失敗、
+    レート制限で呼び出せなかった場合は記録せずに呼び出し枠だけ返す。
+    """
+    if upstream_ok is None:
+        circuit_breaker.release(permit)
+    elif upstream_ok:
+        circuit_breaker.record_success(time.monotonic() - started, permit)
+    else:
+        circuit_breaker.record_failure(permit)
+
+class _Attempt(NamedTuple):
+    """1つのプロバイダーへの問い合わせの結果"""
+    result: Optional[Dict[str, Any]]
+    upstream_ok: Optional[bool]  # 上流が応答したか（接続エラー・5xxはFalse、レート制限で呼び出さなかった場合はNone）
+    failure: Optional[str]       # 失敗の種類（core.negative_cache）。成功・呼び出さなかった場合はNone
+
+def _merge_upstream_ok(current: Optional[bool], outcome: Optional[bool]) -> Optional[bool]:
+    if current or outcome:
+        return True
+    if current is False or outcome is False:
+        return False
+    return None
+
+def _rapidapi_get(provider: Provider, post_url: str, **kwargs: Any) -> Any:
+    """
+    プロバイダーのレートリミッターを通してAPIを呼び出す。
+    429の場合は Retry-After の間待ってから RATE_LIMIT_MAX_429_RETRIES 回まで再試行する。
+    
+    Args:
+        provider: 呼び出すプロバイダー
+        post_url: 正規化済みのInstagram投稿URL
+        **kwargs: http_client.get に渡す追加の引数（stream等）
         
-        if not media_list:
-            logger.error(f"No media URLs found in response")
-            return None
+    Returns:
+        最後のレスポンス
         
-        # 結果の構築
-        result: Dict[str, Any] = {
-            "type": "carousel" if len(media_list) > 1 else "single",
-            "media_count": len(media_list),
-            "media_list": media_list
-        }
+    Raises:
+        RateLimitExceeded: 待ち時間が RATE_LIMIT_MAX_WAIT を超える場合
+    """
+    url, querystring, headers = provider.build_request(post_url)
+    attempt = 0
+    while True:
+        provider.limiter.acquire()
+        response = http_client.get(url, headers=headers, params=querystring, **kwargs)
+        retry_after = provider.limiter.observe(response.status_code, response.headers)
+        if retry_after is None or attempt >= RATE_LIMIT_MAX_429_RETRIES:
+            return response
+        logger.warning(f"{provider.name} returned 429, retrying after {retry_after:.1f}s")
+        response.close()
+        attempt += 1
+
+async def _rapidapi_get_async(provider: Provider, post_url: str) -> Any:
+    """_rapidapi_getのasyncio版"""
+    url, querystring, headers = provider.build_request(post_url)
+    attempt = 0
+    while True:
+        await provider.limiter.acquire_async()
+        response = await async_http_client.get(url, headers=headers, params=querystring)
+        retry_after = provider.limiter.observe(response.status_code, response.headers)
+        if retry_after is None or attempt >= RATE_LIMIT_MAX_429_RETRIES:
+            return response
+        logger.warning(f"{provider.name} returned 429, retrying after {retry_after:.1f}s")
+        attempt += 1
+
+def _log_timing(timing: Optional[RequestTiming]) -> None:
+    """RapidAPI呼び出しの時間内訳をログに出力する"""
+    if timing is None:
+        return
+    logger.info(
+        f"RapidAPI timing: handshake={timing.handshake_ms:.1f}ms "
+        f"wait={timing.wait_ms:.1f}ms transfer={timing.transfer_ms:.1f}ms "
+        f"total={timing.total_ms:.1f}ms attempts={timing.attempts} "
+        f"reused={timing.reused_connection}"
+    )
+
+def _log_response_preview(response: Any) -> None:
+    """
+    レスポンスボディの先頭500文字をログに出力する。
+    パース済みのJSONを再シリアライズせず、受信したバイト列の先頭だけを使う。
+    """
+    content = getattr(response, "content", None)
+    if isinstance(content, bytes):
+        preview = content[:500].decode("utf-8", errors="replace")
+        logger.info(f"RapidAPI Response ({len(content)} bytes): {preview}...")
+
+def _build_result(media_list: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    プロバイダーが変換したメディア情報からprocess_instagram_urlの戻り値となる辞書を構築する。
+    
+    Args:
+        media_list: Provider.normalizeの戻り値
         
-        # 後方互換性のため、最初のメディアの情報も含める
-        first_media = media_list[0]
-        result["media_url"] = first_media["url"]
-        result["preview_url"] = first_media["thumbnail"] or first_media["url"]
+    Returns:
+        結果の辞書、メディアが見つからない場合はNone
+    """
+    if not media_list:
+        logger.error(f"No media URLs found in response")
+        return None
+    
+    result = _make_result(media_list)
+    
+    logger.info(f"Extracted {len(media_list)} media items from Instagram post")
+    logger.info(f"Media types: {[m['type'] for m in media_list]}")
+    
+    return result
+
+def _make_result(media_list: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    メディア情報のリストから結果の辞書を構築する。
+    
+    Args:
+        media_list: _extract_media_infoの戻り値（1件以上）
         
-        # 従来のtypeフィールド（最初のメディアのタイプ）
-        result["media_type"] = first_media["type"]
+    Returns:
+        process_instagram_urlの戻り値と同じ形式の辞書
+    """
+    result: Dict[str, Any] = {
+        "type": "carousel" if len(media_list) > 1 else "single",
+        "media_count": len(media_list),
+        "media_list": media_list
+    }
+    
+    # 後方互換性のため、最初のメディアの情報も含める
+    first_media = media_list[0]
+    result["media_url"] = first_media["url"]
+    result["preview_url"] = first_media["thumbnail"] or first_media["url"]
+    
+    # 従来のtypeフィールド（最初のメディアのタイプ）
+    result["media_type"] = first_media["type"]
+    
+    return result
+
+# ヘッジした問い合わせを並行して実行するスレッド（複数のプロバイダーを設定した場合のみ使う）
+_hedge_executor = ThreadPoolExecutor(
+    max_workers=FAIR_MAX_CONCURRENCY * len(provider_pool.providers), thread_name_prefix="hedge"
+)
+
+def _fetch_media_result(post_url: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """
+    上流APIを呼び出してメディア情報を取得し、結果の辞書を構築する。
+    キャッシュを介さずに常にAPIへアクセスする。
+    
+    順位の高いプロバイダーから問い合わせ、観測したp95を過ぎても応答がない場合や失敗した場合は
+    次のプロバイダーにも問い合わせて、先に得られた結果を使う。
+    
+    Args:
+        post_url: 正規化済みのInstagram投稿URL
         
-        logger.info(f"Extracted {len(media_list)} media items from Instagram post")
-        logger.info(f"Media types: {[m['type'] for m in media_list]}")
+    Returns:
+        (process_instagram_urlと同じ形式の辞書, 失敗の種類) のタプル。
+        成功時は失敗の種類がNone、失敗時は辞書がNone（問い合わせなかった場合は両方None）
+    """
+    if not RAPID_API_KEY:
+        logger.error("RAPID_API_KEY is not set.")
+        return None, None
+    permit = circuit_breaker.allow()
+    if permit is None:
+        logger.warning(f"RapidAPI circuit is open, skipping lookup for {post_url}")
+        return None, None
+
+    started = time.monotonic()
+    providers = provider_pool.ordered()
+    upstream_ok: Optional[bool] = None
+    if len(providers) == 1:
+        try:
+            attempt = _fetch_from_provider(providers[0], post_url)
+            upstream_ok = attempt.upstream_ok
+        finally:
+            _record_lookup(upstream_ok, started, permit)
+        return attempt.result, attempt.failure
+
+    failure: Optional[str] = None
+    remaining = iter(providers)
+    current = next(remaining)
+    upcoming = next(remaining, None)
+    pending: Dict[Future, Provider] = {_hedge_executor.submit(_fetch_from_provider, current, post_url): current}
+    hedged = False
+    try:
+        while pending:
+            delay = provider_pool.hedge_delay(current) if HEDGE_ENABLED and upcoming is not None else None
+            done, _ = wait(list(pending), timeout=delay, return_when=FIRST_COMPLETED)
+            for future in done:
+                provider = pending.pop(future)
+                attempt = future.result()
+                upstream_ok = _merge_upstream_ok(upstream_ok, attempt.upstream_ok)
+                failure = worst_failure(failure, attempt.failure)
+                if attempt.result is not None:
+                    if hedged:
+                        provider.stats.record_win()
+                    return attempt.result, None
+            # 失敗した、またはp95を過ぎても応答がない場合は次のプロバイダーにも問い合わせる
+            # （遅い方の問い合わせは続け、先に返った結果を使う）
+            if upcoming is not None:
+                if not done:
+                    current.stats.record_hedge()
+                    hedged = True
+                    logger.info(f"{current.name} is slow, hedging lookup to {upcoming.name}")
+                current = upcoming
+                pending[_hedge_executor.submit(_fetch_from_provider, current, post_url)] = current
+                upcoming = next(remaining, None)
+        return None, failure
+    finally:
+        _record_lookup(upstream_ok, started, permit)
+
+async def _fetch_media_result_async(post_url: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """
+    _fetch_media_resultのasyncio版。採用しなかった問い合わせはキャンセルする。
+    
+    Args:
+        post_url: 正規化済みのInstagram投稿URL
         
-        return result
+    Returns:
+        _fetch_media_resultと同じ形式のタプル
+    """
+    if not RAPID_API_KEY:
+        logger.error("RAPID_API_KEY is not set.")
+        return None, None
+    permit = circuit_breaker.allow()
+    if permit is None:
+        logger.warning(f"RapidAPI circuit is open, skipping lookup for {post_url}")
+        return None, None
+
+    started = time.monotonic()
+    providers = provider_pool.ordered()
+    upstream_ok: Optional[bool] = None
+    if len(providers) == 1:
+        # キャンセルされた場合も結果を記録しないまま呼び出し枠を返す（半開状態の試しの呼び出しを終える）
+        try:
+            attempt = await _fetch_from_provider_async(providers[0], post_url)
+            upstream_ok = attempt.upstream_ok
+        finally:
+            _record_lookup(upstream_ok, started, permit)
+        return attempt.result, attempt.failure
+
+    failure: Optional[str] = None
+    remaining = iter(providers)
+    current = next(remaining)
+    upcoming = next(remaining, None)
+    pending: Dict["asyncio.Task[_Attempt]", Provider] = {
+        asyncio.ensure_future(_fetch_from_provider_async(current, post_url)): current
+    }
+    hedged = False
+    try:
+        while pending:
+            delay = provider_pool.hedge_delay(current) if HEDGE_ENABLED and upcoming is not None else None
+            done, _ = await asyncio.wait(list(pending), timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                provider = pending.pop(task)
+                attempt = task.result()
+                upstream_ok = _merge_upstream_ok(upstream_ok, attempt.upstream_ok)
+                failure = worst_failure(failure, attempt.failure)
+                if attempt.result is not None:
+                    if hedged:
+                        provider.stats.record_win()
+                    return attempt.result, None
+            if upcoming is not None:
+                if not done:
+                    current.stats.record_hedge()
+                    hedged = True
+                    logger.info(f"{current.name} is slow, hedging lookup to {upcoming.name}")
+                current = upcoming
+                pending[asyncio.ensure_future(_fetch_from_provider_async(current, post_url))] = current
+                upcoming = next(remaining, None)
+        return None, failure
+    finally:
+        for task in pending:
+            task.cancel()
+        _record_lookup(upstream_ok, started, permit)
+
+def _fetch_from_provider(provider: Provider, post_url: str) -> _Attempt:
+    """
+    1つのプロバイダーからメディア情報を取得し、プロバイダーの統計に記録する。
+    
+    Returns:
+        結果・上流が応答したか・失敗の種類を含む _Attempt
+    """
+    started = time.monotonic()
+    try:
+        logger.info(f"Fetching media from {provider.name} for URL: {post_url}")
+        response = _rapidapi_get(provider, post_url)
+    except RateLimitExceeded as e:
+        logger.warning(f"Lookup via {provider.name} skipped: {e}")
+        return _Attempt(None, None, None)
+    except Exception as e:
+        logger.error(f"Error in process_instagram_url ({provider.name}): {e}")
+        provider.stats.record(False, time.monotonic() - started)
+        return _Attempt(None, False, PROVIDER_ERROR)
 
+    data = None
+    try:
+        _log_timing(getattr(response, "timing", None))
+        response.raise_for_status()
+        _log_response_preview(response)
+        data = response.json()
+        result = _build_result(provider.normalize(data))
+    except Exception as e:
+        logger.error(f"Error in process_instagram_url ({provider.name}): {e}")
+        result = None
+    provider.stats.record(result is not None, time.monotonic() - started)
+    return _attempt_from_response(response, result, data)
+
+async def _fetch_from_provider_async(provider: Provider, post_url: str) -> _Attempt:
+    """_fetch_from_providerのasyncio版"""
+    started = time.monotonic()
+    try:
+        logger.info(f"Fetching media from {provider.name} for URL: {post_url}")
+        response = await _rapidapi_get_async(provider, post_url)
+    except RateLimitExceeded as e:
+        logger.warning(f"Lookup via {provider.name} skipped: {e}")
+        return _Attempt(None, None, None)
     except Exception as e:
-        logger.error(f"Error in process_instagram_url: {e}")
-        return None
\ No newline at end of file
+        logger.error(f"Error in process_instagram_url_async ({provider.name}): {e}")
+        provider.stats.record(False, time.monotonic() - started)
+        return _Attempt(None, False, PROVIDER_ERROR)
+
+    data = None
+    try:
+        _log_timing(response.timing)
+        response.raise_for_status()
+        _log_response_preview(response)
+        data = response.json()
+        result = _build_result(provider.normalize(data))
+    except Exception as e:
+        logger.error(f"Error in process_instagram_url_async ({provider.name}): {e}")
+        result = None
+    provider.stats.record(result is not None, time.monotonic() - started)
+    return _attempt_from_response(response, result, data)
+
+def _attempt_from_response(response: Any, result: Optional[Dict[str, Any]], data: Any) -> _Attempt:
+    """レスポンスから _Attempt を作る。失敗時はステータスコードとエラーメッセージから失敗の種類を決める"""
+    if result is not None:
+        return _Attempt(result, True, None)
+    if data is None and response.status_code >= 400:
+        # エラーレスポンスの本文にも「非公開」「見つからない」などの理由が入っていることがある
+        try:
+            data = response.json()
+        except Exception:
+            data = None
+    return _Attempt(None, response.status_code < 500, classify_failure(response.status_code, data))
@@ -0,0 +1,435 @@
+import base64
+import hashlib
+import hmac
+import logging
+import os
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional, Dict, Any, Callable, List
+
+from core.config import (
+    LINE_CHANNEL_SECRET, MEDIA_PROXY_ENABLED, MEDIA_PROXY_BASE_URL, MEDIA_PROXY_SECRET,
+    MEDIA_CACHE_DIR, MEDIA_CACHE_MAX_BYTES, MEDIA_CACHE_MAX_OBJECT_BYTES
+)
+from core.db import SQLiteConnections
+from core.http_client import http_client
+from core.singleflight import SingleFlight
+
+# ログ設定
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS media (
+    key          TEXT PRIMARY KEY,  -- 元URLのsha256
+    digest       TEXT NOT NULL,     -- 内容のsha256（ファイル名）
+    content_type TEXT NOT NULL,
+    size         INTEGER NOT NULL,
+    accessed_at  REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS media_accessed ON media (accessed_at);
+CREATE INDEX IF NOT EXISTS media_digest ON media (digest);
+"""
+
+# ダウンロード時に1回で読み込むサイズ
+CHUNK_SIZE = 64 * 1024
+# 最終アクセス時刻を更新する間隔（秒）。ヒットのたびに書き込まないため
+TOUCH_INTERVAL = 60.0
+# 配信時の Cache-Control: max-age（秒）。同じトークンの内容は変わらない
+CACHE_MAX_AGE = 86400
+# キャッシュするメディアの種類
+CACHEABLE_TYPES = ("image/", "video/")
+
+
+class MediaFetchError(Exception):
+    """元のURLからメディアを取得できなかった"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class MediaTooLarge(MediaFetchError):
+    """メディアが1ファイルの上限を超えている（元のURLから直接取得させる）"""
+
+
+@dataclass(frozen=True)
+class CachedMedia:
+    """ディスクにキャッシュしたメディア"""
+    path: str
+    digest: str
+    content_type: str
+    size: int
+
+
+def _fetch(url: str) -> Any:
+    return http_client.get(url, stream=True)
+
+
+class MediaCache:
+    """
+    CDNのメディアを内容のハッシュ（sha256）をファイル名にして保存するディスクキャッシュ。
+
+    - 元のURL → 内容のハッシュの対応はSQLite（WALモード）に記録し、Gunicornの複数ワーカーと共有する
+    - 内容が同じメディアは、URLが違っても1つのファイルを共有する
+    - 合計サイズが max_bytes を超えたら、最後に使われたのが古いURLから削除する（LRU）。
+      ファイルはどのURLからも参照されなくなった時点で削除する
+    - 同じURLの同時ダウンロードは1回にまとめる（プロセス内）
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: int = 512 * 1024 * 1024,
+        max_object_bytes: int = 50 * 1024 * 1024,
+        fetch: Callable[[str], Any] = _fetch,
+        clock: Callable[[], float] = time.time,
+    ):
+        """
+        Args:
+            directory: キャッシュのディレクトリ（objects/ にファイル、index.sqlite3 に対応表を置く）
+            max_bytes: キャッシュ全体の上限（バイト）
+            max_object_bytes: 1ファイルの上限（バイト）
+            fetch: URLを受け取り、ストリーミングのレスポンス（requests.Response互換）を返す関数
+            clock: 現在時刻（UNIX時間）を返す関数。プロセス間で比較するため壁時計を使う
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_object_bytes = max_object_bytes
+        self._fetch = fetch
+        self._clock = clock
+        self._connections = SQLiteConnections(os.path.join(directory, "index.sqlite3"), _SCHEMA)
+        self._flight = SingleFlight()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.errors = 0
+
+    def fetch(self, url: str) -> CachedMedia:
+        """
+        URLのメディアをキャッシュから返す。キャッシュになければダウンロードして保存する。
+
+        Args:
+            url: CDNのメディアURL
+
+        Returns:
+            キャッシュしたメディア
+
+        Raises:
+            MediaTooLarge: 1ファイルの上限を超えている場合
+            MediaFetchError: ダウンロードに失敗した場合
+        """
+        key = _url_key(url)
+        cached = self.lookup(key)
+        if cached is not None:
+            with self._lock:
+                self.hits += 1
+            return cached
+        # 先行するダウンロードがあればその結果を共有する（完了直後に到着した場合はキャッシュを再確認する）
+        return self._flight.do(key, lambda: self.lookup(key) or self._download(key, url))
+
+    def lookup(self, key: str) -> Optional[CachedMedia]:
+        """キャッシュ済みのメディアを返す（ファイルが削除されていた場合は対応表からも消してNoneを返す）"""
+        conn = self._connections.get()
+        row = conn.execute(
+            "SELECT digest, content_type, size, accessed_at FROM media WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        digest, content_type, size, accessed_at = row
+        path = self._object_path(digest)
+        if not os.path.exists(path):
+            conn.execute("DELETE FROM media WHERE key = ?", (key,))
+            return None
+        now = self._clock()
+        if now - accessed_at >= TOUCH_INTERVAL:
+            conn.execute("UPDATE media SET accessed_at = ? WHERE key = ?", (now, key))
+        return CachedMedia(path, digest, content_type, size)
+
+    def _download(self, key: str, url: str) -> CachedMedia:
+        """メディアをチャンクごとに一時ファイルへ書き込みながらハッシュを計算し、内容のハッシュの名前で保存する"""
+        with self._lock:
+            self.misses += 1
+        try:
+            response = self._fetch(url)
+        except Exception as e:
+            self._count_error()
+            raise MediaFetchError(f"Media download failed: {e!r}") from e
+
+        try:
+            if response.status_code != 200:
+                raise MediaFetchError(f"Media download returned {response.status_code}", response.status_code)
+            content_type = (response.headers.get("Content-Type") or "").split(";")[0].strip().lower()
+            if not content_type.startswith(CACHEABLE_TYPES):
+                raise MediaFetchError(f"Unexpected content type: {content_type or 'none'}")
+            length = response.headers.get("Content-Length")
+            if length and length.isdigit() and int(length) > self.max_object_bytes:
+                raise MediaTooLarge(f"Media is larger than {self.max_object_bytes} bytes")
+
+            digest, size, temp_path = self._write_temp(response)
+        except MediaTooLarge:
+            raise
+        except MediaFetchError:
+            self._count_error()
+            raise
+        except Exception as e:
+            self._count_error()
+            raise MediaFetchError(f"Media download failed: {e!r}") from e
+        finally:
+            response.close()
+
+        return self._commit(key, temp_path, digest, content_type, size)
+
+    def get(self, name: str) -> Optional[CachedMedia]:
+        """
+        名前（URL、put()で保存したデータの名前）に対応するキャッシュ済みのメディアを返す。ダウンロードはしない。
+        """
+        return self.lookup(_url_key(name))
+
+    def put(self, name: str, data: bytes, content_type: str) -> CachedMedia:
+        """
+        生成したデータ（プレビュー画像等）を名前に対応付けて保存する。ダウンロードしたメディアと同じくLRUで削除される。
+
+        Args:
+            name: データの名前（get()で取り出すときに使う）
+            data: 保存するデータ
+            content_type: 配信時のContent-Type
+        """
+        temp_dir = os.path.join(self.directory, "tmp")
+        os.makedirs(temp_dir, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=temp_dir)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        return self._commit(_url_key(name), temp_path, hashlib.sha256(data).hexdigest(), content_type, len(data))
+
+    def _commit(self, key: str, temp_path: str, digest: str, content_type: str, size: int) -> CachedMedia:
+        """一時ファイルを内容のハッシュの名前で保存し、対応表に記録する"""
+        path = self._object_path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 同じ内容のファイルが既にあれば置き換えても内容は変わらない（アトミックに置き換える）
+        os.replace(temp_path, path)
+        self._index(key, digest, content_type, size)
+        return CachedMedia(path, digest, content_type, size)
+
+    def _write_temp(self, response: Any):
+        """レスポンスボディを一時ファイルに書き込み、(内容のハッシュ, サイズ, 一時ファイルのパス) を返す"""
+        temp_dir = os.path.join(self.directory, "tmp")
+        os.makedirs(temp_dir, exist_ok=True)
+        hasher = hashlib.sha256()
+        size = 0
+        fd, temp_path = tempfile.mkstemp(dir=temp_dir)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    if not chunk:
+                        continue
+                    size += len(chunk)
+                    if size > self.max_object_bytes:
+                        raise MediaTooLarge(f"Media is larger than {self.max_object_bytes} bytes")
+                    hasher.update(chunk)
+                    f.write(chunk)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        return hasher.hexdigest(), size, temp_path
+
+    def _index(self, key: str, digest: str, content_type: str, size: int) -> None:
+        """対応表に記録し、合計サイズが上限を超えていれば古いものから削除する"""
+        removed: List[str] = []
+        evicted = 0
+        conn = self._connections.get()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO media (key, digest, content_type, size, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, digest, content_type, size, self._clock()),
+            )
+            total = conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM (SELECT MAX(size) AS size FROM media GROUP BY digest)"
+            ).fetchone()[0]
+            while total > self.max_bytes:
+                row = conn.execute(
+                    "SELECT key, digest, size FROM media WHERE key != ? ORDER BY accessed_at LIMIT 1", (key,)
+                ).fetchone()
+                if row is None:
+                    break
+                victim, victim_digest, victim_size = row
+                conn.execute("DELETE FROM media WHERE key = ?", (victim,))
+                evicted += 1
+                if conn.execute("SELECT 1 FROM media WHERE digest = ? LIMIT 1", (victim_digest,)).fetchone() is None:
+                    total -= victim_size
+                    removed.append(victim_digest)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        with self._lock:
+            self.evictions += evicted
+        # ファイルの削除はコミット後に行う（配信中のファイルは開いている間は読み続けられる）
+        for victim_digest in removed:
+            try:
+                os.unlink(self._object_path(victim_digest))
+            except FileNotFoundError:
+                pass
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self.directory, "objects", digest[:2], digest)
+
+    def _count_error(self) -> None:
+        with self._lock:
+            self.errors += 1
+
+    def clear(self) -> None:
+        """全てのメディアを削除する"""
+        conn = self._connections.get()
+        digests = [row[0] for row in conn.execute("SELECT DISTINCT digest FROM media")]
+        conn.execute("DELETE FROM media")
+        for digest in digests:
+            try:
+                os.unlink(self._object_path(digest))
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        統計情報を返す。
+
+        Returns:
+            entries / files / bytes（全プロセス合計）と、hits / misses / evictions / errors / collapsed（このプロセス）を含む辞書
+        """
+        try:
+            entries, files, total = self._connections.get().execute(
+                "SELECT COUNT(*), COUNT(DISTINCT digest), "
+                "(SELECT COALESCE(SUM(size), 0) FROM (SELECT MAX(size) AS size FROM media GROUP BY digest)) FROM media"
+            ).fetchone()
+        except Exception:
+            entries = files = total = None
+        with self._lock:
+            return {
+                "entries": entries,
+                "files": files,
+                "bytes": total,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "errors": self.errors,
+                "collapsed": self._flight.stats()["collapsed"],
+            }
+
+
+def _url_key(url: str) -> str:
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+class MediaProxy:
+    """
+    送信するメディアのURLを、自前の /media/<token> エンドポイントのURLに置き換える。
+    トークンは元のURLと署名（HMAC）からなり、このBotが発行したURL以外は中継しない（オープンプロキシにしない）。
+    プレビュー画像のエンドポイント（core.previews）も、routeを変えた別のインスタンスで同じ仕組みを使う。
+    """
+
+    def __init__(self, cache: MediaCache, base_url: str, secret: bytes, enabled: bool = True, route: str = "media"):
+        """
+        Args:
+            cache: メディアのディスクキャッシュ
+            base_url: このサーバーの公開URL
+            secret: トークンの署名鍵
+            enabled: Falseの場合はURLを置き換えない
+            route: エンドポイントのパス（署名にも含めるため、他のエンドポイントのトークンは使えない）
+        """
+        self.cache = cache
+        self.route = route
+        self.base_url = base_url.rstrip("/")
+        self._secret = secret
+        self.enabled = enabled and bool(base_url) and bool(secret)
+
+    def sign(self, url: str) -> str:
+        """元のURLからトークンを作成する"""
+        payload = _b64encode(url.encode("utf-8"))
+        return f"{payload}.{self._signature(payload)}"
+
+    def resolve(self, token: str) -> Optional[str]:
+        """
+        トークンから元のURLを取り出す。
+
+        Returns:
+            元のURL（無効な場合・署名が一致しない場合はNone）
+        """
+        if not self.enabled:
+            return None
+        payload, _, signature = token.partition(".")
+        if not payload or not hmac.compare_digest(signature, self._signature(payload)):
+            return None
+        try:
+            return _b64decode(payload).decode("utf-8")
+        except (ValueError, UnicodeDecodeError):
+            return None
+
+    def _signature(self, payload: str) -> str:
+        message = f"{self.route}:{payload}".encode("ascii")
+        return _b64encode(hmac.new(self._secret, message, hashlib.sha256).digest()[:16])
+
+    def proxy_url(self, url: Optional[str]) -> Optional[str]:
+        """URLをプロキシのURLに置き換える（無効な場合・http(s)以外のURLはそのまま返す）"""
+        if not self.enabled or not url or not url.startswith(("https://", "http://")):
+            return url
+        return f"{self.base_url}/{self.route}/{self.sign(url)}"
+
+    def rewrite_result(self, result: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """
+        取得結果に含まれるメディアのURLをプロキシのURLに置き換えた結果を返す（元の結果は変更しない）。
+
+        Args:
+            result: process_instagram_urlの戻り値、またはcombine_resultsでまとめた結果
+        """
+        if not self.enabled or not result:
+            return result
+        rewritten = dict(result)
+        if result.get("media_list"):
+            rewritten["media_list"] = [
+                dict(media, url=self.proxy_url(media.get("url")), thumbnail=self.proxy_url(media.get("thumbnail")))
+                for media in result["media_list"]
+            ]
+        for field in ("media_url", "preview_url"):
+            if result.get(field):
+                rewritten[field] = self.proxy_url(result[field])
+        return rewritten
+
+    def stats(self) -> Dict[str, Any]:
+        """enabled とキャッシュの統計情報を返す"""
+        if not self.enabled:
+            return {"enabled": False}
+        return dict(self.cache.stats(), enabled=self.enabled)
+
+
+def proxy_secret() -> bytes:
+    """プロキシURLの署名鍵（MEDIA_PROXY_SECRET、未設定の場合はLINE_CHANNEL_SECRETから導出する）"""
+    if MEDIA_PROXY_SECRET:
+        return MEDIA_PROXY_SECRET.encode("utf-8")
+    if LINE_CHANNEL_SECRET:
+        return hmac.new(LINE_CHANNEL_SECRET.encode("utf-8"), b"media-proxy", hashlib.sha256).digest()
+    return b""
+
+
+def _create_media_proxy() -> MediaProxy:
+    secret = proxy_secret()
+    if MEDIA_PROXY_ENABLED and not (MEDIA_PROXY_BASE_URL and secret):
+        logger.warning("MEDIA_PROXY_ENABLED requires MEDIA_PROXY_BASE_URL and a signing secret. Media proxy is disabled.")
+    return MediaProxy(media_cache, base_url=MEDIA_PROXY_BASE_URL, secret=secret, enabled=MEDIA_PROXY_ENABLED)
+
+
+# メディアのディスクキャッシュ（Gunicornのワーカー間でも共有する）
+media_cache = MediaCache(MEDIA_CACHE_DIR, max_bytes=MEDIA_CACHE_MAX_BYTES, max_object_bytes=MEDIA_CACHE_MAX_OBJECT_BYTES)
+# LINE Bot・Discord Botで共有するメディアプロキシ
+media_proxy = _create_media_proxy()
@@ -0,0 +1,192 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Callable, Tuple
+
+from core.config import (
+    NEGATIVE_CACHE_ENABLED, NEGATIVE_CACHE_MAX_ENTRIES, NEGATIVE_CACHE_TTL, NEGATIVE_CACHE_EMPTY_TTL,
+    NEGATIVE_CACHE_TRANSIENT_TTL
+)
+
+# 失敗の種類
+NOT_FOUND = "not_found"            # 削除された・存在しない投稿
+PRIVATE = "private"                # 非公開アカウントの投稿
+UNSUPPORTED = "unsupported"        # プロバイダーが扱えないURL（ストーリーズ等、4xxで拒否された）
+EMPTY = "empty"                    # 応答はあったがメディアが見つからなかった
+PROVIDER_ERROR = "provider_error"  # 接続エラー・5xx・429など、投稿ではなくプロバイダー側の一時的な問題
+
+# 複数のプロバイダーに問い合わせた場合に、どの失敗を記録するか（先頭ほど優先）
+FAILURE_PRIORITY = (PRIVATE, NOT_FOUND, UNSUPPORTED, EMPTY, PROVIDER_ERROR)
+
+# エラーメッセージに含まれていれば、その種類の失敗とみなす語句
+_PRIVATE_MARKERS = ("private",)
+_NOT_FOUND_MARKERS = (
+    "not found", "not_found", "notfound", "deleted", "does not exist", "doesn't exist",
+    "no longer available", "removed",
+)
+# エラーメッセージを探すキー
+_MESSAGE_KEYS = ("message", "error", "detail", "msg", "status", "reason")
+
+
+def _error_message(data: Any, depth: int = 0) -> str:
+    """APIレスポンスのJSONからエラーメッセージらしい文字列を集める"""
+    if not isinstance(data, dict) or depth > 2:
+        return ""
+    parts = []
+    for key in _MESSAGE_KEYS:
+        value = data.get(key)
+        if isinstance(value, str):
+            parts.append(value)
+        elif isinstance(value, dict):
+            parts.append(_error_message(value, depth + 1))
+    return " ".join(parts)
+
+
+def classify_failure(status_code: Optional[int], data: Any = None) -> str:
+    """
+    上流APIの失敗を分類する。
+
+    Args:
+        status_code: HTTPステータスコード（接続エラー等で応答がない場合はNone）
+        data: レスポンスのJSON（読めない場合はNone）
+
+    Returns:
+        NOT_FOUND / PRIVATE / UNSUPPORTED / EMPTY / PROVIDER_ERROR のいずれか
+    """
+    if status_code is None or status_code >= 500 or status_code in (401, 403, 429):
+        return PROVIDER_ERROR
+    message = _error_message(data).lower()
+    if any(marker in message for marker in _PRIVATE_MARKERS):
+        return PRIVATE
+    if status_code in (404, 410) or any(marker in message for marker in _NOT_FOUND_MARKERS):
+        return NOT_FOUND
+    if status_code >= 400:
+        return UNSUPPORTED
+    return EMPTY if data is not None else PROVIDER_ERROR
+
+
+def worst_failure(current: Optional[str], failure: Optional[str]) -> Optional[str]:
+    """2つの失敗のうち、FAILURE_PRIORITY で優先するものを返す"""
+    if current is None or failure is None:
+        return current or failure
+    return min(current, failure, key=FAILURE_PRIORITY.index)
+
+
+class NegativeCache:
+    """
+    取得に失敗した投稿をショートコード単位で短時間記録するキャッシュ。
+    同じリンクが何度も貼られた場合に、RapidAPIのクォータとワーカーの時間を使わずに即座に失敗させる。
+
+    - 失敗の種類ごとにTTLを変える（削除・非公開は長め、プロバイダー側の一時的な問題はごく短く）
+    - 結果キャッシュとは別に max_entries でLRUの上限を持つ
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttls: Optional[Dict[str, float]] = None,
+        enabled: bool = True,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        Args:
+            max_entries: 保持する最大エントリ数
+            ttls: 失敗の種類ごとの有効期間（秒）。指定のない種類は記録しない
+            enabled: Falseの場合は何も記録しない
+            clock: 現在時刻を返す関数
+        """
+        self.max_entries = max(1, max_entries)
+        self.ttls = dict(ttls or {})
+        self.enabled = enabled
+        self._clock = clock
+        self._lock = threading.Lock()
+        # key -> (expires_at, 失敗の種類)
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self.hits: Dict[str, int] = {}
+        self.stored: Dict[str, int] = {}
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        記録されている失敗の種類を返す。
+
+        Args:
+            key: 投稿のショートコード
+
+        Returns:
+            失敗の種類、記録がない・期限切れの場合はNone
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, failure = entry
+            if expires_at <= self._clock():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            self.hits[failure] = self.hits.get(failure, 0) + 1
+            return failure
+
+    def set(self, key: str, failure: str) -> None:
+        """
+        失敗を記録する。
+
+        Args:
+            key: 投稿のショートコード
+            failure: 失敗の種類
+        """
+        ttl = self.ttls.get(failure, 0.0)
+        if not self.enabled or ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (self._clock() + ttl, failure)
+            self._entries.move_to_end(key)
+            self.stored[failure] = self.stored.get(failure, 0) + 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        """全エントリと統計情報を消去する"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = {}
+            self.stored = {}
+            self.evictions = 0
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        統計情報を返す。
+
+        Returns:
+            size / evictions と、失敗の種類ごとの hits / stored を含む辞書
+        """
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "size": len(self._entries),
+                "hits": dict(self.hits),
+                "stored": dict(self.stored),
+                "evictions": self.evictions,
+            }
+
+
+# 両Botで共有する失敗のキャッシュ
+negative_cache = NegativeCache(
+    max_entries=NEGATIVE_CACHE_MAX_ENTRIES,
+    ttls={
+        NOT_FOUND: NEGATIVE_CACHE_TTL,
+        PRIVATE: NEGATIVE_CACHE_TTL,
+        UNSUPPORTED: NEGATIVE_CACHE_EMPTY_TTL,
+        EMPTY: NEGATIVE_CACHE_EMPTY_TTL,
+        PROVIDER_ERROR: NEGATIVE_CACHE_TRANSIENT_TTL,
+    },
+    enabled=NEGATIVE_CACHE_ENABLED,
+)
@@ -0,0 +1,97 @@
+import re
+from typing import Optional, List, NamedTuple
+
+# Instagram投稿URLのパターン（コンパイル済み）
+# - 投稿(p)・リール(reel/reels)・IGTV(tv) に対応
+# - "instagram.com/<ユーザー名>/p/<ショートコード>" 形式や instagr.am の短縮ドメインも許容
+# - クエリ文字列(?igsh=... 等)やフラグメントはショートコードの後ろで打ち切られる
+# - ホスト名の途中（fakeinstagram.com・cdninstagram.com 等）からは一致しない
+INSTAGRAM_POST_PATTERN = re.compile(
+    r"(?:https?://)?(?<![\w.-])(?:www\.|m\.)?(?:instagram\.com|instagr\.am)/"
+    r"(?:[A-Za-z0-9_.]+/)?"
+    r"(?P<kind>p|reels?|tv)/(?P<shortcode>[A-Za-z0-9_-]+)",
+    re.IGNORECASE,
+)
+
+# URLパスの種類 -> 正規化後の種類
+_CANONICAL_KINDS = {"p": "p", "reel": "reel", "reels": "reel", "tv": "tv"}
+
+
+class InstagramPost(NamedTuple):
+    """メッセージから検出したInstagram投稿"""
+    shortcode: str  # 投稿のショートコード（キャッシュキーとしても使う）
+    kind: str       # "p" | "reel" | "tv"
+    url: str        # トラッキング用クエリを除いた正規URL
+
+
+def canonical_url(shortcode: str, kind: str = "p") -> str:
+    """
+    ショートコードから正規化した投稿URLを組み立てる。
+
+    Args:
+        shortcode: 投稿のショートコード
+        kind: "p" | "reel" | "reels" | "tv"
+
+    Returns:
+        "https://www.instagram.com/<kind>/<shortcode>/" 形式のURL
+    """
+    kind = _CANONICAL_KINDS.get(kind.lower(), "p")
+    return f"https://www.instagram.com/{kind}/{shortcode}/"
+
+
+def extract_posts(text: Optional[str]) -> List[InstagramPost]:
+    """
+    テキストに含まれる全てのInstagram投稿を、出現順・ショートコードの重複なしで取り出す。
+
+    Args:
+        text: ユーザーからの入力テキスト
+
+    Returns:
+        InstagramPostのリスト（見つからない場合は空リスト）
+    """
+    if not text:
+        return []
+
+    posts: List[InstagramPost] = []
+    seen = set()
+    for match in INSTAGRAM_POST_PATTERN.finditer(text):
+        shortcode = match.group("shortcode")
+        if shortcode in seen:
+            continue
+        seen.add(shortcode)
+        kind = _CANONICAL_KINDS[match.group("kind").lower()]
+        posts.append(InstagramPost(shortcode, kind, canonical_url(shortcode, kind)))
+    return posts
+
+
+def extract_post(text: Optional[str]) -> Optional[InstagramPost]:
+    """
+    テキストに含まれる最初のInstagram投稿を取り出す。
+
+    Args:
+        text: ユーザーからの入力テキスト
+
+    Returns:
+        InstagramPost、見つからない場合はNone
+    """
+    if not text:
+        return None
+    match = INSTAGRAM_POST_PATTERN.search(text)
+    if match is None:
+        return None
+    shortcode = match.group("shortcode")
+    kind = _CANONICAL_KINDS[match.group("kind").lower()]
+    return InstagramPost(shortcode, kind, canonical_url(shortcode, kind))
+
+
+def contains_instagram_url(text: Optional[str]) -> bool:
+    """テキストにInstagram投稿のURLが含まれるかを判定する"""
+    return bool(text) and INSTAGRAM_POST_PATTERN.search(text) is not None
+
+
+def is_instagram_post_url(url: str) -> bool:
+    """
+    URLがInstagramの投稿ページ（メディア本体ではなくHTMLページ）を指しているかを判定する。
+    APIレスポンスからメディアURLを探す際に、投稿ページのURLを除外するために使う。
+    """
+    return INSTAGRAM_POST_PATTERN.search(url) is not None
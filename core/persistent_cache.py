@@ -0,0 +1,253 @@
+import json
+import logging
+import threading
+import time
+import zlib
+from typing import Optional, Dict, Any, Callable, Tuple
+
+from core.db import SQLiteConnections
+
+# ログ設定
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key         TEXT PRIMARY KEY,
+    value       BLOB NOT NULL,  -- encode_value() で圧縮したバイト列
+    size        INTEGER NOT NULL,
+    expires_at  REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed_at);
+CREATE INDEX IF NOT EXISTS results_expires ON results (expires_at);
+-- results.size の合計（書き込みのたびに全件を集計しないよう、同じトランザクションで増減させる）
+CREATE TABLE IF NOT EXISTS totals (
+    id    INTEGER PRIMARY KEY CHECK (id = 0),
+    bytes INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO totals (id, bytes) SELECT 0, COALESCE(SUM(size), 0) FROM results;
+"""
+
+# 保存形式のバージョン（先頭1バイト）。形式を変えた場合は古いエントリをミス扱いにする
+_FORMAT_VERSION = b"\x01"
+# 最終アクセス時刻の更新間隔（秒）。ヒットのたびに書き込みが発生しないよう間引く
+_TOUCH_INTERVAL = 60.0
+# 容量超過時に、最終アクセスが古いエントリを何件ずつ確認して削除するか
+_EVICT_BATCH = 64
+
+
+def encode_value(value: Dict[str, Any]) -> bytes:
+    """結果の辞書を保存用のバイト列（区切りを詰めたJSONをzlibで圧縮したもの）に変換する"""
+    raw = json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    return _FORMAT_VERSION + zlib.compress(raw, 6)
+
+
+def decode_value(data: bytes) -> Optional[Dict[str, Any]]:
+    """encode_valueの逆変換。形式が異なる・壊れている場合はNoneを返す"""
+    if not data or data[:1] != _FORMAT_VERSION:
+        return None
+    try:
+        return json.loads(zlib.decompress(data[1:]).decode("utf-8"))
+    except (zlib.error, ValueError):
+        return None
+
+
+class SQLiteCacheBackend:
+    """
+    ResultCacheの永続化用バックエンド（SQLite WALモード）。
+    LINE(Gunicornの各ワーカー)とDiscordのプロセス間で結果を共有し、再起動・デプロイ後も保持する。
+
+    - エントリは圧縮して保存し、TTLを過ぎたものはミスとして扱う。
+      さらに stale_ttl の間は、上流APIの障害時に返す古い結果として保持する（書き込み時に掃除する）
+    - 合計サイズが max_bytes を超えた場合は、最終アクセスが古いものから削除する。
+      合計サイズは totals テーブルに保持し、書き込みと同じトランザクションで増減させる（プロセス間で共有される）
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_bytes: int = 64 * 1024 * 1024,
+        stale_ttl: float = 0.0,
+        clock: Callable[[], float] = time.time,
+    ):
+        """
+        Args:
+            path: SQLiteファイルのパス
+            max_bytes: 保存するエントリ（圧縮後）の合計サイズの上限
+            stale_ttl: 期限切れ後もエントリを保持する時間（秒）。get(allow_stale=True) で取得できる
+            clock: 現在時刻（UNIX時間）を返す関数。プロセス間で比較するため壁時計を使う
+        """
+        self.path = path
+        self.max_bytes = max(1, max_bytes)
+        self.stale_ttl = max(0.0, stale_ttl)
+        self._clock = clock
+        self._connections = SQLiteConnections(path, _SCHEMA)
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.errors = 0
+
+    def get(self, key: str, allow_stale: bool = False) -> Optional[Tuple[Dict[str, Any], float]]:
+        """
+        エントリを取得する。
+
+        Args:
+            key: 投稿のショートコード
+            allow_stale: Trueの場合、期限切れでも stale_ttl 以内のエントリを返す
+
+        Returns:
+            (結果, 残りの有効期間(秒)) のタプル（期限切れのエントリでは負の値）。
+            存在しない・期限切れの場合はNone
+        """
+        now = self._clock()
+        # この時刻より後に期限が切れるエントリを返す
+        cutoff = now - self.stale_ttl if allow_stale else now
+        try:
+            conn = self._connections.get()
+            row = conn.execute(
+                "SELECT value, expires_at, accessed_at FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and row[1] > cutoff and now - row[2] >= _TOUCH_INTERVAL:
+                conn.execute("UPDATE results SET accessed_at = ? WHERE key = ?", (now, key))
+        except Exception as e:
+            self._record_error("get", e)
+            return None
+
+        value = decode_value(row[0]) if row is not None and row[1] > cutoff else None
+        with self._stats_lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if value is None:
+            return None
+        return value, row[1] - now
+
+    def set(self, key: str, value: Dict[str, Any], ttl: float) -> None:
+        """
+        エントリを保存し、容量を超えた場合は古いエントリを削除する。
+
+        Args:
+            key: 投稿のショートコード
+            value: 保存する結果
+            ttl: 有効期間（秒）
+        """
+        data = encode_value(value)
+        if len(data) > self.max_bytes:
+            return
+
+        now = self._clock()
+        try:
+            conn = self._connections.get()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                previous = conn.execute("SELECT size FROM results WHERE key = ?", (key,)).fetchone()
+                conn.execute(
+                    "INSERT OR REPLACE INTO results (key, value, size, expires_at, accessed_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (key, data, len(data), now + ttl, now),
+                )
+                self._add_bytes(conn, len(data) - (previous[0] if previous else 0))
+                evicted = self._evict(conn, now)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        except Exception as e:
+            self._record_error("set", e)
+            return
+
+        if evicted:
+            with self._stats_lock:
+                self.evictions += evicted
+
+    @staticmethod
+    def _add_bytes(conn, delta: int) -> int:
+        """合計サイズを増減し、増減後の値を返す（トランザクション内で呼ぶ）"""
+        if delta:
+            conn.execute("UPDATE totals SET bytes = bytes + ? WHERE id = 0", (delta,))
+        return conn.execute("SELECT bytes FROM totals WHERE id = 0").fetchone()[0]
+
+    def _evict(self, conn, now: float) -> int:
+        """
+        期限切れ（stale_ttlを含む）のエントリを削除し、容量を超えていれば最終アクセスが古い順に削除する。
+        合計サイズは totals で管理するため、全件を集計・走査するのは容量を超えた場合の古い側の数件だけになる。
+        """
+        cutoff = now - self.stale_ttl
+        expired = conn.execute("SELECT COALESCE(SUM(size), 0) FROM results WHERE expires_at <= ?", (cutoff,)).fetchone()[0]
+        if expired:
+            conn.execute("DELETE FROM results WHERE expires_at <= ?", (cutoff,))
+        total = self._add_bytes(conn, -expired)
+
+        evicted = 0
+        while total > self.max_bytes:
+            # 古い順に数件ずつ確認し、上限に収まるまでに必要な件数をまとめて削除する
+            rows = conn.execute(
+                "SELECT size FROM results ORDER BY accessed_at LIMIT ?", (_EVICT_BATCH,)
+            ).fetchall()
+            if not rows:
+                break
+            count = freed = 0
+            for (size,) in rows:
+                if total - freed <= self.max_bytes:
+                    break
+                freed += size
+                count += 1
+            conn.execute(
+                "DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY accessed_at LIMIT ?)", (count,)
+            )
+            total = self._add_bytes(conn, -freed)
+            evicted += count
+        return evicted
+
+    def clear(self) -> None:
+        """全エントリと統計情報を消去する"""
+        try:
+            conn = self._connections.get()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("DELETE FROM results")
+                conn.execute("UPDATE totals SET bytes = 0 WHERE id = 0")
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        except Exception as e:
+            self._record_error("clear", e)
+        with self._stats_lock:
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+            self.errors = 0
+
+    def _record_error(self, operation: str, error: Exception) -> None:
+        # 永続キャッシュが使えなくてもメモリキャッシュとAPI呼び出しで処理を続けられるよう、例外は送出しない
+        logger.warning(f"Persistent cache {operation} failed: {error!r}")
+        with self._stats_lock:
+            self.errors += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        統計情報を返す。
+
+        Returns:
+            entries / bytes（全プロセス合計）と hits / misses / evictions / errors（このプロセス）を含む辞書
+        """
+        try:
+            entries, size = self._connections.get().execute(
+                "SELECT COUNT(*), (SELECT bytes FROM totals WHERE id = 0) FROM results"
+            ).fetchone()
+        except Exception as e:
+            self._record_error("stats", e)
+            entries, size = None, None
+        with self._stats_lock:
+            return {
+                "entries": entries,
+                "bytes": size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "errors": self.errors,
+            }
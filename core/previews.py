@@ -0,0 +1,255 @@
+import io
+import logging
+import struct
+import threading
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional, Dict, Any
+
+from core.config import (
+    MEDIA_PROXY_BASE_URL, LINE_PREVIEW_ENABLED, LINE_PREVIEW_MAX_DIMENSION, LINE_PREVIEW_MAX_BYTES, LINE_PREVIEW_WORKERS
+)
+from core.media_proxy import CachedMedia, MediaCache, MediaProxy, media_cache, proxy_secret
+from core.singleflight import SingleFlight
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillowがない場合は縮小せず、上限以下のJPEG/PNGをそのまま使う
+    Image = ImageOps = None
+
+# ログ設定
+logger = logging.getLogger(__name__)
+
+# LINEがプレビュー画像として受け付ける形式
+PREVIEW_TYPES = ("image/jpeg", "image/png")
+# 縮小後のJPEGがファイルサイズの上限を超えた場合に、順に下げていく画質
+JPEG_QUALITIES = (85, 70, 50, 30)
+# 代替画像のトークン（署名なしで配信する）
+FALLBACK_TOKEN = "fallback"
+
+
+class PreviewUnavailable(Exception):
+    """プレビュー画像を生成できなかった"""
+
+
+def render_fallback_png(size: int) -> bytes:
+    """
+    代替のプレビュー画像（濃い灰色の正方形に再生ボタンの三角形）のPNGを生成する。
+    Pillowがなくても使えるよう、zlibでPNGを直接組み立てる。
+
+    Args:
+        size: 画像の一辺（px）
+    """
+    background = bytes((38, 38, 38))
+    foreground = bytes((235, 235, 235))
+    left, right = size * 0.38, size * 0.68
+    middle, half_height = size / 2, size * 0.17
+    rows = []
+    for y in range(size):
+        row = bytearray(b"\x00")  # フィルタなし
+        for x in range(size):
+            inside = left <= x <= right and abs(y - middle) <= half_height * (right - x) / (right - left)
+            row += foreground if inside else background
+        rows.append(bytes(row))
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data))
+
+    header = struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0)  # 8bit RGB
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", header)
+        + chunk(b"IDAT", zlib.compress(b"".join(rows), 9))
+        + chunk(b"IEND", b"")
+    )
+
+
+class PreviewGenerator:
+    """
+    元の画像をLINEのプレビュー画像の上限（長辺・ファイルサイズ）に収まるよう縮小したJPEGを生成する。
+
+    - 元の画像と生成したプレビュー画像はどちらも MediaCache に保存する（プレビュー画像は元の画像の内容のハッシュで引くため、
+      CDNのURLが変わっても同じ画像なら再生成しない）
+    - 生成はスレッドプールで行い、同時に生成する数を workers に抑える。同じ画像の同時生成は1回にまとめる
+    """
+
+    def __init__(
+        self,
+        cache: MediaCache,
+        max_dimension: int = 240,
+        max_bytes: int = 1024 * 1024,
+        workers: int = 2,
+    ):
+        """
+        Args:
+            cache: 元の画像とプレビュー画像を保存するディスクキャッシュ
+            max_dimension: プレビュー画像の長辺（px）
+            max_bytes: プレビュー画像のファイルサイズの上限（バイト）
+            workers: プレビュー画像を生成するスレッド数
+        """
+        self.cache = cache
+        self.max_dimension = max_dimension
+        self.max_bytes = max_bytes
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="preview")
+        self._flight = SingleFlight()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.generated = 0
+        self.passthrough = 0
+        self.fallbacks = 0
+
+    def submit(self, url: str) -> "Future[CachedMedia]":
+        """プレビュー画像の生成をスレッドプールに積む（返信の送信前に呼び、LINEが取得するまでに用意しておく）"""
+        return self._executor.submit(self.generate, url)
+
+    def generate(self, url: str) -> CachedMedia:
+        """
+        元の画像のプレビュー画像を返す（キャッシュになければ生成する）。
+
+        Args:
+            url: 元の画像のURL
+
+        Raises:
+            MediaFetchError: 元の画像を取得できなかった場合
+            PreviewUnavailable: プレビュー画像を生成できなかった場合
+        """
+        source = self.cache.fetch(url)
+        if Image is None:
+            # 縮小できないため、LINEの上限に収まる画像だけをそのまま使う
+            if source.content_type in PREVIEW_TYPES and source.size <= self.max_bytes:
+                with self._lock:
+                    self.passthrough += 1
+                return source
+            raise PreviewUnavailable("Pillow is not installed")
+
+        name = f"preview:{self.max_dimension}:{source.digest}"
+        cached = self.cache.get(name)
+        if cached is not None:
+            with self._lock:
+                self.hits += 1
+            return cached
+        return self._flight.do(name, lambda: self.cache.get(name) or self._render(name, source))
+
+    def _render(self, name: str, source: CachedMedia) -> CachedMedia:
+        data = self.downscale(source.path)
+        with self._lock:
+            self.generated += 1
+        return self.cache.put(name, data, "image/jpeg")
+
+    def downscale(self, path: str) -> bytes:
+        """
+        画像を長辺 max_dimension 以下に縮小し、max_bytes 以下のJPEGにする。
+
+        Raises:
+            PreviewUnavailable: Pillowがない場合、最低の画質でも上限を超える場合
+            OSError: 画像として読み込めない場合
+        """
+        if Image is None:
+            raise PreviewUnavailable("Pillow is not installed")
+        size = (self.max_dimension, self.max_dimension)
+        with Image.open(path) as image:
+            # JPEGはデコード時に縮小する（元の解像度で展開しない）
+            image.draft("RGB", size)
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail(size, Image.LANCZOS)
+            if image.mode != "RGB":
+                image = image.convert("RGB")
+            for quality in JPEG_QUALITIES:
+                buffer = io.BytesIO()
+                image.save(buffer, "JPEG", quality=quality, optimize=True, progressive=True)
+                if buffer.tell() <= self.max_bytes:
+                    return buffer.getvalue()
+        raise PreviewUnavailable(f"Preview is larger than {self.max_bytes} bytes")
+
+    def fallback(self) -> CachedMedia:
+        """代替のプレビュー画像を返す（初回に生成してキャッシュに保存する）"""
+        with self._lock:
+            self.fallbacks += 1
+        name = f"preview:{self.max_dimension}:{FALLBACK_TOKEN}"
+        return self.cache.get(name) or self.cache.put(name, render_fallback_png(self.max_dimension), "image/png")
+
+    def stats(self) -> Dict[str, Any]:
+        """hits / generated / passthrough / fallbacks / collapsed と、Pillowの有無を含む統計情報を返す"""
+        with self._lock:
+            return {
+                "pillow": Image is not None,
+                "hits": self.hits,
+                "generated": self.generated,
+                "passthrough": self.passthrough,
+                "fallbacks": self.fallbacks,
+                "collapsed": self._flight.stats()["collapsed"],
+            }
+
+
+class PreviewService:
+    """
+    LINEに送るプレビュー画像のURLを発行し、/preview/<token> へのリクエストに応える。
+    トークンは MediaProxy と同じ署名付きのURLで、生成できない場合・元の画像がない場合は代替画像を返す。
+    代替画像（/preview/fallback）は外部の画像に頼らないよう、プレビューが無効でも公開URLがあれば配信する。
+    """
+
+    def __init__(self, proxy: MediaProxy, generator: PreviewGenerator):
+        """
+        Args:
+            proxy: /preview/ のURLを発行・検証するMediaProxy（route="preview"）
+            generator: プレビュー画像の生成
+        """
+        self.proxy = proxy
+        self.generator = generator
+
+    @property
+    def enabled(self) -> bool:
+        return self.proxy.enabled
+
+    def preview_url(self, url: Optional[str]) -> str:
+        """
+        元の画像のプレビュー画像のURLを返し、裏で生成を始める。
+
+        Args:
+            url: 元の画像（動画の場合はサムネイル）のURL。Noneの場合は代替画像のURLを返す
+        """
+        if not url:
+            return self.fallback_url()
+        self.generator.submit(url)
+        return self.proxy.proxy_url(url)
+
+    def fallback_url(self) -> Optional[str]:
+        """代替画像のURLを返す（公開URL（MEDIA_PROXY_BASE_URL）が設定されていない場合はNone）"""
+        if not self.proxy.base_url:
+            return None
+        return f"{self.proxy.base_url}/{self.proxy.route}/{FALLBACK_TOKEN}"
+
+    def render(self, token: str) -> Optional[CachedMedia]:
+        """
+        トークンのプレビュー画像を返す（生成できない場合は代替画像）。
+
+        Returns:
+            プレビュー画像（無効なトークン・プレビューが無効な場合はNone。代替画像は無効な場合も返す）
+        """
+        if token == FALLBACK_TOKEN and self.fallback_url() is not None:
+            return self.generator.fallback()
+        if not self.enabled:
+            return None
+        url = self.proxy.resolve(token)
+        if url is None:
+            return None
+        try:
+            return self.generator.submit(url).result()
+        except Exception as e:
+            logger.warning(f"Preview generation failed, serving fallback: {e!r}")
+            return self.generator.fallback()
+
+    def stats(self) -> Dict[str, Any]:
+        """enabled と生成の統計情報を返す"""
+        if not self.enabled:
+            return {"enabled": False}
+        return dict(self.generator.stats(), enabled=True)
+
+
+# LINE Botで共有するプレビュー画像の生成・配信（元の画像とプレビュー画像はメディアプロキシのキャッシュに保存する）
+preview_service = PreviewService(
+    MediaProxy(media_cache, base_url=MEDIA_PROXY_BASE_URL, secret=proxy_secret(), enabled=LINE_PREVIEW_ENABLED,
+               route="preview"),
+    PreviewGenerator(media_cache, max_dimension=LINE_PREVIEW_MAX_DIMENSION, max_bytes=LINE_PREVIEW_MAX_BYTES,
+                     workers=LINE_PREVIEW_WORKERS),
+)
@@ -0,0 +1,316 @@
+import threading
+from collections import deque
+from typing import Optional, Dict, Any, Deque, List, Tuple
+
+from core.config import (
+    RAPID_API_KEY, RAPID_API_HOST, UPSTREAM_PROVIDERS, HEDGE_DEFAULT_DELAY, HEDGE_MIN_DELAY, provider_rate_limit
+)
+from core.extractor import extract_media_info
+from core.rate_limiter import RateLimiter
+
+# 順位付けとヘッジの判断に使う直近の呼び出し数
+STATS_WINDOW = 200
+# この回数以上呼び出したプロバイダーだけを統計で順位付けする（それまでは設定順）
+MIN_SAMPLES = 10
+# 成功率の下限（0除算と、失敗が続いたプロバイダーの評価が発散するのを防ぐ）
+_MIN_SUCCESS_RATE = 0.05
+
+
+class ProviderStats:
+    """1つのプロバイダーの直近の成功率とレイテンシ"""
+
+    def __init__(self, window: int = STATS_WINDOW):
+        self._lock = threading.Lock()
+        self._outcomes: Deque[bool] = deque(maxlen=window)
+        # 成功した呼び出しのレイテンシ（秒）
+        self._latencies: Deque[float] = deque(maxlen=window)
+        self.calls = 0
+        self.failures = 0
+        self.hedges = 0   # このプロバイダーが遅いために別のプロバイダーへ追加で問い合わせた回数
+        self.wins = 0     # ヘッジした問い合わせのうち、このプロバイダーの応答を採用した回数
+
+    def record(self, ok: bool, latency: float) -> None:
+        with self._lock:
+            self.calls += 1
+            self._outcomes.append(ok)
+            if ok:
+                self._latencies.append(latency)
+            else:
+                self.failures += 1
+
+    def record_hedge(self) -> None:
+        with self._lock:
+            self.hedges += 1
+
+    def record_win(self) -> None:
+        with self._lock:
+            self.wins += 1
+
+    @property
+    def samples(self) -> int:
+        with self._lock:
+            return len(self._outcomes)
+
+    def success_rate(self) -> float:
+        with self._lock:
+            if not self._outcomes:
+                return 1.0
+            return sum(self._outcomes) / len(self._outcomes)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """成功した呼び出しのレイテンシのパーセンタイル（秒）。サンプルがない場合はNone"""
+        with self._lock:
+            if not self._latencies:
+                return None
+            ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def expected_cost(self) -> float:
+        """
+        成功するまでに見込まれる時間（秒）。中央値のレイテンシを成功率で割ったもの。
+        遅いプロバイダーも、失敗しがちなプロバイダーも後ろに回る。
+        """
+        p50 = self.percentile(0.50)
+        if p50 is None:
+            p50 = HEDGE_DEFAULT_DELAY
+        return p50 / max(_MIN_SUCCESS_RATE, self.success_rate())
+
+    def snapshot(self) -> Dict[str, Any]:
+        p50, p95 = self.percentile(0.50), self.percentile(0.95)
+        success_rate = self.success_rate()
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "failures": self.failures,
+                "success_rate": round(success_rate, 3),
+                "p50_ms": None if p50 is None else round(p50 * 1000, 1),
+                "p95_ms": None if p95 is None else round(p95 * 1000, 1),
+                "hedges": self.hedges,
+                "wins": self.wins,
+            }
+
+
+class Provider:
+    """
+    Instagramダウンロード用の上流API（RapidAPI上のAPI）1つ分のアダプター。
+    リクエストの組み立てと、レスポンスを共通のメディア情報の形式に変換する処理を持つ。
+    APIごとにクォータが異なるため、レートリミッターもプロバイダーごとに持つ。
+
+    サブクラスは host / path / url_param を指定し、必要に応じて normalize を上書きする。
+    """
+
+    name = "base"
+    host = ""
+    path = "/"
+    url_param = "url"
+    # レスポンスが "medias" 形式で、MediaStreamParser による逐次パースができるか
+    streaming = False
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        host: Optional[str] = None,
+        limiter: Optional[RateLimiter] = None,
+    ):
+        """
+        Args:
+            api_key: RapidAPIのキー（Noneの場合は RAPID_API_KEY）
+            host: APIのホスト名（Noneの場合はクラスの既定値）
+            limiter: このプロバイダーの呼び出しに使うレートリミッター
+                （Noneの場合は provider_rate_limit(name) の設定で作成する）
+        """
+        self.api_key = api_key
+        if host:
+            self.host = host
+        self.limiter = limiter if limiter is not None else RateLimiter(**provider_rate_limit(self.name))
+        self.stats = ProviderStats()
+
+    def build_request(self, post_url: str) -> Tuple[str, Dict[str, str], Dict[str, str]]:
+        """
+        リクエストURL・クエリ・ヘッダーを構築する。
+
+        Args:
+            post_url: 正規化済みのInstagram投稿URL
+
+        Returns:
+            (url, querystring, headers) のタプル
+        """
+        url = f"https://{self.host}{self.path}"
+        querystring = {self.url_param: post_url}
+        headers = {
+            "X-RapidAPI-Key": self.api_key or RAPID_API_KEY or "",
+            "X-RapidAPI-Host": self.host,
+        }
+        return url, querystring, headers
+
+    def normalize(self, data: Any) -> List[Dict[str, Any]]:
+        """
+        APIレスポンスのJSONをメディア情報のリストに変換する。
+
+        Returns:
+            {"url", "type", "thumbnail"} の辞書のリスト（見つからない場合は空）
+        """
+        return extract_media_info(data)
+
+    def __repr__(self) -> str:
+        return f"<{type(self).__name__} {self.name} {self.host}>"
+
+
+class DownloaderProvider(Provider):
+    """instagram-downloader-download-instagram-videos-stories（既定。"medias" 形式のレスポンス）"""
+
+    name = "downloader"
+    host = RAPID_API_HOST
+    path = "/download"
+    streaming = True
+
+
+class LooterProvider(Provider):
+    """instagram-looter2（{"data": {"medias": [{"type", "link"}]}} 形式のレスポンス）"""
+
+    name = "looter"
+    host = "instagram-looter2.p.rapidapi.com"
+    path = "/post-dl"
+
+    def normalize(self, data: Any) -> List[Dict[str, Any]]:
+        media_list = []
+        body = data.get("data") if isinstance(data, dict) else None
+        medias = body.get("medias") if isinstance(body, dict) else None
+        for media in medias if isinstance(medias, list) else ():
+            if not isinstance(media, dict) or not isinstance(media.get("link"), str):
+                continue
+            is_video = media.get("type") == "video" or ".mp4" in media["link"]
+            media_list.append({
+                "url": media["link"],
+                "type": "video" if is_video else "image",
+                "thumbnail": media.get("thumbnail") if is_video else None,
+            })
+        return media_list or extract_media_info(data)
+
+
+class ScraperProvider(Provider):
+    """instagram-scraper-api2（Instagramのメディアオブジェクトをそのまま返す形式のレスポンス）"""
+
+    name = "scraper"
+    host = "instagram-scraper-api2.p.rapidapi.com"
+    path = "/v1/post_info"
+    url_param = "code_or_id_or_url"
+
+    def normalize(self, data: Any) -> List[Dict[str, Any]]:
+        post = data.get("data") if isinstance(data, dict) else None
+        if not isinstance(post, dict):
+            return extract_media_info(data)
+        items = post.get("carousel_media")
+        if not isinstance(items, list) or not items:
+            items = [post]
+        media_list = [m for m in (_instagram_media(item) for item in items) if m is not None]
+        return media_list or extract_media_info(data)
+
+
+def _instagram_media(item: Any) -> Optional[Dict[str, Any]]:
+    """Instagramのメディアオブジェクト（video_url / image_versions）からメディア情報を作る"""
+    if not isinstance(item, dict):
+        return None
+    image = None
+    versions = item.get("image_versions") or item.get("image_versions2")
+    candidates = versions.get("items") or versions.get("candidates") if isinstance(versions, dict) else None
+    if isinstance(candidates, list) and candidates and isinstance(candidates[0], dict):
+        image = candidates[0].get("url")
+    image = image or item.get("thumbnail_url") or item.get("display_url")
+
+    if item.get("is_video") or item.get("video_url"):
+        video = item.get("video_url")
+        if isinstance(video, str):
+            return {"url": video, "type": "video", "thumbnail": image}
+    if isinstance(image, str):
+        return {"url": image, "type": "image", "thumbnail": None}
+    return None
+
+
+# UPSTREAM_PROVIDERS で指定できるプロバイダー
+PROVIDER_CLASSES = {cls.name: cls for cls in (DownloaderProvider, LooterProvider, ScraperProvider)}
+
+
+class ProviderPool:
+    """
+    設定したプロバイダーの一覧と、その順位付け・ヘッジの待ち時間を管理する。
+
+    - ordered(): 直近の成功率とレイテンシから見込み時間の短い順に並べる
+      （統計が MIN_SAMPLES に満たないプロバイダーは、統計のあるものの後ろに設定順で並べる）
+    - hedge_delay(): プライマリの応答をこの時間待っても返ってこなければ、次のプロバイダーにも問い合わせる
+      （観測したp95。サンプルがない場合は HEDGE_DEFAULT_DELAY）
+    """
+
+    def __init__(
+        self,
+        providers: List[Provider],
+        default_delay: float = 3.0,
+        min_delay: float = 0.5,
+    ):
+        """
+        Args:
+            providers: 使用するプロバイダー（設定順）
+            default_delay: 統計がない場合のヘッジの待ち時間（秒）
+            min_delay: ヘッジの待ち時間の下限（秒）。p95が極端に短い場合に問い合わせが倍増するのを防ぐ
+        """
+        if not providers:
+            raise ValueError("At least one provider is required")
+        self.providers = list(providers)
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+
+    def ordered(self) -> List[Provider]:
+        """問い合わせる順に並べたプロバイダーのリストを返す"""
+        def key(item: Tuple[int, Provider]) -> Tuple[int, float, int]:
+            index, provider = item
+            if provider.stats.samples < MIN_SAMPLES:
+                return (1, 0.0, index)
+            return (0, provider.stats.expected_cost(), index)
+        return [provider for _, provider in sorted(enumerate(self.providers), key=key)]
+
+    def streaming_provider(self) -> Optional[Provider]:
+        """逐次パースに対応したプロバイダーのうち、最も順位の高いものを返す"""
+        return next((p for p in self.ordered() if p.streaming), None)
+
+    def hedge_delay(self, provider: Provider) -> float:
+        """providerの応答を待つ時間（秒）。これを過ぎたら次のプロバイダーにも問い合わせる"""
+        p95 = provider.stats.percentile(0.95) if provider.stats.samples >= MIN_SAMPLES else None
+        return max(self.min_delay, self.default_delay if p95 is None else p95)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        プロバイダーごとの統計情報を返す。
+
+        Returns:
+            order（現在の問い合わせ順）と、providers（名前 -> calls / failures / success_rate /
+            p50_ms / p95_ms / hedges / wins）を含む辞書
+        """
+        return {
+            "order": [p.name for p in self.ordered()],
+            "providers": {p.name: p.stats.snapshot() for p in self.providers},
+        }
+
+    def rate_limit_stats(self) -> Dict[str, Any]:
+        """プロバイダー名 -> そのプロバイダーのレートリミッターの統計情報（RateLimiter.stats）を返す"""
+        return {p.name: p.limiter.stats() for p in self.providers}
+
+
+def parse_providers(value: str) -> List[Provider]:
+    """
+    "downloader,looter" 形式の文字列からプロバイダーを作成する（未知の名前は無視する）。
+    有効な名前がない場合は既定のプロバイダーを使う。
+    """
+    providers: List[Provider] = []
+    for name in value.split(","):
+        cls = PROVIDER_CLASSES.get(name.strip().lower())
+        if cls is not None and not any(isinstance(p, cls) for p in providers):
+            providers.append(cls())
+    return providers or [DownloaderProvider()]
+
+
+# 両Botで共有するプロバイダーの一覧
+provider_pool = ProviderPool(
+    parse_providers(UPSTREAM_PROVIDERS),
+    default_delay=HEDGE_DEFAULT_DELAY,
+    min_delay=HEDGE_MIN_DELAY,
+)
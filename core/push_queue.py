@@ -0,0 +1,217 @@
+import logging
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Optional, Dict, Any, Callable, Deque, List, Tuple
+
+from core.rate_limiter import RateLimiter, RateLimitExceeded
+
+# ログ設定
+logger = logging.getLogger(__name__)
+
+# 統計に使う直近の呼び出し数
+STATS_WINDOW = 200
+# LINEのreply/pushで1回に送れるメッセージ数の上限
+MAX_MESSAGES_PER_CALL = 5
+# リトライの待ち時間（秒、回数ごとに倍にする）
+RETRY_BACKOFF = 1.0
+
+
+class DeliveryStats:
+    """送信APIの呼び出し種別（reply / push）ごとの呼び出し数・メッセージ数・失敗数・レイテンシ"""
+
+    def __init__(self, window: int = STATS_WINDOW):
+        self._lock = threading.Lock()
+        self._window = window
+        self._latencies: Dict[str, Deque[float]] = {}
+        self._counts: Dict[str, Dict[str, int]] = {}
+
+    def record(self, kind: str, messages: int, latency: float, ok: bool) -> None:
+        """
+        1回の呼び出しを記録する。
+
+        Args:
+            kind: 呼び出しの種別（"reply" / "push"）
+            messages: 送信したメッセージ数（pushの場合はクォータの消費量）
+            latency: 呼び出しにかかった時間（秒）
+            ok: 成功したか
+        """
+        with self._lock:
+            counts = self._counts.setdefault(kind, {"calls": 0, "messages": 0, "failures": 0})
+            counts["calls"] += 1
+            if ok:
+                counts["messages"] += messages
+                self._latencies.setdefault(kind, deque(maxlen=self._window)).append(latency)
+            else:
+                counts["failures"] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        統計情報を返す。
+
+        Returns:
+            種別ごとに calls / messages / failures / p50_ms / p95_ms を含む辞書
+        """
+        with self._lock:
+            result = {}
+            for kind, counts in self._counts.items():
+                ordered = sorted(self._latencies.get(kind, ()))
+                result[kind] = dict(counts, p50_ms=_percentile_ms(ordered, 0.5), p95_ms=_percentile_ms(ordered, 0.95))
+            return result
+
+
+def _percentile_ms(ordered: List[float], q: float) -> Optional[float]:
+    if not ordered:
+        return None
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 1)
+
+
+def _status_code(error: Exception) -> Optional[int]:
+    """送信APIの例外からHTTPステータスコードを取り出す（LineBotApiError.status_code）"""
+    status_code = getattr(error, "status_code", None)
+    return status_code if isinstance(status_code, int) else None
+
+
+class PushQueue:
+    """
+    pushメッセージの送信キュー。返信（reply）に入りきらなかったメッセージを後から送る。
+
+    - enqueue() したメッセージを MAX_MESSAGES_PER_CALL 件ずつの送信にまとめ、1本のワーカースレッドが順に送る
+      （同じ宛先へのメッセージの順序を保つ）
+    - 送信前に limiter でトークンを取得し、送信APIのレート制限を超えないようにする
+    - 送信ごとにリトライキーを付けるため、タイムアウト等でリトライしても二重に届かない
+    - 送信ごとのレイテンシ・送信したメッセージ数（pushはクォータを消費する）を stats で公開する
+    """
+
+    def __init__(
+        self,
+        send: Callable[[str, List[Any], str], None],
+        limiter: Optional[RateLimiter] = None,
+        max_retries: int = 2,
+        max_pending: int = 1000,
+        enabled: bool = True,
+        stats: Optional[DeliveryStats] = None,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        """
+        Args:
+            send: (宛先, メッセージのリスト, リトライキー) を受け取って送信する関数
+            limiter: 送信回数のレートリミッター（Noneの場合は制限しない）
+            max_retries: 429・5xx・接続エラーの場合にリトライする回数
+            max_pending: キューに溜められる送信の最大数（超えた分は破棄する）
+            enabled: Falseの場合は何も送らない
+            stats: 送信の統計（replyと共有する場合に指定）
+            sleep: リトライの待機に使う関数
+        """
+        self.send = send
+        self.limiter = limiter
+        self.max_retries = max(0, max_retries)
+        self.enabled = enabled
+        self.stats = stats or DeliveryStats()
+        self._sleep = sleep
+        self._queue: "queue.Queue[Tuple[str, List[Any]]]" = queue.Queue(maxsize=max(1, max_pending))
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def enqueue(self, to: str, messages: List[Any]) -> int:
+        """
+        メッセージを送信キューに積む。
+
+        Args:
+            to: 送信先（ユーザー・グループ・トークルームのID）
+            messages: 送信するメッセージのリスト
+
+        Returns:
+            積んだ送信の数（MAX_MESSAGES_PER_CALL 件ごとに1回）
+        """
+        if not self.enabled or not to or not messages:
+            return 0
+        queued = 0
+        for start in range(0, len(messages), MAX_MESSAGES_PER_CALL):
+            try:
+                self._queue.put_nowait((to, messages[start:start + MAX_MESSAGES_PER_CALL]))
+                queued += 1
+            except queue.Full:
+                with self._lock:
+                    self.dropped += 1
+                logger.warning(f"Push queue is full, dropped messages for {to}")
+        self._ensure_worker()
+        return queued
+
+    def _ensure_worker(self) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="push-queue", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            to, messages = self._queue.get()
+            try:
+                self.deliver(to, messages)
+            except Exception as e:
+                logger.error(f"Push delivery error: {e}")
+            finally:
+                self._queue.task_done()
+
+    def join(self) -> None:
+        """キューに積まれた送信が全て終わるまで待つ（テスト・停止処理用）"""
+        self._queue.join()
+
+    def deliver(self, to: str, messages: List[Any]) -> bool:
+        """
+        1回分のメッセージを送信する（ワーカースレッドから呼ばれる）。
+
+        Returns:
+            送信できた場合はTrue
+        """
+        retry_key = str(uuid.uuid4())
+        for attempt in range(self.max_retries + 1):
+            try:
+                if self.limiter is not None:
+                    self.limiter.acquire()
+            except RateLimitExceeded as e:
+                logger.warning(f"Push to {to} delayed: {e}")
+                self._sleep(e.retry_after)
+                continue
+            started = time.monotonic()
+            try:
+                self.send(to, messages, retry_key)
+            except Exception as e:
+                status_code = _status_code(e)
+                if status_code == 409:
+                    # 同じリトライキーの送信は受け付け済み（前回の試行が届いていた）
+                    self.stats.record("push", len(messages), time.monotonic() - started, True)
+                    return True
+                self.stats.record("push", len(messages), time.monotonic() - started, False)
+                retryable = status_code is None or status_code == 429 or status_code >= 500
+                if not retryable or attempt >= self.max_retries:
+                    logger.error(f"Push to {to} failed: {e}")
+                    return False
+                logger.warning(f"Push to {to} failed, retrying: {e}")
+                self._sleep(RETRY_BACKOFF * (2 ** attempt))
+                continue
+            self.stats.record("push", len(messages), time.monotonic() - started, True)
+            return True
+        logger.error(f"Push to {to} gave up after {self.max_retries + 1} attempts")
+        return False
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        キューの状態を返す。
+
+        Returns:
+            enabled / pending / dropped と、limiter を使用している場合は "rate_limiter" を含む辞書
+        """
+        with self._lock:
+            snapshot: Dict[str, Any] = {
+                "enabled": self.enabled,
+                "pending": self._queue.qsize(),
+                "dropped": self.dropped,
+            }
+        if self.limiter is not None:
+            snapshot["rate_limiter"] = self.limiter.stats()
+        return snapshot
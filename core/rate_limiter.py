@@ -0,0 +1,271 @@
+import asyncio
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Optional, Dict, Any, Callable, Mapping
+
+# 429でRetry-Afterがない場合に待つ時間（秒）
+DEFAULT_RETRY_AFTER = 1.0
+# 429を受けた際にレートを下げる割合と、成功時に回復させる割合（設定値に対する比率）
+_DECREASE_FACTOR = 0.5
+_RECOVERY_STEP = 0.05
+# 下げたレートの下限（設定値に対する比率）
+_MIN_RATE_RATIO = 0.1
+
+
+class RateLimitExceeded(Exception):
+    """許容する待ち時間内にトークンを確保できない場合に送出される"""
+
+    def __init__(self, retry_after: float, reason: str):
+        super().__init__(f"RapidAPI rate limit reached ({reason}), retry after {retry_after:.1f}s")
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+def parse_retry_after(value: Optional[str], now: Optional[float] = None) -> Optional[float]:
+    """
+    Retry-Afterヘッダーの値（秒数またはHTTP日付）を待ち時間（秒）に変換する。
+
+    Returns:
+        待ち時間（秒）、解釈できない場合はNone
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at - (time.time() if now is None else now))
+
+
+def _header_float(headers: Mapping[str, str], name: str) -> Optional[float]:
+    try:
+        return float(headers[name])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class RateLimiter:
+    """
+    RapidAPI呼び出し用のトークンバケット型レートリミッター。
+
+    - 1秒あたりのレート(per_second)とバースト(burst)、1日あたりの上限(per_day)を守る
+    - トークンがすぐに補充される場合は失敗させずに待つ（最大 max_wait 秒）。
+      待っている呼び出し元の分はトークンを前借りするため、到着順に一定間隔で実行される
+    - 429やRapidAPIのレート制限ヘッダー（X-RateLimit-*）を見て、待機・レートの引き下げを行う
+    - 残りクォータなどのゲージを stats() で公開する
+
+    カウントはプロセス単位。プロセス間で共有する場合は run_app.py の単一プロセス構成を使う。
+    RapidAPIのプロバイダーごとに1つ持つ（core.providers.Provider.limiter）。
+    """
+
+    def __init__(
+        self,
+        per_second: float = 5.0,
+        burst: float = 5.0,
+        per_day: int = 0,
+        max_wait: float = 5.0,
+        enabled: bool = True,
+        clock: Callable[[], float] = time.monotonic,
+        wall_clock: Callable[[], float] = time.time,
+        sleep: Callable[[float], None] = time.sleep,
+        async_sleep: Callable[[float], Any] = asyncio.sleep,
+    ):
+        """
+        Args:
+            per_second: 1秒あたりに補充するトークン数
+            burst: バケットの容量（連続して即時に実行できる回数）
+            per_day: 1日（UTC）あたりの上限。0以下の場合は無制限
+            max_wait: トークンを待つ最大時間（秒）。これより長く待つ必要がある場合は RateLimitExceeded
+            enabled: Falseの場合は制限しない（ヘッダーの記録のみ行う）
+            clock: 経過時間の計測に使う関数
+            wall_clock: 日付の判定とRetry-After(HTTP日付)の解釈に使う関数
+            sleep: 同期版の待機関数
+            async_sleep: asyncio版の待機関数
+        """
+        self.per_second = max(0.001, per_second)
+        self.burst = max(1.0, burst)
+        self.per_day = per_day
+        self.max_wait = max_wait
+        self.enabled = enabled
+        self._clock = clock
+        self._wall_clock = wall_clock
+        self._sleep = sleep
+        self._async_sleep = async_sleep
+        self._lock = threading.Lock()
+
+        self.rate = self.per_second    # 429に応じて調整される現在のレート
+        self._tokens = self.burst
+        self._updated = clock()
+        self._blocked_until = 0.0      # Retry-After等で指定された再開時刻
+        self._day = self._today()
+        self.day_used = 0
+        # RapidAPIのヘッダーから読み取った値
+        self.upstream_limit: Optional[float] = None
+        self.upstream_remaining: Optional[float] = None
+        self.quota_limit: Optional[float] = None
+        self.quota_remaining: Optional[float] = None
+        # 統計
+        self.acquired = 0
+        self.waited = 0
+        self.wait_seconds = 0.0
+        self.rejected = 0
+        self.throttled_responses = 0
+
+    def _today(self) -> int:
+        return int(self._wall_clock() // 86400)
+
+    def _reserve(self, timeout: Optional[float]) -> float:
+        """トークンを1つ予約し、実行までに待つ時間を返す"""
+        if timeout is None:
+            timeout = self.max_wait
+
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+            today = self._today()
+            if today != self._day:
+                self._day = today
+                self.day_used = 0
+
+            if not self.enabled:
+                self.acquired += 1
+                self.day_used += 1
+                return 0.0
+
+            if self.per_day > 0 and self.day_used >= self.per_day:
+                self.rejected += 1
+                raise RateLimitExceeded(86400 - self._wall_clock() % 86400, "daily budget exhausted")
+
+            wait = max(0.0, self._blocked_until - now, (1.0 - self._tokens) / self.rate)
+            if wait > timeout:
+                self.rejected += 1
+                raise RateLimitExceeded(wait, "per-second rate")
+
+            # 前借りしたトークンは後続の呼び出し元の待ち時間に反映される
+            self._tokens -= 1.0
+            self.day_used += 1
+            self.acquired += 1
+            if wait > 0:
+                self.waited += 1
+                self.wait_seconds += wait
+            return wait
+
+    def acquire(self, timeout: Optional[float] = None) -> float:
+        """
+        トークンを1つ取得する。すぐに取得できない場合は補充されるまで待つ。
+
+        Args:
+            timeout: 待つ最大時間（秒）。Noneの場合は max_wait
+
+        Returns:
+            待った時間（秒）
+
+        Raises:
+            RateLimitExceeded: timeout以内に取得できない場合、または1日の上限に達した場合
+        """
+        wait = self._reserve(timeout)
+        if wait > 0:
+            self._sleep(wait)
+        return wait
+
+    async def acquire_async(self, timeout: Optional[float] = None) -> float:
+        """acquireのasyncio版（待機中にイベントループをブロックしない）"""
+        wait = self._reserve(timeout)
+        if wait > 0:
+            await self._async_sleep(wait)
+        return wait
+
+    def observe(self, status_code: int, headers: Optional[Mapping[str, str]]) -> Optional[float]:
+        """
+        RapidAPIのレスポンスを記録し、レート制限の指示に従う。
+
+        - 429: Retry-After（なければ DEFAULT_RETRY_AFTER）の間は新しい呼び出しを待たせ、レートを下げる
+        - X-RateLimit-Requests-Remaining が0: X-RateLimit-Requests-Reset まで待たせる
+        - 成功: 下げたレートを少しずつ設定値まで戻す
+
+        Args:
+            status_code: HTTPステータスコード
+            headers: レスポンスヘッダー
+
+        Returns:
+            429の場合は再試行までの待ち時間（秒）、それ以外はNone
+        """
+        lowered = {k.lower(): v for k, v in headers.items()} if isinstance(headers, Mapping) else {}
+        now = self._clock()
+        wall_now = self._wall_clock()
+
+        with self._lock:
+            # 秒間レート（X-RateLimit-Limit / Remaining / Reset）
+            self.upstream_limit = _header_float(lowered, "x-ratelimit-limit") or self.upstream_limit
+            remaining = _header_float(lowered, "x-ratelimit-remaining")
+            if remaining is not None:
+                self.upstream_remaining = remaining
+                if remaining <= 0:
+                    reset = _header_float(lowered, "x-ratelimit-reset")
+                    if reset is not None:
+                        self._blocked_until = max(self._blocked_until, now + reset)
+
+            # プランのクォータ（X-RateLimit-Requests-Limit / Remaining / Reset）
+            self.quota_limit = _header_float(lowered, "x-ratelimit-requests-limit") or self.quota_limit
+            quota_remaining = _header_float(lowered, "x-ratelimit-requests-remaining")
+            if quota_remaining is not None:
+                self.quota_remaining = quota_remaining
+                if quota_remaining <= 0:
+                    reset = _header_float(lowered, "x-ratelimit-requests-reset")
+                    if reset is not None:
+                        self._blocked_until = max(self._blocked_until, now + reset)
+
+            if status_code == 429:
+                self.throttled_responses += 1
+                retry_after = parse_retry_after(lowered.get("retry-after"), wall_now)
+                if retry_after is None:
+                    retry_after = DEFAULT_RETRY_AFTER
+                self._blocked_until = max(self._blocked_until, now + retry_after)
+                self.rate = max(self.per_second * _MIN_RATE_RATIO, self.rate * _DECREASE_FACTOR)
+                # 前借り分を含めてバケットを空にし、再開後も緩やかに呼び出す
+                self._tokens = min(self._tokens, 0.0)
+                return max(0.0, self._blocked_until - now)
+
+            if status_code < 400 and self.rate < self.per_second:
+                self.rate = min(self.per_second, self.rate + self.per_second * _RECOVERY_STEP)
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        レート制限の状態（ゲージ）と統計情報を返す。
+
+        Returns:
+            tokens / rate / blocked_for / day_used / day_remaining /
+            upstream_limit / upstream_remaining / quota_limit / quota_remaining（RapidAPIのヘッダーの値）/
+            acquired / waited / wait_seconds / rejected / throttled_responses を含む辞書
+        """
+        with self._lock:
+            now = self._clock()
+            tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            return {
+                "enabled": self.enabled,
+                "tokens": round(tokens, 3),
+                "rate": self.rate,
+                "per_second": self.per_second,
+                "blocked_for": max(0.0, self._blocked_until - now),
+                "day_used": self.day_used,
+                "day_remaining": max(0, self.per_day - self.day_used) if self.per_day > 0 else None,
+                "upstream_limit": self.upstream_limit,
+                "upstream_remaining": self.upstream_remaining,
+                "quota_limit": self.quota_limit,
+                "quota_remaining": self.quota_remaining,
+                "acquired": self.acquired,
+                "waited": self.waited,
+                "wait_seconds": round(self.wait_seconds, 3),
+                "rejected": self.rejected,
+                "throttled_responses": self.throttled_responses,
+            }
+
@@ -0,0 +1,302 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, asynccontextmanager
+from typing import Optional, Dict, Any, Callable, Deque, Iterator, AsyncIterator, Mapping, NamedTuple
+
+from core.config import (
+    FAIR_MAX_CONCURRENCY, FAIR_PER_KEY_CONCURRENCY, FAIR_PER_KEY_QUEUE, FAIR_MAX_WAIT, FAIR_CLASS_WEIGHTS
+)
+
+# クラスごとに保持するレイテンシのサンプル数（パーセンタイル計算用）
+LATENCY_SAMPLES = 1024
+
+
+class Requester(NamedTuple):
+    """
+    上流APIへの問い合わせの依頼元。公平性の単位（キー）とレイテンシ集計の単位（クラス）を表す。
+
+    例: Requester("discord_guild", "<guild_id>:<author_id>"), Requester("line_group", "<group_id>")
+    """
+    klass: str  # "discord_guild" | "discord_dm" | "line_user" | "line_group" | "line_room" | "background" | "anonymous"
+    ident: str
+
+
+ANONYMOUS = Requester("anonymous", "")
+
+
+class SchedulerRejected(Exception):
+    """キューが満杯、または待ち時間が上限を超えたため問い合わせを実行しなかった"""
+
+
+class _Waiter:
+    """実行枠を待っている1件の問い合わせ"""
+    __slots__ = ("key", "tag", "enqueued_at", "granted", "event", "loop", "future")
+
+    def __init__(self, key: Requester, tag: float, enqueued_at: float):
+        self.key = key
+        self.tag = tag
+        self.enqueued_at = enqueued_at
+        self.granted = False
+        self.event: Optional[threading.Event] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.future: Optional["asyncio.Future[None]"] = None
+
+
+class _KeyState:
+    __slots__ = ("queue", "active", "last_tag")
+
+    def __init__(self) -> None:
+        self.queue: Deque[_Waiter] = deque()
+        self.active = 0
+        self.last_tag = 0.0
+
+
+class _ClassStats:
+    __slots__ = ("waits", "latencies", "completed", "rejected")
+
+    def __init__(self) -> None:
+        self.waits: Deque[float] = deque(maxlen=LATENCY_SAMPLES)
+        self.latencies: Deque[float] = deque(maxlen=LATENCY_SAMPLES)
+        self.completed = 0
+        self.rejected = 0
+
+
+def _percentiles(samples: Deque[float]) -> Dict[str, Optional[float]]:
+    """p50 / p95 / p99（ミリ秒）を返す"""
+    if not samples:
+        return {"p50": None, "p95": None, "p99": None}
+    ordered = sorted(samples)
+    last = len(ordered) - 1
+    return {
+        name: round(ordered[min(last, int(q * len(ordered)))] * 1000, 1)
+        for name, q in (("p50", 0.50), ("p95", 0.95), ("p99", 0.99))
+    }
+
+
+class FairScheduler:
+    """
+    上流APIへの問い合わせを依頼元ごとに公平に実行する重み付きフェアキュー。
+
+    - 全体の同時実行数を max_concurrency に制限し、空いた枠は依頼元（キー）間で公平に割り当てる
+      （Start-time Fair Queueing: 各問い合わせに「仮想時刻 + 1/重み」のタグを付け、タグが小さいものから実行する）。
+      1人が20件のリンクを送っても、他の依頼元の問い合わせはその後ろに並ばずに済む
+    - キーごとの同時実行数と待ち行列の長さを制限し、超えた問い合わせは SchedulerRejected で断る
+    - クラスごとに待ち時間と処理時間のパーセンタイルを集計する
+
+    LINE(スレッド)とDiscord(asyncio)の両方から使えるよう、状態はロックで保護し、
+    待機はスレッドではEvent、asyncioではFutureで行う。
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 8,
+        per_key_concurrency: int = 2,
+        per_key_queue: int = 10,
+        max_wait: float = 30.0,
+        weights: Optional[Mapping[str, float]] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        Args:
+            max_concurrency: 全体の同時実行数
+            per_key_concurrency: 1つの依頼元の同時実行数
+            per_key_queue: 1つの依頼元が待たせておける問い合わせ数
+            max_wait: 実行枠を待つ最大時間（秒）
+            weights: クラスごとの重み（大きいほど多く割り当てる。未指定のクラスは1.0）
+            clock: 現在時刻を返す関数
+        """
+        self.max_concurrency = max(1, max_concurrency)
+        self.per_key_concurrency = max(1, per_key_concurrency)
+        self.per_key_queue = max(0, per_key_queue)
+        self.max_wait = max_wait
+        self.weights = dict(weights or {})
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._keys: Dict[Requester, _KeyState] = {}
+        self._classes: Dict[str, _ClassStats] = {}
+        self._active = 0
+        self._virtual_time = 0.0
+
+    # --- 公開API ---
+
+    @contextmanager
+    def slot(self, requester: Optional[Requester] = None) -> Iterator[None]:
+        """
+        実行枠を確保するコンテキストマネージャー（スレッド版）。
+
+        Raises:
+            SchedulerRejected: 待ち行列が満杯、または max_wait 以内に枠を確保できない場合
+        """
+        waiter = self._enqueue(requester or ANONYMOUS)
+        if not waiter.event.wait(self.max_wait) and self._cancel(waiter):
+            raise SchedulerRejected(f"Timed out waiting for an upstream slot ({waiter.key.klass})")
+        started = self._clock()
+        try:
+            yield
+        finally:
+            self._release(waiter, started)
+
+    @asynccontextmanager
+    async def aslot(self, requester: Optional[Requester] = None) -> AsyncIterator[None]:
+        """slotのasyncio版"""
+        waiter = self._enqueue(requester or ANONYMOUS, loop=asyncio.get_running_loop())
+        if not waiter.granted:
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter.future), self.max_wait)
+            except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+                if self._cancel(waiter):
+                    if isinstance(e, asyncio.CancelledError):
+                        raise
+                    raise SchedulerRejected(f"Timed out waiting for an upstream slot ({waiter.key.klass})")
+                # キャンセルと同時に割り当てられた場合はそのまま実行する
+                if isinstance(e, asyncio.CancelledError):
+                    self._release(waiter, self._clock())
+                    raise
+        started = self._clock()
+        try:
+            yield
+        finally:
+            self._release(waiter, started)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        スケジューラーの状態と、クラスごとの統計情報を返す。
+
+        Returns:
+            active / queued / keys と、classes（クラス名 -> completed / rejected /
+            wait_ms・latency_ms の p50 / p95 / p99）を含む辞書
+        """
+        with self._lock:
+            classes = {
+                name: {
+                    "completed": s.completed,
+                    "rejected": s.rejected,
+                    "wait_ms": _percentiles(s.waits),
+                    "latency_ms": _percentiles(s.latencies),
+                }
+                for name, s in self._classes.items()
+            }
+            return {
+                "active": self._active,
+                "queued": sum(len(k.queue) for k in self._keys.values()),
+                "keys": len(self._keys),
+                "classes": classes,
+            }
+
+    # --- 内部処理（_lock を取得して状態を更新する） ---
+
+    def _enqueue(self, key: Requester, loop: Optional[asyncio.AbstractEventLoop] = None) -> _Waiter:
+        with self._lock:
+            state = self._keys.get(key)
+            if state is None:
+                state = self._keys[key] = _KeyState()
+            if len(state.queue) >= self.per_key_queue and (
+                state.active >= self.per_key_concurrency or self._active >= self.max_concurrency
+            ):
+                self._class(key.klass).rejected += 1
+                self._forget_if_idle(key, state)
+                raise SchedulerRejected(f"Too many pending lookups for {key.klass}:{key.ident}")
+
+            weight = max(0.01, self.weights.get(key.klass, 1.0))
+            tag = max(self._virtual_time, state.last_tag) + 1.0 / weight
+            state.last_tag = tag
+            waiter = _Waiter(key, tag, self._clock())
+            if loop is None:
+                waiter.event = threading.Event()
+            else:
+                waiter.loop = loop
+                waiter.future = loop.create_future()
+            state.queue.append(waiter)
+            self._dispatch()
+            return waiter
+
+    def _dispatch(self) -> None:
+        """空いている実行枠を、タグが最も小さい実行可能な問い合わせに割り当てる"""
+        while self._active < self.max_concurrency:
+            best: Optional[_KeyState] = None
+            for state in self._keys.values():
+                if state.queue and state.active < self.per_key_concurrency:
+                    if best is None or state.queue[0].tag < best.queue[0].tag:
+                        best = state
+            if best is None:
+                return
+
+            waiter = best.queue.popleft()
+            best.active += 1
+            self._active += 1
+            self._virtual_time = max(self._virtual_time, waiter.tag)
+            waiter.granted = True
+            self._class(waiter.key.klass).waits.append(self._clock() - waiter.enqueued_at)
+            if waiter.event is not None:
+                waiter.event.set()
+            if waiter.future is not None:
+                waiter.loop.call_soon_threadsafe(_resolve, waiter.future)
+
+    def _release(self, waiter: _Waiter, started: float) -> None:
+        with self._lock:
+            state = self._keys[waiter.key]
+            state.active -= 1
+            self._active -= 1
+            stats = self._class(waiter.key.klass)
+            stats.completed += 1
+            stats.latencies.append(self._clock() - started)
+            self._forget_if_idle(waiter.key, state)
+            self._dispatch()
+
+    def _cancel(self, waiter: _Waiter) -> bool:
+        """
+        待機をやめる。まだ割り当てられていなければ待ち行列から外してTrueを返す。
+        既に割り当てられていた場合はFalseを返す（呼び出し元が枠を使うか解放する）。
+        """
+        with self._lock:
+            if waiter.granted:
+                return False
+            state = self._keys[waiter.key]
+            state.queue.remove(waiter)
+            self._class(waiter.key.klass).rejected += 1
+            self._forget_if_idle(waiter.key, state)
+            return True
+
+    def _forget_if_idle(self, key: Requester, state: _KeyState) -> None:
+        # 依頼元ごとの状態が増え続けないよう、何もしていないキーは削除する
+        if not state.queue and state.active == 0:
+            self._keys.pop(key, None)
+
+    def _class(self, name: str) -> _ClassStats:
+        stats = self._classes.get(name)
+        if stats is None:
+            stats = self._classes[name] = _ClassStats()
+        return stats
+
+
+def _resolve(future: "asyncio.Future[None]") -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+def parse_weights(value: str) -> Dict[str, float]:
+    """
+    "line_group=2,discord_guild=1" 形式の文字列をクラスごとの重みに変換する（不正な項目は無視する）。
+    """
+    weights: Dict[str, float] = {}
+    for item in value.split(","):
+        name, sep, weight = item.partition("=")
+        if not sep:
+            continue
+        try:
+            weights[name.strip()] = float(weight)
+        except ValueError:
+            continue
+    return weights
+
+
+# 両Botで共有するスケジューラー
+fair_scheduler = FairScheduler(
+    max_concurrency=FAIR_MAX_CONCURRENCY,
+    per_key_concurrency=FAIR_PER_KEY_CONCURRENCY,
+    per_key_queue=FAIR_PER_KEY_QUEUE,
+    max_wait=FAIR_MAX_WAIT,
+    weights=parse_weights(FAIR_CLASS_WEIGHTS),
+)
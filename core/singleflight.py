@@ -0,0 +1,186 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Optional, Dict, Any, Callable, Awaitable, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+class InFlight:
+    """
+    実行中の呼び出しの登録簿。SingleFlight と AsyncSingleFlight で共有すると、
+    スレッド側とasyncio側の同じキーの呼び出しも1回の実行にまとまる。
+    結果は concurrent.futures.Future で受け渡すため、スレッドからも（ブロックして）、
+    イベントループからも（asyncio.wrap_future で）待つことができる。
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._calls: Dict[str, Tuple["Future[Any]", Optional[asyncio.AbstractEventLoop]]] = {}
+
+    def join(self, key: str, loop: Optional[asyncio.AbstractEventLoop] = None) -> Tuple["Future[Any]", bool]:
+        """
+        キーに対応する実行中の呼び出しに相乗りするか、新しく登録する。
+
+        Args:
+            key: 呼び出しをまとめる単位
+            loop: 実行するイベントループ（asyncio側の場合）
+
+        Returns:
+            (結果を受け取るFuture, 自分が実行する側かどうか)
+        """
+        with self._lock:
+            entry = self._calls.get(key)
+            # 実行していたイベントループが閉じられた呼び出しは完了しないため、相乗りしない
+            if entry is not None and not (entry[1] is not None and entry[1].is_closed()):
+                return entry[0], False
+            future: "Future[Any]" = Future()
+            self._calls[key] = (future, loop)
+            return future, True
+
+    def finish(self, key: str, future: "Future[Any]") -> None:
+        """完了した呼び出しを登録簿から外す（結果をFutureに設定する前に呼ぶ）"""
+        with self._lock:
+            entry = self._calls.get(key)
+            if entry is not None and entry[0] is future:
+                del self._calls[key]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._calls)
+
+
+class SingleFlight:
+    """
+    同じキーに対する同時呼び出しを1回の実行にまとめる（スレッド版）。
+    最初の呼び出し元が関数を実行し、実行中に到着した呼び出し元はその結果を共有する。
+    LINE Bot（Flask/Gunicornのスレッド）向け。
+    """
+
+    def __init__(self, flights: Optional[InFlight] = None) -> None:
+        """
+        Args:
+            flights: 実行中の呼び出しの登録簿（AsyncSingleFlightと共有する場合に渡す）
+        """
+        self.flights = flights if flights is not None else InFlight()
+        self._lock = threading.Lock()
+        self.calls = 0       # do()が呼ばれた回数
+        self.executions = 0  # 実際に関数を実行した回数
+        self.collapsed = 0   # 実行中の呼び出しに相乗りした回数
+
+    def do(self, key: str, fn: Callable[[], T]) -> T:
+        """
+        キーに対応する実行中の呼び出しがあればその結果を待ち、なければfnを実行する。
+
+        Args:
+            key: 呼び出しをまとめる単位（投稿のショートコード等）
+            fn: 実行する関数
+
+        Returns:
+            fnの戻り値（相乗りした場合は先行する呼び出しの戻り値）
+
+        Raises:
+            fnが送出した例外（相乗りした呼び出し元にも同じ例外が送出される）
+        """
+        future, leader = self.flights.join(key)
+        with self._lock:
+            self.calls += 1
+            if leader:
+                self.executions += 1
+            else:
+                self.collapsed += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            self.flights.finish(key, future)
+            future.set_exception(e)
+            raise
+        self.flights.finish(key, future)
+        future.set_result(result)
+        return result
+
+    def stats(self) -> Dict[str, int]:
+        """calls / executions / collapsed / in_flight を含む統計情報を返す"""
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "executions": self.executions,
+                "collapsed": self.collapsed,
+                "in_flight": len(self.flights),
+            }
+
+
+class AsyncSingleFlight:
+    """
+    SingleFlightのasyncio版。Discord Bot向け。
+    実行はタスクとして行うため、最初の呼び出し元がキャンセルされても相乗りした呼び出し元には影響しない。
+    SingleFlightと登録簿を共有している場合は、スレッド側で実行中の呼び出しにもループを止めずに相乗りする。
+    """
+
+    def __init__(self, flights: Optional[InFlight] = None) -> None:
+        """
+        Args:
+            flights: 実行中の呼び出しの登録簿（SingleFlightと共有する場合に渡す）
+        """
+        self.flights = flights if flights is not None else InFlight()
+        self._tasks: Dict[str, "asyncio.Task[Any]"] = {}
+        self.calls = 0
+        self.executions = 0
+        self.collapsed = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        """
+        キーに対応する実行中の呼び出しがあればその結果を待ち、なければfnを実行する。
+
+        Args:
+            key: 呼び出しをまとめる単位（投稿のショートコード等）
+            fn: 実行するコルーチン関数
+
+        Returns:
+            fnの戻り値（相乗りした場合は先行する呼び出しの戻り値）
+        """
+        loop = asyncio.get_running_loop()
+        self.calls += 1
+
+        future, leader = self.flights.join(key, loop)
+        if leader:
+            self.executions += 1
+            task = loop.create_task(fn())
+            # タスクへの参照を保持し、実行中にガベージコレクションされないようにする
+            self._tasks[key] = task
+            task.add_done_callback(lambda t, k=key, f=future: self._settle(k, f, t))
+        else:
+            self.collapsed += 1
+
+        # 個々の呼び出し元のキャンセルが共有の呼び出しに伝播しないようにする
+        return await asyncio.shield(asyncio.wrap_future(future))
+
+    def _settle(self, key: str, future: "Future[Any]", task: "asyncio.Task[Any]") -> None:
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        self.flights.finish(key, future)
+        if task.cancelled():
+            future.cancel()
+        elif task.exception() is not None:
+            future.set_exception(task.exception())
+        else:
+            future.set_result(task.result())
+
+    def stats(self) -> Dict[str, int]:
+        """calls / executions / collapsed / in_flight を含む統計情報を返す"""
+        return {
+            "calls": self.calls,
+            "executions": self.executions,
+            "collapsed": self.collapsed,
+            "in_flight": len(self.flights),
+        }
+
+
+# 両Botで共有するモジュールレベルのインスタンス（登録簿を共有し、スレッド側とasyncio側の同じ投稿の取得もまとめる）
+_flights = InFlight()
+singleflight = SingleFlight(_flights)
+async_singleflight = AsyncSingleFlight(_flights)
@@ -0,0 +1,272 @@
+import codecs
+import json
+import re
+from typing import Optional, Dict, Any, List, Iterable, Iterator, Generator
+
+from core.extractor import extract_media_info, find_all_urls, media_info_from_item
+
+# 構造上意味を持つ文字（文字列の開始とコンテナの開閉）
+_STRUCTURE_RE = re.compile(r'["{}\[\]]')
+# 文字列の終端またはエスケープ
+_STRING_END_RE = re.compile(r'["\\]')
+# スカラー値（数値・true/false/null）の終端
+_SCALAR_END_RE = re.compile(r'[,\]}\s]')
+# 空白以外の文字
+_NON_WS_RE = re.compile(r'\S')
+
+# パーサーがデータの追加を要求していることを表す内部的な値
+_NEED_DATA = object()
+
+
+class MediaStreamParser:
+    """
+    RapidAPIのレスポンスボディを少しずつ受け取りながら解析し、
+    最上位の 'medias' 配列の要素を1件ずつメディア情報として取り出すパーサー。
+
+    'medias' 配列の解析中は処理済みの部分を破棄するため、メモリ使用量はおおよそメディア1件分で済む。
+    'medias' 配列がないレスポンスは全体を読み込んだ後に従来の抽出処理（extract_media_info）で処理する。
+
+    使い方:
+        parser = MediaStreamParser()
+        for chunk in chunks:
+            for media in parser.feed(chunk):
+                ...
+        for media in parser.close():
+            ...
+    """
+
+    def __init__(self) -> None:
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+        self._finished = False
+        self.media_count = 0  # これまでに取り出したメディア数
+        self._gen = self._parse()
+        next(self._gen)  # 最初のデータ要求まで進める
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        """
+        ボディの続きを渡し、その時点で完成したメディア情報を返す。
+
+        Args:
+            chunk: デコード済みのボディ断片
+
+        Returns:
+            新たに取り出せたメディア情報のリスト
+        """
+        if self._finished or not chunk:
+            return []
+        return self._resume(chunk)
+
+    def close(self) -> List[Dict[str, Any]]:
+        """
+        ボディの終端を通知し、残りのメディア情報を返す。
+
+        Raises:
+            ValueError: ボディが不正なJSONの場合
+        """
+        if self._finished:
+            return []
+        self._eof = True
+        return self._resume(None)
+
+    @property
+    def finished(self) -> bool:
+        """必要な部分を読み終えた（以降のボディは読まなくてよい）かどうか"""
+        return self._finished
+
+    def _resume(self, chunk: Optional[str]) -> List[Dict[str, Any]]:
+        items: List[Dict[str, Any]] = []
+        try:
+            value = self._gen.send(chunk)
+            while value is not _NEED_DATA:
+                items.append(value)
+                value = next(self._gen)
+        except StopIteration:
+            self._finished = True
+        except json.JSONDecodeError as e:
+            self._finished = True
+            raise ValueError(f"Invalid JSON in response body: {e}") from e
+        self.media_count += len(items)
+        return items
+
+    # --- 以下、データが足りなくなると _NEED_DATA をyieldして続きを待つジェネレーター群 ---
+
+    def _more(self) -> Generator[Any, Optional[str], bool]:
+        """バッファにデータを追加する。終端に達していればFalseを返す"""
+        if self._eof:
+            return False
+        chunk = yield _NEED_DATA
+        if chunk is None:
+            self._eof = True
+            return False
+        self._buf += chunk
+        return True
+
+    def _search(self, pattern: "re.Pattern[str]") -> Generator[Any, Optional[str], Optional["re.Match[str]"]]:
+        """現在位置以降でパターンを探す（見つかるまでデータを要求する）"""
+        while True:
+            match = pattern.search(self._buf, self._pos)
+            if match is not None:
+                return match
+            if not (yield from self._more()):
+                return None
+
+    def _peek(self) -> Generator[Any, Optional[str], str]:
+        """空白を読み飛ばして次の文字を返す（終端では空文字）"""
+        match = yield from self._search(_NON_WS_RE)
+        if match is None:
+            self._pos = len(self._buf)
+            return ""
+        self._pos = match.start()
+        return match.group()
+
+    def _expect(self, char: str) -> Generator[Any, Optional[str], None]:
+        if (yield from self._peek()) != char:
+            raise json.JSONDecodeError(f"Expecting '{char}'", self._buf, self._pos)
+        self._pos += 1
+
+    def _skip_string(self) -> Generator[Any, Optional[str], None]:
+        """開始の '"' の直後から、文字列の終端の直後まで進める"""
+        while True:
+            match = yield from self._search(_STRING_END_RE)
+            if match is None:
+                raise json.JSONDecodeError("Unterminated string", self._buf, self._pos)
+            if match.group() == '"':
+                self._pos = match.end()
+                return
+            # エスケープされた次の1文字を読み飛ばす
+            self._pos = match.end() + 1
+            while self._pos > len(self._buf):
+                if not (yield from self._more()):
+                    raise json.JSONDecodeError("Unterminated string", self._buf, self._pos)
+
+    def _skip_value(self) -> Generator[Any, Optional[str], None]:
+        """現在位置の値（オブジェクト・配列・文字列・スカラー）の直後まで進める"""
+        first = yield from self._peek()
+        if first == "":
+            raise json.JSONDecodeError("Expecting value", self._buf, self._pos)
+        if first == '"':
+            self._pos += 1
+            yield from self._skip_string()
+            return
+        if first not in "{[":
+            match = yield from self._search(_SCALAR_END_RE)
+            self._pos = match.start() if match is not None else len(self._buf)
+            return
+
+        depth = 0
+        while True:
+            match = yield from self._search(_STRUCTURE_RE)
+            if match is None:
+                raise json.JSONDecodeError("Unterminated container", self._buf, self._pos)
+            self._pos = match.end()
+            char = match.group()
+            if char == '"':
+                yield from self._skip_string()
+            elif char in "{[":
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    return
+
+    def _read_all(self) -> Generator[Any, Optional[str], str]:
+        while (yield from self._more()):
+            pass
+        return self._buf
+
+    def _parse(self) -> Generator[Any, Optional[str], None]:
+        """パーサー本体"""
+        if (yield from self._peek()) != "{":
+            # 最上位がオブジェクトでない場合は全体を読み込んで従来の方法で処理する
+            yield from self._from_document((yield from self._read_all()))
+            return
+
+        self._pos += 1
+        while True:
+            char = yield from self._peek()
+            if char == "}":
+                break
+            if char == ",":
+                self._pos += 1
+                continue
+            if char != '"':
+                raise json.JSONDecodeError("Expecting property name", self._buf, self._pos)
+
+            key_start = self._pos
+            self._pos += 1
+            yield from self._skip_string()
+            key = json.loads(self._buf[key_start:self._pos])
+            yield from self._expect(":")
+
+            if key == "medias" and (yield from self._peek()) == "[":
+                self._pos += 1
+                yield from self._parse_medias()
+                return
+            yield from self._skip_value()
+
+        # 'medias' 配列が見つからなかった場合は、読み込んだ全体を従来の方法で処理する
+        yield from self._from_document(self._buf)
+
+    def _parse_medias(self) -> Generator[Any, Optional[str], None]:
+        """'medias' 配列の要素を1件ずつデコードして取り出す"""
+        rejected: List[Any] = []
+        yielded = 0
+        while True:
+            # 処理済みの部分を破棄してメモリ使用量を抑える
+            self._buf = self._buf[self._pos:]
+            self._pos = 0
+
+            char = yield from self._peek()
+            if char == "]":
+                break
+            if char == ",":
+                self._pos += 1
+                continue
+            if char == "":
+                raise json.JSONDecodeError("Unterminated medias array", self._buf, self._pos)
+
+            start = self._pos
+            yield from self._skip_value()
+            item = json.loads(self._buf[start:self._pos])
+            media_info = media_info_from_item(item)
+            if media_info is None:
+                rejected.append(item)
+                continue
+            yielded += 1
+            yield media_info
+
+        # 'medias' に有効な要素がなかった場合は、従来どおり要素内のURLを探す
+        if yielded == 0:
+            for url in find_all_urls({"medias": rejected}):
+                yield {"url": url, "type": "video" if ".mp4" in url else "image", "thumbnail": None}
+
+    def _from_document(self, text: str) -> Generator[Any, Optional[str], None]:
+        data = json.loads(text)
+        for media_info in extract_media_info(data):
+            yield media_info
+
+
+def iter_media_items(chunks: Iterable[bytes], encoding: str = "utf-8") -> Iterator[Dict[str, Any]]:
+    """
+    バイト列のチャンクを順に解析し、メディア情報を1件ずつ返すジェネレーター。
+    'medias' 配列を読み終えた時点で残りのチャンクは読まない。
+
+    Args:
+        chunks: レスポンスボディのチャンク
+        encoding: ボディの文字コード
+
+    Yields:
+        {"url", "type", "thumbnail"} の辞書
+    """
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    parser = MediaStreamParser()
+    for chunk in chunks:
+        yield from parser.feed(decoder.decode(chunk))
+        if parser.finished:
+            return
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield from parser.feed(tail)
+    yield from parser.close()
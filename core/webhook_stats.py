@@ -0,0 +1,86 @@
+import threading
+from collections import deque
+from typing import Optional, Dict, Any, Deque, List
+
+# 統計に使う直近のイベント数・Webhook数
+STATS_WINDOW = 200
+
+
+class WebhookStats:
+    """
+    LINE Webhookの1回あたりのイベント数と、イベント・Webhookごとの処理時間。
+    1つのWebhookに含まれるイベントは並行して処理するため、Webhookの処理時間は
+    最も遅いイベントの処理時間に近くなる（イベント数倍にはならない）。
+    """
+
+    def __init__(self, window: int = STATS_WINDOW):
+        self._lock = threading.Lock()
+        self._event_latencies: Deque[float] = deque(maxlen=window)
+        self._batch_latencies: Deque[float] = deque(maxlen=window)
+        self._batch_sizes: Deque[int] = deque(maxlen=window)
+        self.batches = 0
+        self.events = 0
+        self.failures = 0
+        self.max_batch_size = 0
+
+    def record_event(self, latency: float, ok: bool) -> None:
+        """
+        1件のイベントの処理を記録する。
+
+        Args:
+            latency: 処理にかかった時間（秒）
+            ok: 例外なく処理できたか
+        """
+        with self._lock:
+            self.events += 1
+            self._event_latencies.append(latency)
+            if not ok:
+                self.failures += 1
+
+    def record_batch(self, size: int, latency: float) -> None:
+        """
+        1回のWebhookの処理を記録する。
+
+        Args:
+            size: Webhookに含まれていたイベント数
+            latency: 全イベントの処理にかかった時間（秒）
+        """
+        with self._lock:
+            self.batches += 1
+            self._batch_sizes.append(size)
+            self._batch_latencies.append(latency)
+            self.max_batch_size = max(self.max_batch_size, size)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        統計情報を返す。
+
+        Returns:
+            batches / events / failures / max_batch_size / mean_batch_size（直近）と、
+            イベント・Webhookごとの処理時間の p50 / p95（ミリ秒）を含む辞書
+        """
+        with self._lock:
+            sizes = list(self._batch_sizes)
+            events = sorted(self._event_latencies)
+            batches = sorted(self._batch_latencies)
+            return {
+                "batches": self.batches,
+                "events": self.events,
+                "failures": self.failures,
+                "max_batch_size": self.max_batch_size,
+                "mean_batch_size": round(sum(sizes) / len(sizes), 2) if sizes else 0.0,
+                "event_p50_ms": _percentile_ms(events, 0.5),
+                "event_p95_ms": _percentile_ms(events, 0.95),
+                "batch_p50_ms": _percentile_ms(batches, 0.5),
+                "batch_p95_ms": _percentile_ms(batches, 0.95),
+            }
+
+
+def _percentile_ms(ordered: List[float], q: float) -> Optional[float]:
+    if not ordered:
+        return None
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 1)
+
+
+# LINE Bot（Flask版・単一プロセス版）で共有するWebhookの統計
+webhook_stats = WebhookStats()
@@ -0,0 +1,248 @@
+# LINE BotとDiscord Botを1つのプロセス・1つのイベントループで動かすエントリーポイント。
+#
+# start.sh の従来構成（Gunicorn(LINE) と run_discord.py を別プロセスで起動）と比べて、
+# - インタプリタとライブラリの読み込みが1回で済むためメモリ使用量が少ない
+# - 結果キャッシュ・HTTPコネクションプール・single-flightを両Botで共有できる
+# - Discord Botが停止した場合はプロセスごと終了するため、Renderによって再起動される
+import asyncio
+import json
+import logging
+import os
+import signal
+import time
+
+from aiohttp import web
+from linebot.exceptions import InvalidSignatureError
+from linebot.models import MessageEvent, TextMessage
+
+from core.config import (
+    DISCORD_BOT_TOKEN, JOB_QUEUE_ENABLED, JOB_QUEUE_WORKERS, JOB_QUEUE_POLL_INTERVAL, LINE_EVENT_CONCURRENCY
+)
+from core.cache import result_cache
+from core.http_client import async_http_client
+from core.job_queue import job_queue, AsyncJobWorker
+from core.circuit_breaker import circuit_breaker
+from core.providers import provider_pool
+from core.negative_cache import negative_cache
+from core.scheduler import fair_scheduler
+from core.singleflight import async_singleflight
+from core.webhook_stats import WebhookStats, webhook_stats
+from core.idempotency import idempotency_store
+from core.media_proxy import media_proxy, MediaFetchError, MediaTooLarge, CACHE_MAX_AGE
+from core.previews import preview_service
+import run_discord
+import run_line
+
+# ログ設定
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+# Webhook内のイベントを並行して処理する数の上限（全Webhookで共有する）
+_event_slots = asyncio.Semaphore(LINE_EVENT_CONCURRENCY)
+
+
+async def dispatch_event(event) -> None:
+    """Webhookイベントを対応するハンドラーに渡す（テキストメッセージ以外は無視する）"""
+    if isinstance(event, MessageEvent) and isinstance(event.message, TextMessage):
+        await run_line.handle_message_async(event)
+
+
+async def dispatch_events(events):
+    """
+    1つのWebhookに含まれるイベントを並行して処理する（run_line.handle_eventsのasyncio版）。
+    失敗はイベントごとにログと統計に記録し、例外は送出しない。
+
+    Returns:
+        処理に失敗したイベントのリスト
+    """
+    started = time.monotonic()
+    targets = [event for event in events if run_line.is_text_message(event)]
+    succeeded = await asyncio.gather(*(_dispatch_timed(event) for event in targets))
+    webhook_stats.record_batch(len(events), time.monotonic() - started)
+    return [event for event, ok in zip(targets, succeeded) if not ok]
+
+
+async def _dispatch_timed(event):
+    """イベントを1件処理し、処理時間を記録する。例外は送出せずに成功したかを返す"""
+    async with _event_slots:
+        started = time.monotonic()
+        try:
+            await dispatch_event(event)
+        except Exception as e:
+            logger.error(f"Error handling LINE event: {e}")
+            webhook_stats.record_event(time.monotonic() - started, False)
+            return False
+        webhook_stats.record_event(time.monotonic() - started, True)
+        return True
+
+
+async def process_webhook_job(payload: str) -> None:
+    """
+    キューに積まれたWebhookを処理する（AsyncJobWorkerから呼ばれる）。
+    返信する前に失敗したイベントがある場合は、そのイベントだけをリトライする。
+    """
+    job = json.loads(payload)
+    events = run_line.handler.parser.parse(job["body"], job["signature"])
+    failed = await dispatch_events(run_line.drop_redelivered(events, job.get("skip", ())))
+    run_line.retry_failed_events(job, failed)
+
+
+line_worker = AsyncJobWorker(
+    job_queue, process_webhook_job, concurrency=JOB_QUEUE_WORKERS, poll_interval=JOB_QUEUE_POLL_INTERVAL
+)
+# キューを使わない設定の場合に実行中のWebhook処理（タスクがGCされないよう参照を保持する）
+_inline_tasks = set()
+
+
+async def health_check(request: web.Request) -> web.Response:
+    """Render等がサービスをKillしないためのヘルスチェック用エンドポイント"""
+    return web.Response(text="Bot is alive")
+
+
+async def metrics(request: web.Request) -> web.Response:
+    """ジョブキュー・結果キャッシュ・single-flight・レートリミッター・スケジューラーの統計情報を返す"""
+    return web.json_response({
+        "job_queue": await asyncio.to_thread(job_queue.stats),
+        "result_cache": await asyncio.to_thread(result_cache.stats),
+        "singleflight": async_singleflight.stats(),
+        "rate_limiter": provider_pool.rate_limit_stats(),
+        "circuit_breaker": circuit_breaker.stats(),
+        "providers": provider_pool.stats(),
+        "negative_cache": negative_cache.stats(),
+        "scheduler": fair_scheduler.stats(),
+        "line_delivery": run_line.delivery_stats.snapshot(),
+        "push_queue": run_line.push_queue.snapshot(),
+        "webhook": webhook_stats.snapshot(),
+        "idempotency": await asyncio.to_thread(idempotency_store.stats),
+        "media_proxy": await asyncio.to_thread(media_proxy.stats),
+        "previews": preview_service.stats(),
+    })
+
+
+async def media(request: web.Request) -> web.StreamResponse:
+    """
+    メディアプロキシ（run_line.mediaのaiohttp版）。
+    ダウンロードはスレッドで行い、キャッシュ済みのファイルは FileResponse（sendfile・Range対応）で配信する。
+    """
+    url = media_proxy.resolve(request.match_info["token"])
+    if url is None:
+        raise web.HTTPNotFound()
+    try:
+        cached = await asyncio.to_thread(media_proxy.cache.fetch, url)
+    except MediaTooLarge:
+        raise web.HTTPFound(url)
+    except MediaFetchError as e:
+        logger.warning(f"Media proxy fetch failed: {e}")
+        if e.status_code in (403, 404, 410):
+            raise web.HTTPNotFound()
+        raise web.HTTPBadGateway()
+    return web.FileResponse(cached.path, headers={
+        "Content-Type": cached.content_type,
+        "Cache-Control": f"public, max-age={CACHE_MAX_AGE}",
+    })
+
+
+async def preview(request: web.Request) -> web.StreamResponse:
+    """LINEのプレビュー画像を配信する（run_line.previewのaiohttp版）"""
+    cached = await asyncio.to_thread(preview_service.render, request.match_info["token"])
+    if cached is None:
+        raise web.HTTPNotFound()
+    return web.FileResponse(cached.path, headers={
+        "Content-Type": cached.content_type,
+        "Cache-Control": f"public, max-age={CACHE_MAX_AGE}",
+    })
+
+
+async def callback(request: web.Request) -> web.Response:
+    """
+    LINE PlatformからのWebhookを受け取るエンドポイント。
+    署名を検証してキューに積み、すぐに200を返す。
+    """
+    signature = request.headers.get('X-Line-Signature', '')
+    body = await request.text()
+
+    if not JOB_QUEUE_ENABLED:
+        try:
+            events = run_line.handler.parser.parse(body, signature)
+        except InvalidSignatureError:
+            logger.warning("Invalid signature. Please check your channel access token/channel secret.")
+            raise web.HTTPBadRequest()
+        task = asyncio.create_task(dispatch_events(run_line.drop_redelivered(events)))
+        _inline_tasks.add(task)
+        task.add_done_callback(_inline_tasks.discard)
+        return web.Response(text="OK")
+
+    if not run_line.handler.parser.signature_validator.validate(body, signature):
+        logger.warning("Invalid signature. Please check your channel access token/channel secret.")
+        raise web.HTTPBadRequest()
+
+    # LINEが再送したイベントは、キューに積む前に取り除く（全て再送ならジョブを作らない）
+    duplicates, count = await asyncio.to_thread(run_line.find_redelivered, body)
+    if duplicates and len(duplicates) == count:
+        logger.info(f"Dropped redelivered LINE webhook ({count} events)")
+        return web.Response(text="OK")
+
+    job = {"body": body, "signature": signature}
+    if duplicates:
+        job["skip"] = duplicates
+    try:
+        await asyncio.to_thread(job_queue.enqueue, json.dumps(job))
+    except Exception:
+        # 500を返してLINEに再送させるため、記録したキーを取り消す
+        await asyncio.to_thread(run_line.forget_delivered, body, duplicates)
+        raise
+    line_worker.notify()
+    return web.Response(text="OK")
+
+
+def create_web_app() -> web.Application:
+    """LINE Webhook・ヘルスチェック・メトリクス・メディアプロキシ用のaiohttpアプリケーションを作成する"""
+    app = web.Application()
+    app.router.add_get("/", health_check)
+    app.router.add_get("/metrics", metrics)
+    app.router.add_post("/callback", callback)
+    app.router.add_get("/media/{token}", media)
+    app.router.add_get("/preview/{token}", preview)
+    return app
+
+
+async def main(port: int) -> None:
+    """HTTPサーバーとDiscord Botを起動し、どちらかが終了するまで待つ"""
+    runner = web.AppRunner(create_web_app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "0.0.0.0", port).start()
+    logger.info(f"LINE webhook server listening on port {port}")
+
+    if JOB_QUEUE_ENABLED:
+        line_worker.start()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    waiters = [asyncio.create_task(stop.wait())]
+    if DISCORD_BOT_TOKEN:
+        waiters.append(asyncio.create_task(run_discord.client.start(DISCORD_BOT_TOKEN)))
+    else:
+        logger.error("DISCORD_BOT_TOKEN is not set in environment variables. Running LINE bot only.")
+
+    try:
+        done, _ = await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            # Discord Botが異常終了した場合は例外を送出してプロセスを終了させる
+            task.result()
+    finally:
+        logger.info("Shutting down")
+        for task in waiters:
+            task.cancel()
+        await line_worker.stop()
+        if not run_discord.client.is_closed():
+            await run_discord.client.close()
+        await runner.cleanup()
+        await async_http_client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(os.environ.get("PORT", 10000))))
@@ -3,13 +3,22 @@ import asyncio
 import logging
 from typing import Optional, List
 
-from core.config import DISCORD_BOT_TOKEN
-from core.logic import process_instagram_url
+from core.config import DISCORD_BOT_TOKEN, DISCORD_BATCH_EMBEDS
+from core.logic import process_instagram_urls_async, combine_results
+from core.parser import contains_instagram_url
+from core.scheduler import Requester
+from core.media_proxy import media_proxy
 
 # ログ設定
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 1件の返信で表示するメディアの最大数
+MAX_MEDIA = 10
+# Discordの1メッセージあたりのEmbed数・本文の文字数の上限
+MAX_EMBEDS_PER_MESSAGE = 10
+MAX_CONTENT_LENGTH = 2000
+
 # Discordクライアントの設定
 intents = discord.Intents.default()
 intents.message_content = True  # メッセージ内容の読み取り権限
@@ -20,20 +29,30 @@ async def on_ready():
     """Bot起動時のイベント"""
     logger.info(f'Logged in as {client.user} (ID: {client.user.id})')
 
+def requester_for(message: discord.Message) -> Requester:
+    """
+    メッセージの依頼元を返す（RapidAPIの問い合わせをサーバー内のユーザーごとに公平に割り当てるため）。
+    """
+    if message.guild is not None:
+        return Requester("discord_guild", f"{message.guild.id}:{message.author.id}")
+    return Requester("discord_dm", str(message.author.id))
+
 async def send_media_embeds(message: discord.Message, result: dict):
     """
     複数のメディアをEmbed形式で送信する。
     
     Args:
         message: 元のDiscordメッセージオブジェクト
-        result: process_instagram_urlの戻り値
+        result: process_instagram_url_asyncの戻り値、またはcombine_resultsでまとめた結果
     """
     if "media_list" in result and len(result["media_list"]) > 0:
         media_list = result["media_list"]
         media_count = len(media_list)
         
         # 複数メディアの場合
-        if media_count > 1:
+        if media_count > 1 and DISCORD_BATCH_EMBEDS:
+            await send_media_batched(message, media_list)
+        elif media_count > 1:
             # まず全体の情報を送信
             info_embed = discord.Embed(
                 title="📸 Instagram メディア",
@@ -43,7 +62,7 @@ async def send_media_embeds(message: discord.Message, result: dict):
             await message.reply(embed=info_embed)
             
             # 各メディアを個別に送信（Discord Embedの制限を考慮）
-            for i, media in enumerate(media_list[:10], 1):  # 最大10個まで
+            for i, media in enumerate(media_list[:MAX_MEDIA], 1):  # 最大10個まで
                 if media["type"] == "video":
                     # 動画の場合はURLを直接送信（Discordが自動でプレイヤーを展開）
                     await message.channel.send(
@@ -63,9 +82,9 @@ async def send_media_embeds(message: discord.Message, result: dict):
                     await asyncio.sleep(0.5)
             
             # 10個を超える場合の通知
-            if media_count > 10:
+            if media_count > MAX_MEDIA:
                 await message.channel.send(
-                    f"⚠️ 残り{media_count - 10}個のメディアがありますが、表示を省略しました。"
+                    f"⚠️ 残り{media_count - MAX_MEDIA}個のメディアがありますが、表示を省略しました。"
                 )
         else:
             # 単一メディアの場合
@@ -86,6 +105,55 @@ async def send_media_embeds(message: discord.Message, result: dict):
         media_url = result["media_url"]
         await message.reply(content=media_url)
 
+async def send_media_batched(message: discord.Message, media_list: List[dict]):
+    """
+    複数のメディアをまとめて送信する。
+    画像は1メッセージに最大10件のEmbedとして、動画のURLは1つの本文にまとめて送るため、
+    カルーセル全体が1〜2回のリクエストで届く。
+    待機は入れず、レート制限はdiscord.pyが管理するバケットに任せる。
+    
+    Args:
+        message: 元のDiscordメッセージオブジェクト
+        media_list: メディア情報のリスト（2件以上）
+    """
+    media_count = len(media_list)
+    images: List[discord.Embed] = []
+    lines = [f"📸 {media_count}件のメディアが見つかりました"]
+    for i, media in enumerate(media_list[:MAX_MEDIA], 1):
+        if media["type"] == "video":
+            # 動画はURLを本文に入れる（Discordが自動でプレイヤーを展開）
+            lines.append(f"**動画 {i}/{media_count}**\n{media['url']}")
+        else:
+            embed = discord.Embed(title=f"画像 {i}/{media_count}", color=discord.Color.green())
+            embed.set_image(url=media["url"])
+            images.append(embed)
+    if media_count > MAX_MEDIA:
+        lines.append(f"⚠️ 残り{media_count - MAX_MEDIA}個のメディアがありますが、表示を省略しました。")
+
+    # 見出しは最初の画像のメッセージに載せ、残りの本文（動画・省略の通知）は別のメッセージにまとめる
+    batches = []
+    for start in range(0, len(images), MAX_EMBEDS_PER_MESSAGE):
+        batches.append({"embeds": images[start:start + MAX_EMBEDS_PER_MESSAGE]})
+    if batches:
+        batches[0]["content"] = lines.pop(0)
+    batches.extend({"content": content} for content in _pack_lines(lines))
+
+    for i, batch in enumerate(batches):
+        if i == 0:
+            await message.reply(**batch)
+        else:
+            await message.channel.send(**batch)
+
+def _pack_lines(lines: List[str]) -> List[str]:
+    """行をDiscordの本文の文字数上限に収まるようにまとめる"""
+    contents: List[str] = []
+    for line in lines:
+        if contents and len(contents[-1]) + 1 + len(line) <= MAX_CONTENT_LENGTH:
+            contents[-1] += "\n" + line
+        else:
+            contents.append(line[:MAX_CONTENT_LENGTH])
+    return contents
+
 @client.event
 async def on_message(message: discord.Message):
     """
@@ -100,22 +168,29 @@ async def on_message(message: discord.Message):
     # メッセージ本文を取得
     content = message.content
     
-    # InstagramのURLが含まれているか簡易チェック (最適化のため)
-    if "instagram.com/p/" not in content and "instagram.com/reel/" not in content:
+    # InstagramのURLが含まれているかチェック (最適化のため)
+    if not contains_instagram_url(content):
         return
 
     # タイピング表示を開始（処理中であることを示す）
     async with message.channel.typing():
         try:
-            # 同期処理である process_instagram_url を非同期スレッドで実行
-            # これにより、API待ち時間中も他のイベント（他ユーザーへの応答など）をブロックしない
-            result = await asyncio.to_thread(process_instagram_url, content)
+            # asyncio版のAPIを直接awaitする（メッセージ内の複数リンクは並行して取得）
+            # スレッドを消費せず、API待ち時間中も他のイベント（他ユーザーへの応答など）をブロックしない
+            results = await process_instagram_urls_async(content, requester_for(message))
+            result = combine_results(results)
             
             if result:
                 logger.info(f"Found {result.get('media_count', 1)} media items for message: {message.id}")
                 
-                # メディアの送信
-                await send_media_embeds(message, result)
+                # メディアの送信（メディアプロキシが有効な場合はURLを置き換える）
+                await send_media_embeds(message, media_proxy.rewrite_result(result))
+                
+                # 一部の投稿だけ取得に失敗した場合の通知
+                if result.get("failed_count"):
+                    await message.channel.send(
+                        f"⚠️ {result['failed_count']}件の投稿はメディアを取得できませんでした。"
+                    )
             else:
                 # メディアが取得できなかった場合
                 error_embed = discord.Embed(
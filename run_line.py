@@ -1,5 +1,9 @@
+import asyncio
+import json
 import logging
-from flask import Flask, request, abort
+import time
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, request, abort, jsonify, redirect, send_file
 from linebot import LineBotApi, WebhookHandler
 from linebot.exceptions import InvalidSignatureError
 from linebot.models import (
@@ -7,8 +11,23 @@ from linebot.models import (
     TemplateSendMessage, ImageCarouselTemplate, ImageCarouselColumn, URIAction
 )
 
-from core.config import LINE_CHANNEL_ACCESS_TOKEN, LINE_CHANNEL_SECRET
-from core.logic import process_instagram_url
+from core.config import (
+    LINE_CHANNEL_ACCESS_TOKEN, LINE_CHANNEL_SECRET,
+    JOB_QUEUE_ENABLED, JOB_QUEUE_WORKERS, JOB_QUEUE_POLL_INTERVAL,
+    LINE_PUSH_ENABLED, LINE_PUSH_PER_SECOND, LINE_PUSH_MAX_RETRIES, LINE_EVENT_CONCURRENCY
+)
+from core.logic import process_instagram_urls, process_instagram_urls_async, combine_results
+from core.job_queue import job_queue, JobWorkerPool, RetryJob
+from core.rate_limiter import RateLimiter
+from core.push_queue import DeliveryStats, PushQueue, MAX_MESSAGES_PER_CALL
+from core.circuit_breaker import circuit_breaker
+from core.providers import provider_pool
+from core.negative_cache import negative_cache
+from core.scheduler import Requester, fair_scheduler
+from core.webhook_stats import webhook_stats
+from core.idempotency import idempotency_store
+from core.media_proxy import media_proxy, MediaFetchError, MediaTooLarge, CACHE_MAX_AGE
+from core.previews import preview_service
 
 # ログ設定
 logging.basicConfig(level=logging.INFO)
@@ -25,37 +44,293 @@ if not LINE_CHANNEL_ACCESS_TOKEN or not LINE_CHANNEL_SECRET:
 line_bot_api = LineBotApi(LINE_CHANNEL_ACCESS_TOKEN if LINE_CHANNEL_ACCESS_TOKEN else "DUMMY")
 handler = WebhookHandler(LINE_CHANNEL_SECRET if LINE_CHANNEL_SECRET else "DUMMY")
 
+# 画像カルーセル1つに入れられる画像の最大数
+CAROUSEL_MAX_COLUMNS = 10
+# 画像カルーセルで画像をタップした時に開くURL（URIAction.uri）の最大長
+URI_ACTION_MAX_LENGTH = 1000
+
+# reply / push の呼び出しごとのレイテンシと送信数（pushはクォータの消費量）
+delivery_stats = DeliveryStats()
+
+def push_messages(to, messages, retry_key):
+    line_bot_api.push_message(to, messages, retry_key=retry_key)
+
+# 返信に入りきらなかったメッセージを送るキュー
+push_queue = PushQueue(
+    push_messages,
+    limiter=RateLimiter(per_second=LINE_PUSH_PER_SECOND, burst=LINE_PUSH_PER_SECOND),
+    max_retries=LINE_PUSH_MAX_RETRIES,
+    enabled=LINE_PUSH_ENABLED,
+    stats=delivery_stats,
+)
+
+# Webhook内の複数のイベントを並行して処理するスレッドプール（全Webhookで共有し、同時実行数を制限する）
+_event_executor = ThreadPoolExecutor(max_workers=LINE_EVENT_CONCURRENCY, thread_name_prefix="line-event")
+
+def process_webhook_job(payload: str) -> None:
+    """
+    キューに積まれたWebhookを処理する（ワーカースレッドで実行される）。
+    返信する前に失敗したイベントがある場合は、そのイベントだけをリトライする。
+    """
+    job = json.loads(payload)
+    retry_failed_events(job, handle_webhook(job["body"], job["signature"], job.get("skip", ())))
+
+def handle_webhook(body: str, signature: str, skip=None):
+    """
+    Webhookの署名を検証し、含まれるイベントを処理する。
+    
+    Args:
+        body: Webhookの本文
+        signature: X-Line-Signatureヘッダーの値
+        skip: 受信時に再送と判定済みのイベントのキー。Noneの場合はここで再送かを判定する
+    
+    Returns:
+        返信する前に処理に失敗したイベントのリスト
+    
+    Raises:
+        InvalidSignatureError: 署名が正しくない場合
+    """
+    events = handler.parser.parse(body, signature)
+    return handle_events(drop_redelivered(events, skip))
+
+def retry_failed_events(job, failed) -> None:
+    """
+    失敗したイベントだけを再実行するよう、それ以外のイベントをskipに加えたpayloadでジョブをリトライさせる。
+    成功したイベントを再実行すると二重に返信してしまうため、ジョブ全体はリトライしない。
+    
+    Args:
+        job: キューに積まれたジョブ（body / signature / skip）
+        failed: 返信する前に処理に失敗したイベントのリスト（空の場合は何もしない）
+    
+    Raises:
+        RetryJob: 失敗したイベントがある場合
+    """
+    if not failed:
+        return
+    retry = {event_key(event) for event in failed}
+    events = json.loads(job["body"]).get("events") or []
+    keys = [event_key(event) for event in events if isinstance(event, dict)]
+    job = dict(job, skip=[key for key in keys if key not in retry])
+    raise RetryJob(json.dumps(job), f"{len(failed)} of {len(keys)} LINE events failed before replying")
+
+def event_key(event) -> str:
+    """イベントを識別するキー（webhookEventId、古い形式ではメッセージID）を返す。本文のJSON・イベントオブジェクトの両方に対応"""
+    if isinstance(event, dict):
+        message = event.get("message")
+        return event.get("webhookEventId") or (message.get("id") if isinstance(message, dict) else None) or ""
+    message = getattr(event, "message", None)
+    return getattr(event, "webhook_event_id", None) or getattr(message, "id", None) or ""
+
+def find_redelivered(body: str):
+    """
+    Webhookの本文から処理済み（再送された）イベントを探し、新しいイベントは処理済みとして記録する。
+    署名を検証した後に呼ぶこと。
+    
+    Returns:
+        (再送されたイベントのキーのリスト, イベント数) のタプル
+    """
+    try:
+        events = json.loads(body).get("events") or []
+    except (ValueError, AttributeError):
+        return [], 0
+    keys = [event_key(event) for event in events if isinstance(event, dict)]
+    return [key for key in keys if key and idempotency_store.is_duplicate(key)], len(events)
+
+def forget_delivered(body: str, duplicates) -> None:
+    """
+    find_redelivered が処理済みとして記録したキーを取り消す。
+    ジョブキューへの登録に失敗した場合に呼び、LINEの再送を重複として捨てないようにする。
+    
+    Args:
+        body: find_redelivered に渡したWebhookの本文
+        duplicates: find_redelivered が返した再送されたイベントのキー（これらは取り消さない）
+    """
+    try:
+        events = json.loads(body).get("events") or []
+    except (ValueError, AttributeError):
+        return
+    duplicates = set(duplicates)
+    for event in events:
+        if isinstance(event, dict):
+            key = event_key(event)
+            if key and key not in duplicates:
+                idempotency_store.forget(key)
+
+def drop_redelivered(events, skip=None):
+    """
+    再送されたイベントを取り除く。
+    
+    Args:
+        events: パース済みのイベントのリスト
+        skip: 再送と判定済みのイベントのキー。Noneの場合は idempotency_store で判定する
+    """
+    if skip is None:
+        kept = [event for event in events if not idempotency_store.is_duplicate(event_key(event))]
+    else:
+        skip = set(skip)
+        kept = [event for event in events if event_key(event) not in skip]
+    if len(kept) < len(events):
+        logger.info(f"Dropped {len(events) - len(kept)} redelivered LINE events")
+    return kept
+
+def is_text_message(event) -> bool:
+    return isinstance(event, MessageEvent) and isinstance(event.message, TextMessage)
+
+def handle_events(events):
+    """
+    1つのWebhookに含まれるイベントを並行して処理する（テキストメッセージ以外は無視する）。
+    LINEは複数のイベントを1つのWebhookにまとめて送るため、順に処理すると最後のイベントが
+    それまでの全イベントのRapidAPI呼び出しを待つことになる。
+    失敗はイベントごとにログと統計に記録し、例外は送出しない（返信を試みた後は reply_with_result が例外を送出しないため、
+    失敗したイベントは返信する前に失敗したもの）。
+    
+    Returns:
+        処理に失敗したイベントのリスト
+    """
+    started = time.monotonic()
+    targets = [event for event in events if is_text_message(event)]
+    if len(targets) == 1:
+        succeeded = [_handle_event(targets[0])]
+    else:
+        succeeded = list(_event_executor.map(_handle_event, targets))
+    webhook_stats.record_batch(len(events), time.monotonic() - started)
+    return [event for event, ok in zip(targets, succeeded) if not ok]
+
+def _handle_event(event):
+    """イベントを1件処理し、処理時間を記録する。例外は送出せずに成功したかを返す"""
+    started = time.monotonic()
+    try:
+        handle_message(event)
+    except Exception as e:
+        logger.error(f"Error handling LINE event: {e}")
+        webhook_stats.record_event(time.monotonic() - started, False)
+        return False
+    webhook_stats.record_event(time.monotonic() - started, True)
+    return True
+
+job_workers = JobWorkerPool(
+    job_queue, process_webhook_job, workers=JOB_QUEUE_WORKERS, poll_interval=JOB_QUEUE_POLL_INTERVAL
+)
+
+def ensure_job_workers():
+    """ワーカースレッドが起動していなければ起動する（Gunicornのワーカープロセスごとに1回）"""
+    if JOB_QUEUE_ENABLED and not job_workers.running:
+        job_workers.start()
+
 @app.route("/")
 def health_check():
     """Render等がサービスをKillしないためのヘルスチェック用エンドポイント"""
+    # 再起動前に積まれていたジョブも処理されるよう、ここでもワーカーを起動しておく
+    ensure_job_workers()
     return "Bot is alive", 200
 
+@app.route("/metrics")
+def metrics():
+    """ジョブキューの滞留数・最古ジョブの経過時間、RapidAPIの残りクォータなどを返す"""
+    return jsonify({
+        "job_queue": job_queue.stats(),
+        "rate_limiter": provider_pool.rate_limit_stats(),
+        "circuit_breaker": circuit_breaker.stats(),
+        "providers": provider_pool.stats(),
+        "negative_cache": negative_cache.stats(),
+        "scheduler": fair_scheduler.stats(),
+        "line_delivery": delivery_stats.snapshot(),
+        "push_queue": push_queue.snapshot(),
+        "webhook": webhook_stats.snapshot(),
+        "idempotency": idempotency_store.stats(),
+        "media_proxy": media_proxy.stats(),
+        "previews": preview_service.stats(),
+    })
+
+@app.route("/media/<token>")
+def media(token):
+    """
+    メディアプロキシ。署名付きのトークンが指す元のメディアをディスクキャッシュから配信する。
+    Rangeリクエスト（動画のシーク）に対応し、Gunicornでは sendfile でファイルを送る。
+    """
+    url = media_proxy.resolve(token)
+    if url is None:
+        abort(404)
+    try:
+        cached = media_proxy.cache.fetch(url)
+    except MediaTooLarge:
+        # キャッシュに入れない大きさのメディアは元のURLから取得させる
+        return redirect(url)
+    except MediaFetchError as e:
+        logger.warning(f"Media proxy fetch failed: {e}")
+        abort(404 if e.status_code in (403, 404, 410) else 502)
+    return send_file(
+        cached.path, mimetype=cached.content_type, conditional=True, etag=cached.digest, max_age=CACHE_MAX_AGE
+    )
+
+@app.route("/preview/<token>")
+def preview(token):
+    """LINEのプレビュー画像（縮小した画像、生成できない場合は代替画像）を配信する"""
+    cached = preview_service.render(token)
+    if cached is None:
+        abort(404)
+    return send_file(
+        cached.path, mimetype=cached.content_type, conditional=True, etag=cached.digest, max_age=CACHE_MAX_AGE
+    )
+
 @app.route("/callback", methods=['POST'])
 def callback():
-    """LINE PlatformからのWebhookを受け取るエンドポイント"""
+    """
+    LINE PlatformからのWebhookを受け取るエンドポイント。
+    署名を検証してキューに積み、すぐに200を返す（RapidAPIの呼び出しと返信はワーカーが行う）。
+    """
     # X-Line-Signatureヘッダーの検証
-    signature = request.headers.get('X-Line-Signature')
+    signature = request.headers.get('X-Line-Signature', '')
     body = request.get_data(as_text=True)
 
-    app.logger.info("Request body: " + body)
+    app.logger.debug("Request body: " + body)
 
-    try:
-        handler.handle(body, signature)
-    except InvalidSignatureError:
+    if not JOB_QUEUE_ENABLED:
+        try:
+            handle_webhook(body, signature)
+        except InvalidSignatureError:
+            logger.warning("Invalid signature. Please check your channel access token/channel secret.")
+            abort(400)
+        return 'OK'
+
+    if not handler.parser.signature_validator.validate(body, signature):
         logger.warning("Invalid signature. Please check your channel access token/channel secret.")
         abort(400)
 
+    # LINEが再送したイベントは、キューに積む前に取り除く（全て再送ならジョブを作らない）
+    duplicates, count = find_redelivered(body)
+    if duplicates and len(duplicates) == count:
+        logger.info(f"Dropped redelivered LINE webhook ({count} events)")
+        return 'OK'
+
+    ensure_job_workers()
+    job = {"body": body, "signature": signature}
+    if duplicates:
+        job["skip"] = duplicates
+    try:
+        job_queue.enqueue(json.dumps(job))
+    except Exception:
+        # 500を返してLINEに再送させるため、記録したキーを取り消す
+        forget_delivered(body, duplicates)
+        raise
+    job_workers.notify()
+
     return 'OK'
 
 def create_media_messages(result):
     """
     取得したメディア情報からLINE用のメッセージオブジェクトを作成する。
+    投稿内の順番を保ったまま、連続する画像を最大10枚ずつ画像カルーセル（ImageCarouselTemplate）1つにまとめ、
+    動画は1件ずつのメッセージにする。
+    1回の返信で送れるのは5件までのため、6件目以降は reply_with_result がpushメッセージで送る。
+    メディアプロキシ・プレビュー画像が有効な場合は、URLを自前のエンドポイントのURLにする
+    （プレビュー画像は元のURLから生成するため、resultには置き換える前のURLを渡す）。
     
     Args:
-        result: process_instagram_urlの戻り値
+        result: process_instagram_urlの戻り値、またはcombine_resultsでまとめた結果
         
     Returns:
-        list: 送信するメッセージオブジェクトのリスト
+        list: 送信するメッセージオブジェクトのリスト（送る順）
     """
     messages = []
     
@@ -69,76 +344,129 @@ def create_media_messages(result):
                 TextSendMessage(text=f"📸 {len(media_list)}件のメディアが見つかりました！")
             )
             
-            # LINEの制限: 一度に送れるメッセージは最大5個まで
-            # 画像と動画を分けて処理
-            images = [m for m in media_list if m["type"] == "image"]
-            videos = [m for m in media_list if m["type"] == "video"]
-            
-            # 画像をまとめて送信（最大4枚、残り1枠はテキスト用）
-            for i in range(0, len(images), 4):
-                batch = images[i:i+4]
-                for img in batch:
-                    messages.append(
-                        ImageSendMessage(
-                            original_content_url=img["url"],
-                            preview_image_url=img["url"]
-                        )
-                    )
-                # 5個制限に達したら一旦送信するため、ここでbreak
-                if len(messages) >= 5:
-                    break
-            
-            # 動画は個別に処理（5個制限があるため、画像の後に送れない可能性がある）
-            # 実際の運用では、別のreplyとして送るか、ユーザーに「動画もあります」と通知
-            if videos and len(messages) < 5:
-                for video in videos[:5-len(messages)]:
-                    preview = video["thumbnail"] or "https://via.placeholder.com/1024x1024.png?text=Video"
-                    messages.append(
-                        VideoSendMessage(
-                            original_content_url=video["url"],
-                            preview_image_url=preview
-                        )
-                    )
+            # 連続する画像をまとめ、動画が来たらそこまでの画像を送ってから動画を送る
+            # （動画と、タップ時に開くURLが長すぎてカルーセルに入れられない画像は1件ずつ送る）
+            images = []  # (投稿内の位置, メディア情報)
+            for position, media in enumerate(media_list, 1):
+                if media["type"] == "image" and carousel_uri(media) is not None:
+                    images.append((position, media))
+                    continue
+                messages.extend(create_image_messages(images, total=len(media_list)))
+                images = []
+                if media["type"] == "video":
+                    messages.append(create_video_message(media))
+                else:
+                    messages.append(create_image_message(media))
+            messages.extend(create_image_messages(images, total=len(media_list)))
         else:
             # 単一メディアの場合（従来の処理）
             media = media_list[0]
             if media["type"] == "video":
-                preview = media["thumbnail"] or "https://via.placeholder.com/1024x1024.png?text=Video"
-                messages.append(
-                    VideoSendMessage(
-                        original_content_url=media["url"],
-                        preview_image_url=preview
-                    )
-                )
+                messages.append(create_video_message(media))
             else:
-                messages.append(
-                    ImageSendMessage(
-                        original_content_url=media["url"],
-                        preview_image_url=media["url"]
-                    )
-                )
+                messages.append(create_image_message(media))
     else:
         # 後方互換性: 古い形式の場合
         media_url = result["media_url"]
         preview_url = result.get("preview_url", media_url)
         
         if result.get("media_type") == "video" or result.get("type") == "video":
-            messages.append(
-                VideoSendMessage(
-                    original_content_url=media_url,
-                    preview_image_url=preview_url
-                )
-            )
+            messages.append(create_video_message({"url": media_url, "thumbnail": preview_url}))
         else:
             messages.append(
                 ImageSendMessage(
-                    original_content_url=media_url,
-                    preview_image_url=media_url
+                    original_content_url=media_proxy.proxy_url(media_url),
+                    preview_image_url=preview_image_url(media_url)
                 )
             )
     
-    # LINEの制限により最大5個まで
-    return messages[:5]
+    return messages
+
+def create_image_messages(images, total):
+    """
+    連続する画像を10枚ずつ1つの画像カルーセルにまとめる（1枚だけ残った場合は通常の画像メッセージ）。
+    
+    Args:
+        images: (投稿内の位置, メディア情報) のリスト（位置は連続している）
+        total: 投稿のメディアの総数
+    """
+    messages = []
+    for i in range(0, len(images), CAROUSEL_MAX_COLUMNS):
+        batch = images[i:i + CAROUSEL_MAX_COLUMNS]
+        if len(batch) == 1:
+            messages.append(create_image_message(batch[0][1]))
+        else:
+            messages.append(create_image_carousel([media for _, media in batch], first=batch[0][0], total=total))
+    return messages
+
+def create_image_message(media):
+    return ImageSendMessage(
+        original_content_url=media_proxy.proxy_url(media["url"]),
+        preview_image_url=preview_image_url(media["url"])
+    )
+
+def create_video_message(media):
+    """
+    動画のメッセージを作成する。
+    プレビュー画像を用意できない（サムネイルがなく、代替画像を配信する公開URLもない）場合は、
+    動画メッセージを送れないため動画のURLをテキストで送る。
+    """
+    preview = preview_image_url(media["thumbnail"])
+    if preview is None:
+        logger.warning("No preview image for video, sending its URL as text")
+        return TextSendMessage(text=f"🎬 {media_proxy.proxy_url(media['url'])}")
+    return VideoSendMessage(
+        original_content_url=media_proxy.proxy_url(media["url"]),
+        preview_image_url=preview
+    )
+
+def preview_image_url(url):
+    """
+    preview_image_urlに使うURLを返す。
+    プレビューが有効な場合は縮小したプレビュー画像、無効な場合は元の画像のURLを使う。
+    URLがない場合は /preview/fallback の代替画像を使う。
+    
+    Args:
+        url: 元の画像（動画の場合はサムネイル）のURL
+        
+    Returns:
+        URL（URLがなく、代替画像を配信する公開URLも設定されていない場合はNone）
+    """
+    if preview_service.enabled:
+        return preview_service.preview_url(url)
+    return media_proxy.proxy_url(url) or preview_service.fallback_url()
+
+def create_image_carousel(images, first, total):
+    """
+    画像を1つの画像カルーセルにまとめる。カルーセルにはプレビュー画像を表示し、タップすると元の画像を開く。
+    
+    Args:
+        images: 投稿内で連続する画像のメディア情報のリスト（最大10件）
+        first: 先頭の画像が投稿の何件目か
+        total: 投稿のメディアの総数
+    """
+    last = first + len(images) - 1
+    return TemplateSendMessage(
+        alt_text=f"📸 {first}〜{last}件目の画像（全{total}件）",
+        template=ImageCarouselTemplate(columns=[
+            ImageCarouselColumn(image_url=preview_image_url(media["url"]), action=URIAction(uri=carousel_uri(media)))
+            for media in images
+        ])
+    )
+
+def carousel_uri(media):
+    """
+    画像カルーセルで画像をタップした時に開くURLを返す。
+    メディアプロキシのURLがLINEの上限（1000文字）を超える場合は元のURLを使い、
+    どちらも超える場合はNone（カルーセルに入れず通常の画像メッセージで送る）。
+    
+    Args:
+        media: 画像のメディア情報
+    """
+    for url in (media_proxy.proxy_url(media["url"]), media["url"]):
+        if url and len(url) <= URI_ACTION_MAX_LENGTH:
+            return url
+    return None
 
 @handler.add(MessageEvent, message=TextMessage)
 def handle_message(event):
@@ -149,9 +477,54 @@ def handle_message(event):
     """
     text = event.message.text
     
-    # 共通ロジックを使用してInstagramの情報を取得
-    result = process_instagram_url(text)
+    # 共通ロジックを使用してInstagramの情報を取得（メッセージ内の複数リンクは並行して取得）
+    result = combine_results(process_instagram_urls(text, requester_for(event)))
+    reply_with_result(event.reply_token, result, push_target_for(event))
+
+async def handle_message_async(event):
+    """
+    handle_messageのasyncio版（run_app.pyの単一プロセス構成で使用）。
+    メディア情報はDiscord Botと共有のasyncio版APIで取得し、返信のみスレッドで行う。
+    """
+    text = event.message.text
+    result = combine_results(await process_instagram_urls_async(text, requester_for(event)))
+    if result:
+        await asyncio.to_thread(reply_with_result, event.reply_token, result, push_target_for(event))
+
+def requester_for(event):
+    """
+    イベントの依頼元を返す（RapidAPIの問い合わせをトーク・グループごとに公平に割り当てるため）。
+    グループ・トークルームではその単位、1対1のトークではユーザー単位になる。
+    """
+    source = event.source
+    source_type = getattr(source, "type", None)
+    if source_type == "group":
+        return Requester("line_group", source.group_id)
+    if source_type == "room":
+        return Requester("line_room", source.room_id)
+    return Requester("line_user", getattr(source, "user_id", None) or "")
+
+def push_target_for(event):
+    """pushメッセージの送信先（グループ・トークルーム・ユーザーのID）を返す"""
+    source = event.source
+    source_type = getattr(source, "type", None)
+    if source_type == "group":
+        return source.group_id
+    if source_type == "room":
+        return source.room_id
+    return getattr(source, "user_id", None)
+
+def reply_with_result(reply_token, result, push_to=None):
+    """
+    取得結果をLINEに返信する。
+    返信に入りきらないメッセージ（6件目以降）は、push_toが指定されていればpushメッセージのキューに積む。
+    reply tokenは一度しか使えないため、返信に失敗しても例外は送出しない（イベントをリトライしても返信できない）。
     
+    Args:
+        reply_token: イベントのreply token
+        result: combine_resultsの戻り値（Noneの場合は何もしない）
+        push_to: pushメッセージの送信先（Noneの場合は返信に入りきらない分を送らない）
+    """
     if result:
         try:
             logger.info(f"Processing {result.get('media_count', 1)} media items")
@@ -160,28 +533,39 @@ def handle_message(event):
             messages = create_media_messages(result)
             
             if messages:
-                # 複数メディアの送信
-                line_bot_api.reply_message(event.reply_token, messages)
+                reply, overflow = messages[:MAX_MESSAGES_PER_CALL], messages[MAX_MESSAGES_PER_CALL:]
+                send_reply(reply_token, reply)
                 
-                # 5個を超えるメディアがある場合の追加通知
-                if "media_list" in result and len(result["media_list"]) > 5:
-                    # Note: reply_tokenは一度しか使えないため、pushメッセージを使用する必要がある
-                    # ただし、push APIは有料プランが必要な場合がある
-                    logger.info(f"Total {len(result['media_list'])} media found, but only first 5 can be sent due to LINE limitation")
+                # reply_tokenは一度しか使えないため、残りはpushメッセージで送る（クォータを消費する）
+                if overflow and not (push_to and push_queue.enqueue(push_to, overflow)):
+                    logger.info(f"{len(overflow)} messages could not be sent: push delivery is unavailable")
             else:
                 raise Exception("No messages created")
                 
         except Exception as e:
             logger.error(f"Error sending message: {e}")
-            line_bot_api.reply_message(
-                event.reply_token,
-                TextSendMessage(text="エラーが発生しました🙇‍♂️\n送信中に問題が発生しました。")
-            )
+            try:
+                line_bot_api.reply_message(
+                    reply_token,
+                    TextSendMessage(text="エラーが発生しました🙇‍♂️\n送信中に問題が発生しました。")
+                )
+            except Exception as reply_error:
+                logger.error(f"Error sending error reply: {reply_error}")
     else:
         # InstagramのURLでない、または取得に失敗した場合は何もしない
         # (取得失敗時にエラーメッセージを送る仕様にする場合はここでTextSendMessageを送る)
         pass
 
+def send_reply(reply_token, messages):
+    """返信を送り、レイテンシと送信数を記録する"""
+    started = time.monotonic()
+    try:
+        line_bot_api.reply_message(reply_token, messages)
+    except Exception:
+        delivery_stats.record("reply", len(messages), time.monotonic() - started, False)
+        raise
+    delivery_stats.record("reply", len(messages), time.monotonic() - started, True)
+
 if __name__ == "__main__":
     # ローカルでのテスト用
     # ポート番号の設定（デフォルト5000）
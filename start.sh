@@ -1,11 +1,18 @@
 #!/bin/bash
-# ログがバッファリングされないように -u オプションを追加
-# Discord Botをバックグラウンドで起動
-python -u run_discord.py &
-
 # RenderのPORT環境変数が設定されていない場合のデフォルト値
 PORT=${PORT:-10000}
+export PORT
+
+# RUNTIME=split の場合は従来どおり Discord Bot と LINE Bot (Gunicorn) を別プロセスで起動する
+if [ "${RUNTIME:-single}" = "split" ]; then
+    # ログがバッファリングされないように -u オプションを追加
+    # Discord Botをバックグラウンドで起動
+    python -u run_discord.py &
+
+    # LINE Bot (Gunicorn) をフォアグラウンドで起動
+    # Renderからのアクセスを受け付けるため 0.0.0.0:$PORT に明示的にバインド
+    exec gunicorn --bind 0.0.0.0:$PORT run_line:app
+fi
 
-# LINE Bot (Gunicorn) をフォアグラウンドで起動
-# Renderからのアクセスを受け付けるため 0.0.0.0:$PORT に明示的にバインド
-exec gunicorn --bind 0.0.0.0:$PORT run_line:app
+# デフォルト: LINE Bot (aiohttp) と Discord Bot を1つのプロセス・イベントループで起動
+exec python -u run_app.py
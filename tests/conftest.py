@@ -4,6 +4,64 @@ import pytest
 import os
 from unittest.mock import Mock
 
+# Keep tests from writing persistent cache files into the repository: default to the in-memory stores
+os.environ.setdefault("RESULT_CACHE_BACKEND", "memory")
+os.environ.setdefault("IDEMPOTENCY_BACKEND", "memory")
+
+
+@pytest.fixture(autouse=True)
+def clear_result_cache():
+    """Isolate tests from results cached by previous tests."""
+    from core.cache import result_cache
+    result_cache.clear()
+    yield
+    result_cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def fresh_rate_limiter():
+    """Give every provider its own fresh rate limiter so earlier calls never throttle later tests."""
+    from core.providers import provider_pool
+    from core.rate_limiter import RateLimiter
+    originals = [provider.limiter for provider in provider_pool.providers]
+    for provider in provider_pool.providers:
+        provider.limiter = RateLimiter(per_second=1000, burst=1000)
+    yield
+    for provider, limiter in zip(provider_pool.providers, originals):
+        provider.limiter = limiter
+
+
+@pytest.fixture(autouse=True)
+def fresh_circuit_breaker():
+    """Give every test a closed circuit so failures simulated by earlier tests never fail later ones fast."""
+    from unittest.mock import patch
+    import core.logic
+    from core.circuit_breaker import CircuitBreaker
+    breaker = CircuitBreaker()
+    breaker.add_listener(core.logic._on_circuit_change)
+    with patch('core.logic.circuit_breaker', breaker):
+        core.logic._pending_refresh.clear()
+        yield breaker
+        core.logic._pending_refresh.clear()
+
+
+@pytest.fixture(autouse=True)
+def clear_negative_cache():
+    """Isolate tests from failures recorded by previous tests."""
+    from core.negative_cache import negative_cache
+    negative_cache.clear()
+    yield
+    negative_cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def clear_idempotency_store():
+    """Let every test deliver webhook events that earlier tests already used."""
+    from core.idempotency import idempotency_store
+    idempotency_store.clear()
+    yield
+    idempotency_store.clear()
+
 
 @pytest.fixture(scope="session")
 def test_env_vars():
@@ -0,0 +1,57 @@
+"""Tests for the asyncio variant of the core extraction API."""
+
+import pytest
+from unittest.mock import AsyncMock, patch
+from core.http_client import AsyncResponse
+from core.logic import process_instagram_url_async
+
+
+def _api_response(body: bytes, status_code: int = 200) -> AsyncResponse:
+    return AsyncResponse(status_code=status_code, headers={}, content=body, url="https://api.test/download")
+
+
+class TestProcessInstagramUrlAsync:
+    """Test suite for process_instagram_url_async."""
+
+    @pytest.mark.asyncio
+    async def test_non_instagram_text_is_ignored(self):
+        """Messages without an Instagram link make no request."""
+        with patch('core.logic.async_http_client.get', new_callable=AsyncMock) as mock_get:
+            assert await process_instagram_url_async("hello") is None
+        assert not mock_get.called
+
+    @pytest.mark.asyncio
+    @patch('core.logic.RAPID_API_KEY', 'test_api_key')
+    async def test_carousel_response(self):
+        """Carousel responses produce the same result shape as the sync API."""
+        body = b'{"medias": [{"url": "https://example.com/1.jpg"}, {"video_url": "https://example.com/2.mp4"}]}'
+        with patch('core.logic.async_http_client.get', new_callable=AsyncMock) as mock_get:
+            mock_get.return_value = _api_response(body)
+            result = await process_instagram_url_async("https://www.instagram.com/p/ASYNC1/")
+
+        assert result["type"] == "carousel"
+        assert result["media_count"] == 2
+        assert result["media_list"][1]["type"] == "video"
+        assert result["media_url"] == "https://example.com/1.jpg"
+
+    @pytest.mark.asyncio
+    @patch('core.logic.RAPID_API_KEY', 'test_api_key')
+    async def test_http_error_returns_none(self):
+        """Upstream errors are reported as None."""
+        with patch('core.logic.async_http_client.get', new_callable=AsyncMock) as mock_get:
+            mock_get.return_value = _api_response(b"", status_code=404)
+            result = await process_instagram_url_async("https://www.instagram.com/p/ASYNC2/")
+
+        assert result is None
+
+    @pytest.mark.asyncio
+    @patch('core.logic.RAPID_API_KEY', 'test_api_key')
+    async def test_shares_result_cache(self):
+        """Repeat lookups are served from the shared result cache."""
+        body = b'{"medias": [{"url": "https://example.com/1.jpg"}]}'
+        with patch('core.logic.async_http_client.get', new_callable=AsyncMock) as mock_get:
+            mock_get.return_value = _api_response(body)
+            await process_instagram_url_async("https://www.instagram.com/p/ASYNC3/")
+            await process_instagram_url_async("https://www.instagram.com/p/ASYNC3/")
+
+        assert mock_get.call_count == 1
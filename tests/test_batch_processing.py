@@ -0,0 +1,102 @@
+"""Tests for concurrent processing of multiple links in one message."""
+
+import asyncio
+import json
+
+import pytest
+from unittest.mock import AsyncMock, Mock, patch
+from core.http_client import AsyncResponse
+from core.logic import process_instagram_urls, process_instagram_urls_async, combine_results
+
+MESSAGE = (
+    "https://www.instagram.com/p/ONE/ https://www.instagram.com/p/BROKEN/ "
+    "https://www.instagram.com/reel/THREE/"
+)
+
+
+def _medias_for(post_url):
+    """Build a fake API body whose media URL encodes the requested post."""
+    shortcode = post_url.rstrip("/").rsplit("/", 1)[-1]
+    return {"medias": [{"url": f"https://cdn.example.com/{shortcode}.jpg"}]}
+
+
+class TestProcessInstagramUrls:
+    """Test suite for the batch entry points."""
+
+    @patch('core.logic.RAPID_API_KEY', 'test_api_key')
+    @patch('requests.Session.get')
+    def test_results_are_ordered_and_failures_isolated(self, mock_get):
+        """Each link gets its own slot; one failure does not affect others."""
+        def fake_get(url, params=None, **kwargs):
+            if "BROKEN" in params["url"]:
+                raise Exception("Network error")
+            response = Mock()
+            response.status_code = 200
+            response.json.return_value = _medias_for(params["url"])
+            return response
+
+        mock_get.side_effect = fake_get
+        results = process_instagram_urls(MESSAGE)
+
+        assert len(results) == 3
+        assert results[0]["media_url"] == "https://cdn.example.com/ONE.jpg"
+        assert results[1] is None
+        assert results[2]["media_url"] == "https://cdn.example.com/THREE.jpg"
+
+    def test_no_links(self):
+        """Messages without links yield an empty list."""
+        assert process_instagram_urls("hello") == []
+
+    @pytest.mark.asyncio
+    @patch('core.logic.BATCH_MAX_CONCURRENCY', 2)
+    @patch('core.logic.RAPID_API_KEY', 'test_api_key')
+    async def test_async_concurrency_is_capped(self):
+        """No more than BATCH_MAX_CONCURRENCY lookups run at once."""
+        active = 0
+        peak = 0
+
+        async def fake_get(url, params=None, **kwargs):
+            nonlocal active, peak
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.01)
+            active -= 1
+            body = json.dumps(_medias_for(params["url"])).encode()
+            return AsyncResponse(status_code=200, headers={}, content=body, url=url)
+
+        text = " ".join(f"https://www.instagram.com/p/C{i}/" for i in range(5))
+        with patch('core.logic.async_http_client.get', new_callable=AsyncMock) as mock_get:
+            mock_get.side_effect = fake_get
+            results = await process_instagram_urls_async(text)
+
+        assert peak == 2
+        assert [r["media_url"] for r in results] == [f"https://cdn.example.com/C{i}.jpg" for i in range(5)]
+
+
+class TestCombineResults:
+    """Test suite for combine_results."""
+
+    def _result(self, *urls):
+        media_list = [{"url": u, "type": "image", "thumbnail": None} for u in urls]
+        return {"media_list": media_list, "media_count": len(media_list)}
+
+    def test_combines_media_in_order(self):
+        """Media from all successful posts are merged in order."""
+        combined = combine_results([self._result("a", "b"), None, self._result("c")])
+
+        assert [m["url"] for m in combined["media_list"]] == ["a", "b", "c"]
+        assert combined["type"] == "carousel"
+        assert combined["media_count"] == 3
+        assert combined["media_url"] == "a"
+        assert combined["post_count"] == 2
+        assert combined["failed_count"] == 1
+
+    def test_single_result_is_returned_unchanged(self):
+        """A one-link message keeps the single-post result."""
+        result = self._result("a")
+        assert combine_results([result]) is result
+
+    def test_all_failed(self):
+        """Nothing to render when every lookup failed."""
+        assert combine_results([None, None]) is None
+        assert combine_results([]) is None
@@ -0,0 +1,130 @@
+"""Tests for the TinyLFU admission policy of the result cache."""
+
+import itertools
+import random
+
+import pytest
+
+from core.admission import FrequencySketch, MAX_COUNT
+from core.cache import ResultCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestFrequencySketch:
+    """Test suite for FrequencySketch."""
+
+    def test_estimates_counts(self):
+        sketch = FrequencySketch(capacity=64)
+        for _ in range(5):
+            sketch.increment("popular")
+        sketch.increment("rare")
+
+        assert sketch.estimate("popular") == 5
+        assert sketch.estimate("rare") == 1
+        assert sketch.estimate("unseen") == 0
+
+    def test_counters_saturate(self):
+        sketch = FrequencySketch(capacity=64, sample_factor=100)
+        for _ in range(100):
+            sketch.increment("A")
+        assert sketch.estimate("A") == MAX_COUNT
+
+    def test_aging_halves_counts(self):
+        sketch = FrequencySketch(capacity=16, sample_factor=1)
+        for _ in range(8):
+            sketch.increment("A")
+        for i in range(8):
+            sketch.increment(f"other{i}")
+
+        assert sketch.resets == 1
+        assert sketch.estimate("A") == 4
+
+    def test_admit_requires_higher_frequency(self):
+        sketch = FrequencySketch(capacity=64)
+        sketch.increment("victim")
+        sketch.increment("candidate")
+        assert not sketch.admit("candidate", "victim")
+
+        sketch.increment("candidate")
+        assert sketch.admit("candidate", "victim")
+
+
+class TestResultCacheAdmission:
+    """A full cache keeps frequently requested entries over one-off links."""
+
+    def setup_method(self):
+        self.clock = FakeClock()
+        self.cache = ResultCache(max_entries=2, ttl=60, clock=self.clock, admission=True)
+
+    def _lookup(self, key):
+        """Look up like core.logic does: get first, store on a miss."""
+        if self.cache.get(key) is None:
+            self.cache.set(key, {"key": key})
+
+    def test_one_off_entry_does_not_evict_popular_one(self):
+        for key in ("A", "A", "A", "B", "B"):
+            self._lookup(key)
+        self._lookup("ONCE")
+
+        assert self.cache.get("ONCE") is None
+        assert self.cache.get("A") is not None
+        assert self.cache.get("B") is not None
+        assert self.cache.stats()["rejections"] == 1
+
+    def test_repeatedly_requested_entry_is_admitted(self):
+        for key in ("A", "B", "C", "C"):
+            self._lookup(key)
+
+        assert self.cache.get("C") is not None
+        assert self.cache.stats()["evictions"] == 1
+
+    def test_expired_victim_is_always_replaced(self):
+        for key in ("A", "A", "B", "B"):
+            self._lookup(key)
+        self.clock.now += 61
+        self.cache.set("NEW", {"key": "NEW"})
+        assert self.cache.get("NEW") is not None
+
+    def test_updating_cached_entry_is_always_admitted(self):
+        self._lookup("A")
+        self._lookup("B")
+        self.cache.set("A", {"key": "A2"})
+        assert self.cache.get("A") == {"key": "A2"}
+        assert self.cache.stats()["rejections"] == 0
+
+
+def _skewed_trace(length, popular_keys=1000, one_off_share=0.5, seed=42):
+    """Zipf-distributed requests for shared posts interleaved with links that are only sent once."""
+    rng = random.Random(seed)
+    weights = [1 / rank for rank in range(1, popular_keys + 1)]
+    popular = rng.choices(range(popular_keys), weights=weights, k=length)
+    one_off = itertools.count()
+    return [
+        f"once{next(one_off)}" if rng.random() < one_off_share else f"post{key}"
+        for key in popular
+    ]
+
+
+def _hit_rate(cache, trace):
+    for key in trace:
+        if cache.get(key) is None:
+            cache.set(key, {"key": key})
+    stats = cache.stats()
+    return stats["hits"] / (stats["hits"] + stats["misses"])
+
+
+@pytest.mark.slow
+def test_benchmark_hit_rate_against_lru():
+    """Replay a skewed trace and compare the hit rate of TinyLFU admission with plain LRU."""
+    trace = _skewed_trace(50_000)
+    lru = _hit_rate(ResultCache(max_entries=100, ttl=1e9), trace)
+    tinylfu = _hit_rate(ResultCache(max_entries=100, ttl=1e9, admission=True), trace)
+
+    assert tinylfu > lru * 1.2, f"hit rate: lru={lru:.3f} tinylfu={tinylfu:.3f}"
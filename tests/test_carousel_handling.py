@@ -111,7 +111,7 @@ class TestCarouselHandling:
         assert video_item is not None
         assert video_item["thumbnail"] is not None
     
-    @patch('requests.get')
+    @patch('requests.Session.get')
     def test_process_instagram_url_carousel(self, mock_get):
         """Test process_instagram_url with carousel response."""
         mock_response = Mock()
@@ -136,7 +136,7 @@ class TestCarouselHandling:
         assert "media_url" in result
         assert result["media_url"] == "https://example.com/image1.jpg"
     
-    @patch('requests.get')
+    @patch('requests.Session.get')
     def test_process_instagram_url_single_media(self, mock_get):
         """Test process_instagram_url with single media response."""
         mock_response = Mock()
@@ -155,7 +155,7 @@ class TestCarouselHandling:
         assert result["media_count"] == 1
         assert len(result["media_list"]) == 1
     
-    @patch('requests.get')
+    @patch('requests.Session.get')
     def test_process_instagram_url_empty_response(self, mock_get):
         """Test process_instagram_url with empty response."""
         mock_response = Mock()
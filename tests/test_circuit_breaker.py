@@ -0,0 +1,312 @@
+"""Tests for the upstream circuit breaker and the stale-while-revalidate fallback."""
+
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+from unittest.mock import Mock, patch
+
+import core.logic
+from core.cache import ResultCache
+from core.circuit_breaker import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+from core.logic import process_instagram_url, aiter_media, _fetch_media_result_async
+from core.negative_cache import NegativeCache
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def _breaker(clock, **kwargs):
+    options = dict(window=4, min_calls=4, failure_rate=0.5, open_seconds=30, clock=clock)
+    options.update(kwargs)
+    return CircuitBreaker(**options)
+
+
+class TestCircuitBreaker:
+    """Test suite for CircuitBreaker."""
+
+    def test_opens_at_failure_rate(self):
+        breaker = _breaker(FakeClock())
+        for _ in range(2):
+            breaker.record_success(0.1)
+        breaker.record_failure()
+        assert breaker.state == CLOSED
+
+        breaker.record_failure()
+        assert breaker.state == OPEN
+        assert breaker.is_open()
+        assert not breaker.allow()
+        assert breaker.stats()["rejected"] == 1
+
+    def test_needs_min_calls_before_opening(self):
+        breaker = _breaker(FakeClock())
+        for _ in range(3):
+            breaker.record_failure()
+        assert breaker.state == CLOSED
+
+    def test_opens_on_slow_calls(self):
+        breaker = _breaker(FakeClock(), slow_call_seconds=2, slow_call_rate=0.75)
+        breaker.record_success(0.5)
+        for _ in range(3):
+            breaker.record_success(5.0)
+        assert breaker.state == OPEN
+
+    def test_half_open_allows_a_single_probe(self):
+        clock = FakeClock()
+        breaker = _breaker(clock)
+        for _ in range(4):
+            breaker.record_failure()
+
+        clock.now += 30
+        assert not breaker.is_open()
+        probe = breaker.allow()
+        assert probe
+        assert breaker.state == HALF_OPEN
+        assert not breaker.allow()
+
+        breaker.record_success(0.1, probe)
+        assert breaker.state == CLOSED
+        assert breaker.allow()
+        assert breaker.stats()["calls"] == 0
+
+    def test_failed_probe_reopens(self):
+        clock = FakeClock()
+        breaker = _breaker(clock)
+        for _ in range(4):
+            breaker.record_failure()
+        clock.now += 30
+        probe = breaker.allow()
+        assert probe
+
+        breaker.record_failure(probe)
+        assert breaker.state == OPEN
+        assert breaker.stats()["opened"] == 2
+        assert not breaker.allow()
+
+    def test_listeners_see_transitions(self):
+        clock = FakeClock()
+        breaker = _breaker(clock)
+        transitions = []
+        breaker.add_listener(lambda old, new: transitions.append((old, new)))
+
+        for _ in range(4):
+            breaker.record_failure()
+        clock.now += 30
+        breaker.record_success(0.1, breaker.allow())
+
+        assert transitions == [(CLOSED, OPEN), (OPEN, HALF_OPEN), (HALF_OPEN, CLOSED)]
+
+    def test_only_the_probe_ends_half_open(self):
+        """Calls allowed before the circuit opened cannot free or decide the probe."""
+        clock = FakeClock()
+        breaker = _breaker(clock)
+        earlier = [breaker.allow() for _ in range(2)]
+        for _ in range(4):
+            breaker.record_failure()
+
+        clock.now += 30
+        probe = breaker.allow()
+        assert probe
+
+        # The earlier calls finish while the probe is still running
+        breaker.release(earlier[0])
+        breaker.record_success(0.1, earlier[1])
+        breaker.record_success(0.1)
+        assert breaker.state == HALF_OPEN
+        assert not breaker.allow()
+
+        breaker.release(probe)
+        second = breaker.allow()
+        assert second
+        assert second is not probe
+        # A probe that was already released cannot decide the state either
+        breaker.record_success(0.1, probe)
+        assert breaker.state == HALF_OPEN
+
+        breaker.record_success(0.1, second)
+        assert breaker.state == CLOSED
+
+    def test_concurrent_half_open_calls_start_one_probe(self):
+        clock = FakeClock()
+        breaker = _breaker(clock)
+        for _ in range(4):
+            breaker.record_failure()
+        clock.now += 30
+
+        barrier = threading.Barrier(8)
+
+        def call(_):
+            barrier.wait()
+            return breaker.allow()
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            permits = list(executor.map(call, range(8)))
+
+        assert sum(1 for permit in permits if permit) == 1
+        assert breaker.stats()["rejected"] == 7
+
+    def test_disabled_breaker_always_allows(self):
+        breaker = _breaker(FakeClock(), enabled=False)
+        for _ in range(4):
+            breaker.record_failure()
+        assert breaker.allow()
+        assert not breaker.is_open()
+
+
+def _response(status_code, body=None):
+    response = Mock()
+    response.status_code = status_code
+    response.headers = {}
+    response.content = b"{}"
+    response.json.return_value = body or {}
+    if status_code >= 400:
+        response.raise_for_status.side_effect = requests.HTTPError(f"{status_code} Error")
+    else:
+        response.raise_for_status.return_value = None
+    return response
+
+
+@patch('core.logic.RAPID_API_KEY', 'test_api_key')
+class TestStaleWhileRevalidate:
+    """Lookups fall back to expired results while the provider is down."""
+
+    URL = "https://www.instagram.com/p/STALE1/"
+    OLD = {"medias": [{"url": "https://example.com/old.jpg"}]}
+    NEW = {"medias": [{"url": "https://example.com/new.jpg"}]}
+
+    @pytest.fixture
+    def clock(self):
+        return FakeClock()
+
+    @pytest.fixture
+    def cache(self, clock):
+        cache = ResultCache(ttl=60, stale_ttl=3600, clock=clock)
+        with patch('core.logic.result_cache', cache):
+            yield cache
+
+    @pytest.fixture(autouse=True)
+    def no_negative_cache(self):
+        # Repeated lookups of the same post must reach the breaker instead of failing fast
+        with patch('core.logic.negative_cache', NegativeCache(enabled=False)):
+            yield
+
+    @pytest.fixture
+    def breaker(self, clock):
+        breaker = _breaker(clock, window=2, min_calls=2)
+        breaker.add_listener(core.logic._on_circuit_change)
+        with patch('core.logic.circuit_breaker', breaker):
+            yield breaker
+
+    def test_serves_stale_and_refreshes_after_recovery(self, clock, cache, breaker):
+        with patch('requests.Session.get') as mock_get:
+            mock_get.return_value = _response(200, self.OLD)
+            assert process_instagram_url(self.URL)["media_url"] == "https://example.com/old.jpg"
+
+            # The upstream goes down after the TTL has passed: two failures open the circuit
+            clock.now += 120
+            mock_get.return_value = _response(503)
+            for _ in range(2):
+                assert process_instagram_url(self.URL)["media_url"] == "https://example.com/old.jpg"
+            assert breaker.state == OPEN
+
+            # While open, the stale result is served without calling the upstream
+            calls = mock_get.call_count
+            assert process_instagram_url(self.URL)["media_url"] == "https://example.com/old.jpg"
+            assert mock_get.call_count == calls
+            assert cache.stats()["stale_hits"] == 3
+
+            # A successful probe closes the circuit and refreshes the stale entry
+            clock.now += 30
+            mock_get.return_value = _response(200, self.NEW)
+            process_instagram_url("https://www.instagram.com/p/OTHER1/")
+            core.logic._refresh_executor.submit(lambda: None).result()
+
+        assert breaker.state == CLOSED
+        assert cache.get("STALE1")["media_url"] == "https://example.com/new.jpg"
+
+    def test_open_circuit_without_cached_result_returns_none(self, cache, breaker):
+        for _ in range(2):
+            breaker.record_failure()
+
+        with patch('requests.Session.get') as mock_get:
+            assert process_instagram_url("https://www.instagram.com/p/NOCACHE1/") is None
+        assert not mock_get.called
+
+    def test_connection_errors_count_as_failures(self, cache, breaker):
+        with patch('requests.Session.get', side_effect=requests.ConnectionError("down")):
+            for _ in range(2):
+                assert process_instagram_url("https://www.instagram.com/p/DOWN1/") is None
+        assert breaker.state == OPEN
+
+    def test_stale_entries_expire_after_stale_ttl(self, clock, cache):
+        cache.set("OLD1", {"media_url": "x"})
+        clock.now += 120
+        assert cache.get("OLD1") is None
+        assert cache.get_stale("OLD1") == {"media_url": "x"}
+
+        clock.now += 3600
+        assert cache.get_stale("OLD1") is None
+
+
+@patch('core.logic.RAPID_API_KEY', 'test_api_key')
+class TestCancelledProbe:
+    """A half-open probe that is cancelled before the upstream answers frees the probe slot."""
+
+    @pytest.fixture
+    def breaker(self):
+        clock = FakeClock()
+        breaker = _breaker(clock)
+        for _ in range(4):
+            breaker.record_failure()
+        clock.now += 30
+        with patch('core.logic.circuit_breaker', breaker):
+            yield breaker
+
+    @staticmethod
+    async def _cancel_while_probing(coro, started):
+        task = asyncio.ensure_future(coro)
+        await started.wait()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    @pytest.mark.asyncio
+    async def test_streaming_lookup(self, breaker):
+        started = asyncio.Event()
+
+        async def hanging_chunks(url, chunk_size=8192, **kwargs):
+            started.set()
+            await asyncio.sleep(60)
+            yield b""
+
+        async def consume():
+            return [media async for media in aiter_media("https://www.instagram.com/p/PROBE1/")]
+
+        with patch('core.logic.async_http_client.iter_chunks', side_effect=hanging_chunks), \
+             patch('core.logic.negative_cache.get', return_value=None):
+            await self._cancel_while_probing(consume(), started)
+
+        assert breaker.state == HALF_OPEN
+        assert breaker.allow()
+
+    @pytest.mark.asyncio
+    async def test_single_provider_lookup(self, breaker):
+        started = asyncio.Event()
+
+        async def hanging_fetch(provider, post_url):
+            started.set()
+            await asyncio.sleep(60)
+
+        with patch('core.logic._fetch_from_provider_async', side_effect=hanging_fetch), \
+             patch('core.logic.provider_pool.ordered', return_value=[Mock()]):
+            await self._cancel_while_probing(_fetch_media_result_async("https://www.instagram.com/p/PROBE2/"), started)
+
+        assert breaker.state == HALF_OPEN
+        assert breaker.allow()
@@ -122,4 +122,74 @@ class TestDiscordBotErrorHandling:
             # await on_message(self.message)
             
             # Verify error was handled gracefully
-            # assert self.channel.send.called
\ No newline at end of file
+            # assert self.channel.send.called
+
+class TestBatchedDelivery:
+    """Carousels are delivered in as few Discord requests as possible."""
+
+    def setup_method(self):
+        self.message = Mock(spec=discord.Message)
+        self.message.reply = AsyncMock()
+        self.message.channel = Mock(spec=discord.TextChannel)
+        self.message.channel.send = AsyncMock()
+
+    @staticmethod
+    def _result(media_list):
+        return {"media_list": media_list, "media_count": len(media_list)}
+
+    @pytest.mark.asyncio
+    async def test_image_carousel_is_one_message(self):
+        import run_discord
+        media = [{"url": f"https://example.com/{i}.jpg", "type": "image"} for i in range(10)]
+
+        with patch('run_discord.DISCORD_BATCH_EMBEDS', True), \
+                patch('asyncio.sleep', new_callable=AsyncMock) as sleep:
+            await run_discord.send_media_embeds(self.message, self._result(media))
+
+        self.message.reply.assert_awaited_once()
+        kwargs = self.message.reply.call_args.kwargs
+        assert len(kwargs["embeds"]) == 10
+        assert kwargs["embeds"][9].image.url == "https://example.com/9.jpg"
+        assert "10件" in kwargs["content"]
+        assert not self.message.channel.send.called
+        assert not sleep.called
+
+    @pytest.mark.asyncio
+    async def test_videos_are_grouped_into_one_content_message(self):
+        import run_discord
+        media = [
+            {"url": "https://example.com/1.jpg", "type": "image"},
+            {"url": "https://example.com/2.mp4", "type": "video"},
+            {"url": "https://example.com/3.mp4", "type": "video"},
+        ]
+
+        with patch('run_discord.DISCORD_BATCH_EMBEDS', True):
+            await run_discord.send_media_embeds(self.message, self._result(media))
+
+        assert len(self.message.reply.call_args.kwargs["embeds"]) == 1
+        self.message.channel.send.assert_awaited_once()
+        content = self.message.channel.send.call_args.kwargs["content"]
+        assert "https://example.com/2.mp4" in content
+        assert "https://example.com/3.mp4" in content
+
+    @pytest.mark.asyncio
+    async def test_video_only_carousel_replies_with_content(self):
+        import run_discord
+        media = [{"url": f"https://example.com/{i}.mp4", "type": "video"} for i in range(12)]
+
+        with patch('run_discord.DISCORD_BATCH_EMBEDS', True):
+            await run_discord.send_media_embeds(self.message, self._result(media))
+
+        self.message.reply.assert_awaited_once()
+        content = self.message.reply.call_args.kwargs["content"]
+        assert "https://example.com/9.mp4" in content
+        assert "https://example.com/10.mp4" not in content
+        assert "残り2個" in content
+        assert not self.message.channel.send.called
+
+    def test_pack_lines_respects_content_limit(self):
+        import run_discord
+        lines = ["x" * 900] * 5
+        contents = run_discord._pack_lines(lines)
+        assert len(contents) == 3
+        assert all(len(c) <= run_discord.MAX_CONTENT_LENGTH for c in contents)
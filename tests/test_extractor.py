@@ -0,0 +1,206 @@
+"""Tests for the non-recursive media extraction engine."""
+
+import pytest
+from core.extractor import (
+    MAX_DEPTH, clear_plan_cache, extract_media_info, find_all_urls, get_plan_cache_stats,
+    media_info_from_item
+)
+
+
+@pytest.fixture(autouse=True)
+def fresh_plan_cache():
+    """Start every test without learned extraction plans."""
+    clear_plan_cache()
+    yield
+    clear_plan_cache()
+
+
+def _legacy_find_all_urls(obj, collected_urls=None):
+    """Recursive reference implementation the extractor must match."""
+    if collected_urls is None:
+        collected_urls = []
+    if isinstance(obj, dict):
+        if 'medias' in obj and isinstance(obj['medias'], list):
+            for media_item in obj['medias']:
+                _legacy_find_all_urls(media_item, collected_urls)
+            return collected_urls
+        for key in ['video_url', 'download_url', 'media', 'thumbnail', 'cover', 'thumb', 'url']:
+            if key in obj and isinstance(obj[key], str) and obj[key].startswith('http'):
+                if "instagram.com/p/" in obj[key] or "instagram.com/reel/" in obj[key]:
+                    continue
+                if obj[key] not in collected_urls:
+                    collected_urls.append(obj[key])
+        for key in ['body', 'data', 'results', 'items', 'carousel_media', 'edges']:
+            if key in obj:
+                _legacy_find_all_urls(obj[key], collected_urls)
+    elif isinstance(obj, list):
+        for item in obj:
+            _legacy_find_all_urls(item, collected_urls)
+    return collected_urls
+
+
+def _legacy_extract_media_info(data):
+    """Reference implementation of the original media info extraction."""
+    media_list = []
+    if 'medias' in data and isinstance(data['medias'], list):
+        for media in data['medias']:
+            media_info = {"url": None, "type": "image", "thumbnail": None}
+            if isinstance(media, dict):
+                if 'video_url' in media:
+                    media_info["url"] = media['video_url']
+                    media_info["type"] = "video"
+                    if 'thumbnail' in media:
+                        media_info["thumbnail"] = media['thumbnail']
+                    elif 'thumb' in media:
+                        media_info["thumbnail"] = media['thumb']
+                elif 'download_url' in media:
+                    media_info["url"] = media['download_url']
+                elif 'url' in media and not ("instagram.com/p/" in media['url'] or "instagram.com/reel/" in media['url']):
+                    media_info["url"] = media['url']
+                if media_info["url"]:
+                    if ".mp4" in media_info["url"] or "video" in str(media).lower():
+                        media_info["type"] = "video"
+                    media_list.append(media_info)
+    if not media_list:
+        for url in _legacy_find_all_urls(data):
+            media_list.append({"url": url, "type": "video" if ".mp4" in url else "image", "thumbnail": None})
+    return media_list
+
+
+SHAPES = [
+    {"medias": [{"url": "https://example.com/image1.jpg"}]},
+    {"medias": [
+        {"url": "https://example.com/image1.jpg"},
+        {"video_url": "https://example.com/video1.mp4", "thumbnail": "https://example.com/t.jpg"},
+        {"download_url": "https://example.com/image2.jpg"},
+        {"url": "https://instagram.com/p/ABC123/"},
+        {"url": "https://example.com/clip", "type": "Video"},
+        {"media": "https://example.com/image1.jpg"},
+    ]},
+    {"data": {"items": [{"url": "https://example.com/a.jpg", "thumbnail": "https://example.com/a_t.jpg"}]}},
+    {"body": {"carousel_media": [
+        {"url": "https://example.com/c1.jpg"},
+        {"video_url": "https://example.com/c2.mp4", "items": [{"cover": "https://example.com/c2.jpg"}]},
+    ]}, "data": [{"download_url": "https://example.com/d.jpg"}]},
+    {"results": [[{"thumb": "https://example.com/r.jpg"}], {"edges": {"url": "https://example.com/e.jpg"}}]},
+    {"url": "https://example.com/top.jpg", "data": {"medias": [{"url": "https://example.com/m.jpg"}]}},
+    {},
+]
+
+
+class TestEquivalence:
+    """The rewritten extractor returns exactly what the original returned."""
+
+    @pytest.mark.parametrize("data", SHAPES)
+    def test_find_all_urls_matches_legacy(self, data):
+        assert find_all_urls(data) == _legacy_find_all_urls(data)
+
+    @pytest.mark.parametrize("data", SHAPES)
+    def test_extract_media_info_matches_legacy(self, data):
+        assert extract_media_info(data) == _legacy_extract_media_info(data)
+
+    @pytest.mark.parametrize("fixture", ["mock_instagram_response", "mock_video_response", "mock_carousel_response"])
+    def test_conftest_fixtures_match_legacy(self, fixture, request):
+        data = request.getfixturevalue(fixture)
+        assert find_all_urls(data) == _legacy_find_all_urls(data)
+        assert extract_media_info(data) == _legacy_extract_media_info(data)
+
+
+class TestExtractionPlans:
+    """Test suite for shape-signature memoization."""
+
+    @pytest.mark.parametrize("data", SHAPES)
+    def test_replayed_plan_matches_legacy(self, data):
+        """A learned plan yields the same URLs as the generic walk."""
+        find_all_urls(data)
+        assert find_all_urls(data) == _legacy_find_all_urls(data)
+
+    def test_same_shape_uses_plan(self):
+        """Responses with the same structure reuse one plan."""
+        first = {"data": {"items": [{"url": "https://example.com/1.jpg"}], "caption": "x"}}
+        second = {"data": {"items": [{"url": "https://example.com/2.jpg"}], "caption": "y"}}
+
+        find_all_urls(first)
+        assert find_all_urls(second) == ["https://example.com/2.jpg"]
+
+        stats = get_plan_cache_stats()
+        assert stats["misses"] == 1
+        assert stats["hits"] == 1
+
+    def test_key_skipped_while_learning_falls_back_to_walk(self):
+        """A nested key the plan never followed (because 'medias' was a list) re-learns instead of failing."""
+        find_all_urls({"medias": [{"url": "http://a.jpg"}], "data": {"x": 1}})
+        second = {"medias": None, "data": {"url": "http://b.jpg"}}
+
+        assert find_all_urls(second) == ["http://b.jpg"]
+        assert find_all_urls(second) == ["http://b.jpg"]
+        assert get_plan_cache_stats()["fallbacks"] == 1
+
+    def test_flat_media_lists_are_read_without_the_stack(self):
+        """Replaying a plan whose list items were flat media dicts collects them directly."""
+        from unittest.mock import patch
+        from core import extractor
+
+        data = {"medias": [{"url": f"https://example.com/{i}.jpg", "thumbnail": f"https://example.com/{i}t.jpg"}
+                           for i in range(5)]}
+        find_all_urls(data)
+        with patch.object(extractor, "_collect_direct_urls", wraps=extractor._collect_direct_urls) as collect:
+            assert find_all_urls(data) == _legacy_find_all_urls(data)
+        assert collect.call_count == 5
+        assert get_plan_cache_stats()["hits"] == 1
+
+    def test_nested_item_in_flat_list_falls_back(self):
+        """An item that is no longer flat makes the replay fall back to the generic walk."""
+        find_all_urls({"medias": [{"url": "https://example.com/a.jpg"}]})
+        nested = {"medias": [{"url": "https://example.com/b.jpg"}, {"data": {"url": "https://example.com/c.jpg"}}]}
+
+        assert find_all_urls(nested) == _legacy_find_all_urls(nested)
+        assert get_plan_cache_stats()["fallbacks"] == 1
+
+    def test_mixed_carousel_items_get_distinct_signatures(self):
+        """A carousel whose items differ in shape is not served by a narrower plan."""
+        images = {"data": {"carousel_media": [{"url": "https://example.com/a.jpg"}]}}
+        mixed = {"data": {"carousel_media": [
+            {"url": "https://example.com/b.jpg"},
+            {"video_url": "https://example.com/c.mp4", "thumbnail": "https://example.com/c.jpg"},
+        ]}}
+
+        find_all_urls(images)
+        assert find_all_urls(mixed) == _legacy_find_all_urls(mixed)
+
+    def test_direct_key_becoming_a_url_changes_the_shape(self):
+        """A key that held no URL when the plan was learned is still read later."""
+        find_all_urls({"data": {"url": "https://example.com/a.jpg", "thumbnail": ""}})
+        data = {"data": {"url": "https://example.com/b.jpg", "thumbnail": "https://example.com/b_t.jpg"}}
+        assert find_all_urls(data) == _legacy_find_all_urls(data)
+
+
+class TestLimits:
+    """Test suite for adversarial payloads."""
+
+    def test_deep_nesting_does_not_recurse(self):
+        """Nesting far beyond the recursion limit is handled without error."""
+        data = {"url": "https://example.com/top.jpg"}
+        for _ in range(5000):
+            data = {"data": data}
+        assert find_all_urls(data) == []
+
+    def test_depth_limit(self):
+        """URLs nested deeper than MAX_DEPTH are not collected."""
+        shallow = {"url": "https://example.com/ok.jpg"}
+        for _ in range(MAX_DEPTH):
+            shallow = {"data": shallow}
+        deep = {"data": shallow}
+        assert find_all_urls(shallow) == ["https://example.com/ok.jpg"]
+        assert find_all_urls(deep) == []
+
+    def test_large_carousel_deduplicates(self):
+        """Large payloads with repeated URLs keep first-seen order."""
+        medias = [{"url": f"https://example.com/{i % 50}.jpg"} for i in range(5000)]
+        urls = find_all_urls({"medias": medias})
+        assert urls == [f"https://example.com/{i}.jpg" for i in range(50)]
+
+    def test_media_info_ignores_non_string_urls(self):
+        """Malformed items are skipped instead of raising."""
+        assert media_info_from_item({"url": None}) is None
+        assert media_info_from_item("https://example.com/a.jpg") is None
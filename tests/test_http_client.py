@@ -0,0 +1,209 @@
+"""Tests for the pooled HTTP client."""
+
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+from unittest.mock import Mock, patch
+from core.http_client import HttpClient, AsyncHttpClient, RequestTiming
+
+
+class _KeepAliveHandler(BaseHTTPRequestHandler):
+    """Minimal keep-alive handler returning a small JSON body."""
+
+    protocol_version = "HTTP/1.1"
+    # Number of leading requests answered with 503
+    failures_remaining = 0
+
+    def do_GET(self):
+        if _KeepAliveHandler.failures_remaining > 0:
+            _KeepAliveHandler.failures_remaining -= 1
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = b'{"medias": []}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def local_server():
+    """Run a local keep-alive HTTP server for the duration of a test."""
+    _KeepAliveHandler.failures_remaining = 0
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _KeepAliveHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/"
+    server.shutdown()
+    server.server_close()
+
+
+def _response(status_code):
+    response = Mock()
+    response.status_code = status_code
+    return response
+
+
+class TestHttpClient:
+    """Test suite for HttpClient."""
+
+    def setup_method(self):
+        """Setup test fixtures."""
+        self.sleeps = []
+        self.client = HttpClient(max_retries=2, sleep=self.sleeps.append)
+
+    def test_retries_server_errors(self):
+        """5xx responses are retried with backoff until success."""
+        with patch.object(self.client.session, "get") as mock_get:
+            mock_get.side_effect = [_response(503), _response(502), _response(200)]
+            response = self.client.get("https://example.com/")
+
+        assert response.status_code == 200
+        assert mock_get.call_count == 3
+        assert len(self.sleeps) == 2
+        assert response.timing.attempts == 3
+
+    def test_returns_last_error_response_when_retries_exhausted(self):
+        """The final 5xx response is returned once retries run out."""
+        with patch.object(self.client.session, "get") as mock_get:
+            mock_get.return_value = _response(500)
+            response = self.client.get("https://example.com/")
+
+        assert response.status_code == 500
+        assert mock_get.call_count == 3
+
+    def test_client_errors_are_not_retried(self):
+        """4xx responses are returned immediately."""
+        with patch.object(self.client.session, "get") as mock_get:
+            mock_get.return_value = _response(404)
+            response = self.client.get("https://example.com/")
+
+        assert response.status_code == 404
+        assert mock_get.call_count == 1
+        assert self.sleeps == []
+
+    def test_connection_errors_raise_after_retries(self):
+        """Connection errors propagate after the last retry."""
+        with patch.object(self.client.session, "get") as mock_get:
+            mock_get.side_effect = requests.ConnectionError("refused")
+            with pytest.raises(requests.ConnectionError):
+                self.client.get("https://example.com/")
+
+        assert mock_get.call_count == 3
+
+    def test_default_timeout_is_applied(self):
+        """Requests always carry a connect/read timeout."""
+        client = HttpClient(connect_timeout=1.5, read_timeout=7)
+        with patch.object(client.session, "get") as mock_get:
+            mock_get.return_value = _response(200)
+            client.get("https://example.com/")
+
+        assert mock_get.call_args.kwargs["timeout"] == (1.5, 7)
+
+    def test_backoff_is_bounded(self):
+        """Jittered backoff never exceeds the configured maximum."""
+        client = HttpClient(backoff_base=1.0, backoff_max=2.0)
+        for attempt in range(10):
+            assert 0 <= client.backoff_delay(attempt) <= 2.0
+
+    def test_connections_are_reused(self, local_server):
+        """The second request reuses the pooled keep-alive connection."""
+        client = HttpClient()
+        first = client.get(local_server)
+        second = client.get(local_server)
+        client.close()
+
+        assert isinstance(first.timing, RequestTiming)
+        assert first.timing.reused_connection is False
+        assert first.timing.handshake_ms > 0
+        assert second.timing.reused_connection is True
+        assert second.timing.handshake_ms == 0
+
+
+class TestAsyncHttpClient:
+    """Test suite for AsyncHttpClient."""
+
+    @pytest.mark.asyncio
+    async def test_get_reads_body_and_reuses_connection(self, local_server):
+        """Responses are fully read and pooled connections are reused."""
+        client = AsyncHttpClient()
+        try:
+            first = await client.get(local_server)
+            second = await client.get(local_server)
+        finally:
+            await client.close()
+
+        assert first.status_code == 200
+        assert first.json() == {"medias": []}
+        assert first.timing.reused_connection is False
+        assert second.timing.reused_connection is True
+        assert second.timing.handshake_ms == 0
+
+    @pytest.mark.asyncio
+    async def test_retries_server_errors(self, local_server):
+        """5xx responses are retried before returning the final response."""
+        sleeps = []
+
+        async def fake_sleep(delay):
+            sleeps.append(delay)
+
+        _KeepAliveHandler.failures_remaining = 2
+        client = AsyncHttpClient(max_retries=2, sleep=fake_sleep)
+        try:
+            response = await client.get(local_server)
+        finally:
+            await client.close()
+
+        assert response.status_code == 200
+        assert response.timing.attempts == 3
+        assert len(sleeps) == 2
+
+    @pytest.mark.asyncio
+    async def test_raise_for_status(self, local_server):
+        """Error statuses raise once retries are exhausted."""
+        _KeepAliveHandler.failures_remaining = 5
+        client = AsyncHttpClient(max_retries=0)
+        try:
+            response = await client.get(local_server)
+        finally:
+            await client.close()
+
+        assert response.status_code == 503
+        with pytest.raises(Exception):
+            response.raise_for_status()
+
+    @pytest.mark.asyncio
+    async def test_iter_chunks_streams_body(self, local_server):
+        """iter_chunks retries 5xx responses and then yields the body."""
+        async def fake_sleep(delay):
+            pass
+
+        _KeepAliveHandler.failures_remaining = 1
+        client = AsyncHttpClient(max_retries=1, sleep=fake_sleep)
+        try:
+            chunks = [chunk async for chunk in client.iter_chunks(local_server, chunk_size=4)]
+        finally:
+            await client.close()
+
+        assert b"".join(chunks) == b'{"medias": []}'
+        assert len(chunks) > 1
+
+    @pytest.mark.asyncio
+    async def test_iter_chunks_raises_on_error_status(self, local_server):
+        """iter_chunks raises HTTPError instead of yielding an error body."""
+        _KeepAliveHandler.failures_remaining = 5
+        client = AsyncHttpClient(max_retries=0)
+        try:
+            with pytest.raises(requests.HTTPError):
+                async for _ in client.iter_chunks(local_server):
+                    pass
+        finally:
+            await client.close()
@@ -0,0 +1,186 @@
+"""Tests for dropping redelivered LINE webhook events."""
+
+import json
+
+import pytest
+from unittest.mock import patch
+
+from core.idempotency import IdempotencyStore, SQLiteIdempotencyBackend, digest
+from core.job_queue import JobQueue
+
+
+class FakeClock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class TestIdempotencyStore:
+    """Test suite for IdempotencyStore."""
+
+    def test_second_delivery_is_a_duplicate(self):
+        store = IdempotencyStore()
+        assert not store.is_duplicate("E1")
+        assert store.is_duplicate("E1")
+        assert not store.is_duplicate("E2")
+
+        stats = store.stats()
+        assert stats["checked"] == 3
+        assert stats["duplicates"] == 1
+        assert stats["duplicate_rate"] == pytest.approx(1 / 3, abs=1e-4)
+
+    def test_keys_expire_after_ttl(self):
+        clock = FakeClock()
+        store = IdempotencyStore(ttl=60, clock=clock)
+        store.is_duplicate("E1")
+        clock.now += 61
+        assert not store.is_duplicate("E1")
+
+    def test_memory_is_bounded(self):
+        store = IdempotencyStore(max_entries=2)
+        for key in ("E1", "E2", "E3"):
+            store.is_duplicate(key)
+        assert len(store) == 2
+        assert not store.is_duplicate("E1")
+
+    def test_empty_key_and_disabled_store_are_never_duplicates(self):
+        store = IdempotencyStore()
+        assert not store.is_duplicate("")
+        assert not store.is_duplicate("")
+
+        store = IdempotencyStore(enabled=False)
+        store.is_duplicate("E1")
+        assert not store.is_duplicate("E1")
+
+    def test_forgotten_key_is_new_again(self):
+        store = IdempotencyStore()
+        store.is_duplicate("E1")
+        store.forget("E1")
+        assert not store.is_duplicate("E1")
+
+
+class TestSQLiteIdempotencyBackend:
+    """The on-disk backend is shared by every process using the same file."""
+
+    def test_shared_between_stores(self, tmp_path):
+        path = str(tmp_path / "idempotency.sqlite3")
+        first = IdempotencyStore(backend=SQLiteIdempotencyBackend(path))
+        second = IdempotencyStore(backend=SQLiteIdempotencyBackend(path))
+
+        assert not first.is_duplicate("E1")
+        assert second.is_duplicate("E1")
+        assert second.stats()["duplicates"] == 1
+
+    def test_expired_rows_are_reused(self, tmp_path):
+        clock = FakeClock()
+        backend = SQLiteIdempotencyBackend(str(tmp_path / "idempotency.sqlite3"), clock=clock)
+        assert backend.add(digest("E1"), ttl=60) is True
+        assert backend.add(digest("E1"), ttl=60) is False
+
+        clock.now += 61
+        assert backend.add(digest("E1"), ttl=60) is True
+        assert backend.stats()["entries"] == 1
+
+    def test_forget_removes_the_shared_row(self, tmp_path):
+        path = str(tmp_path / "idempotency.sqlite3")
+        first = IdempotencyStore(backend=SQLiteIdempotencyBackend(path))
+        second = IdempotencyStore(backend=SQLiteIdempotencyBackend(path))
+
+        first.is_duplicate("E1")
+        first.forget("E1")
+        assert not second.is_duplicate("E1")
+
+    def test_unusable_path_never_drops_events(self, tmp_path):
+        blocker = tmp_path / "file"
+        blocker.write_text("x")
+        backend = SQLiteIdempotencyBackend(str(blocker / "idempotency.sqlite3"))
+        store = IdempotencyStore(backend=backend)
+        assert backend.add(digest("E1"), ttl=60) is None
+        assert not store.is_duplicate("E2")
+        assert backend.stats()["errors"] >= 1
+
+
+def _body(*event_ids):
+    events = [
+        {
+            "type": "message",
+            "mode": "active",
+            "timestamp": 0,
+            "source": {"type": "user", "userId": "U1"},
+            "replyToken": "token",
+            "webhookEventId": event_id,
+            "deliveryContext": {"isRedelivery": False},
+            "message": {"type": "text", "id": f"m-{event_id}", "text": "https://www.instagram.com/p/X/"},
+        }
+        for event_id in event_ids
+    ]
+    return json.dumps({"destination": "D", "events": events})
+
+
+class TestLineCallback:
+    """The run_line callback discards redelivered events before enqueueing."""
+
+    @pytest.fixture
+    def queue(self, tmp_path):
+        return JobQueue(str(tmp_path / "jobs.sqlite3"))
+
+    def _post(self, run_line, body):
+        return run_line.app.test_client().post('/callback', data=body, headers={'X-Line-Signature': 'sig'})
+
+    def test_fully_redelivered_webhook_is_not_enqueued(self, queue):
+        import run_line
+
+        with patch('run_line.job_queue', queue), \
+             patch('run_line.JOB_QUEUE_ENABLED', True), \
+             patch('run_line.ensure_job_workers'), \
+             patch.object(run_line.handler.parser.signature_validator, 'validate', return_value=True):
+            assert self._post(run_line, _body("E1", "E2")).status_code == 200
+            assert self._post(run_line, _body("E1", "E2")).status_code == 200
+
+        assert queue.stats()["depth"] == 1
+
+    def test_partially_redelivered_webhook_skips_seen_events(self, queue):
+        import run_line
+
+        with patch('run_line.job_queue', queue), \
+             patch('run_line.JOB_QUEUE_ENABLED', True), \
+             patch('run_line.ensure_job_workers'), \
+             patch.object(run_line.handler.parser.signature_validator, 'validate', return_value=True):
+            self._post(run_line, _body("E1"))
+            self._post(run_line, _body("E1", "E2"))
+
+            queue.claim()
+            job = queue.claim()
+            assert json.loads(job.payload)["skip"] == ["E1"]
+
+            with patch('run_line.handle_message') as mock_handle:
+                run_line.process_webhook_job(job.payload)
+
+        assert [call.args[0].webhook_event_id for call in mock_handle.call_args_list] == ["E2"]
+
+    def test_failed_enqueue_lets_the_redelivery_through(self, queue):
+        import run_line
+
+        with patch('run_line.JOB_QUEUE_ENABLED', True), \
+             patch('run_line.ensure_job_workers'), \
+             patch.object(run_line.handler.parser.signature_validator, 'validate', return_value=True):
+            with patch('run_line.job_queue') as broken:
+                broken.enqueue.side_effect = RuntimeError("database is locked")
+                assert self._post(run_line, _body("E1", "E2")).status_code == 500
+            with patch('run_line.job_queue', queue):
+                assert self._post(run_line, _body("E1", "E2")).status_code == 200
+
+        assert "skip" not in json.loads(queue.claim().payload)
+
+    def test_inline_handling_drops_redelivered_events(self):
+        import run_line
+
+        with patch('run_line.JOB_QUEUE_ENABLED', False), \
+             patch.object(run_line.handler.parser.signature_validator, 'validate', return_value=True), \
+             patch('run_line.handle_message') as mock_handle:
+            self._post(run_line, _body("E1"))
+            self._post(run_line, _body("E1"))
+
+        assert mock_handle.call_count == 1
@@ -0,0 +1,288 @@
+"""Tests for the durable webhook job queue."""
+
+import json
+import threading
+
+import pytest
+from unittest.mock import patch
+from core.job_queue import JobQueue, JobWorkerPool, LeaseLost, RetryJob
+
+
+class FakeClock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def queue(tmp_path, clock):
+    q = JobQueue(str(tmp_path / "jobs.sqlite3"), max_attempts=3, retry_base=1.0, retry_max=4.0, lease=30.0, clock=clock)
+    q.retry_delay = lambda attempts: 2.0 * attempts
+    return q
+
+
+class TestJobQueue:
+    """Test suite for JobQueue."""
+
+    def test_fifo_claim_and_complete(self, queue):
+        """Jobs are claimed oldest first and removed on completion."""
+        queue.enqueue("a")
+        queue.enqueue("b")
+
+        first = queue.claim()
+        second = queue.claim()
+        assert (first.payload, second.payload) == ("a", "b")
+        assert first.attempts == 1
+        assert queue.claim() is None
+
+        queue.complete(first)
+        queue.complete(second)
+        assert queue.stats()["depth"] == 0
+        assert queue.stats()["completed"] == 2
+
+    def test_uses_wal_mode(self, queue):
+        """The database is opened in WAL mode for concurrent readers and writers."""
+        queue.enqueue("a")
+        assert queue._connect().execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+    def test_lease_expiry_makes_job_visible_again(self, queue, clock):
+        """A claimed job that is never completed is retried after its lease expires."""
+        queue.enqueue("a")
+        assert queue.claim() is not None
+        assert queue.claim() is None
+
+        clock.now += 31
+        job = queue.claim()
+        assert job.payload == "a"
+        assert job.attempts == 2
+
+    def test_extend_lease_keeps_job_hidden(self, queue, clock):
+        """A worker that extends its lease keeps the job while it runs."""
+        queue.enqueue("a")
+        job = queue.claim()
+        clock.now += 20
+        queue.extend_lease(job)
+        clock.now += 20
+
+        assert queue.claim() is None
+        queue.complete(job)
+        assert queue.stats()["depth"] == 0
+
+    def test_stale_worker_cannot_ack_a_reclaimed_job(self, queue, clock):
+        """After the lease expires only the new owner can complete, fail or extend the job."""
+        queue.enqueue("a")
+        stale = queue.claim()
+        clock.now += 31
+        current = queue.claim()
+
+        with pytest.raises(LeaseLost):
+            queue.complete(stale)
+        with pytest.raises(LeaseLost):
+            queue.fail(stale, "boom")
+        with pytest.raises(LeaseLost):
+            queue.extend_lease(stale)
+        assert queue.stats()["depth"] == 1
+        assert queue.stats()["completed"] == 0
+
+        queue.complete(current)
+        assert queue.stats()["depth"] == 0
+
+    def test_failed_jobs_are_retried_after_backoff(self, queue, clock):
+        """Failures reschedule the job with backoff."""
+        queue.enqueue("a")
+        job = queue.claim()
+        assert queue.fail(job, "boom") is True
+        assert queue.claim() is None
+
+        clock.now += 2.0
+        retry = queue.claim()
+        assert retry.id == job.id
+        assert retry.attempts == 2
+
+    def test_dead_letter_after_max_attempts(self, queue, clock):
+        """Jobs that keep failing are moved to the dead-letter set."""
+        queue.enqueue("a")
+        for _ in range(3):
+            clock.now += 100
+            job = queue.claim()
+            queue.fail(job, "boom")
+
+        clock.now += 100
+        assert queue.claim() is None
+        stats = queue.stats()
+        assert stats["dead"] == 1
+        assert stats["depth"] == 0
+        assert stats["dead_lettered"] == 1
+        assert queue.dead_letters()[0]["last_error"] == "boom"
+
+        assert queue.requeue_dead() == 1
+        assert queue.claim().payload == "a"
+
+    def test_stats_report_depth_and_age(self, queue, clock):
+        """Depth, readiness and oldest-job age are reported."""
+        queue.enqueue("a")
+        clock.now += 5
+        queue.enqueue("b", delay=10)
+
+        stats = queue.stats()
+        assert stats["depth"] == 2
+        assert stats["ready"] == 1
+        assert stats["oldest_age"] == 5
+
+    def test_concurrent_claims_never_share_a_job(self, tmp_path):
+        """Independent connections (as in separate workers) claim each job once."""
+        path = str(tmp_path / "jobs.sqlite3")
+        producer = JobQueue(path)
+        for i in range(100):
+            producer.enqueue(str(i))
+
+        claimed = []
+        lock = threading.Lock()
+
+        def drain():
+            q = JobQueue(path)
+            while (job := q.claim()) is not None:
+                with lock:
+                    claimed.append(job.payload)
+                q.complete(job)
+
+        threads = [threading.Thread(target=drain) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert sorted(claimed, key=int) == [str(i) for i in range(100)]
+
+
+class TestJobWorkerPool:
+    """Test suite for JobWorkerPool."""
+
+    def test_run_pending_retries_failures(self, queue, clock):
+        """Handler exceptions are retried and eventually dead-lettered."""
+        calls = []
+
+        def handler(payload):
+            calls.append(payload)
+            if payload == "bad":
+                raise RuntimeError("upstream down")
+
+        pool = JobWorkerPool(queue, handler)
+        queue.enqueue("good")
+        queue.enqueue("bad")
+        assert pool.run_pending() == 2
+
+        for _ in range(2):
+            clock.now += 100
+            pool.run_pending()
+
+        assert calls.count("good") == 1
+        assert calls.count("bad") == 3
+        assert queue.stats()["dead"] == 1
+
+    def test_retry_job_replaces_the_payload(self, queue, clock):
+        """A handler can narrow what is retried by raising RetryJob."""
+        def handler(payload):
+            if payload == "a,b":
+                raise RetryJob("b", "b failed")
+
+        pool = JobWorkerPool(queue, handler)
+        queue.enqueue("a,b")
+        pool.run_pending()
+
+        clock.now += 100
+        job = queue.claim()
+        assert (job.payload, job.attempts) == ("b", 2)
+
+    def test_lease_is_extended_while_the_handler_runs(self, tmp_path):
+        """A handler running longer than the lease keeps its job."""
+        q = JobQueue(str(tmp_path / "jobs.sqlite3"), lease=0.15)
+        q.enqueue("slow")
+        reclaimed = []
+
+        def handler(payload):
+            for _ in range(4):
+                threading.Event().wait(0.1)
+                reclaimed.append(JobQueue(q.path, lease=0.15).claim())
+
+        JobWorkerPool(q, handler).run_pending()
+
+        assert reclaimed == [None] * 4
+        assert q.stats()["depth"] == 0
+        assert q.stats()["completed"] == 1
+
+    def test_threads_drain_the_queue(self, tmp_path):
+        """Started workers process enqueued jobs in the background."""
+        q = JobQueue(str(tmp_path / "jobs.sqlite3"))
+        done = threading.Event()
+        seen = []
+
+        def handler(payload):
+            seen.append(payload)
+            if len(seen) == 3:
+                done.set()
+
+        pool = JobWorkerPool(q, handler, workers=2, poll_interval=0.05)
+        pool.start()
+        try:
+            for i in range(3):
+                q.enqueue(str(i))
+                pool.notify()
+            assert done.wait(5)
+        finally:
+            pool.stop()
+
+        assert sorted(seen) == ["0", "1", "2"]
+        assert not pool.running
+
+
+class TestLineWebhookEnqueue:
+    """The LINE webhook only verifies and enqueues."""
+
+    def test_callback_enqueues_and_returns_immediately(self, queue):
+        import run_line
+
+        with patch('run_line.job_queue', queue), \
+             patch('run_line.JOB_QUEUE_ENABLED', True), \
+             patch('run_line.ensure_job_workers'), \
+             patch.object(run_line.handler.parser.signature_validator, 'validate', return_value=True), \
+             patch.object(run_line.handler, 'handle') as mock_handle:
+            response = run_line.app.test_client().post(
+                '/callback', data='{"events": []}', headers={'X-Line-Signature': 'sig'}
+            )
+
+        assert response.status_code == 200
+        assert not mock_handle.called
+        job = queue.claim()
+        assert json.loads(job.payload) == {"body": '{"events": []}', "signature": "sig"}
+
+    def test_invalid_signature_is_rejected(self, queue):
+        import run_line
+
+        with patch('run_line.job_queue', queue), \
+             patch('run_line.JOB_QUEUE_ENABLED', True), \
+             patch('run_line.ensure_job_workers'), \
+             patch.object(run_line.handler.parser.signature_validator, 'validate', return_value=False):
+            response = run_line.app.test_client().post(
+                '/callback', data='{"events": []}', headers={'X-Line-Signature': 'bad'}
+            )
+
+        assert response.status_code == 400
+        assert queue.stats()["depth"] == 0
+
+    def test_job_is_dispatched_to_the_line_handler(self):
+        import run_line
+
+        with patch.object(run_line.handler.parser, 'parse', return_value=[]) as mock_parse, \
+             patch('run_line.handle_events', return_value=[]) as mock_handle:
+            run_line.process_webhook_job(json.dumps({"body": "{}", "signature": "sig"}))
+
+        mock_parse.assert_called_once_with("{}", "sig")
+        mock_handle.assert_called_once_with([])
@@ -110,4 +110,178 @@ class TestLineBotMediaReply:
         mock_api.reply_message.return_value = None
         
         # Verify the call was made
-        # assert mock_api.reply_message.called
\ No newline at end of file
+        # assert mock_api.reply_message.called
+
+def _media(count, media_type="image"):
+    ext = "mp4" if media_type == "video" else "jpg"
+    return [
+        {"url": f"https://example.com/{i}.{ext}", "type": media_type,
+         "thumbnail": f"https://example.com/{i}-thumb.jpg" if media_type == "video" else None}
+        for i in range(count)
+    ]
+
+
+class TestLineDeliveryPlanner:
+    """Large carousels are packed into image carousels and overflow is pushed."""
+
+    def test_twenty_images_fit_in_one_reply(self):
+        import run_line
+        from linebot.models import TemplateSendMessage
+
+        messages = run_line.create_media_messages({"media_list": _media(20)})
+
+        assert len(messages) == 3
+        assert all(isinstance(m, TemplateSendMessage) for m in messages[1:])
+        columns = messages[2].template.columns
+        assert len(columns) == 10
+        assert columns[-1].image_url == "https://example.com/19.jpg"
+        assert columns[-1].action.uri == "https://example.com/19.jpg"
+
+    def test_single_leftover_image_is_a_plain_image(self):
+        import run_line
+        from linebot.models import ImageSendMessage
+
+        messages = run_line.create_media_messages({"media_list": _media(11)})
+        assert isinstance(messages[-1], ImageSendMessage)
+        assert messages[-1].original_content_url == "https://example.com/10.jpg"
+
+    def test_mixed_media_keep_the_post_order(self):
+        import run_line
+        from linebot.models import ImageSendMessage, TemplateSendMessage, VideoSendMessage
+
+        images, videos = _media(6), _media(2, "video")
+        media_list = images[:3] + videos[:1] + images[3:4] + videos[1:] + images[4:]
+        messages = run_line.create_media_messages({"media_list": media_list})
+
+        assert [type(m) for m in messages[1:]] == [
+            TemplateSendMessage, VideoSendMessage, ImageSendMessage, VideoSendMessage, TemplateSendMessage
+        ]
+        assert messages[1].alt_text == "📸 1〜3件目の画像（全8件）"
+        assert messages[2].original_content_url == "https://example.com/0.mp4"
+        assert messages[3].original_content_url == "https://example.com/3.jpg"
+        assert messages[5].alt_text == "📸 7〜8件目の画像（全8件）"
+        assert [c.image_url for c in messages[5].template.columns] == [
+            "https://example.com/4.jpg", "https://example.com/5.jpg"
+        ]
+
+    def test_carousel_shows_previews_and_keeps_tap_targets_short(self, tmp_path):
+        import run_line
+        from core.media_proxy import MediaProxy
+        from core.previews import PreviewGenerator, PreviewService
+        from linebot.models import ImageSendMessage
+
+        proxy = MediaProxy(cache=None, base_url="https://bot.example.com", secret=b"secret")
+        previews = PreviewService(
+            MediaProxy(cache=None, base_url="https://bot.example.com", secret=b"secret", route="preview"),
+            PreviewGenerator(cache=None),
+        )
+        media_list = _media(2) + [
+            {"url": "https://cdn.example.com/" + "a" * 720 + ".jpg", "type": "image", "thumbnail": None},
+            {"url": "https://cdn.example.com/" + "b" * 1000 + ".jpg", "type": "image", "thumbnail": None},
+        ]
+        with patch('run_line.media_proxy', proxy), patch('run_line.preview_service', previews), \
+             patch.object(previews.generator, 'submit'):
+            messages = run_line.create_media_messages({"media_list": media_list})
+
+        columns = messages[1].template.columns
+        assert len(columns) == 3
+        assert all(c.image_url.startswith("https://bot.example.com/preview/") for c in columns)
+        assert columns[0].action.uri.startswith("https://bot.example.com/media/")
+        assert columns[2].action.uri == media_list[2]["url"]
+        assert isinstance(messages[2], ImageSendMessage)
+        assert all(len(c.action.uri) <= run_line.URI_ACTION_MAX_LENGTH for c in columns)
+
+    @patch('run_line.line_bot_api')
+    def test_overflow_is_pushed(self, mock_api):
+        import run_line
+
+        result = {"media_list": _media(8, "video"), "media_count": 8}
+        with patch.object(run_line.push_queue, 'enqueue', return_value=1) as enqueue:
+            run_line.reply_with_result("token", result, push_to="U1")
+
+        reply_messages = mock_api.reply_message.call_args.args[1]
+        assert len(reply_messages) == 5
+        to, overflow = enqueue.call_args.args
+        assert to == "U1"
+        assert [m.original_content_url for m in overflow] == [f"https://example.com/{i}.mp4" for i in range(4, 8)]
+
+    @patch('run_line.line_bot_api')
+    def test_overflow_without_push_target_is_not_sent(self, mock_api):
+        import run_line
+
+        with patch.object(run_line.push_queue, 'enqueue') as enqueue:
+            run_line.reply_with_result("token", {"media_list": _media(8, "video")})
+        assert mock_api.reply_message.call_count == 1
+        assert not enqueue.called
+
+    def test_push_target(self):
+        import run_line
+
+        event = Mock()
+        event.source = Mock(type="group", group_id="G1")
+        assert run_line.push_target_for(event) == "G1"
+        event.source = Mock(type="user", user_id="U1")
+        assert run_line.push_target_for(event) == "U1"
+
+
+class TestMultiEventWebhook:
+    """All events in one webhook are handled concurrently."""
+
+    @staticmethod
+    def _event():
+        from linebot.models import MessageEvent, TextMessage
+        return MessageEvent(reply_token="token", message=TextMessage(id="1", text="https://www.instagram.com/p/X/"))
+
+    def test_events_are_handled_concurrently(self):
+        import threading
+        import run_line
+        from core.webhook_stats import WebhookStats
+
+        barrier = threading.Barrier(3, timeout=2)
+
+        def handle(event):
+            barrier.wait()  # only passes if all three events are in flight at once
+
+        stats = WebhookStats()
+        with patch('run_line.handle_message', side_effect=handle) as mock_handle, \
+             patch('run_line.webhook_stats', stats):
+            run_line.handle_events([self._event() for _ in range(3)])
+
+        assert mock_handle.call_count == 3
+        snapshot = stats.snapshot()
+        assert snapshot["batches"] == 1
+        assert snapshot["max_batch_size"] == 3
+        assert snapshot["events"] == 3
+
+    def test_non_text_events_are_ignored_and_failures_are_returned(self):
+        import run_line
+
+        events = [self._event(), Mock(), self._event()]
+        with patch('run_line.handle_message', side_effect=[RuntimeError("boom"), None]) as mock_handle:
+            failed = run_line.handle_events(events)
+
+        assert mock_handle.call_count == 2
+        assert len(failed) == 1 and failed[0] in (events[0], events[2])
+
+    def test_only_events_that_failed_before_replying_are_retried(self):
+        import json
+        import run_line
+        from core.job_queue import RetryJob
+
+        body = json.dumps({"events": [{"webhookEventId": f"E{i}"} for i in range(3)]})
+        failed = [Mock(webhook_event_id="E1")]
+
+        run_line.retry_failed_events({"body": body, "signature": "sig"}, [])
+        with pytest.raises(RetryJob) as excinfo:
+            run_line.retry_failed_events({"body": body, "signature": "sig", "skip": ["E0"]}, failed)
+
+        assert json.loads(excinfo.value.payload) == {"body": body, "signature": "sig", "skip": ["E0", "E2"]}
+
+    @patch('run_line.line_bot_api')
+    def test_failed_reply_is_not_raised(self, mock_api):
+        import run_line
+
+        mock_api.reply_message.side_effect = RuntimeError("invalid reply token")
+        run_line.reply_with_result("token", {"media_list": _media(1)})
+
+        assert mock_api.reply_message.call_count == 2
@@ -0,0 +1,271 @@
+"""Tests for the media proxy and its content-addressed disk cache."""
+
+import os
+import threading
+from unittest.mock import patch
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+from core.media_proxy import MediaCache, MediaProxy, MediaFetchError, MediaTooLarge
+import run_app
+import run_line
+
+
+class FakeResponse:
+    def __init__(self, body=b"", status_code=200, content_type="image/jpeg", chunk=4):
+        self.body = body
+        self.status_code = status_code
+        self.headers = {"Content-Type": content_type, "Content-Length": str(len(body))}
+        self.chunk = chunk
+        self.closed = False
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.body), self.chunk):
+            yield self.body[start:start + self.chunk]
+
+    def close(self):
+        self.closed = True
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def _cache(tmp_path, bodies, **kwargs):
+    """A cache whose downloads return the body registered for each URL."""
+    fetched = []
+
+    def fetch(url):
+        fetched.append(url)
+        body = bodies[url]
+        return body if isinstance(body, FakeResponse) else FakeResponse(body)
+
+    cache = MediaCache(str(tmp_path / "media"), fetch=fetch, **kwargs)
+    return cache, fetched
+
+
+class TestMediaCache:
+    """Test suite for MediaCache."""
+
+    def test_downloads_once_and_serves_from_disk(self, tmp_path):
+        cache, fetched = _cache(tmp_path, {"https://cdn/a.jpg": b"image-bytes"})
+
+        first = cache.fetch("https://cdn/a.jpg")
+        second = cache.fetch("https://cdn/a.jpg")
+
+        assert fetched == ["https://cdn/a.jpg"]
+        assert first == second
+        assert first.content_type == "image/jpeg"
+        with open(first.path, "rb") as f:
+            assert f.read() == b"image-bytes"
+        assert cache.stats()["hits"] == 1
+        assert cache.stats()["misses"] == 1
+
+    def test_identical_content_shares_one_file(self, tmp_path):
+        cache, _ = _cache(tmp_path, {"https://cdn/a.jpg?sig=1": b"same", "https://cdn/a.jpg?sig=2": b"same"})
+
+        first = cache.fetch("https://cdn/a.jpg?sig=1")
+        second = cache.fetch("https://cdn/a.jpg?sig=2")
+
+        assert first.path == second.path
+        assert cache.stats()["entries"] == 2
+        assert cache.stats()["files"] == 1
+        assert cache.stats()["bytes"] == 4
+
+    def test_evicts_least_recently_used_by_total_bytes(self, tmp_path):
+        clock = FakeClock()
+        bodies = {f"https://cdn/{name}": name.encode() * 10 for name in ("a", "b", "c")}
+        cache, fetched = _cache(tmp_path, bodies, max_bytes=25, clock=clock)
+
+        a = cache.fetch("https://cdn/a")
+        clock.now += 100
+        cache.fetch("https://cdn/b")
+        clock.now += 100
+        cache.fetch("https://cdn/a")  # touch: b is now the least recently used
+        clock.now += 100
+        cache.fetch("https://cdn/c")
+
+        assert os.path.exists(a.path)
+        assert cache.stats()["bytes"] == 20
+        assert cache.stats()["evictions"] == 1
+        cache.fetch("https://cdn/b")
+        assert fetched.count("https://cdn/b") == 2
+
+    def test_redownloads_when_file_was_removed(self, tmp_path):
+        cache, fetched = _cache(tmp_path, {"https://cdn/a": b"bytes"})
+        os.unlink(cache.fetch("https://cdn/a").path)
+
+        assert os.path.exists(cache.fetch("https://cdn/a").path)
+        assert len(fetched) == 2
+
+    def test_rejects_objects_over_the_size_limit(self, tmp_path):
+        chunked = FakeResponse(b"x" * 100)
+        del chunked.headers["Content-Length"]
+        cache, _ = _cache(tmp_path, {"https://cdn/big": FakeResponse(b"x" * 100), "https://cdn/chunked": chunked},
+                          max_object_bytes=10)
+
+        with pytest.raises(MediaTooLarge):
+            cache.fetch("https://cdn/big")
+        with pytest.raises(MediaTooLarge):
+            cache.fetch("https://cdn/chunked")
+        assert os.listdir(tmp_path / "media" / "tmp") == []
+        assert cache.stats()["entries"] == 0
+
+    def test_upstream_errors_are_not_cached(self, tmp_path):
+        cache, fetched = _cache(tmp_path, {
+            "https://cdn/gone": FakeResponse(status_code=403),
+            "https://cdn/page": FakeResponse(b"<html>", content_type="text/html"),
+        })
+
+        with pytest.raises(MediaFetchError) as excinfo:
+            cache.fetch("https://cdn/gone")
+        assert excinfo.value.status_code == 403
+        with pytest.raises(MediaFetchError):
+            cache.fetch("https://cdn/page")
+        assert cache.stats()["entries"] == 0
+        assert cache.stats()["errors"] == 2
+
+    def test_concurrent_requests_download_once(self, tmp_path):
+        started = threading.Event()
+        release = threading.Event()
+        fetched = []
+
+        def fetch(url):
+            fetched.append(url)
+            started.set()
+            release.wait(5)
+            return FakeResponse(b"video", content_type="video/mp4")
+
+        cache = MediaCache(str(tmp_path / "media"), fetch=fetch)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.fetch("https://cdn/v.mp4"))) for _ in range(4)]
+        threads[0].start()
+        started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        while cache._flight.stats()["collapsed"] < 3:
+            pass
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        assert fetched == ["https://cdn/v.mp4"]
+        assert len({result.path for result in results}) == 1
+        assert cache.stats()["collapsed"] == 3
+
+
+class TestMediaProxy:
+    """Test suite for signed proxy URLs."""
+
+    def setup_method(self):
+        self.proxy = MediaProxy(cache=None, base_url="https://bot.example.com/", secret=b"secret")
+
+    def test_round_trips_signed_urls(self):
+        url = "https://cdn.example.com/v/t51/photo.jpg?stp=dst-jpg&oe=65F0A1B2"
+        proxied = self.proxy.proxy_url(url)
+
+        assert proxied.startswith("https://bot.example.com/media/")
+        assert self.proxy.resolve(proxied.rsplit("/", 1)[1]) == url
+
+    def test_rejects_tampered_tokens(self):
+        token = self.proxy.sign("https://cdn.example.com/a.jpg")
+        forged = MediaProxy(cache=None, base_url="https://bot.example.com", secret=b"other").sign("https://evil/")
+
+        assert self.proxy.resolve(forged) is None
+        assert self.proxy.resolve(token[:-2] + "xx") is None
+        assert self.proxy.resolve("garbage") is None
+
+    def test_rewrites_media_urls_without_changing_the_result(self):
+        result = {
+            "media_list": [
+                {"type": "video", "url": "https://cdn/v.mp4", "thumbnail": "https://cdn/t.jpg"},
+                {"type": "image", "url": "https://cdn/i.jpg", "thumbnail": None},
+            ],
+            "media_count": 2,
+        }
+        rewritten = self.proxy.rewrite_result(result)
+
+        assert rewritten["media_list"][0]["url"].startswith("https://bot.example.com/media/")
+        assert rewritten["media_list"][0]["thumbnail"].startswith("https://bot.example.com/media/")
+        assert rewritten["media_list"][1]["thumbnail"] is None
+        assert rewritten["media_count"] == 2
+        assert result["media_list"][0]["url"] == "https://cdn/v.mp4"
+
+    def test_disabled_without_base_url(self):
+        proxy = MediaProxy(cache=None, base_url="", secret=b"secret")
+        result = {"media_url": "https://cdn/a.jpg"}
+
+        assert proxy.rewrite_result(result) is result
+        assert proxy.resolve(self.proxy.sign("https://cdn/a.jpg")) is None
+
+
+@pytest.fixture
+def proxy(tmp_path):
+    cache, _ = _cache(tmp_path, {
+        "https://cdn/v.mp4": FakeResponse(bytes(range(100)), content_type="video/mp4"),
+        "https://cdn/big.mp4": FakeResponse(b"x" * 200, content_type="video/mp4"),
+        "https://cdn/expired.jpg": FakeResponse(status_code=403),
+    }, max_object_bytes=150)
+    proxy = MediaProxy(cache, base_url="https://bot.example.com", secret=b"secret")
+    with patch("run_line.media_proxy", proxy), patch("run_app.media_proxy", proxy):
+        yield proxy
+
+
+class TestFlaskMediaRoute:
+    """Test suite for the /media route of the Flask LINE bot."""
+
+    def setup_method(self):
+        self.client = run_line.app.test_client()
+
+    def test_serves_cached_media_with_range_support(self, proxy):
+        token = proxy.sign("https://cdn/v.mp4")
+
+        full = self.client.get(f"/media/{token}")
+        partial = self.client.get(f"/media/{token}", headers={"Range": "bytes=10-19"})
+
+        assert full.status_code == 200
+        assert full.mimetype == "video/mp4"
+        assert full.data == bytes(range(100))
+        assert partial.status_code == 206
+        assert partial.data == bytes(range(10, 20))
+        assert partial.headers["Content-Range"] == "bytes 10-19/100"
+        full.close()
+        partial.close()
+
+    def test_rejects_unsigned_urls(self, proxy):
+        assert self.client.get("/media/aHR0cHM6Ly9ldmls.AAAA").status_code == 404
+
+    def test_redirects_oversized_media_and_reports_upstream_errors(self, proxy):
+        big = self.client.get(f"/media/{proxy.sign('https://cdn/big.mp4')}")
+        expired = self.client.get(f"/media/{proxy.sign('https://cdn/expired.jpg')}")
+
+        assert big.status_code == 302
+        assert big.headers["Location"] == "https://cdn/big.mp4"
+        assert expired.status_code == 404
+
+
+class TestAiohttpMediaRoute:
+    """Test suite for the /media route of the single-process server."""
+
+    @pytest.mark.asyncio
+    async def test_serves_cached_media_with_range_support(self, proxy):
+        client = TestClient(TestServer(run_app.create_web_app()))
+        await client.start_server()
+        try:
+            token = proxy.sign("https://cdn/v.mp4")
+            full = await client.get(f"/media/{token}")
+            partial = await client.get(f"/media/{token}", headers={"Range": "bytes=90-"})
+
+            assert full.status == 200
+            assert full.headers["Content-Type"] == "video/mp4"
+            assert await full.read() == bytes(range(100))
+            assert partial.status == 206
+            assert await partial.read() == bytes(range(90, 100))
+            assert (await client.get("/media/forged.token")).status == 404
+        finally:
+            await client.close()
@@ -0,0 +1,159 @@
+"""Tests for the negative cache of failed lookups."""
+
+import json
+
+import pytest
+import requests
+from unittest.mock import Mock, patch
+
+from core.logic import process_instagram_url, process_instagram_url_async
+from core.negative_cache import (
+    NegativeCache, classify_failure, worst_failure,
+    NOT_FOUND, PRIVATE, UNSUPPORTED, EMPTY, PROVIDER_ERROR,
+)
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+TTLS = {NOT_FOUND: 600, PRIVATE: 600, UNSUPPORTED: 120, EMPTY: 120, PROVIDER_ERROR: 15}
+
+
+class TestClassifyFailure:
+    """Upstream failures are sorted into classes with different lifetimes."""
+
+    def test_status_codes(self):
+        assert classify_failure(404) == NOT_FOUND
+        assert classify_failure(410) == NOT_FOUND
+        assert classify_failure(400) == UNSUPPORTED
+        assert classify_failure(422) == UNSUPPORTED
+
+    def test_provider_side_problems_are_transient(self):
+        for status_code in (None, 500, 503, 401, 403, 429):
+            assert classify_failure(status_code) == PROVIDER_ERROR
+
+    def test_error_message_refines_the_class(self):
+        assert classify_failure(400, {"message": "This account is private"}) == PRIVATE
+        assert classify_failure(200, {"error": {"detail": "Media not found or deleted"}}) == NOT_FOUND
+        # A private account reported with a 404 is still private
+        assert classify_failure(404, {"message": "Private account"}) == PRIVATE
+
+    def test_empty_response(self):
+        assert classify_failure(200, {"medias": []}) == EMPTY
+        # A success status with an unreadable body is the provider's fault
+        assert classify_failure(200, None) == PROVIDER_ERROR
+
+    def test_worst_failure_prefers_post_level_classes(self):
+        assert worst_failure(None, EMPTY) == EMPTY
+        assert worst_failure(PROVIDER_ERROR, None) == PROVIDER_ERROR
+        assert worst_failure(PROVIDER_ERROR, NOT_FOUND) == NOT_FOUND
+        assert worst_failure(EMPTY, PRIVATE) == PRIVATE
+
+
+class TestNegativeCache:
+    """Test suite for NegativeCache."""
+
+    def setup_method(self):
+        self.clock = FakeClock()
+        self.cache = NegativeCache(max_entries=2, ttls=TTLS, clock=self.clock)
+
+    def test_ttl_per_failure_class(self):
+        self.cache.set("GONE", NOT_FOUND)
+        self.cache.set("DOWN", PROVIDER_ERROR)
+        assert self.cache.get("GONE") == NOT_FOUND
+        assert self.cache.get("DOWN") == PROVIDER_ERROR
+
+        self.clock.now += 16
+        assert self.cache.get("DOWN") is None
+        assert self.cache.get("GONE") == NOT_FOUND
+
+        self.clock.now += 600
+        assert self.cache.get("GONE") is None
+
+        stats = self.cache.stats()
+        assert stats["hits"] == {NOT_FOUND: 2, PROVIDER_ERROR: 1}
+        assert stats["stored"] == {NOT_FOUND: 1, PROVIDER_ERROR: 1}
+
+    def test_lru_cap(self):
+        self.cache.set("A", NOT_FOUND)
+        self.cache.set("B", NOT_FOUND)
+        self.cache.get("A")  # A becomes most recently used
+        self.cache.set("C", EMPTY)
+
+        assert self.cache.get("B") is None
+        assert self.cache.get("A") == NOT_FOUND
+        assert len(self.cache) == 2
+        assert self.cache.stats()["evictions"] == 1
+
+    def test_classes_without_ttl_and_disabled_cache_store_nothing(self):
+        cache = NegativeCache(ttls={NOT_FOUND: 600})
+        cache.set("A", PROVIDER_ERROR)
+        assert cache.get("A") is None
+
+        cache = NegativeCache(ttls=TTLS, enabled=False)
+        cache.set("A", NOT_FOUND)
+        assert cache.get("A") is None
+        assert len(cache) == 0
+
+
+def _response(status_code, body):
+    response = Mock()
+    response.status_code = status_code
+    response.headers = {}
+    response.content = json.dumps(body).encode()
+    response.json.return_value = body
+    if status_code >= 400:
+        response.raise_for_status.side_effect = requests.HTTPError(f"{status_code} Error")
+    else:
+        response.raise_for_status.return_value = None
+    return response
+
+
+@patch('core.logic.RAPID_API_KEY', 'test_api_key')
+class TestLookupIntegration:
+    """Repeated links to broken posts fail without calling the upstream again."""
+
+    @pytest.fixture
+    def clock(self):
+        clock = FakeClock()
+        with patch('core.logic.negative_cache', NegativeCache(ttls=TTLS, clock=clock)) as cache:
+            clock.cache = cache
+            yield clock
+
+    def test_deleted_post_is_looked_up_once(self, clock):
+        with patch('requests.Session.get', return_value=_response(404, {"message": "Not Found"})) as mock_get:
+            for _ in range(3):
+                assert process_instagram_url("https://www.instagram.com/p/GONE1/") is None
+        assert mock_get.call_count == 1
+        assert clock.cache.stats()["hits"] == {NOT_FOUND: 2}
+
+    def test_private_post_from_error_body(self, clock):
+        body = {"error": "This account is private"}
+        with patch('requests.Session.get', return_value=_response(400, body)) as mock_get:
+            assert process_instagram_url("https://www.instagram.com/p/PRIV1/") is None
+            assert process_instagram_url("https://www.instagram.com/p/PRIV1/") is None
+        assert mock_get.call_count == 1
+        assert clock.cache.get("PRIV1") == PRIVATE
+
+    def test_empty_result_expires(self, clock):
+        with patch('requests.Session.get', return_value=_response(200, {"medias": []})) as mock_get:
+            assert process_instagram_url("https://www.instagram.com/p/EMPTY1/") is None
+            assert process_instagram_url("https://www.instagram.com/p/EMPTY1/") is None
+            assert mock_get.call_count == 1
+
+            clock.now += 121
+            mock_get.return_value = _response(200, {"medias": [{"url": "https://example.com/a.jpg"}]})
+            assert process_instagram_url("https://www.instagram.com/p/EMPTY1/")["media_count"] == 1
+        assert mock_get.call_count == 2
+
+    @pytest.mark.asyncio
+    async def test_async_lookup_uses_the_same_cache(self, clock):
+        clock.cache.set("GONE2", NOT_FOUND)
+        with patch('core.logic.async_http_client') as client:
+            assert await process_instagram_url_async("https://www.instagram.com/p/GONE2/") is None
+        assert not client.get.called
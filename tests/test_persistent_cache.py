@@ -0,0 +1,248 @@
+"""Tests for the cross-process persistent result cache."""
+
+import asyncio
+import multiprocessing
+import time
+
+import pytest
+from core.cache import ResultCache
+from core.persistent_cache import SQLiteCacheBackend, encode_value, decode_value
+
+
+RESULT = {
+    "type": "carousel",
+    "media_count": 2,
+    "media_list": [
+        {"url": "https://example.com/1.jpg", "type": "image", "thumbnail": None},
+        {"url": "https://example.com/2.mp4", "type": "video", "thumbnail": "https://example.com/2.jpg"},
+    ],
+    "media_url": "https://example.com/1.jpg",
+    "preview_url": "https://example.com/1.jpg",
+}
+
+
+class FakeClock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def _write_from_other_process(path, key):
+    SQLiteCacheBackend(path).set(key, RESULT, ttl=600)
+
+
+class TestEncoding:
+    """Test suite for the stored value encoding."""
+
+    def test_round_trip(self):
+        assert decode_value(encode_value(RESULT)) == RESULT
+
+    def test_encoding_is_compact(self):
+        """Stored entries are smaller than the plain JSON for repetitive payloads."""
+        import json
+        value = {"media_list": [{"url": f"https://scontent.cdninstagram.com/v/t51/{i}.jpg", "type": "image"} for i in range(20)]}
+        assert len(encode_value(value)) < len(json.dumps(value)) / 2
+
+    def test_corrupt_or_foreign_data_is_a_miss(self):
+        assert decode_value(b"") is None
+        assert decode_value(b"\x00garbage") is None
+        assert decode_value(b"\x01not-zlib") is None
+
+
+class TestSQLiteCacheBackend:
+    """Test suite for SQLiteCacheBackend."""
+
+    def test_get_and_ttl(self, tmp_path):
+        clock = FakeClock()
+        backend = SQLiteCacheBackend(str(tmp_path / "cache.sqlite3"), clock=clock)
+        backend.set("A", RESULT, ttl=60)
+
+        value, remaining = backend.get("A")
+        assert value == RESULT
+        assert remaining == 60
+
+        clock.now += 61
+        assert backend.get("A") is None
+        assert backend.stats()["misses"] == 1
+
+    def test_stale_entries_are_kept_for_stale_ttl(self, tmp_path):
+        clock = FakeClock()
+        backend = SQLiteCacheBackend(str(tmp_path / "cache.sqlite3"), stale_ttl=300, clock=clock)
+        backend.set("A", RESULT, ttl=60)
+
+        clock.now += 120
+        assert backend.get("A") is None
+        value, remaining = backend.get("A", allow_stale=True)
+        assert value == RESULT
+        assert remaining == -60
+
+        # Entries past stale_ttl are purged on the next write
+        clock.now += 300
+        backend.set("B", RESULT, ttl=60)
+        assert backend.get("A", allow_stale=True) is None
+        assert backend.stats()["entries"] == 1
+
+    def test_survives_restart(self, tmp_path):
+        """A new backend instance on the same file sees earlier entries."""
+        path = str(tmp_path / "cache.sqlite3")
+        SQLiteCacheBackend(path).set("A", RESULT, ttl=60)
+        assert SQLiteCacheBackend(path).get("A")[0] == RESULT
+
+    def test_shared_across_processes(self, tmp_path):
+        """Entries written by another process are visible."""
+        path = str(tmp_path / "cache.sqlite3")
+        backend = SQLiteCacheBackend(path)
+        backend.get("warmup")  # create the schema before the child writes
+
+        process = multiprocessing.get_context("spawn").Process(target=_write_from_other_process, args=(path, "B"))
+        process.start()
+        process.join(30)
+
+        assert process.exitcode == 0
+        assert backend.get("B")[0] == RESULT
+
+    def test_byte_cap_evicts_least_recently_used(self, tmp_path):
+        clock = FakeClock()
+        size = len(encode_value(RESULT))
+        backend = SQLiteCacheBackend(str(tmp_path / "cache.sqlite3"), max_bytes=size * 2, clock=clock)
+
+        backend.set("A", RESULT, ttl=600)
+        clock.now += 100
+        backend.set("B", RESULT, ttl=600)
+        clock.now += 100
+        assert backend.get("A") is not None  # touches A
+        clock.now += 100
+        backend.set("C", RESULT, ttl=600)
+
+        assert backend.get("B") is None
+        assert backend.get("A") is not None
+        assert backend.get("C") is not None
+        stats = backend.stats()
+        assert stats["evictions"] == 1
+        assert stats["bytes"] <= size * 2
+
+    def test_running_byte_total_tracks_replacements_and_sweeps(self, tmp_path):
+        clock = FakeClock()
+        path = str(tmp_path / "cache.sqlite3")
+        backend = SQLiteCacheBackend(path, clock=clock)
+        small, large = {"n": 1}, {"n": "x" * 500}
+
+        backend.set("A", small, ttl=60)
+        backend.set("A", large, ttl=60)  # replace
+        backend.set("B", small, ttl=600)
+        assert backend.stats()["bytes"] == len(encode_value(large)) + len(encode_value(small))
+
+        clock.now += 120
+        backend.set("C", small, ttl=600)  # sweeps the expired A
+        assert backend.stats()["bytes"] == 2 * len(encode_value(small))
+        # a fresh process sees the same total without rescanning
+        assert SQLiteCacheBackend(path, clock=clock).stats()["bytes"] == 2 * len(encode_value(small))
+
+    def test_evicts_as_many_old_entries_as_needed_in_one_write(self, tmp_path):
+        clock = FakeClock()
+        size = len(encode_value(RESULT))
+        backend = SQLiteCacheBackend(str(tmp_path / "cache.sqlite3"), max_bytes=size * 100, clock=clock)
+        for i in range(100):
+            backend.set(f"K{i}", RESULT, ttl=600)
+            clock.now += 1
+        backend.max_bytes = size * 10
+
+        backend.set("NEW", RESULT, ttl=600)
+
+        stats = backend.stats()
+        assert stats["entries"] == 10
+        assert stats["bytes"] == size * 10
+        assert stats["evictions"] == 91
+        assert backend.get("NEW") is not None
+        assert backend.get("K99") is not None
+
+    def test_unusable_path_degrades_to_misses(self, tmp_path):
+        """Storage errors are logged and treated as misses instead of raising."""
+        blocker = tmp_path / "file"
+        blocker.write_text("x")
+        backend = SQLiteCacheBackend(str(blocker / "cache.sqlite3"))
+        backend.set("A", RESULT, ttl=60)
+        assert backend.get("A") is None
+        assert backend.stats()["errors"] >= 2
+
+
+class TestResultCacheWithBackend:
+    """ResultCache falls through to the persistent backend."""
+
+    def test_backend_hit_after_restart(self, tmp_path):
+        path = str(tmp_path / "cache.sqlite3")
+        ResultCache(backend=SQLiteCacheBackend(path)).set("A", RESULT)
+
+        cache = ResultCache(backend=SQLiteCacheBackend(path))
+        assert cache.get("A") == RESULT
+        assert len(cache) == 1
+        stats = cache.stats()
+        assert stats["hits"] == 1
+        assert stats["backend"]["hits"] == 1
+
+    def test_clear_clears_backend(self, tmp_path):
+        backend = SQLiteCacheBackend(str(tmp_path / "cache.sqlite3"))
+        cache = ResultCache(backend=backend)
+        cache.set("A", RESULT)
+        cache.clear()
+        assert cache.get("A") is None
+        assert backend.stats()["entries"] == 0
+
+
+class SlowBackend:
+    """A backend whose calls block like SQLite waiting on another process's write lock."""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.stored = {}
+
+    def get(self, key, allow_stale=False):
+        time.sleep(self.delay)
+        return (self.stored[key], 60.0) if key in self.stored else None
+
+    def set(self, key, value, ttl):
+        time.sleep(self.delay)
+        self.stored[key] = value
+
+    def clear(self):
+        self.stored.clear()
+
+
+class TestAsyncResultCache:
+    """The asyncio accessors keep backend I/O off the event loop."""
+
+    @pytest.mark.asyncio
+    async def test_backend_io_does_not_block_the_loop(self):
+        backend = SlowBackend(delay=0.2)
+        backend.stored["A"] = RESULT
+        cache = ResultCache(backend=backend)
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        task = asyncio.create_task(ticker())
+        try:
+            assert await cache.aget("A") == RESULT
+            assert await cache.aget_stale("missing") is None
+        finally:
+            task.cancel()
+        assert ticks >= 10
+
+    @pytest.mark.asyncio
+    async def test_set_writes_behind(self):
+        backend = SlowBackend(delay=0.2)
+        cache = ResultCache(backend=backend)
+
+        started = time.monotonic()
+        cache.aset("A", RESULT)
+        assert time.monotonic() - started < 0.1
+        assert await cache.aget("A") == RESULT  # served from memory at once
+
+        await asyncio.to_thread(cache.flush)
+        assert backend.stored["A"] == RESULT
@@ -0,0 +1,174 @@
+"""Tests for the LINE preview image pipeline."""
+
+import io
+import struct
+import zlib
+from unittest.mock import patch
+
+import pytest
+
+from core.media_proxy import MediaCache, MediaProxy
+from core.previews import PreviewGenerator, PreviewService, PreviewUnavailable, FALLBACK_TOKEN, render_fallback_png
+import run_line
+
+
+class FakeResponse:
+    def __init__(self, body=b"", status_code=200, content_type="image/jpeg"):
+        self.body = body
+        self.status_code = status_code
+        self.headers = {"Content-Type": content_type, "Content-Length": str(len(body))}
+
+    def iter_content(self, chunk_size):
+        yield self.body
+
+    def close(self):
+        pass
+
+
+def _decode_png(data):
+    """Return (width, height, rows of RGB bytes) for the 8-bit RGB PNGs produced by render_fallback_png."""
+    assert data[:8] == b"\x89PNG\r\n\x1a\n"
+    width, height = struct.unpack(">II", data[16:24])
+    idat_length = struct.unpack(">I", data[33:37])[0]
+    raw = zlib.decompress(data[41:41 + idat_length])
+    stride = width * 3 + 1
+    return width, height, [raw[y * stride + 1:(y + 1) * stride] for y in range(height)]
+
+
+def _jpeg(width, height):
+    image_module = pytest.importorskip("PIL.Image")
+    buffer = io.BytesIO()
+    image_module.new("RGB", (width, height), (200, 30, 30)).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+def _service(tmp_path, bodies, **kwargs):
+    fetched = []
+
+    def fetch(url):
+        fetched.append(url)
+        return bodies[url]
+
+    cache = MediaCache(str(tmp_path / "media"), fetch=fetch)
+    proxy = MediaProxy(cache, base_url="https://bot.example.com", secret=b"secret", route="preview")
+    return PreviewService(proxy, PreviewGenerator(cache, **kwargs)), fetched
+
+
+class TestFallbackImage:
+    """The fallback preview is generated locally without Pillow."""
+
+    def test_renders_play_button_png(self):
+        width, height, rows = _decode_png(render_fallback_png(64))
+
+        assert (width, height) == (64, 64)
+        assert rows[0][:3] == bytes((38, 38, 38))
+        assert rows[32][3 * 30:3 * 31] == bytes((235, 235, 235))
+
+
+class TestPreviewService:
+    """Test suite for PreviewService and PreviewGenerator."""
+
+    def test_serves_fallback_for_missing_and_failed_sources(self, tmp_path):
+        service, _ = _service(tmp_path, {"https://cdn/expired.jpg": FakeResponse(status_code=403)})
+
+        assert service.preview_url(None) == f"https://bot.example.com/preview/{FALLBACK_TOKEN}"
+        fallback = service.render(service.proxy.sign("https://cdn/expired.jpg"))
+        assert fallback.content_type == "image/png"
+        assert service.render(FALLBACK_TOKEN).path == fallback.path
+        assert service.render("forged.token") is None
+
+    def test_without_pillow_uses_small_originals_only(self, tmp_path):
+        service, _ = _service(tmp_path, {
+            "https://cdn/small.jpg": FakeResponse(b"jpeg-bytes"),
+            "https://cdn/large.jpg": FakeResponse(b"x" * 100),
+        }, max_bytes=50)
+
+        with patch("core.previews.Image", None):
+            assert service.generator.generate("https://cdn/small.jpg").content_type == "image/jpeg"
+            with pytest.raises(PreviewUnavailable):
+                service.generator.generate("https://cdn/large.jpg")
+            assert service.render(service.proxy.sign("https://cdn/large.jpg")).content_type == "image/png"
+        assert service.generator.stats()["passthrough"] == 1
+
+    def test_downscales_images_within_limits(self, tmp_path):
+        image_module = pytest.importorskip("PIL.Image")
+        service, _ = _service(tmp_path, {"https://cdn/photo.jpg": FakeResponse(_jpeg(1080, 1350))},
+                              max_dimension=240, max_bytes=20_000)
+
+        preview = service.render(service.proxy.sign("https://cdn/photo.jpg"))
+
+        assert preview.content_type == "image/jpeg"
+        assert preview.size <= 20_000
+        with image_module.open(preview.path) as image:
+            assert max(image.size) == 240
+
+    def test_reuses_preview_for_identical_content(self, tmp_path):
+        body = _jpeg(600, 600)
+        service, fetched = _service(tmp_path, {
+            "https://cdn/photo.jpg?sig=1": FakeResponse(body),
+            "https://cdn/photo.jpg?sig=2": FakeResponse(body),
+        })
+
+        first = service.generator.generate("https://cdn/photo.jpg?sig=1")
+        second = service.generator.generate("https://cdn/photo.jpg?sig=2")
+
+        assert first.path == second.path
+        assert service.generator.stats()["generated"] == 1
+        assert service.generator.stats()["hits"] == 1
+
+
+class TestLinePreviewMessages:
+    """LINE messages point preview_image_url at the preview endpoint."""
+
+    def test_uses_preview_endpoint_and_fallback(self, tmp_path):
+        service, _ = _service(tmp_path, {})
+        with patch("run_line.preview_service", service), patch.object(service.generator, "submit") as submit:
+            image = run_line.create_image_message({"type": "image", "url": "https://cdn/i.jpg"})
+            video = run_line.create_video_message({"type": "video", "url": "https://cdn/v.mp4", "thumbnail": None})
+
+        assert image.original_content_url == "https://cdn/i.jpg"
+        assert service.proxy.resolve(image.preview_image_url.rsplit("/", 1)[1]) == "https://cdn/i.jpg"
+        assert video.preview_image_url == f"https://bot.example.com/preview/{FALLBACK_TOKEN}"
+        submit.assert_called_once_with("https://cdn/i.jpg")
+
+    def test_flask_route_serves_fallback(self, tmp_path):
+        service, _ = _service(tmp_path, {})
+        with patch("run_line.preview_service", service):
+            response = run_line.app.test_client().get(f"/preview/{FALLBACK_TOKEN}")
+
+        assert response.status_code == 200
+        assert response.mimetype == "image/png"
+        assert _decode_png(response.data)[:2] == (240, 240)
+        response.close()
+
+
+class TestFallbackWithoutPreviews:
+    """Videos without a thumbnail never depend on an external placeholder image."""
+
+    def _disabled_service(self, tmp_path, base_url):
+        cache = MediaCache(str(tmp_path / "media"), fetch=lambda url: None)
+        proxy = MediaProxy(cache, base_url=base_url, secret=b"secret", enabled=False, route="preview")
+        return PreviewService(proxy, PreviewGenerator(cache))
+
+    def test_disabled_previews_still_serve_the_bundled_fallback(self, tmp_path):
+        service = self._disabled_service(tmp_path, "https://bot.example.com")
+        disabled_proxy = MediaProxy(cache=None, base_url="", secret=b"")
+        with patch("run_line.preview_service", service), patch("run_line.media_proxy", disabled_proxy):
+            video = run_line.create_video_message({"type": "video", "url": "https://cdn/v.mp4", "thumbnail": None})
+            response = run_line.app.test_client().get(f"/preview/{FALLBACK_TOKEN}")
+
+        assert video.preview_image_url == f"https://bot.example.com/preview/{FALLBACK_TOKEN}"
+        assert response.status_code == 200
+        assert response.mimetype == "image/png"
+        assert service.render(service.proxy.sign("https://cdn/i.jpg")) is None
+        response.close()
+
+    def test_without_a_public_url_the_video_link_is_sent_as_text(self, tmp_path):
+        service = self._disabled_service(tmp_path, "")
+        disabled_proxy = MediaProxy(cache=None, base_url="", secret=b"")
+        with patch("run_line.preview_service", service), patch("run_line.media_proxy", disabled_proxy):
+            message = run_line.create_video_message({"type": "video", "url": "https://cdn/v.mp4", "thumbnail": None})
+
+        assert isinstance(message, run_line.TextSendMessage)
+        assert "https://cdn/v.mp4" in message.text
+        assert service.render(FALLBACK_TOKEN) is None
@@ -0,0 +1,240 @@
+"""Tests for upstream provider adapters, ordering and hedged lookups."""
+
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+import requests
+from unittest.mock import Mock, patch
+
+from core.http_client import AsyncResponse
+from core.logic import process_instagram_url, process_instagram_url_async
+from core.config import provider_rate_limit
+from core.providers import (
+    DownloaderProvider, LooterProvider, ScraperProvider, ProviderPool, MIN_SAMPLES, parse_providers
+)
+
+
+class TestNormalizers:
+    """Each adapter turns its API's response into the common media list."""
+
+    def test_downloader_uses_medias(self):
+        data = {"medias": [{"url": "https://example.com/a.jpg"}, {"video_url": "https://example.com/b.mp4"}]}
+        media = DownloaderProvider().normalize(data)
+        assert [m["type"] for m in media] == ["image", "video"]
+
+    def test_looter(self):
+        data = {"status": True, "data": {"medias": [
+            {"type": "image", "link": "https://example.com/a.jpg"},
+            {"type": "video", "link": "https://example.com/b.mp4", "thumbnail": "https://example.com/b.jpg"},
+        ]}}
+        assert LooterProvider().normalize(data) == [
+            {"url": "https://example.com/a.jpg", "type": "image", "thumbnail": None},
+            {"url": "https://example.com/b.mp4", "type": "video", "thumbnail": "https://example.com/b.jpg"},
+        ]
+
+    def test_scraper_carousel(self):
+        data = {"data": {"carousel_media": [
+            {"image_versions": {"items": [{"url": "https://example.com/a.jpg"}]}},
+            {"is_video": True, "video_url": "https://example.com/b.mp4",
+             "image_versions": {"items": [{"url": "https://example.com/b.jpg"}]}},
+        ]}}
+        assert ScraperProvider().normalize(data) == [
+            {"url": "https://example.com/a.jpg", "type": "image", "thumbnail": None},
+            {"url": "https://example.com/b.mp4", "type": "video", "thumbnail": "https://example.com/b.jpg"},
+        ]
+
+    def test_scraper_single_post(self):
+        data = {"data": {"image_versions": {"items": [{"url": "https://example.com/a.jpg"}]}}}
+        assert ScraperProvider().normalize(data)[0]["url"] == "https://example.com/a.jpg"
+
+    def test_build_request(self):
+        url, params, headers = ScraperProvider(api_key="k").build_request("https://www.instagram.com/p/X/")
+        assert url == "https://instagram-scraper-api2.p.rapidapi.com/v1/post_info"
+        assert params == {"code_or_id_or_url": "https://www.instagram.com/p/X/"}
+        assert headers["X-RapidAPI-Host"] == "instagram-scraper-api2.p.rapidapi.com"
+        assert headers["X-RapidAPI-Key"] == "k"
+
+    def test_parse_providers(self):
+        assert [p.name for p in parse_providers("looter, scraper,unknown,looter")] == ["looter", "scraper"]
+        assert [p.name for p in parse_providers("")] == ["downloader"]
+
+
+class TestProviderPool:
+    """Statistics drive the provider order and the hedge delay."""
+
+    def test_configured_order_until_enough_samples(self):
+        first, second = DownloaderProvider(), LooterProvider()
+        pool = ProviderPool([first, second])
+        assert pool.ordered() == [first, second]
+
+        for _ in range(MIN_SAMPLES):
+            first.stats.record(True, 2.0)
+            second.stats.record(True, 0.2)
+        assert pool.ordered() == [second, first]
+
+    def test_failures_push_provider_back(self):
+        first, second = DownloaderProvider(), LooterProvider()
+        pool = ProviderPool([first, second])
+        for i in range(MIN_SAMPLES):
+            first.stats.record(i % 4 == 0, 0.1)
+            second.stats.record(True, 0.3)
+        assert pool.ordered() == [second, first]
+
+    def test_hedge_delay_is_p95(self):
+        provider = DownloaderProvider()
+        pool = ProviderPool([provider], default_delay=3.0, min_delay=0.05)
+        assert pool.hedge_delay(provider) == 3.0
+
+        for i in range(100):
+            provider.stats.record(True, (i + 1) / 100)
+        assert pool.hedge_delay(provider) == pytest.approx(0.96)
+        assert pool.stats()["providers"]["downloader"]["p95_ms"] == pytest.approx(960.0)
+
+    def test_streaming_provider(self):
+        pool = ProviderPool([LooterProvider(), DownloaderProvider()])
+        assert pool.streaming_provider().name == "downloader"
+        assert ProviderPool([LooterProvider()]).streaming_provider() is None
+
+
+class TestProviderRateLimits:
+    """Each provider is throttled by its own rate limiter."""
+
+    def test_limits_can_be_set_per_provider(self, monkeypatch):
+        monkeypatch.setenv("RATE_LIMIT_LOOTER_PER_SECOND", "2")
+        monkeypatch.setenv("RATE_LIMIT_LOOTER_PER_DAY", "1000")
+
+        assert provider_rate_limit("looter")["per_second"] == 2
+        assert LooterProvider().limiter.per_day == 1000
+        assert DownloaderProvider().limiter.per_day == provider_rate_limit("downloader")["per_day"]
+
+    def test_providers_do_not_share_a_limiter(self):
+        first, second = DownloaderProvider(), LooterProvider()
+        first.limiter.observe(429, {"Retry-After": "60"})
+
+        assert first.limiter is not second.limiter
+        assert first.limiter.stats()["blocked_for"] > 0
+        assert second.limiter.stats()["blocked_for"] == 0
+        assert set(ProviderPool([first, second]).rate_limit_stats()) == {"downloader", "looter"}
+
+
+def _response(status_code, body):
+    response = Mock()
+    response.status_code = status_code
+    response.headers = {}
+    response.content = json.dumps(body).encode()
+    response.json.return_value = body
+    if status_code >= 400:
+        response.raise_for_status.side_effect = requests.HTTPError(f"{status_code} Error")
+    else:
+        response.raise_for_status.return_value = None
+    return response
+
+
+DOWNLOADER_BODY = {"medias": [{"url": "https://example.com/downloader.jpg"}]}
+LOOTER_BODY = {"data": {"medias": [{"type": "image", "link": "https://example.com/looter.jpg"}]}}
+
+
+@patch('core.logic.RAPID_API_KEY', 'test_api_key')
+class TestHedgedLookups:
+    """A slow or failing primary is backed up by the next provider."""
+
+    @pytest.fixture
+    def pool(self):
+        pool = ProviderPool([DownloaderProvider(), LooterProvider()], default_delay=0.05, min_delay=0.01)
+        with patch('core.logic.provider_pool', pool):
+            yield pool
+
+    def test_slow_primary_is_hedged(self, pool):
+        release = threading.Event()
+
+        def fake_get(url, params=None, **kwargs):
+            if "looter" in url:
+                return _response(200, LOOTER_BODY)
+            release.wait(2)
+            return _response(200, DOWNLOADER_BODY)
+
+        with patch('requests.Session.get', side_effect=fake_get) as mock_get:
+            result = process_instagram_url("https://www.instagram.com/p/HEDGE1/")
+            release.set()
+
+        assert result["media_url"] == "https://example.com/looter.jpg"
+        assert mock_get.call_count == 2
+        stats = pool.stats()["providers"]
+        assert stats["downloader"]["hedges"] == 1
+        assert stats["looter"]["wins"] == 1
+
+    def test_fast_primary_is_not_hedged(self, pool):
+        with patch('requests.Session.get', return_value=_response(200, DOWNLOADER_BODY)) as mock_get:
+            result = process_instagram_url("https://www.instagram.com/p/HEDGE2/")
+
+        assert result["media_url"] == "https://example.com/downloader.jpg"
+        assert mock_get.call_count == 1
+        assert pool.stats()["providers"]["downloader"]["hedges"] == 0
+
+    def test_failed_primary_fails_over(self, pool):
+        # Don't hedge before the HTTP client has finished retrying the primary
+        pool.default_delay = 5.0
+
+        def fake_get(url, params=None, **kwargs):
+            if "looter" in url:
+                return _response(200, LOOTER_BODY)
+            raise requests.ConnectionError("down")
+
+        with patch('requests.Session.get', side_effect=fake_get):
+            result = process_instagram_url("https://www.instagram.com/p/HEDGE3/")
+
+        assert result["media_url"] == "https://example.com/looter.jpg"
+        stats = pool.stats()["providers"]
+        assert stats["downloader"]["failures"] == 1
+        assert stats["downloader"]["hedges"] == 0
+
+    def test_throttled_primary_does_not_block_the_next_provider(self, pool):
+        pool.default_delay = 5.0
+
+        def fake_get(url, params=None, **kwargs):
+            if "looter" in url:
+                return _response(200, LOOTER_BODY)
+            response = _response(429, {})
+            response.headers = {"Retry-After": "60"}
+            return response
+
+        with patch('requests.Session.get', side_effect=fake_get):
+            result = process_instagram_url("https://www.instagram.com/p/HEDGE6/")
+
+        assert result["media_url"] == "https://example.com/looter.jpg"
+        limits = pool.rate_limit_stats()
+        assert limits["downloader"]["throttled_responses"] == 1
+        assert limits["downloader"]["blocked_for"] > 0
+        assert limits["looter"]["throttled_responses"] == 0
+
+    def test_all_providers_failing_counts_one_breaker_failure(self, pool, fresh_circuit_breaker):
+        with patch('requests.Session.get', return_value=_response(503, {})):
+            assert process_instagram_url("https://www.instagram.com/p/HEDGE4/") is None
+        assert fresh_circuit_breaker.stats()["calls"] == 1
+        assert fresh_circuit_breaker.stats()["failure_rate"] == 1.0
+
+    @pytest.mark.asyncio
+    async def test_async_hedge_cancels_the_loser(self, pool):
+        cancelled = asyncio.Event()
+
+        async def fake_get(url, params=None, **kwargs):
+            if "looter" in url:
+                body = json.dumps(LOOTER_BODY).encode()
+                return AsyncResponse(status_code=200, headers={}, content=body, url=url)
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        with patch('core.logic.async_http_client') as client:
+            client.get = fake_get
+            started = time.monotonic()
+            result = await process_instagram_url_async("https://www.instagram.com/p/HEDGE5/")
+
+        assert result["media_url"] == "https://example.com/looter.jpg"
+        assert time.monotonic() - started < 1
+        await asyncio.wait_for(cancelled.wait(), 1)
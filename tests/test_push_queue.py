@@ -0,0 +1,82 @@
+"""Tests for the rate-limited push message queue."""
+
+from unittest.mock import Mock
+
+from core.push_queue import DeliveryStats, PushQueue, MAX_MESSAGES_PER_CALL
+from core.rate_limiter import RateLimiter
+
+
+class ApiError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"{status_code} Error")
+        self.status_code = status_code
+
+
+class TestPushQueue:
+    """Test suite for PushQueue."""
+
+    def setup_method(self):
+        self.send = Mock()
+        self.sleeps = []
+        self.queue = PushQueue(self.send, sleep=self.sleeps.append)
+
+    def test_messages_are_sent_in_batches_of_five(self):
+        assert self.queue.enqueue("U1", list(range(12))) == 3
+        self.queue.join()
+
+        batches = [call.args[1] for call in self.send.call_args_list]
+        assert batches == [list(range(5)), list(range(5, 10)), [10, 11]]
+        assert all(call.args[0] == "U1" for call in self.send.call_args_list)
+
+        stats = self.queue.stats.snapshot()["push"]
+        assert stats["calls"] == 3
+        assert stats["messages"] == 12
+        assert stats["p95_ms"] is not None
+
+    def test_retries_reuse_the_retry_key(self):
+        self.send.side_effect = [ApiError(500), None]
+        assert self.queue.deliver("U1", ["m"])
+
+        keys = [call.args[2] for call in self.send.call_args_list]
+        assert len(keys) == 2 and keys[0] == keys[1]
+        assert self.sleeps == [1.0]
+        assert self.queue.stats.snapshot()["push"]["failures"] == 1
+
+    def test_conflict_means_already_delivered(self):
+        self.send.side_effect = ApiError(409)
+        assert self.queue.deliver("U1", ["m"])
+        assert self.send.call_count == 1
+
+    def test_client_errors_are_not_retried(self):
+        self.send.side_effect = ApiError(400)
+        assert not self.queue.deliver("U1", ["m"])
+        assert self.send.call_count == 1
+
+    def test_rate_limiter_paces_calls(self):
+        limiter = Mock(spec=RateLimiter)
+        queue = PushQueue(self.send, limiter=limiter)
+        queue.enqueue("U1", list(range(MAX_MESSAGES_PER_CALL * 2)))
+        queue.join()
+        assert limiter.acquire.call_count == 2
+
+    def test_disabled_queue_sends_nothing(self):
+        queue = PushQueue(self.send, enabled=False)
+        assert queue.enqueue("U1", ["m"]) == 0
+        assert not self.send.called
+
+    def test_full_queue_drops_batches(self):
+        queue = PushQueue(self.send, max_pending=1)
+        queue._ensure_worker = Mock()  # keep the worker from draining the queue
+        assert queue.enqueue("U1", list(range(MAX_MESSAGES_PER_CALL * 2))) == 1
+        assert queue.snapshot()["dropped"] == 1
+
+
+def test_delivery_stats_per_kind():
+    stats = DeliveryStats()
+    stats.record("reply", 3, 0.1, True)
+    stats.record("push", 5, 0.2, False)
+
+    snapshot = stats.snapshot()
+    assert snapshot["reply"] == {"calls": 1, "messages": 3, "failures": 0, "p50_ms": 100.0, "p95_ms": 100.0}
+    assert snapshot["push"]["failures"] == 1
+    assert snapshot["push"]["messages"] == 0
@@ -0,0 +1,159 @@
+"""Tests for the RapidAPI token-bucket rate limiter."""
+
+import pytest
+from unittest.mock import Mock, patch
+from core.logic import process_instagram_url
+from core.providers import provider_pool
+from core.rate_limiter import RateLimiter, RateLimitExceeded, parse_retry_after
+
+
+class FakeTime:
+    """Clock whose sleep() advances time instead of blocking."""
+
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def _limiter(fake, **kwargs):
+    return RateLimiter(clock=fake, wall_clock=fake, sleep=fake.sleep, **kwargs)
+
+
+class TestRateLimiter:
+    """Test suite for RateLimiter."""
+
+    def test_burst_then_steady_rate(self):
+        """Requests beyond the burst are spaced at the configured rate."""
+        fake = FakeTime()
+        limiter = _limiter(fake, per_second=2, burst=2)
+
+        waits = [limiter.acquire() for _ in range(5)]
+        assert waits[:2] == [0.0, 0.0]
+        assert waits[2:] == pytest.approx([0.5, 0.5, 0.5])
+
+    def test_queued_callers_are_spaced_out(self):
+        """Reservations made at the same instant wait progressively longer."""
+        fake = FakeTime()
+        limiter = _limiter(fake, per_second=4, burst=1)
+        limiter.acquire()
+        assert [limiter._reserve(None) for _ in range(3)] == pytest.approx([0.25, 0.5, 0.75])
+
+    def test_rejects_when_wait_exceeds_max(self):
+        fake = FakeTime()
+        limiter = _limiter(fake, per_second=1, burst=1, max_wait=0.5)
+        limiter.acquire()
+        with pytest.raises(RateLimitExceeded) as exc:
+            limiter.acquire()
+        assert exc.value.retry_after == pytest.approx(1.0)
+        assert limiter.stats()["rejected"] == 1
+
+    def test_daily_budget(self):
+        fake = FakeTime(now=86400 * 100 + 10)
+        limiter = _limiter(fake, per_second=100, burst=100, per_day=2)
+        limiter.acquire()
+        limiter.acquire()
+        with pytest.raises(RateLimitExceeded):
+            limiter.acquire()
+        assert limiter.stats()["day_remaining"] == 0
+
+        fake.now = 86400 * 101 + 1
+        limiter.acquire()
+        assert limiter.stats()["day_used"] == 1
+
+    def test_retry_after_blocks_and_slows_down(self):
+        """A 429 pauses new calls for Retry-After and halves the rate."""
+        fake = FakeTime()
+        limiter = _limiter(fake, per_second=10, burst=10)
+        assert limiter.observe(429, {"Retry-After": "2"}) == 2.0
+        assert limiter.rate == 5
+
+        assert limiter.acquire() == pytest.approx(2.0)
+        for _ in range(30):
+            limiter.observe(200, {})
+        assert limiter.rate == 10
+
+    def test_rapidapi_headers_are_published(self):
+        """RapidAPI quota headers are exposed as gauges and honoured when exhausted."""
+        fake = FakeTime()
+        limiter = _limiter(fake)
+        limiter.observe(200, {
+            "X-RateLimit-Requests-Limit": "1000",
+            "X-RateLimit-Requests-Remaining": "0",
+            "X-RateLimit-Requests-Reset": "3",
+        })
+        stats = limiter.stats()
+        assert stats["quota_limit"] == 1000
+        assert stats["quota_remaining"] == 0
+        assert stats["blocked_for"] == 3
+        assert limiter.acquire() == pytest.approx(3.0)
+
+    def test_non_mapping_headers_are_ignored(self):
+        limiter = _limiter(FakeTime())
+        assert limiter.observe(200, None) is None
+
+    def test_parse_retry_after(self):
+        assert parse_retry_after("5") == 5.0
+        assert parse_retry_after("Wed, 21 Oct 2015 07:28:10 GMT", now=1445412480.0) == 10.0
+        assert parse_retry_after("soon") is None
+        assert parse_retry_after(None) is None
+
+    @pytest.mark.asyncio
+    async def test_async_acquire_waits_without_blocking(self):
+        fake = FakeTime()
+        slept = []
+
+        async def fake_sleep(seconds):
+            slept.append(seconds)
+
+        limiter = RateLimiter(per_second=1, burst=1, clock=fake, wall_clock=fake, async_sleep=fake_sleep)
+        await limiter.acquire_async()
+        await limiter.acquire_async()
+        assert slept == [1.0]
+
+
+def _response(status_code, headers=None, body=None):
+    response = Mock()
+    response.status_code = status_code
+    response.headers = headers or {}
+    response.json.return_value = body or {}
+    response.raise_for_status = Mock()
+    if status_code >= 400:
+        response.raise_for_status.side_effect = Exception(f"HTTP {status_code}")
+    return response
+
+
+class TestRateLimitedLookups:
+    """The lookup path waits out short 429s instead of failing."""
+
+    @patch('core.logic.RAPID_API_KEY', 'test_api_key')
+    def test_short_429_is_retried(self):
+        fake = FakeTime()
+        limiter = _limiter(fake, per_second=10, burst=10)
+        body = {"medias": [{"url": "https://example.com/1.jpg"}]}
+
+        with patch.object(provider_pool.providers[0], 'limiter', limiter), patch('requests.Session.get') as mock_get:
+            mock_get.side_effect = [_response(429, {"Retry-After": "1"}), _response(200, body=body)]
+            result = process_instagram_url("https://www.instagram.com/p/RATE1/")
+
+        assert result["media_url"] == "https://example.com/1.jpg"
+        assert mock_get.call_count == 2
+        assert fake.sleeps == [1.0]
+        assert limiter.stats()["throttled_responses"] == 1
+
+    @patch('core.logic.RAPID_API_KEY', 'test_api_key')
+    def test_long_block_fails_fast(self):
+        fake = FakeTime()
+        limiter = _limiter(fake, max_wait=1)
+        limiter.observe(429, {"Retry-After": "60"})
+
+        with patch.object(provider_pool.providers[0], 'limiter', limiter), patch('requests.Session.get') as mock_get:
+            assert process_instagram_url("https://www.instagram.com/p/RATE2/") is None
+
+        assert not mock_get.called
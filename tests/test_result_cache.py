@@ -0,0 +1,208 @@
+"""Tests for the shortcode-keyed result cache."""
+
+import pytest
+from unittest.mock import Mock, patch
+
+import core.logic
+from core.cache import ResultCache, cdn_expiry, result_expiry
+from core.logic import process_instagram_url
+from core.negative_cache import NegativeCache, PROVIDER_ERROR
+
+
+class FakeClock:
+    """Manually advanced clock for TTL tests."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestResultCache:
+    """Test suite for ResultCache."""
+
+    def setup_method(self):
+        """Setup test fixtures."""
+        self.clock = FakeClock()
+        self.cache = ResultCache(max_entries=2, ttl=60, clock=self.clock)
+
+    def test_get_returns_stored_value(self):
+        """Stored results are returned and counted as hits."""
+        self.cache.set("ABC", {"media_count": 1})
+        assert self.cache.get("ABC") == {"media_count": 1}
+        assert self.cache.get("XYZ") is None
+
+        stats = self.cache.stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 1
+
+    def test_get_returns_copy(self):
+        """Mutating a returned result does not affect the cache."""
+        self.cache.set("ABC", {"media_list": []})
+        self.cache.get("ABC")["media_list"].append("mutated")
+        assert self.cache.get("ABC") == {"media_list": []}
+
+    def test_entries_expire_after_ttl(self):
+        """Entries older than the TTL are treated as misses."""
+        self.cache.set("ABC", {"media_count": 1})
+        self.clock.now += 61
+        assert self.cache.get("ABC") is None
+        assert self.cache.stats()["expirations"] == 1
+        assert len(self.cache) == 0
+
+    def test_lru_eviction(self):
+        """The least recently used entry is evicted when full."""
+        self.cache.set("A", {"n": 1})
+        self.cache.set("B", {"n": 2})
+        self.cache.get("A")  # A becomes most recently used
+        self.cache.set("C", {"n": 3})
+
+        assert self.cache.get("B") is None
+        assert self.cache.get("A") == {"n": 1}
+        assert self.cache.get("C") == {"n": 3}
+        assert self.cache.stats()["evictions"] == 1
+
+    def test_disabled_cache(self):
+        """A disabled cache never stores or returns results."""
+        cache = ResultCache(enabled=False)
+        cache.set("ABC", {"n": 1})
+        assert cache.get("ABC") is None
+        assert len(cache) == 0
+
+
+WALL_NOW = 1_700_000_000
+
+
+def _cdn_url(name, expires_at):
+    return f"https://scontent.cdninstagram.com/v/{name}.jpg?stp=dst-jpg&oe={int(expires_at):X}&_nc_sid=abc"
+
+
+def _result(*urls):
+    media_list = [{"url": url, "type": "image", "thumbnail": None} for url in urls]
+    return {"media_list": media_list, "media_url": urls[0], "preview_url": urls[0]}
+
+
+class TestCdnExpiry:
+    """TTLs follow the expiry of the signed CDN links."""
+
+    def setup_method(self):
+        self.clock = FakeClock()
+        self.cache = ResultCache(
+            ttl=600, expiry_margin=60, clock=self.clock, wall_clock=lambda: WALL_NOW
+        )
+
+    def test_parses_hex_oe_parameter(self):
+        assert cdn_expiry(_cdn_url("a", WALL_NOW + 10)) == WALL_NOW + 10
+        assert cdn_expiry("https://example.com/a.jpg") is None
+        assert cdn_expiry("https://example.com/a.jpg?oe=zz") is None
+        assert cdn_expiry(None) is None
+
+    def test_earliest_expiry_wins(self):
+        result = _result(_cdn_url("a", WALL_NOW + 500), _cdn_url("b", WALL_NOW + 200), "https://example.com/c.jpg")
+        assert result_expiry(result) == WALL_NOW + 200
+        assert result_expiry(_result("https://example.com/c.jpg")) is None
+
+    def test_ttl_capped_by_expiry_minus_margin(self):
+        self.cache.set("A", _result(_cdn_url("a", WALL_NOW + 300)))
+        self.clock.now += 239
+        assert self.cache.get("A") is not None
+        self.clock.now += 2
+        assert self.cache.get("A") is None
+        assert self.cache.stats()["expiry_capped"] == 1
+
+    def test_far_expiry_keeps_configured_ttl(self):
+        self.cache.set("A", _result(_cdn_url("a", WALL_NOW + 86400)))
+        self.clock.now += 599
+        assert self.cache.get("A") is not None
+
+    def test_links_about_to_expire_are_not_cached(self):
+        self.cache.set("A", _result(_cdn_url("a", WALL_NOW + 30)))
+        assert self.cache.get("A") is None
+        assert self.cache.stats()["expired_links"] == 1
+
+
+class TestRefreshAhead:
+    """Popular entries are handed out for refresh shortly before they expire."""
+
+    def setup_method(self):
+        self.clock = FakeClock()
+        self.cache = ResultCache(ttl=600, refresh_ahead=60, refresh_min_hits=2, clock=self.clock)
+
+    def test_claims_popular_entry_once_near_expiry(self):
+        self.cache.set("A", {"n": 1})
+        self.cache.get("A")
+        self.cache.get("A")
+        assert not self.cache.claim_refresh("A")  # not close to expiry yet
+
+        self.clock.now += 550
+        assert self.cache.claim_refresh("A")
+        assert not self.cache.claim_refresh("A")  # already being refreshed
+
+        self.cache.set("A", {"n": 2})
+        assert self.cache.stats()["refreshes"] == 1
+
+    def test_unpopular_entry_is_left_to_expire(self):
+        self.cache.set("A", {"n": 1})
+        self.cache.get("A")
+        self.clock.now += 550
+        assert not self.cache.claim_refresh("A")
+
+    @patch('core.logic.RAPID_API_KEY', 'test_api_key')
+    def test_lookup_refreshes_in_background(self):
+        url = "https://www.instagram.com/p/HOT1/"
+        responses = [{"medias": [{"url": "https://example.com/old.jpg"}]},
+                     {"medias": [{"url": "https://example.com/new.jpg"}]}]
+
+        with patch('core.logic.result_cache', self.cache), patch('requests.Session.get') as mock_get:
+            mock_get.return_value.status_code = 200
+            mock_get.return_value.json.side_effect = responses
+            process_instagram_url(url)
+            process_instagram_url(url)
+            process_instagram_url(url)
+
+            self.clock.now += 550
+            assert process_instagram_url(url)["media_url"] == "https://example.com/old.jpg"
+            core.logic._refresh_executor.submit(lambda: None).result()
+
+        assert mock_get.call_count == 2
+        assert self.cache.get("HOT1")["media_url"] == "https://example.com/new.jpg"
+
+
+class TestProcessInstagramUrlCaching:
+    """Test suite for caching in process_instagram_url."""
+
+    @patch('core.logic.RAPID_API_KEY', 'test_api_key')
+    @patch('requests.Session.get')
+    def test_repeat_requests_use_cache(self, mock_get):
+        """The same post is fetched from the API only once."""
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {
+            "medias": [{"url": "https://example.com/image.jpg"}]
+        }
+        mock_get.return_value = mock_response
+
+        first = process_instagram_url("https://www.instagram.com/p/CACHED1/")
+        second = process_instagram_url("look https://instagram.com/p/CACHED1/?igsh=abc")
+
+        assert first == second
+        assert mock_get.call_count == 1
+
+    @patch('core.logic.RAPID_API_KEY', 'test_api_key')
+    @patch('requests.Session.get')
+    def test_failures_are_not_cached(self, mock_get):
+        """Failed lookups are kept out of the result cache and retried once the short negative TTL passes."""
+        mock_get.side_effect = Exception("Network error")
+        clock = FakeClock()
+        failures = NegativeCache(ttls={PROVIDER_ERROR: 15}, clock=clock)
+
+        with patch('core.logic.negative_cache', failures):
+            assert process_instagram_url("https://www.instagram.com/p/FAIL1/") is None
+            assert process_instagram_url("https://www.instagram.com/p/FAIL1/") is None
+            assert mock_get.call_count == 1
+
+            clock.now += 16
+            assert process_instagram_url("https://www.instagram.com/p/FAIL1/") is None
+            assert mock_get.call_count == 2
+        assert len(core.logic.result_cache) == 0
@@ -0,0 +1,209 @@
+"""Tests for the single-process asyncio runtime."""
+
+import asyncio
+import json
+import time
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+from unittest.mock import AsyncMock, patch
+from core.job_queue import JobQueue, AsyncJobWorker, RetryJob
+import run_app
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(str(tmp_path / "jobs.sqlite3"))
+
+
+async def _client():
+    client = TestClient(TestServer(run_app.create_web_app()))
+    await client.start_server()
+    return client
+
+
+def _text_event(text, event_id="E1"):
+    return {
+        "type": "message",
+        "mode": "active",
+        "timestamp": 0,
+        "source": {"type": "user", "userId": "U1"},
+        "replyToken": "token",
+        "webhookEventId": event_id,
+        "deliveryContext": {"isRedelivery": False},
+        "message": {"type": "text", "id": "1", "text": text},
+    }
+
+
+class TestWebhookServer:
+    """Test suite for the aiohttp LINE webhook."""
+
+    @pytest.mark.asyncio
+    async def test_health_check(self):
+        client = await _client()
+        try:
+            response = await client.get("/")
+            assert response.status == 200
+            assert await response.text() == "Bot is alive"
+        finally:
+            await client.close()
+
+    @pytest.mark.asyncio
+    async def test_callback_enqueues_signed_body(self, queue):
+        """Valid webhooks are stored and acknowledged without processing inline."""
+        client = await _client()
+        try:
+            with patch('run_app.job_queue', queue), \
+                 patch('run_app.JOB_QUEUE_ENABLED', True), \
+                 patch.object(run_app.run_line.handler.parser.signature_validator, 'validate', return_value=True):
+                response = await client.post("/callback", data='{"events": []}', headers={"X-Line-Signature": "sig"})
+        finally:
+            await client.close()
+
+        assert response.status == 200
+        assert json.loads(queue.claim().payload) == {"body": '{"events": []}', "signature": "sig"}
+
+    @pytest.mark.asyncio
+    async def test_callback_rejects_invalid_signature(self, queue):
+        client = await _client()
+        try:
+            with patch('run_app.job_queue', queue), \
+                 patch('run_app.JOB_QUEUE_ENABLED', True), \
+                 patch.object(run_app.run_line.handler.parser.signature_validator, 'validate', return_value=False):
+                response = await client.post("/callback", data='{"events": []}', headers={"X-Line-Signature": "bad"})
+        finally:
+            await client.close()
+
+        assert response.status == 400
+        assert queue.stats()["depth"] == 0
+
+    @pytest.mark.asyncio
+    async def test_callback_drops_redelivered_webhook(self, queue):
+        body = json.dumps({"destination": "D", "events": [_text_event("https://www.instagram.com/p/DUP1/", "DUP1")]})
+        client = await _client()
+        try:
+            with patch('run_app.job_queue', queue), \
+                 patch('run_app.JOB_QUEUE_ENABLED', True), \
+                 patch.object(run_app.run_line.handler.parser.signature_validator, 'validate', return_value=True):
+                for _ in range(2):
+                    response = await client.post("/callback", data=body, headers={"X-Line-Signature": "sig"})
+                    assert response.status == 200
+        finally:
+            await client.close()
+
+        assert queue.stats()["depth"] == 1
+        assert run_app.idempotency_store.stats()["duplicates"] == 1
+
+    @pytest.mark.asyncio
+    async def test_failed_enqueue_lets_the_redelivery_through(self, queue):
+        """Events are not recorded as seen when the job could not be stored."""
+        body = json.dumps({"destination": "D", "events": [_text_event("https://www.instagram.com/p/LOST1/", "LOST1")]})
+        client = await _client()
+        try:
+            with patch('run_app.JOB_QUEUE_ENABLED', True), \
+                 patch.object(run_app.run_line.handler.parser.signature_validator, 'validate', return_value=True):
+                with patch('run_app.job_queue') as broken:
+                    broken.enqueue.side_effect = RuntimeError("database is locked")
+                    response = await client.post("/callback", data=body, headers={"X-Line-Signature": "sig"})
+                    assert response.status == 500
+                with patch('run_app.job_queue', queue):
+                    response = await client.post("/callback", data=body, headers={"X-Line-Signature": "sig"})
+                    assert response.status == 200
+        finally:
+            await client.close()
+
+        assert queue.stats()["depth"] == 1
+        assert run_app.idempotency_store.stats()["duplicates"] == 0
+
+    @pytest.mark.asyncio
+    async def test_metrics_include_shared_components(self, queue):
+        client = await _client()
+        try:
+            with patch('run_app.job_queue', queue):
+                response = await client.get("/metrics")
+                data = await response.json()
+        finally:
+            await client.close()
+
+        assert {"job_queue", "result_cache", "singleflight", "rate_limiter", "scheduler", "idempotency"} <= set(data)
+
+
+class TestAsyncJobProcessing:
+    """Queued webhooks are processed on the event loop."""
+
+    @pytest.mark.asyncio
+    async def test_text_messages_use_the_async_api(self, queue):
+        body = json.dumps({"destination": "D", "events": [_text_event("https://www.instagram.com/p/APP1/")]})
+        queue.enqueue(json.dumps({"body": body, "signature": "sig"}))
+        worker = AsyncJobWorker(queue, run_app.process_webhook_job)
+
+        with patch.object(run_app.run_line.handler.parser.signature_validator, 'validate', return_value=True), \
+             patch('run_line.process_instagram_urls_async', new_callable=AsyncMock) as mock_fetch, \
+             patch('run_line.reply_with_result') as mock_reply:
+            mock_fetch.return_value = [{"media_list": [{"url": "https://example.com/1.jpg", "type": "image", "thumbnail": None}]}]
+            assert await worker.run_pending() == 1
+
+        mock_fetch.assert_awaited_once_with("https://www.instagram.com/p/APP1/", run_app.run_line.Requester("line_user", "U1"))
+        assert mock_reply.call_args.args[0] == "token"
+        assert queue.stats()["depth"] == 0
+
+    @pytest.mark.asyncio
+    async def test_failed_jobs_are_retried(self, queue):
+        queue.enqueue("payload")
+        worker = AsyncJobWorker(queue, AsyncMock(side_effect=RuntimeError("boom")))
+        assert await worker.run_pending() == 1
+        assert queue.stats()["retried"] == 1
+
+    @pytest.mark.asyncio
+    async def test_lease_is_extended_while_the_handler_runs(self, tmp_path):
+        queue = JobQueue(str(tmp_path / "jobs.sqlite3"), lease=0.15)
+        queue.enqueue("slow")
+        reclaimed = []
+
+        async def handler(payload):
+            for _ in range(4):
+                await asyncio.sleep(0.1)
+                reclaimed.append(JobQueue(queue.path, lease=0.15).claim())
+
+        assert await AsyncJobWorker(queue, handler).run_pending() == 1
+        assert reclaimed == [None] * 4
+        assert queue.stats()["completed"] == 1
+
+    @pytest.mark.asyncio
+    async def test_events_in_one_webhook_run_concurrently(self):
+        events = [_text_event(f"https://www.instagram.com/p/MULTI{i}/", f"E{i}") for i in range(5)]
+        body = json.dumps({"destination": "D", "events": events})
+
+        async def slow_fetch(text, requester):
+            await asyncio.sleep(0.2)
+            return [{"media_list": [{"url": "https://example.com/1.jpg", "type": "image", "thumbnail": None}]}]
+
+        stats = run_app.WebhookStats()
+        with patch.object(run_app.run_line.handler.parser.signature_validator, 'validate', return_value=True), \
+             patch('run_line.process_instagram_urls_async', side_effect=slow_fetch), \
+             patch('run_line.reply_with_result') as mock_reply, \
+             patch('run_app.webhook_stats', stats):
+            started = time.monotonic()
+            await run_app.process_webhook_job(json.dumps({"body": body, "signature": "sig"}))
+            elapsed = time.monotonic() - started
+
+        assert mock_reply.call_count == 5
+        assert elapsed < 0.6
+        snapshot = stats.snapshot()
+        assert snapshot["max_batch_size"] == 5
+        assert snapshot["events"] == 5
+
+    @pytest.mark.asyncio
+    async def test_failed_event_does_not_stop_the_others(self):
+        events = [_text_event(f"https://www.instagram.com/p/FAIL{i}/", f"E{i}") for i in range(2)]
+        body = json.dumps({"destination": "D", "events": events})
+        mock_handle = AsyncMock(side_effect=[RuntimeError("boom"), None])
+
+        with patch.object(run_app.run_line.handler.parser.signature_validator, 'validate', return_value=True), \
+             patch('run_line.handle_message_async', mock_handle):
+            with pytest.raises(RetryJob) as excinfo:
+                await run_app.process_webhook_job(json.dumps({"body": body, "signature": "sig"}))
+
+        assert mock_handle.await_count == 2
+        # Only the failed event is retried; the one that already replied is skipped
+        assert json.loads(excinfo.value.payload)["skip"] == ["E1"]
@@ -0,0 +1,186 @@
+"""Tests for the per-requester fair scheduler."""
+
+import asyncio
+import threading
+import time
+
+import pytest
+from core.scheduler import FairScheduler, Requester, SchedulerRejected, parse_weights
+
+
+ALICE = Requester("discord_guild", "1:alice")
+BOB = Requester("discord_guild", "1:bob")
+GROUP = Requester("line_group", "G1")
+
+
+async def _run(scheduler, requester, order, label, hold=0.01):
+    async with scheduler.aslot(requester):
+        order.append(label)
+        await asyncio.sleep(hold)
+
+
+class TestFairScheduler:
+    """Test suite for FairScheduler."""
+
+    @pytest.mark.asyncio
+    async def test_spammer_does_not_delay_others(self):
+        """A late requester is served next instead of after the spammer's backlog."""
+        scheduler = FairScheduler(max_concurrency=1, per_key_concurrency=1, per_key_queue=20)
+        order = []
+        tasks = [asyncio.create_task(_run(scheduler, ALICE, order, f"alice{i}")) for i in range(6)]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(_run(scheduler, BOB, order, "bob")))
+        await asyncio.gather(*tasks)
+
+        assert order.index("bob") <= 2
+
+    @pytest.mark.asyncio
+    async def test_per_key_concurrency(self):
+        """One requester never holds more than its share of slots."""
+        scheduler = FairScheduler(max_concurrency=10, per_key_concurrency=2, per_key_queue=20)
+        running = 0
+        peak = 0
+
+        async def lookup():
+            nonlocal running, peak
+            async with scheduler.aslot(ALICE):
+                running += 1
+                peak = max(peak, running)
+                await asyncio.sleep(0.01)
+                running -= 1
+
+        await asyncio.gather(*(lookup() for _ in range(8)))
+        assert peak == 2
+
+    @pytest.mark.asyncio
+    async def test_queue_limit_rejects(self):
+        scheduler = FairScheduler(max_concurrency=1, per_key_concurrency=1, per_key_queue=1)
+        order = []
+        first = asyncio.create_task(_run(scheduler, ALICE, order, "a", hold=0.05))
+        second = asyncio.create_task(_run(scheduler, ALICE, order, "b"))
+        await asyncio.sleep(0)
+
+        with pytest.raises(SchedulerRejected):
+            async with scheduler.aslot(ALICE):
+                pass
+
+        await asyncio.gather(first, second)
+        stats = scheduler.stats()["classes"]["discord_guild"]
+        assert stats["rejected"] == 1
+        assert stats["completed"] == 2
+
+    @pytest.mark.asyncio
+    async def test_wait_timeout(self):
+        scheduler = FairScheduler(max_concurrency=1, max_wait=0.01)
+        order = []
+        holder = asyncio.create_task(_run(scheduler, ALICE, order, "a", hold=0.1))
+        await asyncio.sleep(0)
+
+        with pytest.raises(SchedulerRejected):
+            async with scheduler.aslot(BOB):
+                pass
+        await holder
+        assert scheduler.stats()["queued"] == 0
+
+    @pytest.mark.asyncio
+    async def test_cancelled_waiter_leaves_queue(self):
+        scheduler = FairScheduler(max_concurrency=1)
+        order = []
+        holder = asyncio.create_task(_run(scheduler, ALICE, order, "a", hold=0.05))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(_run(scheduler, BOB, order, "b"))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await holder
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+
+        stats = scheduler.stats()
+        assert stats["active"] == 0
+        assert stats["queued"] == 0
+        assert order == ["a"]
+
+    @pytest.mark.asyncio
+    async def test_weights(self):
+        """Heavier classes receive proportionally more slots while both are backlogged."""
+        scheduler = FairScheduler(max_concurrency=1, per_key_concurrency=1, per_key_queue=20,
+                                  weights={"line_group": 2})
+        order = []
+        tasks = [asyncio.create_task(_run(scheduler, ALICE, order, "alice", hold=0)) for _ in range(6)]
+        tasks += [asyncio.create_task(_run(scheduler, GROUP, order, "group", hold=0)) for _ in range(6)]
+        await asyncio.gather(*tasks)
+
+        assert order[:9].count("group") >= 5
+        assert order[-2:] == ["alice", "alice"]
+
+    def test_thread_slots(self):
+        """The blocking variant limits concurrency across threads."""
+        scheduler = FairScheduler(max_concurrency=2, per_key_concurrency=2)
+        lock = threading.Lock()
+        running = 0
+        peak = 0
+
+        def lookup(requester):
+            nonlocal running, peak
+            with scheduler.slot(requester):
+                with lock:
+                    running += 1
+                    peak = max(peak, running)
+                time.sleep(0.01)
+                with lock:
+                    running -= 1
+
+        threads = [threading.Thread(target=lookup, args=(r,)) for r in (ALICE, BOB) * 4]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert peak == 2
+        assert scheduler.stats()["keys"] == 0
+
+    def test_latency_percentiles_per_class(self):
+        scheduler = FairScheduler()
+        for _ in range(3):
+            with scheduler.slot(ALICE):
+                pass
+        with scheduler.slot(GROUP):
+            pass
+
+        classes = scheduler.stats()["classes"]
+        assert set(classes) == {"discord_guild", "line_group"}
+        assert classes["discord_guild"]["completed"] == 3
+        assert classes["discord_guild"]["latency_ms"]["p99"] is not None
+
+    def test_parse_weights(self):
+        assert parse_weights("line_group=2, discord_guild=0.5,bad,x=y") == {"line_group": 2.0, "discord_guild": 0.5}
+        assert parse_weights("") == {}
+
+
+class TestScheduledLookups:
+    """Lookups go through the shared scheduler keyed by requester."""
+
+    @pytest.mark.asyncio
+    async def test_requester_is_scheduled_and_rejections_become_failures(self):
+        from unittest.mock import AsyncMock, patch
+        from core.http_client import AsyncResponse
+        from core.logic import process_instagram_urls_async
+
+        scheduler = FairScheduler(max_concurrency=1, per_key_concurrency=1, per_key_queue=0)
+        body = b'{"medias": [{"url": "https://example.com/1.jpg"}]}'
+
+        async def slow_get(url, **kwargs):
+            await asyncio.sleep(0.01)
+            return AsyncResponse(status_code=200, headers={}, content=body, url=url)
+
+        with patch('core.logic.fair_scheduler', scheduler), \
+             patch('core.logic.RAPID_API_KEY', 'test_api_key'), \
+             patch('core.logic.async_http_client.get', new=AsyncMock(side_effect=slow_get)):
+            results = await process_instagram_urls_async(
+                "https://www.instagram.com/p/FAIR1/ https://www.instagram.com/p/FAIR2/", ALICE
+            )
+
+        assert sum(r is not None for r in results) == 1
+        classes = scheduler.stats()["classes"]["discord_guild"]
+        assert classes["completed"] == 1
+        assert classes["rejected"] == 1
@@ -0,0 +1,204 @@
+"""Tests for request coalescing of concurrent lookups."""
+
+import asyncio
+import threading
+import time
+
+import pytest
+from unittest.mock import AsyncMock, Mock, patch
+from core.http_client import AsyncResponse
+from core.logic import process_instagram_url, process_instagram_url_async
+from core.singleflight import SingleFlight, AsyncSingleFlight, InFlight
+
+
+class TestSingleFlight:
+    """Test suite for the thread-based SingleFlight."""
+
+    def test_concurrent_calls_share_one_execution(self):
+        """Concurrent callers with the same key run the function once."""
+        group = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        executions = []
+
+        def slow():
+            executions.append(1)
+            started.set()
+            release.wait(5)
+            return "result"
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(group.do("k", slow)))
+        leader.start()
+        started.wait(5)
+
+        followers = [threading.Thread(target=lambda: results.append(group.do("k", slow))) for _ in range(4)]
+        for t in followers:
+            t.start()
+        while group.stats()["collapsed"] < 4:
+            time.sleep(0.001)
+        release.set()
+        for t in [leader] + followers:
+            t.join(5)
+
+        assert results == ["result"] * 5
+        assert len(executions) == 1
+        assert group.stats() == {"calls": 5, "executions": 1, "collapsed": 4, "in_flight": 0}
+
+    def test_errors_propagate_to_all_callers(self):
+        """An exception in the shared call is raised to every caller."""
+        group = SingleFlight()
+        with pytest.raises(ValueError):
+            group.do("k", Mock(side_effect=ValueError("boom")))
+        assert group.stats()["in_flight"] == 0
+
+    def test_sequential_calls_execute_again(self):
+        """Completed calls are not reused by later callers."""
+        group = SingleFlight()
+        fn = Mock(return_value=1)
+        group.do("k", fn)
+        group.do("k", fn)
+        assert fn.call_count == 2
+
+
+class TestAsyncSingleFlight:
+    """Test suite for the asyncio-based AsyncSingleFlight."""
+
+    @pytest.mark.asyncio
+    async def test_concurrent_calls_share_one_execution(self):
+        """Concurrent coroutines with the same key await one task."""
+        group = AsyncSingleFlight()
+        calls = []
+
+        async def slow():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "result"
+
+        results = await asyncio.gather(*(group.do("k", slow) for _ in range(10)))
+
+        assert results == ["result"] * 10
+        assert len(calls) == 1
+        assert group.stats()["collapsed"] == 9
+        assert group.stats()["in_flight"] == 0
+
+    @pytest.mark.asyncio
+    async def test_cancelled_caller_does_not_cancel_others(self):
+        """Cancelling one waiter leaves the shared task running."""
+        group = AsyncSingleFlight()
+
+        async def slow():
+            await asyncio.sleep(0.02)
+            return "result"
+
+        first = asyncio.ensure_future(group.do("k", slow))
+        second = asyncio.ensure_future(group.do("k", slow))
+        await asyncio.sleep(0)
+        first.cancel()
+
+        assert await second == "result"
+
+
+class TestSharedInFlight:
+    """Test suite for coalescing across the thread and asyncio paths."""
+
+    @pytest.mark.asyncio
+    async def test_async_caller_joins_thread_call(self):
+        """A coroutine joins a call already running in a thread without blocking the loop."""
+        flights = InFlight()
+        group, async_group = SingleFlight(flights), AsyncSingleFlight(flights)
+        started = threading.Event()
+        release = threading.Event()
+        executions = []
+
+        def slow():
+            executions.append("thread")
+            started.set()
+            release.wait(5)
+            return "result"
+
+        async def never():
+            executions.append("async")
+            return "other"
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(group.do("k", slow)))
+        leader.start()
+        await asyncio.to_thread(started.wait, 5)
+        follower = asyncio.ensure_future(async_group.do("k", never))
+        await asyncio.sleep(0.01)
+        release.set()
+
+        assert await follower == "result"
+        leader.join(5)
+        assert executions == ["thread"]
+        assert async_group.stats()["collapsed"] == 1
+        assert async_group.stats()["in_flight"] == 0
+
+    @pytest.mark.asyncio
+    async def test_thread_caller_joins_async_call(self):
+        """A thread joins a call already running as a task on the loop."""
+        flights = InFlight()
+        group, async_group = SingleFlight(flights), AsyncSingleFlight(flights)
+        executions = []
+
+        async def slow():
+            executions.append("async")
+            await asyncio.sleep(0.05)
+            return "result"
+
+        leader = asyncio.ensure_future(async_group.do("k", slow))
+        await asyncio.sleep(0)
+        follower = asyncio.to_thread(group.do, "k", lambda: executions.append("thread"))
+
+        assert await asyncio.gather(leader, follower) == ["result", "result"]
+        assert executions == ["async"]
+        assert group.stats()["collapsed"] == 1
+
+
+class TestCoalescedLookups:
+    """Test suite for coalescing in the core lookup API."""
+
+    @pytest.mark.asyncio
+    @patch('core.logic.RAPID_API_KEY', 'test_api_key')
+    async def test_async_lookups_for_same_post_are_coalesced(self):
+        """Concurrent async lookups of one post make a single API call."""
+        body = b'{"medias": [{"url": "https://example.com/1.jpg"}]}'
+
+        async def slow_get(*args, **kwargs):
+            await asyncio.sleep(0.01)
+            return AsyncResponse(status_code=200, headers={}, content=body, url="https://api.test/")
+
+        with patch('core.logic.async_http_client.get', new_callable=AsyncMock) as mock_get:
+            mock_get.side_effect = slow_get
+            results = await asyncio.gather(*(
+                process_instagram_url_async(f"https://www.instagram.com/reel/SF1/?n={i}") for i in range(5)
+            ))
+
+        assert mock_get.call_count == 1
+        assert all(r["media_url"] == "https://example.com/1.jpg" for r in results)
+
+    @patch('core.logic.RAPID_API_KEY', 'test_api_key')
+    @patch('requests.Session.get')
+    def test_thread_lookups_for_same_post_are_coalesced(self, mock_get):
+        """Concurrent threaded lookups of one post make a single API call."""
+        def slow_get(*args, **kwargs):
+            time.sleep(0.05)
+            response = Mock()
+            response.status_code = 200
+            response.json.return_value = {"medias": [{"url": "https://example.com/1.jpg"}]}
+            return response
+
+        mock_get.side_effect = slow_get
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(process_instagram_url("https://instagram.com/p/SF2/")))
+            for _ in range(5)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(5)
+
+        assert mock_get.call_count == 1
+        assert len(results) == 5 and all(r is not None for r in results)
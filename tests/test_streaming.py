@@ -0,0 +1,129 @@
+"""Tests for the incremental media parser and iter_media."""
+
+import json
+
+import pytest
+from unittest.mock import Mock, patch
+from core.extractor import extract_media_info
+from core.logic import iter_media, aiter_media
+from core.streaming import MediaStreamParser, iter_media_items
+
+
+CAROUSEL = {
+    "url": "https://www.instagram.com/p/STREAM/",
+    "author": {"name": "x \"quoted\" \\ name", "tags": ["a", "b]"]},
+    "medias": [
+        {"url": "https://example.com/1.jpg", "type": "image"},
+        {"video_url": "https://example.com/2.mp4", "thumbnail": "https://example.com/2.jpg"},
+        {"url": "https://example.com/3.jpg", "meta": {"caption": "{not [a] container}"}},
+    ],
+    "trailer": {"ignored": True},
+}
+
+
+def _chunks(data: bytes, size: int):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+class TestMediaStreamParser:
+    """Test suite for MediaStreamParser / iter_media_items."""
+
+    @pytest.mark.parametrize("size", [1, 2, 7, 64, 10_000])
+    def test_matches_full_parse_for_any_chunking(self, size):
+        """Chunk boundaries never change the extracted media."""
+        body = json.dumps(CAROUSEL, ensure_ascii=False).encode("utf-8")
+        assert list(iter_media_items(_chunks(body, size))) == extract_media_info(CAROUSEL)
+
+    def test_multibyte_characters_split_across_chunks(self):
+        """UTF-8 sequences split across chunks are decoded correctly."""
+        data = {"caption": "日本語キャプション", "medias": [{"url": "https://example.com/写真.jpg"}]}
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        items = list(iter_media_items(_chunks(body, 1)))
+        assert items[0]["url"] == "https://example.com/写真.jpg"
+
+    def test_items_are_emitted_before_the_body_ends(self):
+        """Each media item is available as soon as its JSON is complete."""
+        parser = MediaStreamParser()
+        assert parser.feed('{"medias": [{"url": "https://example.com/1.jpg"}') != []
+        assert parser.feed(', {"url": "https://example.com/2.jpg"}') != []
+        assert not parser.finished
+        assert parser.feed("]") == []
+        assert parser.finished
+        assert parser.media_count == 2
+
+    def test_stops_reading_after_medias(self):
+        """Chunks after the medias array are not consumed."""
+        consumed = []
+
+        def chunks():
+            for chunk in (b'{"medias": [{"url": "https://example.com/1.jpg"}]', b', "x": 1', b"}"):
+                consumed.append(chunk)
+                yield chunk
+
+        assert len(list(iter_media_items(chunks()))) == 1
+        assert len(consumed) == 1
+
+    def test_falls_back_without_medias_key(self):
+        """Responses without a top-level medias array use the generic extractor."""
+        data = {"data": {"items": [{"image_versions2": {"candidates": [{"url": "https://example.com/a.jpg"}]}}]}}
+        body = json.dumps(data).encode("utf-8")
+        assert list(iter_media_items(_chunks(body, 5))) == extract_media_info(data)
+
+    def test_falls_back_for_unrecognised_medias_items(self):
+        """medias items without direct URLs are searched recursively."""
+        data = {"medias": [{"resources": [{"src": "https://example.com/deep.jpg"}]}]}
+        body = json.dumps(data).encode("utf-8")
+        assert list(iter_media_items([body])) == extract_media_info(data)
+
+    def test_invalid_json_raises_value_error(self):
+        """Truncated bodies raise ValueError."""
+        with pytest.raises(ValueError):
+            list(iter_media_items([b'{"medias": [{"url": "https://example.com/1.jpg"']))
+
+
+def _streaming_response(body: bytes, status_code: int = 200):
+    response = Mock()
+    response.status_code = status_code
+    response.raise_for_status = Mock()
+    response.iter_content = Mock(return_value=iter(_chunks(body, 16)))
+    return response
+
+
+class TestIterMedia:
+    """Test suite for iter_media / aiter_media."""
+
+    @patch('core.logic.RAPID_API_KEY', 'test_api_key')
+    def test_yields_media_and_populates_cache(self):
+        """Streamed media are yielded in order and cached for later lookups."""
+        body = json.dumps(CAROUSEL).encode("utf-8")
+        with patch('core.logic.http_client.session.get') as mock_get:
+            mock_get.return_value = _streaming_response(body)
+            first = list(iter_media("https://www.instagram.com/p/STREAM1/"))
+            second = list(iter_media("https://www.instagram.com/p/STREAM1/"))
+
+        assert first == extract_media_info(CAROUSEL)
+        assert second == first
+        assert mock_get.call_count == 1
+        assert mock_get.call_args.kwargs["stream"] is True
+        mock_get.return_value.close.assert_called_once()
+
+    def test_non_instagram_text_yields_nothing(self):
+        """No request is made when the text has no Instagram link."""
+        with patch('core.logic.http_client.session.get') as mock_get:
+            assert list(iter_media("hello")) == []
+        assert not mock_get.called
+
+    @pytest.mark.asyncio
+    @patch('core.logic.RAPID_API_KEY', 'test_api_key')
+    async def test_async_variant(self):
+        """aiter_media yields the same items from the async client."""
+        body = json.dumps(CAROUSEL).encode("utf-8")
+
+        async def fake_chunks(url, chunk_size=8192, **kwargs):
+            for chunk in _chunks(body, 16):
+                yield chunk
+
+        with patch('core.logic.async_http_client.iter_chunks', side_effect=fake_chunks):
+            items = [media async for media in aiter_media("https://www.instagram.com/p/STREAM2/")]
+
+        assert items == extract_media_info(CAROUSEL)
@@ -0,0 +1,88 @@
+"""Tests for the Instagram URL parser."""
+
+import pytest
+from unittest.mock import Mock, patch
+from core.logic import process_instagram_url
+from core.parser import (
+    InstagramPost, canonical_url, contains_instagram_url, extract_post, extract_posts,
+    is_instagram_post_url
+)
+
+
+class TestExtractPosts:
+    """Test suite for shortcode extraction."""
+
+    def test_supported_url_forms(self):
+        """Post, reel, reels and tv URLs are normalized."""
+        test_cases = [
+            ("https://www.instagram.com/p/ABC123/", InstagramPost("ABC123", "p", "https://www.instagram.com/p/ABC123/")),
+            ("http://instagram.com/p/XYZ789", InstagramPost("XYZ789", "p", "https://www.instagram.com/p/XYZ789/")),
+            ("https://www.instagram.com/reel/REEL456/", InstagramPost("REEL456", "reel", "https://www.instagram.com/reel/REEL456/")),
+            ("https://www.instagram.com/reels/Cr_x-9/", InstagramPost("Cr_x-9", "reel", "https://www.instagram.com/reel/Cr_x-9/")),
+            ("https://m.instagram.com/tv/TV1/", InstagramPost("TV1", "tv", "https://www.instagram.com/tv/TV1/")),
+            ("instagram.com/someone/p/USR1/", InstagramPost("USR1", "p", "https://www.instagram.com/p/USR1/")),
+        ]
+
+        for text, expected in test_cases:
+            assert extract_post(text) == expected, f"Failed for: {text}"
+
+    def test_tracking_query_is_stripped(self):
+        """Query strings and fragments do not reach the canonical URL."""
+        post = extract_post("https://www.instagram.com/p/TEST123/?utm_source=ig_web&igsh=abc#x")
+        assert post.url == "https://www.instagram.com/p/TEST123/"
+
+    def test_multiple_links_in_order_without_duplicates(self):
+        """Every link in a chatty message is found once, in order."""
+        text = (
+            "look https://www.instagram.com/reel/B2/ and https://instagram.com/p/A1/?igsh=1 "
+            "also https://www.instagram.com/p/B2/ again"
+        )
+        assert [p.shortcode for p in extract_posts(text)] == ["B2", "A1"]
+
+    def test_non_post_urls(self):
+        """Profiles, other sites and empty input are ignored."""
+        for text in ["https://www.google.com", "not_a_url", "https://instagram.com/username/", "", None]:
+            assert extract_post(text) is None
+            assert extract_posts(text) == []
+            assert not contains_instagram_url(text)
+
+    def test_lookalike_hosts(self):
+        """Hosts that merely end in instagram.com are not Instagram."""
+        for text in [
+            "https://fakeinstagram.com/p/X/",
+            "fakeinstagram.com/p/X",
+            "https://scontent.cdninstagram.com/p/X/",
+            "https://evil-instagram.com/reel/X/",
+            "https://instagram.com.evil.example/p/X/",
+            "https://phish.instagram.com/p/X/",
+        ]:
+            assert extract_post(text) is None, f"Matched: {text}"
+            assert not contains_instagram_url(text)
+
+        assert extract_post("(https://www.instagram.com/p/OK1/)").shortcode == "OK1"
+
+    def test_canonical_url(self):
+        """Canonical URLs always use www and a trailing slash."""
+        assert canonical_url("ABC", "reels") == "https://www.instagram.com/reel/ABC/"
+
+    def test_is_instagram_post_url(self):
+        """Post page URLs are distinguished from CDN media URLs."""
+        assert is_instagram_post_url("https://instagram.com/p/ABC123/")
+        assert not is_instagram_post_url("https://scontent.cdninstagram.com/v/t51/123.jpg")
+
+
+class TestUpstreamPayload:
+    """Test suite for what is sent to RapidAPI."""
+
+    @patch('core.logic.RAPID_API_KEY', 'test_api_key')
+    @patch('requests.Session.get')
+    def test_only_canonical_url_is_sent(self, mock_get):
+        """The whole message is never forwarded upstream."""
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {"medias": [{"url": "https://example.com/image.jpg"}]}
+        mock_get.return_value = mock_response
+
+        process_instagram_url("omg watch this https://www.instagram.com/reel/PAY1/?igsh=xyz lol")
+
+        assert mock_get.call_args.kwargs["params"] == {"url": "https://www.instagram.com/reel/PAY1/"}